@@ -155,6 +155,7 @@ class UnityEnvironment(BaseEnv):
         side_channels: Optional[List[SideChannel]] = None,
         log_folder: Optional[str] = None,
         num_areas: int = 1,
+        uint8_visual_observations: bool = False,
     ):
         """
         Starts a new unity environment and establishes a connection with the environment.
@@ -168,7 +169,9 @@ class UnityEnvironment(BaseEnv):
         no_graphics_monitor: Whether to run the main worker in graphics mode, with the remaining in no-graphics mode
         :int timeout_wait: Time (in seconds) to wait for connection from environment. :list args: Addition Unity
         command line arguments :list side_channels: Additional side channel for no-rl communication with Unity :str
-        log_folder: Optional folder to write the Unity Player log file into.  Requires absolute path.
+        log_folder: Optional folder to write the Unity Player log file into.  Requires absolute path. :bool
+        uint8_visual_observations: Whether to return compressed visual observations as uint8 arrays in [0, 255]
+        instead of float32 arrays in [0, 1].
         """
         atexit.register(self._close)
         self._additional_args = additional_args or []
@@ -186,6 +189,7 @@ class UnityEnvironment(BaseEnv):
         # The process that is started. If None, no process was started
         self._process: Optional[subprocess.Popen] = None
         self._timeout_wait: int = timeout_wait
+        self._uint8_visual_observations = uint8_visual_observations
         self._communicator = self._get_communicator(worker_id, base_port, timeout_wait)
         self._worker_id = worker_id
         if side_channels is None:
@@ -304,7 +308,9 @@ class UnityEnvironment(BaseEnv):
             if brain_name in output.agentInfos:
                 agent_info_list = output.agentInfos[brain_name].value
                 self._env_state[brain_name] = steps_from_proto(
-                    agent_info_list, self._env_specs[brain_name]
+                    agent_info_list,
+                    self._env_specs[brain_name],
+                    self._uint8_visual_observations,
                 )
             else:
                 self._env_state[brain_name] = (
@@ -17,12 +17,37 @@ from mlagents_envs.communicator_objects.observation_pb2 import (
 from mlagents_envs.communicator_objects.brain_parameters_pb2 import BrainParametersProto
 import numpy as np
 import io
-from typing import cast, List, Tuple, Collection, Optional, Iterable
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import cast, Dict, List, Tuple, Collection, Optional, Iterable
 from PIL import Image
 
 
 PNG_HEADER = b"\x89PNG\r\n\x1a\n"
 
+# Maximum number of threads used to decompress the visual observations of a step.
+# Pillow releases the GIL while decoding, so the images of several agents can be
+# decompressed at the same time.
+MAX_VISUAL_DECODE_THREADS = min(8, os.cpu_count() or 1)
+# Below this many agents, the images are decompressed on the calling thread.
+MIN_AGENTS_FOR_PARALLEL_DECODE = 4
+
+_visual_decode_executor: Optional[ThreadPoolExecutor] = None
+_visual_decode_executor_pid: Optional[int] = None
+
+
+def _get_visual_decode_executor() -> ThreadPoolExecutor:
+    global _visual_decode_executor, _visual_decode_executor_pid
+    # The threads of an executor created before a fork don't exist in the child.
+    if _visual_decode_executor is None or _visual_decode_executor_pid != os.getpid():
+        _visual_decode_executor = ThreadPoolExecutor(
+            max_workers=MAX_VISUAL_DECODE_THREADS,
+            thread_name_prefix="visual_decode",
+        )
+        _visual_decode_executor_pid = os.getpid()
+    return _visual_decode_executor
+
 
 def behavior_spec_from_proto(
     brain_param_proto: BrainParametersProto, agent_info: AgentInfoProto
@@ -102,16 +127,11 @@ class OffsetBytesIO:
         return self.fp.tell()
 
 
-@timed
-def process_pixels(
-    image_bytes: bytes, expected_channels: int, mappings: Optional[List[int]] = None
-) -> np.ndarray:
+def _decompress_pngs(image_bytes: bytes) -> List[np.ndarray]:
     """
-    Converts byte array observation image into numpy array, re-sizes it,
-    and optionally converts it to grey scale
-    :param image_bytes: input byte array corresponding to image
-    :param expected_channels: Expected output channels
-    :return: processed numpy array of observation from environment
+    Decompresses the concatenated PNGs of a compressed observation.
+    :param image_bytes: input byte array corresponding to the images
+    :return: list of uint8 arrays of shape (channels, height, width), one per PNG
     """
     image_fp = OffsetBytesIO(image_bytes)
 
@@ -122,9 +142,7 @@ def process_pixels(
             image = Image.open(image_fp)
             # Normally Image loads lazily, load() forces it to do loading in the timer scope.
             image.load()
-        image_arrays.append(
-            np.moveaxis(np.array(image, dtype=np.float32) / 255.0, -1, 0)
-        )
+        image_arrays.append(np.moveaxis(np.asarray(image), -1, 0))
 
         # Look for the next header, starting from the current stream location
         try:
@@ -133,63 +151,82 @@ def process_pixels(
         except ValueError:
             # Didn't find the header, so must be at the end.
             break
+    return image_arrays
 
-    if mappings is not None and len(mappings) > 0:
-        return _process_images_mapping(image_arrays, mappings)
-    else:
-        return _process_images_num_channels(image_arrays, expected_channels)
 
-
-def _process_images_mapping(image_arrays, mappings):
+@timed
+def process_pixels(
+    image_bytes: bytes, expected_channels: int, mappings: Optional[List[int]] = None
+) -> np.ndarray:
     """
-    Helper function for processing decompressed images with compressed channel mappings.
+    Converts byte array observation image into numpy array, re-sizes it,
+    and optionally converts it to grey scale
+    :param image_bytes: input byte array corresponding to image
+    :param expected_channels: Expected output channels
+    :return: processed numpy array of observation from environment
     """
-    image_arrays = np.concatenate(image_arrays, axis=0).transpose((0, 1, 2))
-
-    if len(mappings) != len(image_arrays):
-        raise UnityObservationException(
-            f"Compressed observation and its mapping had different number of channels - "
-            f"observation had {len(image_arrays)} channels but its mapping had {len(mappings)} channels"
-        )
-    if len({m for m in mappings if m > -1}) != max(mappings) + 1:
-        raise UnityObservationException(
-            f"Invalid Compressed Channel Mapping: the mapping {mappings} does not have the correct format."
-        )
-    if max(mappings) >= len(image_arrays):
-        raise UnityObservationException(
-            f"Invalid Compressed Channel Mapping: the mapping has index larger than the total "
-            f"number of channels in observation - mapping index {max(mappings)} is"
-            f"invalid for input observation with {len(image_arrays)} channels."
-        )
+    image_arrays = [
+        img.astype(np.float32) / 255.0 for img in _decompress_pngs(image_bytes)
+    ]
+    channel_sources = _compressed_channel_sources(
+        [len(img) for img in image_arrays], expected_channels, mappings
+    )
+    return _average_channels(np.concatenate(image_arrays, axis=0), channel_sources)
 
-    processed_image_arrays: List[np.array] = [[] for _ in range(max(mappings) + 1)]
-    for mapping_idx, img in zip(mappings, image_arrays):
-        if mapping_idx > -1:
-            processed_image_arrays[mapping_idx].append(img)
 
-    for i, img_array in enumerate(processed_image_arrays):
-        processed_image_arrays[i] = np.mean(img_array, axis=0)
-    img = np.stack(processed_image_arrays, axis=0)
-    return img
+def _compressed_channel_sources(
+    image_channels: List[int],
+    expected_channels: int,
+    mappings: Optional[List[int]] = None,
+) -> List[List[int]]:
+    """
+    Returns, for each channel of the processed observation, the channels of the
+    decompressed images that are averaged into it.
+    :param image_channels: Number of channels of each decompressed image
+    :param expected_channels: Expected output channels, used when there is no mapping
+    :param mappings: Compressed channel mapping of the observation, if any
+    """
+    num_channels = sum(image_channels)
+    if mappings is not None and len(mappings) > 0:
+        if len(mappings) != num_channels:
+            raise UnityObservationException(
+                f"Compressed observation and its mapping had different number of channels - "
+                f"observation had {num_channels} channels but its mapping had {len(mappings)} channels"
+            )
+        if len({m for m in mappings if m > -1}) != max(mappings) + 1:
+            raise UnityObservationException(
+                f"Invalid Compressed Channel Mapping: the mapping {mappings} does not have the correct format."
+            )
+        if max(mappings) >= num_channels:
+            raise UnityObservationException(
+                f"Invalid Compressed Channel Mapping: the mapping has index larger than the total "
+                f"number of channels in observation - mapping index {max(mappings)} is"
+                f"invalid for input observation with {num_channels} channels."
+            )
+        channel_sources: List[List[int]] = [[] for _ in range(max(mappings) + 1)]
+        for channel, mapping_idx in enumerate(mappings):
+            if mapping_idx > -1:
+                channel_sources[mapping_idx].append(channel)
+        return channel_sources
+    # This is for old API without mapping provided.
+    if expected_channels == 1:
+        # Convert the first image to grayscale
+        return [list(range(image_channels[0]))]
+    # Use the first n channels, n=expected_channels. We can drop additional channels
+    # since they may need to be added to include numbers of observation channels not
+    # divisible by 3.
+    return [[channel] for channel in range(min(num_channels, expected_channels))]
 
 
-def _process_images_num_channels(image_arrays, expected_channels):
+def _average_channels(
+    image: np.ndarray, channel_sources: List[List[int]]
+) -> np.ndarray:
     """
-    Helper function for processing decompressed images with number of expected channels.
-    This is for old API without mapping provided. Use the first n channel, n=expected_channels.
+    Builds the float processed observation from the float decompressed channels.
     """
-    if expected_channels == 1:
-        # Convert to grayscale
-        img = np.mean(image_arrays[0], axis=0)
-        img = np.reshape(img, [1, img.shape[0], img.shape[1]])
-    else:
-        img = np.concatenate(image_arrays, axis=0)
-        # We can drop additional channels since they may need to be added to include
-        # numbers of observation channels not divisible by 3.
-        actual_channels = list(img.shape)[0]
-        if actual_channels > expected_channels:
-            img = img[0:expected_channels, ...]
-    return img
+    return np.stack(
+        [np.mean(image[sources], axis=0) for sources in channel_sources], axis=0
+    )
 
 
 def _check_observations_match_spec(
@@ -250,22 +287,103 @@ def _process_maybe_compressed_observation(
     obs_index: int,
     observation_spec: ObservationSpec,
     agent_info_list: Collection[AgentInfoProto],
+    uint8_visual_obs: bool = False,
 ) -> np.ndarray:
+    """
+    Converts the visual observation at obs_index of all the agents into a numpy array.
+    :param uint8_visual_obs: If True, compressed observations are returned as uint8 in
+        [0, 255] instead of float32 in [0, 1]. Uncompressed observations are always
+        float32.
+    """
     shape = cast(Tuple[int, int, int], observation_spec.shape)
     if len(agent_info_list) == 0:
-        return np.zeros((0, shape[0], shape[1], shape[2]), dtype=np.float32)
+        return np.zeros(
+            (0, shape[0], shape[1], shape[2]),
+            dtype=np.uint8 if uint8_visual_obs else np.float32,
+        )
 
+    observations = [
+        agent_info.observations[obs_index] for agent_info in agent_info_list
+    ]
     try:
-        batched_visual = [
-            _observation_to_np_array(agent_obs.observations[obs_index], shape)
-            for agent_obs in agent_info_list
-        ]
+        if any(obs.compression_type == COMPRESSION_TYPE_NONE for obs in observations):
+            batched_visual = [
+                _observation_to_np_array(obs, shape) for obs in observations
+            ]
+            return np.array(batched_visual, dtype=np.float32)
+        return _decompress_visual_observations(observations, shape, uint8_visual_obs)
     except ValueError:
         # Try to get a more useful error message
         _check_observations_match_spec(obs_index, observation_spec, agent_info_list)
         # If that didn't raise anything, raise the original error
         raise
-    return np.array(batched_visual, dtype=np.float32)
+
+
+def _decompress_visual_observations(
+    observations: List[ObservationProto],
+    shape: Tuple[int, int, int],
+    uint8_visual_obs: bool = False,
+) -> np.ndarray:
+    """
+    Decompresses the compressed observations of all the agents straight into a uint8
+    array, using a thread pool when there are enough agents. Unless uint8_visual_obs is
+    True, the array is converted to float32 once for all the agents.
+    Channels that are the mean of several decompressed channels are computed in float32
+    and don't go through the uint8 array. They are rounded if uint8_visual_obs is True.
+    """
+    pixels = np.empty((len(observations),) + shape, dtype=np.uint8)
+    averaged: Dict[int, np.ndarray] = {}
+
+    def _decompress(index: int) -> None:
+        obs = observations[index]
+        if list(obs.shape) != list(shape):
+            raise UnityObservationException(
+                f"Observation did not have the expected shape - got {obs.shape} but expected {shape}"
+            )
+        image_arrays = _decompress_pngs(obs.compressed_data)
+        channel_sources = _compressed_channel_sources(
+            [len(img) for img in image_arrays],
+            shape[0],
+            list(obs.compressed_channel_mapping),
+        )
+        image = np.concatenate(image_arrays, axis=0)
+        decompressed_shape = (len(channel_sources),) + image.shape[1:]
+        if decompressed_shape != shape:
+            raise UnityObservationException(
+                f"Decompressed observation did not have the expected shape - "
+                f"decompressed had {decompressed_shape} but expected {shape}"
+            )
+        if all(len(sources) == 1 for sources in channel_sources):
+            np.take(
+                image,
+                [sources[0] for sources in channel_sources],
+                axis=0,
+                out=pixels[index],
+            )
+        else:
+            averaged[index] = _average_channels(
+                image.astype(np.float32) / 255.0, channel_sources
+            )
+
+    with hierarchical_timer("visual_decompress"):
+        if len(observations) >= MIN_AGENTS_FOR_PARALLEL_DECODE:
+            # Consume the results so that exceptions are raised here.
+            list(
+                _get_visual_decode_executor().map(_decompress, range(len(observations)))
+            )
+        else:
+            for index in range(len(observations)):
+                _decompress(index)
+
+    if uint8_visual_obs:
+        for index, img in averaged.items():
+            pixels[index] = np.rint(img * 255.0)
+        return pixels
+    batched_visual = pixels.astype(np.float32)
+    batched_visual /= 255.0
+    for index, img in averaged.items():
+        batched_visual[index] = img
+    return batched_visual
 
 
 def _raise_on_nan_and_inf(data: np.array, source: str) -> np.array:
@@ -296,26 +414,94 @@ def _process_rank_one_or_two_observation(
 ) -> np.ndarray:
     if len(agent_info_list) == 0:
         return np.zeros((0,) + observation_spec.shape, dtype=np.float32)
+    # Read the data of all the agents into a single preallocated array.
+    obs_size = int(np.prod(observation_spec.shape))
+    float_data = itertools.chain.from_iterable(
+        agent_obs.observations[obs_index].float_data.data
+        for agent_obs in agent_info_list
+    )
     try:
-        np_obs = np.array(
-            [
-                agent_obs.observations[obs_index].float_data.data
-                for agent_obs in agent_info_list
-            ],
-            dtype=np.float32,
-        ).reshape((len(agent_info_list),) + observation_spec.shape)
+        np_obs = np.fromiter(
+            float_data, dtype=np.float32, count=len(agent_info_list) * obs_size
+        )
+        if next(float_data, None) is not None:
+            raise ValueError("More observation data than expected.")
     except ValueError:
         # Try to get a more useful error message
         _check_observations_match_spec(obs_index, observation_spec, agent_info_list)
         # If that didn't raise anything, raise the original error
         raise
+    np_obs = np_obs.reshape((len(agent_info_list),) + observation_spec.shape)
     _raise_on_nan_and_inf(np_obs, "observations")
     return np_obs
 
 
+def _process_action_mask(
+    behavior_spec: BehaviorSpec, agent_info_list: Collection[AgentInfoProto]
+) -> List[np.ndarray]:
+    """
+    Builds the action masks of the agents, split per discrete branch. Agents that
+    didn't send a mask of the expected size have all their actions available.
+    """
+    n_agents = len(agent_info_list)
+    a_size = int(np.sum(behavior_spec.action_spec.discrete_branches))
+    action_mask = np.zeros((n_agents, a_size), dtype=bool)
+    if n_agents > 0:
+        has_mask = (
+            np.fromiter(
+                (len(agent_info.action_mask) for agent_info in agent_info_list),
+                dtype=np.int64,
+                count=n_agents,
+            )
+            == a_size
+        )
+        num_masked = int(np.count_nonzero(has_mask))
+        masks = itertools.chain.from_iterable(
+            agent_info.action_mask
+            for agent_info, masked in zip(agent_info_list, has_mask)
+            if masked
+        )
+        action_mask[has_mask] = np.fromiter(
+            masks, dtype=bool, count=num_masked * a_size
+        ).reshape(num_masked, a_size)
+    indices = _generate_split_indices(behavior_spec.action_spec.discrete_branches)
+    return np.split(action_mask, indices, axis=1)
+
+
+def observations_from_proto(
+    agent_info_list: Collection[AgentInfoProto],
+    behavior_spec: BehaviorSpec,
+    uint8_visual_obs: bool = False,
+) -> List[np.ndarray]:
+    """
+    Decodes the observations of the agents, in the order of agent_info_list.
+    :param agent_info_list: The infos of the agents.
+    :param behavior_spec: The specs of the behavior the agents belong to.
+    :param uint8_visual_obs: Whether to keep the visual observations as uint8.
+    :return: One array per observation, whose first dimension indexes the agents.
+    """
+    obs_list: List[np.ndarray] = []
+    for obs_index, observation_spec in enumerate(behavior_spec.observation_specs):
+        if len(observation_spec.shape) == 3:
+            obs_list.append(
+                _process_maybe_compressed_observation(
+                    obs_index, observation_spec, agent_info_list, uint8_visual_obs
+                )
+            )
+        else:
+            obs_list.append(
+                _process_rank_one_or_two_observation(
+                    obs_index, observation_spec, agent_info_list
+                )
+            )
+    return obs_list
+
+
 @timed
 def steps_from_proto(
-    agent_info_list: Collection[AgentInfoProto], behavior_spec: BehaviorSpec
+    agent_info_list: Collection[AgentInfoProto],
+    behavior_spec: BehaviorSpec,
+    uint8_visual_obs: bool = False,
 ) -> Tuple[DecisionSteps, TerminalSteps]:
     decision_agent_info_list = [
         agent_info for agent_info in agent_info_list if not agent_info.done
@@ -323,87 +509,70 @@ def steps_from_proto(
     terminal_agent_info_list = [
         agent_info for agent_info in agent_info_list if agent_info.done
     ]
-    decision_obs_list: List[np.ndarray] = []
-    terminal_obs_list: List[np.ndarray] = []
-    for obs_index, observation_spec in enumerate(behavior_spec.observation_specs):
-        is_visual = len(observation_spec.shape) == 3
-        if is_visual:
-            decision_obs_list.append(
-                _process_maybe_compressed_observation(
-                    obs_index, observation_spec, decision_agent_info_list
-                )
-            )
-            terminal_obs_list.append(
-                _process_maybe_compressed_observation(
-                    obs_index, observation_spec, terminal_agent_info_list
-                )
-            )
-        else:
-            decision_obs_list.append(
-                _process_rank_one_or_two_observation(
-                    obs_index, observation_spec, decision_agent_info_list
-                )
-            )
-            terminal_obs_list.append(
-                _process_rank_one_or_two_observation(
-                    obs_index, observation_spec, terminal_agent_info_list
-                )
-            )
-    decision_rewards = np.array(
-        [agent_info.reward for agent_info in decision_agent_info_list], dtype=np.float32
+    decision_obs_list = observations_from_proto(
+        decision_agent_info_list, behavior_spec, uint8_visual_obs
+    )
+    terminal_obs_list = observations_from_proto(
+        terminal_agent_info_list, behavior_spec, uint8_visual_obs
     )
-    terminal_rewards = np.array(
-        [agent_info.reward for agent_info in terminal_agent_info_list], dtype=np.float32
+    n_decision = len(decision_agent_info_list)
+    n_terminal = len(terminal_agent_info_list)
+    decision_rewards = np.fromiter(
+        (agent_info.reward for agent_info in decision_agent_info_list),
+        dtype=np.float32,
+        count=n_decision,
+    )
+    terminal_rewards = np.fromiter(
+        (agent_info.reward for agent_info in terminal_agent_info_list),
+        dtype=np.float32,
+        count=n_terminal,
     )
 
-    decision_group_rewards = np.array(
-        [agent_info.group_reward for agent_info in decision_agent_info_list],
+    decision_group_rewards = np.fromiter(
+        (agent_info.group_reward for agent_info in decision_agent_info_list),
         dtype=np.float32,
+        count=n_decision,
     )
-    terminal_group_rewards = np.array(
-        [agent_info.group_reward for agent_info in terminal_agent_info_list],
+    terminal_group_rewards = np.fromiter(
+        (agent_info.group_reward for agent_info in terminal_agent_info_list),
         dtype=np.float32,
+        count=n_terminal,
     )
 
-    _raise_on_nan_and_inf(decision_rewards, "rewards")
-    _raise_on_nan_and_inf(terminal_rewards, "rewards")
-    _raise_on_nan_and_inf(decision_group_rewards, "group_rewards")
-    _raise_on_nan_and_inf(terminal_group_rewards, "group_rewards")
+    # Check all of the rewards at once.
+    _raise_on_nan_and_inf(
+        np.concatenate(
+            [
+                decision_rewards,
+                terminal_rewards,
+                decision_group_rewards,
+                terminal_group_rewards,
+            ]
+        ),
+        "rewards",
+    )
 
     decision_group_id = [agent_info.group_id for agent_info in decision_agent_info_list]
     terminal_group_id = [agent_info.group_id for agent_info in terminal_agent_info_list]
 
-    max_step = np.array(
-        [agent_info.max_step_reached for agent_info in terminal_agent_info_list],
+    max_step = np.fromiter(
+        (agent_info.max_step_reached for agent_info in terminal_agent_info_list),
         dtype=bool,
+        count=n_terminal,
     )
-    decision_agent_id = np.array(
-        [agent_info.id for agent_info in decision_agent_info_list], dtype=np.int32
+    decision_agent_id = np.fromiter(
+        (agent_info.id for agent_info in decision_agent_info_list),
+        dtype=np.int32,
+        count=n_decision,
     )
-    terminal_agent_id = np.array(
-        [agent_info.id for agent_info in terminal_agent_info_list], dtype=np.int32
+    terminal_agent_id = np.fromiter(
+        (agent_info.id for agent_info in terminal_agent_info_list),
+        dtype=np.int32,
+        count=n_terminal,
     )
     action_mask = None
     if behavior_spec.action_spec.discrete_size > 0:
-        if any(
-            [agent_info.action_mask is not None]
-            for agent_info in decision_agent_info_list
-        ):
-            n_agents = len(decision_agent_info_list)
-            a_size = np.sum(behavior_spec.action_spec.discrete_branches)
-            mask_matrix = np.ones((n_agents, a_size), dtype=bool)
-            for agent_index, agent_info in enumerate(decision_agent_info_list):
-                if agent_info.action_mask is not None:
-                    if len(agent_info.action_mask) == a_size:
-                        mask_matrix[agent_index, :] = [
-                            False if agent_info.action_mask[k] else True
-                            for k in range(a_size)
-                        ]
-            action_mask = (1 - mask_matrix).astype(bool)
-            indices = _generate_split_indices(
-                behavior_spec.action_spec.discrete_branches
-            )
-            action_mask = np.split(action_mask, indices, axis=1)
+        action_mask = _process_action_mask(behavior_spec, decision_agent_info_list)
     return (
         DecisionSteps(
             decision_obs_list,
@@ -22,8 +22,10 @@ from mlagents_envs.base_env import (
 )
 from mlagents_envs.exception import UnityObservationException
 from mlagents_envs.rpc_utils import (
+    MIN_AGENTS_FOR_PARALLEL_DECODE,
     behavior_spec_from_proto,
     process_pixels,
+    _observation_to_np_array,
     _process_maybe_compressed_observation,
     _process_rank_one_or_two_observation,
     steps_from_proto,
@@ -341,6 +343,88 @@ def test_process_visual_observation_padded_channels():
     assert np.allclose(arr[0, :, :, :], expected_out_array_1, atol=0.01)
 
 
+def test_process_visual_observation_parallel():
+    shape = (6, 32, 16)
+    mappings = [[0, 1, 2, 3, 4, 5], [0, 0, 0, 1, 2, 3, 4, 5, -1], [0, 1, 2, 3, 4, 5]]
+    ap_list = []
+    for i in range(2 * MIN_AGENTS_FOR_PARALLEL_DECODE):
+        mapping = mappings[i % len(mappings)]
+        in_array = np.random.rand(len(mapping), shape[1], shape[2])
+        ap = AgentInfoProto()
+        ap.observations.extend(
+            [generate_compressed_proto_obs_with_mapping(in_array, mapping)]
+        )
+        ap_list.append(ap)
+    obs_spec = create_observation_specs_with_shapes([shape])[0]
+    arr = _process_maybe_compressed_observation(0, obs_spec, ap_list)
+    assert arr.shape == (len(ap_list),) + shape
+    assert arr.dtype == np.float32
+    for i, ap in enumerate(ap_list):
+        # Same result as decompressing the observations one at a time.
+        np.testing.assert_array_equal(
+            arr[i], _observation_to_np_array(ap.observations[0], shape)
+        )
+
+
+def test_process_visual_observation_parallel_raises():
+    shape = (3, 32, 16)
+    ap_list = []
+    for i in range(MIN_AGENTS_FOR_PARALLEL_DECODE):
+        mapping = [0, 1, 2] if i > 0 else [0, 1, 1]
+        ap = AgentInfoProto()
+        ap.observations.extend(
+            [
+                generate_compressed_proto_obs_with_mapping(
+                    np.random.rand(*shape), mapping
+                )
+            ]
+        )
+        ap_list.append(ap)
+    obs_spec = create_observation_specs_with_shapes([shape])[0]
+    with pytest.raises(UnityObservationException):
+        _process_maybe_compressed_observation(0, obs_spec, ap_list)
+
+
+def test_process_visual_observation_uint8():
+    shape = (3, 32, 16)
+    mappings = [[0, 1, 2], [0, 1, 2, -1, -1, -1]]
+    ap_list = []
+    for i in range(2 * MIN_AGENTS_FOR_PARALLEL_DECODE):
+        mapping = mappings[i % len(mappings)]
+        in_array = np.random.rand(len(mapping), shape[1], shape[2])
+        ap = AgentInfoProto()
+        ap.observations.extend(
+            [generate_compressed_proto_obs_with_mapping(in_array, mapping)]
+        )
+        ap_list.append(ap)
+    obs_spec = create_observation_specs_with_shapes([shape])[0]
+    float_arr = _process_maybe_compressed_observation(0, obs_spec, ap_list)
+    uint8_arr = _process_maybe_compressed_observation(
+        0, obs_spec, ap_list, uint8_visual_obs=True
+    )
+    assert uint8_arr.dtype == np.uint8
+    np.testing.assert_array_equal(uint8_arr, np.rint(float_arr * 255))
+
+    # Averaged channels are rounded
+    gray_ap = AgentInfoProto()
+    gray_ap.observations.extend(
+        [generate_compressed_proto_obs_with_mapping(np.random.rand(*shape), [0, 0, 0])]
+    )
+    gray_spec = create_observation_specs_with_shapes([(1,) + shape[1:]])[0]
+    float_arr = _process_maybe_compressed_observation(0, gray_spec, [gray_ap])
+    uint8_arr = _process_maybe_compressed_observation(
+        0, gray_spec, [gray_ap], uint8_visual_obs=True
+    )
+    assert uint8_arr.dtype == np.uint8
+    np.testing.assert_array_equal(uint8_arr, np.rint(float_arr * 255))
+
+    empty_arr = _process_maybe_compressed_observation(
+        0, obs_spec, [], uint8_visual_obs=True
+    )
+    assert empty_arr.shape == (0,) + shape
+    assert empty_arr.dtype == np.uint8
+
+
 def test_process_visual_observation_bad_shape():
     in_array_1 = np.random.rand(128, 64, 3)
     proto_obs_1 = generate_compressed_proto_obs(in_array_1)
@@ -450,6 +534,26 @@ def test_action_masking_discrete_2():
     assert masks[0][0, 0]
 
 
+def test_action_masking_discrete_missing_masks():
+    n_agents = 10
+    shapes = [(3,), (4,)]
+    behavior_spec = BehaviorSpec(
+        create_observation_specs_with_shapes(shapes), ActionSpec.create_discrete((7, 3))
+    )
+    ap_list = generate_list_agent_proto(n_agents, shapes)
+    # Agents without a mask, or with a mask of the wrong size, can take any action.
+    del ap_list[1].action_mask[:]
+    del ap_list[3].action_mask[3:]
+    decision_steps, _ = steps_from_proto(ap_list, behavior_spec)
+    masks = np.concatenate(decision_steps.action_mask, axis=1)
+    expected_mask = np.array([True, False] * 5)
+    for agent_id, mask in zip(decision_steps.agent_id, masks):
+        if agent_id in (1, 3):
+            assert not mask.any()
+        else:
+            np.testing.assert_array_equal(mask, expected_mask)
+
+
 def test_action_masking_continuous():
     n_agents = 10
     shapes = [(3,), (4,)]
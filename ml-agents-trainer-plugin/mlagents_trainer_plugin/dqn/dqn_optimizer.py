@@ -95,6 +95,26 @@ class DQNOptimizer(TorchOptimizer):
         :param num_sequences: Number of sequences to process.
         :return: Results of update.
         """
+        update_stats, _ = self._update(batch, num_sequences)
+        return update_stats
+
+    @timed
+    def update_prioritized(
+        self, batch: AgentBuffer, num_sequences: int, importance_weights: np.ndarray
+    ) -> Tuple[Dict[str, float], np.ndarray]:
+        update_stats, td_errors = self._update(
+            batch,
+            num_sequences,
+            torch.as_tensor(importance_weights, dtype=torch.float32),
+        )
+        return update_stats, ModelUtils.to_numpy(td_errors)
+
+    def _update(
+        self,
+        batch: AgentBuffer,
+        num_sequences: int,
+        importance_weights: Optional[torch.Tensor] = None,
+    ) -> Tuple[Dict[str, float], torch.Tensor]:
         # Get decayed parameters
         decay_lr = self.decay_learning_rate.get_value(self.policy.get_current_step())
         exp_rate = self.decay_exploration_rate.get_value(self.policy.get_current_step())
@@ -108,21 +128,24 @@ class DQNOptimizer(TorchOptimizer):
         n_obs = len(self.policy.behavior_spec.observation_specs)
         current_obs = ObsUtil.from_buffer(batch, n_obs)
         # Convert to tensors
-        current_obs = [ModelUtils.list_to_tensor(obs) for obs in current_obs]
+        current_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in current_obs]
 
         next_obs = ObsUtil.from_buffer_next(batch, n_obs)
         # Convert to tensors
-        next_obs = [ModelUtils.list_to_tensor(obs) for obs in next_obs]
+        next_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in next_obs]
 
         actions = AgentAction.from_buffer(batch)
 
         dones = ModelUtils.list_to_tensor(batch[BufferKey.DONE])
+        # The TD errors of the padded steps of recurrent sequences are 0.
+        loss_masks = ModelUtils.list_to_tensor(batch[BufferKey.MASKS])
 
         current_q_values, _ = self.policy.actor.critic_pass(
             current_obs, sequence_length=self.policy.sequence_length
         )
 
         qloss = []
+        td_errors = []
         with torch.no_grad():
             greedy_actions = self.policy.actor.get_greedy_action(current_q_values)
             next_q_values_list, _ = self.q_net_target.critic_pass(
@@ -142,7 +165,23 @@ class DQNOptimizer(TorchOptimizer):
             curr_q = torch.gather(
                 current_q_values[name], dim=1, index=actions.discrete_tensor
             )
-            qloss.append(torch.nn.functional.smooth_l1_loss(curr_q, target_q_values))
+            if importance_weights is None:
+                qloss.append(
+                    torch.nn.functional.smooth_l1_loss(curr_q, target_q_values)
+                )
+            else:
+                # Correct for the bias of prioritized replay.
+                qloss.append(
+                    torch.mean(
+                        importance_weights.reshape(-1, 1)
+                        * torch.nn.functional.smooth_l1_loss(
+                            curr_q, target_q_values, reduction="none"
+                        )
+                    )
+                )
+            td_errors.append(
+                torch.abs(target_q_values - curr_q.detach()).squeeze(1) * loss_masks
+            )
 
         loss = torch.mean(torch.stack(qloss))
         ModelUtils.update_learning_rate(self.optimizer, decay_lr)
@@ -159,7 +198,7 @@ class DQNOptimizer(TorchOptimizer):
 
         for reward_provider in self.reward_signals.values():
             update_stats.update(reward_provider.update(batch))
-        return update_stats
+        return update_stats, torch.mean(torch.stack(td_errors), dim=0)
 
     def get_modules(self):
         modules = {
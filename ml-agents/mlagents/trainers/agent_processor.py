@@ -1,8 +1,23 @@
+import os
+import pickle
 import sys
+import tempfile
+import threading
+import time
 import numpy as np
-from typing import List, Dict, TypeVar, Generic, Tuple, Any, Union
-from collections import defaultdict, Counter
-import queue
+from typing import (
+    List,
+    Dict,
+    TypeVar,
+    Generic,
+    Tuple,
+    Any,
+    Union,
+    Optional,
+    Deque,
+    cast,
+)
+from collections import defaultdict, Counter, deque
 from mlagents.torch_utils import torch
 
 from mlagents_envs.base_env import (
@@ -16,7 +31,10 @@ from mlagents_envs.side_channel.stats_side_channel import (
     StatsAggregationMethod,
     EnvironmentStats,
 )
+from mlagents_envs.logging_util import get_logger
+from mlagents_envs.timers import set_gauge
 from mlagents.trainers.exception import UnityTrainerException
+from mlagents.trainers.settings import QueueOverflowPolicy
 from mlagents.trainers.trajectory import AgentStatus, Trajectory, AgentExperience
 from mlagents.trainers.policy import Policy
 from mlagents.trainers.action_info import ActionInfo, ActionInfoOutputs
@@ -32,6 +50,8 @@ from mlagents.trainers.torch_entities.utils import ModelUtils
 
 T = TypeVar("T")
 
+logger = get_logger(__name__)
+
 
 class AgentProcessor:
     """
@@ -46,6 +66,7 @@ class AgentProcessor:
         behavior_id: str,
         stats_reporter: StatsReporter,
         max_trajectory_length: int = sys.maxsize,
+        batched: bool = False,
     ):
         """
         Create an AgentProcessor.
@@ -55,6 +76,8 @@ class AgentProcessor:
         :param policy: Policy instance associated with this AgentProcessor.
         :param max_trajectory_length: Maximum length of a trajectory before it is added to the trainer.
         :param stats_category: The category under which to write the stats. Usually, this comes from the Trainer.
+        :param batched: Whether to process the steps of all the agents together, gathering their actions,
+        log probs and memories with one array operation per step rather than one per agent.
         """
         self._experience_buffers: Dict[
             GlobalAgentId, List[AgentExperience]
@@ -82,6 +105,7 @@ class AgentProcessor:
         self._max_trajectory_length = max_trajectory_length
         self._trajectory_queues: List[AgentManagerQueue[Trajectory]] = []
         self._behavior_id = behavior_id
+        self._batched = batched
 
         # Note: In the future this policy reference will be the policy of the env_manager and not the trainer.
         # We can in that case just grab the action from the policy rather than having it passed in.
@@ -118,6 +142,16 @@ class AgentProcessor:
             if global_id in self._last_step_result:  # Don't store if agent just reset
                 self._last_take_action_outputs[global_id] = take_action_outputs
 
+        if self._batched:
+            self._add_experiences_batched(
+                decision_steps,
+                terminal_steps,
+                worker_id,
+                action_global_agent_ids,
+                take_action_outputs,
+            )
+            return
+
         # Iterate over all the terminal steps, first gather all the group obs
         # and then create the AgentExperiences/Trajectories. _add_to_group_status
         # stores Group statuses in a common data structure self.group_status
@@ -147,15 +181,221 @@ class AgentProcessor:
             global_id = get_global_agent_id(worker_id, local_id)
             self._clear_group_status_and_obs(global_id)
 
-        for _gid in action_global_agent_ids:
+        for idx, _gid in enumerate(action_global_agent_ids):
             # If the ID doesn't have a last step result, the agent just reset,
             # don't store the action.
             if _gid in self._last_step_result:
                 if "action" in take_action_outputs:
+                    actions = cast(ActionTuple, take_action_outputs["action"])
                     self.policy.save_previous_action(
-                        [_gid], take_action_outputs["action"]
+                        [_gid], ActionTuple(discrete=actions.discrete[[idx]])
                     )
 
+    def _add_experiences_batched(
+        self,
+        decision_steps: DecisionSteps,
+        terminal_steps: TerminalSteps,
+        worker_id: int,
+        action_global_agent_ids: List[GlobalAgentId],
+        take_action_outputs: ActionInfoOutputs,
+    ) -> None:
+        """
+        Same as add_experiences, but the stored actions, log probs, memories and
+        previous actions of all the agents of a DecisionSteps or TerminalSteps are
+        gathered together rather than agent by agent.
+        """
+        terminal_list = self._split_steps(terminal_steps)
+        decision_list = self._split_steps(decision_steps)
+        terminal_ids = [
+            get_global_agent_id(worker_id, step.agent_id) for step in terminal_list
+        ]
+        decision_ids = [
+            get_global_agent_id(worker_id, step.agent_id) for step in decision_list
+        ]
+
+        # As in add_experiences, gather all the group obs and statuses before creating
+        # the experiences, first for the terminal steps and then for the decision steps.
+        for terminal_step in terminal_list:
+            if terminal_step.group_id > 0:
+                self._add_group_status_and_obs(terminal_step, worker_id)
+        self._process_steps(terminal_list, terminal_ids, worker_id)
+        for ongoing_step in decision_list:
+            if ongoing_step.group_id > 0:
+                self._add_group_status_and_obs(ongoing_step, worker_id)
+        self._process_steps(decision_list, decision_ids, worker_id)
+        for global_id in terminal_ids:
+            self._clear_group_status_and_obs(global_id)
+
+        if "action" in take_action_outputs:
+            # If the ID doesn't have a last step result, the agent just reset,
+            # don't store the action.
+            indices = [
+                index
+                for index, global_id in enumerate(action_global_agent_ids)
+                if global_id in self._last_step_result
+            ]
+            if indices:
+                actions = cast(ActionTuple, take_action_outputs["action"])
+                self.policy.save_previous_action(
+                    [action_global_agent_ids[index] for index in indices],
+                    ActionTuple(discrete=actions.discrete[indices]),
+                )
+
+    @staticmethod
+    def _split_steps(
+        steps: Union[DecisionSteps, TerminalSteps]
+    ) -> List[Union[DecisionStep, TerminalStep]]:
+        """
+        Returns the DecisionStep or TerminalStep of every agent, in order. Unlike
+        iterating over steps.values(), each array is split once for all the agents.
+        """
+        num_agents = len(steps)
+        if num_agents == 0:
+            return []
+        agent_obs = [list(obs) for obs in zip(*steps.obs)] or [
+            [] for _ in range(num_agents)
+        ]
+        fields = zip(
+            agent_obs,
+            steps.reward,
+            steps.agent_id,
+            steps.group_id,
+            steps.group_reward,
+        )
+        if isinstance(steps, TerminalSteps):
+            return [
+                TerminalStep(obs, reward, interrupted, agent_id, group_id, group_reward)
+                for (obs, reward, agent_id, group_id, group_reward), interrupted in zip(
+                    fields, steps.interrupted
+                )
+            ]
+        if steps.action_mask is not None:
+            agent_masks = [list(masks) for masks in zip(*steps.action_mask)]
+        else:
+            agent_masks = [None] * num_agents
+        return [
+            DecisionStep(obs, reward, agent_id, action_mask, group_id, group_reward)
+            for (obs, reward, agent_id, group_id, group_reward), action_mask in zip(
+                fields, agent_masks
+            )
+        ]
+
+    def _process_steps(
+        self,
+        steps: List[Union[TerminalStep, DecisionStep]],
+        global_agent_ids: List[GlobalAgentId],
+        worker_id: int,
+    ) -> None:
+        """
+        Batched version of _process_step, for the steps of a DecisionSteps or
+        TerminalSteps split with _split_steps.
+        """
+        if not steps:
+            return
+        terminated = isinstance(steps[0], TerminalStep)
+        # Positions of the agents whose step is the consequence of a past action,
+        # with the step and action outputs of that action.
+        experienced: List[int] = []
+        stored_steps: List[Tuple[DecisionStep, int]] = []
+        stored_outputs: List[ActionInfoOutputs] = []
+        for position, (step, global_agent_id) in enumerate(
+            zip(steps, global_agent_ids)
+        ):
+            stored_step = self._last_step_result.get(global_agent_id)
+            outputs = self._last_take_action_outputs.get(global_agent_id)
+            if not terminated:
+                # Index is needed to grab from last_take_action_outputs
+                self._last_step_result[global_agent_id] = (step, position)
+            if stored_step is not None and outputs is not None:
+                experienced.append(position)
+                stored_steps.append(stored_step)
+                stored_outputs.append(outputs)
+        if not experienced:
+            return
+
+        experienced_ids = [global_agent_ids[position] for position in experienced]
+        if self.policy.use_recurrent:
+            memories = list(self.policy.retrieve_previous_memories(experienced_ids))
+        else:
+            memories = [None] * len(experienced)
+        prev_actions = self.policy.retrieve_previous_action(experienced_ids)
+        action_tuples, log_probs_tuples = self._gather_action_outputs(
+            stored_outputs, [index for _, index in stored_steps]
+        )
+
+        for i, position in enumerate(experienced):
+            step = steps[position]
+            global_agent_id = global_agent_ids[position]
+            global_group_id = get_global_group_id(worker_id, step.group_id)
+            stored_decision_step = stored_steps[i][0]
+            # Assemble teammate_obs. If none saved, then it will be an empty list.
+            group_statuses = []
+            if step.group_id > 0:
+                for _id, _mate_status in self._group_status[global_group_id].items():
+                    if _id != global_agent_id:
+                        group_statuses.append(_mate_status)
+            experience = AgentExperience(
+                obs=stored_decision_step.obs,
+                reward=step.reward,
+                done=terminated,
+                action=action_tuples[i],
+                action_probs=log_probs_tuples[i],
+                action_mask=stored_decision_step.action_mask,
+                prev_action=prev_actions[i],
+                interrupted=step.interrupted if terminated else False,
+                memory=memories[i],
+                group_status=group_statuses,
+                group_reward=step.group_reward,
+            )
+            self._add_experience(step, global_agent_id, global_group_id, experience)
+
+    @staticmethod
+    def _gather_action_outputs(
+        stored_outputs: List[ActionInfoOutputs], indices: List[int]
+    ) -> Tuple[List[ActionTuple], List[LogProbsTuple]]:
+        """
+        Returns the action and log probs the agents took, stored_outputs[i] being the
+        outputs of the forward pass of the i-th agent and indices[i] its index in that
+        pass. The agents that acted in the same forward pass are gathered together.
+        """
+        action_tuples: List[ActionTuple] = [None] * len(indices)  # type: ignore
+        log_probs_tuples: List[LogProbsTuple] = [None] * len(indices)  # type: ignore
+        # id of the outputs -> (outputs, positions in indices, indices in the outputs)
+        by_outputs: Dict[int, Tuple[ActionInfoOutputs, List[int], List[int]]] = {}
+        for position, (outputs, index) in enumerate(zip(stored_outputs, indices)):
+            _, positions, output_indices = by_outputs.setdefault(
+                id(outputs), (outputs, [], [])
+            )
+            positions.append(position)
+            output_indices.append(index)
+
+        for outputs, positions, output_indices in by_outputs.values():
+            stored_actions = cast(ActionTuple, outputs["action"])
+            continuous = stored_actions.continuous[output_indices]
+            discrete = stored_actions.discrete[output_indices]
+            for position, _continuous, _discrete in zip(
+                positions, continuous, discrete
+            ):
+                action_tuples[position] = ActionTuple(
+                    continuous=_continuous, discrete=_discrete
+                )
+            if "log_probs" not in outputs:
+                for position in positions:
+                    log_probs_tuples[position] = LogProbsTuple.empty_log_probs()
+                continue
+            stored_action_probs = cast(LogProbsTuple, outputs["log_probs"])
+            if not isinstance(stored_action_probs, LogProbsTuple):
+                stored_action_probs = stored_action_probs.to_log_probs_tuple()
+            continuous = stored_action_probs.continuous[output_indices]
+            discrete = stored_action_probs.discrete[output_indices]
+            for position, _continuous, _discrete in zip(
+                positions, continuous, discrete
+            ):
+                log_probs_tuples[position] = LogProbsTuple(
+                    continuous=_continuous, discrete=_discrete
+                )
+        return action_tuples, log_probs_tuples
+
     def _add_group_status_and_obs(
         self, step: Union[TerminalStep, DecisionStep], worker_id: int
     ) -> None:
@@ -273,41 +513,55 @@ class AgentProcessor:
                 group_status=group_statuses,
                 group_reward=step.group_reward,
             )
-            # Add the value outputs if needed
-            self._experience_buffers[global_agent_id].append(experience)
-            self._episode_rewards[global_agent_id] += step.reward
-            if not terminated:
-                self._episode_steps[global_agent_id] += 1
+            self._add_experience(step, global_agent_id, global_group_id, experience)
 
-            # Add a trajectory segment to the buffer if terminal or the length has reached the time horizon
-            if (
-                len(self._experience_buffers[global_agent_id])
-                >= self._max_trajectory_length
-                or terminated
-            ):
-                next_obs = step.obs
-                next_group_obs = []
-                for _id, _obs in self._current_group_obs[global_group_id].items():
-                    if _id != global_agent_id:
-                        next_group_obs.append(_obs)
-
-                trajectory = Trajectory(
-                    steps=self._experience_buffers[global_agent_id],
-                    agent_id=global_agent_id,
-                    next_obs=next_obs,
-                    next_group_obs=next_group_obs,
-                    behavior_id=self._behavior_id,
-                )
-                for traj_queue in self._trajectory_queues:
-                    traj_queue.put(trajectory)
-                self._experience_buffers[global_agent_id] = []
-            if terminated:
-                # Record episode length.
-                self._stats_reporter.add_stat(
-                    "Environment/Episode Length",
-                    self._episode_steps.get(global_agent_id, 0),
-                )
-                self._clean_agent_data(global_agent_id)
+    def _add_experience(
+        self,
+        step: Union[TerminalStep, DecisionStep],
+        global_agent_id: GlobalAgentId,
+        global_group_id: GlobalGroupId,
+        experience: AgentExperience,
+    ) -> None:
+        """
+        Appends the experience to the agent's experience history, and publishes the
+        trajectory if the agent is done or its trajectory has reached the maximum length.
+        """
+        terminated = experience.done
+        # Add the value outputs if needed
+        self._experience_buffers[global_agent_id].append(experience)
+        self._episode_rewards[global_agent_id] += step.reward
+        if not terminated:
+            self._episode_steps[global_agent_id] += 1
+
+        # Add a trajectory segment to the buffer if terminal or the length has reached the time horizon
+        if (
+            len(self._experience_buffers[global_agent_id])
+            >= self._max_trajectory_length
+            or terminated
+        ):
+            next_obs = step.obs
+            next_group_obs = []
+            for _id, _obs in self._current_group_obs[global_group_id].items():
+                if _id != global_agent_id:
+                    next_group_obs.append(_obs)
+
+            trajectory = Trajectory(
+                steps=self._experience_buffers[global_agent_id],
+                agent_id=global_agent_id,
+                next_obs=next_obs,
+                next_group_obs=next_group_obs,
+                behavior_id=self._behavior_id,
+            )
+            for traj_queue in self._trajectory_queues:
+                traj_queue.put(trajectory)
+            self._experience_buffers[global_agent_id] = []
+        if terminated:
+            # Record episode length.
+            self._stats_reporter.add_stat(
+                "Environment/Episode Length",
+                self._episode_steps.get(global_agent_id, 0),
+            )
+            self._clean_agent_data(global_agent_id)
 
     def _clean_agent_data(self, global_id: GlobalAgentId) -> None:
         """
@@ -354,6 +608,9 @@ class AgentManagerQueue(Generic[T]):
     Queue used by the AgentManager. Note that we make our own class here because in most implementations
     deque is sufficient and faster. However, if we want to switch to multiprocessing, we'll need to change
     out this implementation.
+    Unbounded queues and queues that drop their oldest items rely on the thread safety of deque.append and
+    deque.popleft and don't take a lock. Bounded queues that block or spill their items to disk when full
+    use a lock to wait for room or to keep their items in order.
     """
 
     class Empty(Exception):
@@ -363,14 +620,39 @@ class AgentManagerQueue(Generic[T]):
 
         pass
 
-    def __init__(self, behavior_id: str, maxlen: int = 0):
+    def __init__(
+        self,
+        behavior_id: str,
+        maxlen: int = 0,
+        overflow_policy: QueueOverflowPolicy = QueueOverflowPolicy.BLOCK,
+        name: Optional[str] = None,
+    ):
         """
         Initializes an AgentManagerQueue. Note that we can give it a behavior_id so that it can be identified
         separately from an AgentManager.
+        :param maxlen: Maximum number of items in the queue. 0 means the queue is unbounded.
+        :param overflow_policy: What to do with the items put in the queue when it is full.
+        :param name: Name of the queue in the timer gauges. The depth and latency of the queue are only
+        recorded for named queues.
         """
         self._maxlen: int = maxlen
-        self._queue: queue.Queue = queue.Queue(maxsize=maxlen)
         self._behavior_id = behavior_id
+        self._overflow_policy = overflow_policy
+        bounded = maxlen > 0
+        # Items are stored with the time they were put in the queue, to measure the latency.
+        self._queue: Deque[Tuple[float, T]] = deque(
+            maxlen=maxlen
+            if bounded and overflow_policy == QueueOverflowPolicy.DROP_OLDEST
+            else None
+        )
+        self._lock: Optional[threading.Condition] = None
+        if bounded and overflow_policy != QueueOverflowPolicy.DROP_OLDEST:
+            self._lock = threading.Condition()
+        self._spill_dir: Optional[tempfile.TemporaryDirectory] = None
+        self._spilled: Deque[str] = deque()
+        self._num_spilled = 0
+        self._gauge_prefix = f"{behavior_id}.{name}" if name is not None else None
+        self._warned_overflow = False
 
     @property
     def maxlen(self):
@@ -390,26 +672,112 @@ class AgentManagerQueue(Generic[T]):
 
     def qsize(self) -> int:
         """
-        Returns the approximate size of the queue. Note that values may differ
-        depending on the underlying queue implementation.
+        Returns the approximate size of the queue, including the items spilled to disk.
         """
-        return self._queue.qsize()
+        return len(self._queue) + len(self._spilled)
 
     def empty(self) -> bool:
-        return self._queue.empty()
+        return self.qsize() == 0
 
     def get_nowait(self) -> T:
         """
         Gets the next item from the queue, throwing an AgentManagerQueue.Empty exception
         if the queue is empty.
         """
-        try:
-            return self._queue.get_nowait()
-        except queue.Empty:
+        items = self.get_many(1)
+        if not items:
             raise self.Empty("The AgentManagerQueue is empty.")
+        return items[0]
+
+    def get_many(self, max_items: Optional[int] = None) -> List[T]:
+        """
+        Gets the items that are in the queue, without waiting for more.
+        :param max_items: Maximum number of items to get. By default, gets as many items
+        as there are in the queue when called, so that a consumer can't be kept busy
+        by a producer filling the queue faster than it is emptied.
+        :return: The items, oldest first. Empty if the queue is empty.
+        """
+        entries: List[Tuple[float, T]] = []
+        if self._lock is None:
+            count = len(self._queue) if max_items is None else max_items
+            while len(entries) < count:
+                try:
+                    entries.append(self._queue.popleft())
+                except IndexError:
+                    break
+        else:
+            with self._lock:
+                count = self.qsize() if max_items is None else max_items
+                while len(entries) < count and self._queue:
+                    entries.append(self._queue.popleft())
+                    self._unspill()
+                self._lock.notify_all()
+        if entries and self._gauge_prefix is not None:
+            now = time.perf_counter()
+            latency = sum(now - put_time for put_time, _ in entries) / len(entries)
+            set_gauge(f"{self._gauge_prefix}.latency_ms", 1000 * latency)
+            set_gauge(f"{self._gauge_prefix}.depth", self.qsize())
+        return [item for _, item in entries]
 
     def put(self, item: T) -> None:
-        self._queue.put(item)
+        self.put_many([item])
+
+    def put_many(self, items: List[T]) -> None:
+        """
+        Puts the items in the queue. If the queue is full, either waits for the items to
+        fit, drops the oldest items of the queue, or spills the items to disk, depending
+        on the overflow policy.
+        """
+        now = time.perf_counter()
+        entries = [(now, item) for item in items]
+        if self._lock is None:
+            if self._maxlen > 0 and len(self._queue) + len(entries) > self._maxlen:
+                self._warn_overflow("dropping the oldest items")
+            self._queue.extend(entries)
+        elif self._overflow_policy == QueueOverflowPolicy.BLOCK:
+            with self._lock:
+                for entry in entries:
+                    self._lock.wait_for(lambda: len(self._queue) < self._maxlen)
+                    self._queue.append(entry)
+        else:
+            with self._lock:
+                for entry in entries:
+                    # Once items are spilled, the following ones are spilled as well to
+                    # keep the items in order.
+                    if self._spilled or len(self._queue) >= self._maxlen:
+                        self._warn_overflow("spilling the new items to disk")
+                        self._spill(entry)
+                    else:
+                        self._queue.append(entry)
+        if self._gauge_prefix is not None:
+            set_gauge(f"{self._gauge_prefix}.depth", self.qsize())
+
+    def _spill(self, entry: Tuple[float, T]) -> None:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix="mlagents_queue_")
+        path = os.path.join(self._spill_dir.name, f"{self._num_spilled}.pkl")
+        self._num_spilled += 1
+        with open(path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spilled.append(path)
+
+    def _unspill(self) -> None:
+        """
+        Moves the oldest spilled items back to the queue while there is room.
+        """
+        while self._spilled and len(self._queue) < self._maxlen:
+            path = self._spilled.popleft()
+            with open(path, "rb") as f:
+                self._queue.append(pickle.load(f))
+            os.remove(path)
+
+    def _warn_overflow(self, action: str) -> None:
+        if not self._warned_overflow:
+            logger.warning(
+                f"The queue of {self._behavior_id} is full, {action}. "
+                "The trainer isn't keeping up with the environments."
+            )
+            self._warned_overflow = True
 
 
 class AgentManager(AgentProcessor):
@@ -425,11 +793,20 @@ class AgentManager(AgentProcessor):
         stats_reporter: StatsReporter,
         max_trajectory_length: int = sys.maxsize,
         threaded: bool = True,
+        batched: bool = False,
+        trajectory_queue_len: int = 20,
+        trajectory_queue_overflow: QueueOverflowPolicy = QueueOverflowPolicy.BLOCK,
     ):
-        super().__init__(policy, behavior_id, stats_reporter, max_trajectory_length)
-        trajectory_queue_len = 20 if threaded else 0
+        super().__init__(
+            policy, behavior_id, stats_reporter, max_trajectory_length, batched
+        )
+        # Only threaded trainers can empty the trajectory queue while the environments
+        # are stepping, so the queue is unbounded otherwise.
         self.trajectory_queue: AgentManagerQueue[Trajectory] = AgentManagerQueue(
-            self._behavior_id, maxlen=trajectory_queue_len
+            self._behavior_id,
+            maxlen=trajectory_queue_len if threaded else 0,
+            overflow_policy=trajectory_queue_overflow,
+            name="trajectory_queue",
         )
         # NOTE: we make policy queues of infinite length to avoid lockups of the trainers.
         # In the environment manager, we make sure to empty the policy queue before continuing to produce steps.
@@ -1,10 +1,14 @@
 from collections import defaultdict
 from collections.abc import MutableMapping
 import enum
+import functools
 import itertools
-from typing import BinaryIO, DefaultDict, List, Tuple, Union, Optional
+import os
+import tempfile
+from typing import Any, BinaryIO, DefaultDict, Iterator, List, Tuple, Union, Optional
 
 import numpy as np
+import numpy.typing as npt
 import h5py
 
 from mlagents_envs.exception import UnityException
@@ -14,6 +18,26 @@ from mlagents_envs.exception import UnityException
 BufferEntry = Union[np.ndarray, List[np.ndarray]]
 
 
+def _padding_like(element: BufferEntry, padding_value: float) -> np.ndarray:
+    """
+    Returns the element multiplied by padding_value, used to pad incomplete sequences.
+    uint8 elements (visual observations) are kept as uint8 so that padding doesn't change
+    the dtype of the batch.
+    """
+    padding = np.array(element, dtype=np.float32) * padding_value
+    if np.asarray(element).dtype == np.uint8:
+        return padding.astype(np.uint8)
+    return padding
+
+
+def _h5_dtype(data: np.ndarray) -> str:
+    """
+    Returns the dtype a field is saved with in an h5 file. uint8 fields (visual observations)
+    are saved as uint8, everything else as float32.
+    """
+    return "u1" if data.dtype == np.uint8 else "f"
+
+
 class BufferException(UnityException):
     """
     Related to errors with the Buffer.
@@ -174,11 +198,12 @@ class AgentBufferField(list):
                     " too large given the current number of data points."
                 )
             if batch_size * training_length > len(self):
+                padding: BufferEntry
                 if self.contains_lists:
                     padding = []
                 else:
                     # We want to duplicate the last value in the array, multiplied by the padding_value.
-                    padding = np.array(self[-1], dtype=np.float32) * self.padding_value
+                    padding = _padding_like(self[-1], self.padding_value)
                 return self[:] + [padding] * (training_length - leftover)
 
             else:
@@ -207,7 +232,7 @@ class AgentBufferField(list):
         self[:] = []
 
     def padded_to_batch(
-        self, pad_value: np.float = 0, dtype: np.dtype = np.float32
+        self, pad_value: np.float = 0, dtype: npt.DTypeLike = np.float32
     ) -> Union[np.ndarray, List[np.ndarray]]:
         """
         Converts this AgentBufferField (which is a List[BufferEntry]) into a numpy array
@@ -251,6 +276,318 @@ class AgentBufferField(list):
         return np.array(self)
 
 
+class ColumnarAgentBufferField:
+    """
+    ColumnarAgentBufferField stores a field in a single preallocated numpy array (a column)
+    instead of a list of per-step arrays. The shape and dtype of an element are inferred from
+    the first element added. Slices of the field are views into the column and indexing with
+    an array of indices gathers all of the elements in one operation.
+    Group entries (List[np.ndarray]) are stored in an object column, one list per element.
+    """
+
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, capacity: int = 0):
+        """
+        :param capacity: Number of elements to preallocate when the first element is added.
+            The column grows geometrically past this.
+        """
+        self.padding_value: float = 0
+        self._capacity = capacity
+        self._data: Optional[np.ndarray] = None
+        # The live elements are self._data[self._start : self._start + self._length]
+        self._start = 0
+        self._length = 0
+        # Whether self._data is memory shared with another field, e.g. a mini-batch
+        # of a ColumnarAgentBuffer. Such fields are copied before they are written to.
+        self._is_view = False
+
+    @staticmethod
+    def from_array(
+        data: np.ndarray, padding_value: float = 0
+    ) -> "ColumnarAgentBufferField":
+        """
+        Wraps an array in a ColumnarAgentBufferField without copying it.
+        :param data: Array whose first dimension indexes the elements of the field.
+        :param padding_value: The value used to pad when get_batch is called.
+        """
+        field = ColumnarAgentBufferField()
+        field._data = data
+        field._length = len(data)
+        field._is_view = True
+        field.padding_value = padding_value
+        return field
+
+    def __str__(self) -> str:
+        return f"ColumnarAgentBufferField: {self._view()}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._view())
+
+    def __array__(
+        self, dtype: Optional[npt.DTypeLike] = None, copy: Optional[bool] = None
+    ) -> np.ndarray:
+        view = self._view()
+        if dtype is None or view.dtype == dtype:
+            return view
+        return view.astype(dtype)
+
+    def __getitem__(self, index):
+        return_data = self._view()[index]
+        if isinstance(index, (int, np.integer)):
+            if isinstance(return_data, list):
+                return AgentBufferField(return_data)
+            return return_data
+        return ColumnarAgentBufferField.from_array(return_data, self.padding_value)
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        view = self._view()
+        if self.contains_lists and isinstance(index, slice):
+            # Assigning a sequence of lists to an object array would try to broadcast them.
+            for i, element in zip(range(*index.indices(len(view))), value):
+                view[i] = element
+        else:
+            view[index] = value
+
+    @property
+    def contains_lists(self) -> bool:
+        """
+        Checks whether this ColumnarAgentBufferField contains List[np.ndarray].
+        """
+        return self._data is not None and self._data.dtype == object
+
+    def append(self, element: BufferEntry, padding_value: float = 0.0) -> None:
+        """
+        Adds an element to the end of the column. Also lets you change the padding
+        type, so that it can be set on append (e.g. action_masks should
+        be padded with 1.)
+        :param element: The element to append to the column.
+        :param padding_value: The value used to pad when get_batch is called.
+        """
+        if self._data is None:
+            self._allocate(element, 1)
+        elif not self.contains_lists:
+            element = np.asarray(element)
+            self._check_compatible(element.shape, element.dtype)
+        self._reserve(1)
+        self._data[self._start + self._length] = element
+        self._length += 1
+        self.padding_value = padding_value
+
+    def extend(self, data: Union[List[BufferEntry], np.ndarray]) -> None:
+        """
+        Adds all of the elements in data to the end of the column.
+        :param data: A list of BufferEntry or an array whose first dimension indexes elements.
+        """
+        if isinstance(data, ColumnarAgentBufferField):
+            data = data._view()
+        if len(data) == 0:
+            return
+        if self._data is None:
+            self._allocate(data[0], len(data))
+        if self.contains_lists:
+            self._reserve(len(data))
+            end = self._start + self._length
+            for i, element in enumerate(data):
+                self._data[end + i] = element
+        else:
+            array_data = np.asarray(data)
+            if array_data.dtype == object:
+                raise BufferException(
+                    "Unable to add elements of different shapes to a ColumnarAgentBufferField."
+                )
+            self._check_compatible(array_data.shape[1:], array_data.dtype)
+            self._reserve(len(array_data))
+            end = self._start + self._length
+            self._data[end : end + len(array_data)] = array_data
+        self._length += len(data)
+
+    def set(self, data: Union[List[BufferEntry], np.ndarray]) -> None:
+        """
+        Sets the elements of the column to the input data.
+        :param data: The BufferEntry list or array to be set.
+        """
+        if isinstance(data, ColumnarAgentBufferField):
+            data = data._view()
+        if (
+            self._data is not None
+            and isinstance(data, np.ndarray)
+            and np.may_share_memory(data, self._data)
+        ):
+            data = data.copy()
+        self.reset_field()
+        self.extend(data)
+
+    def drop_oldest(self, num_elements: int) -> None:
+        """
+        Removes the first num_elements elements of the column. This does not move any data,
+        the space is reclaimed the next time the column needs to grow.
+        :param num_elements: The number of elements to remove.
+        """
+        num_elements = min(num_elements, self._length)
+        self._start += num_elements
+        self._length -= num_elements
+
+    def get_batch(
+        self,
+        batch_size: int = None,
+        training_length: Optional[int] = 1,
+        sequential: bool = True,
+    ) -> Union[np.ndarray, List[BufferEntry]]:
+        """
+        Retrieve the last batch_size elements of length training_length
+        from the column. Follows the semantics of AgentBufferField.get_batch, but returns
+        an array (a view when no padding is needed) rather than a list, unless the field
+        contains group entries.
+        :param batch_size: The number of elements to retrieve. If None:
+        All elements will be retrieved.
+        :param training_length: The length of the sequence to be retrieved. If
+        None: only takes one element.
+        :param sequential: If true and training_length is not None: the elements
+        will not repeat in the sequence. [a,b,c,d,e] with training_length = 2 and
+        sequential=True gives [[0,a],[b,c],[d,e]]. If sequential=False gives
+        [[a,b],[b,c],[c,d],[d,e]]
+        """
+        if training_length is None:
+            training_length = 1
+        view = self._view()
+        if sequential:
+            # The sequences will not have overlapping elements (this involves padding)
+            leftover = len(self) % training_length
+            max_batch_size = len(self) // training_length + 1 * (leftover != 0)
+            if batch_size is None:
+                batch_size = max_batch_size
+            if batch_size > max_batch_size:
+                raise BufferException(
+                    "The batch size and training length requested for get_batch where"
+                    " too large given the current number of data points."
+                )
+            if batch_size * training_length > len(self):
+                num_padding = training_length - leftover
+                if self.contains_lists:
+                    return list(view) + [[]] * num_padding
+                # We want to duplicate the last value in the array, multiplied by the padding_value.
+                padding = _padding_like(view[-1], self.padding_value)
+                return np.concatenate(
+                    [view, np.broadcast_to(padding, (num_padding,) + padding.shape)]
+                )
+            batch = view[len(self) - batch_size * training_length :]
+        else:
+            # The sequences will have overlapping elements
+            if batch_size is None:
+                # retrieve the maximum number of elements
+                batch_size = len(self) - training_length + 1
+            if (len(self) - training_length + 1) < batch_size:
+                raise BufferException(
+                    "The batch size and training length requested for get_batch where"
+                    " too large given the current number of data points."
+                )
+            ends = np.arange(len(self) - batch_size + 1, len(self) + 1)
+            indices = ends[:, None] - training_length + np.arange(training_length)
+            batch = view[indices.ravel()]
+        return list(batch) if self.contains_lists else batch
+
+    def reset_field(self) -> None:
+        """
+        Resets the ColumnarAgentBufferField. The allocated column is kept for reuse.
+        """
+        if self._is_view:
+            self._data = None
+            self._is_view = False
+        self._start = 0
+        self._length = 0
+
+    def padded_to_batch(
+        self, pad_value: float = 0, dtype: npt.DTypeLike = np.float32
+    ) -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Converts this ColumnarAgentBufferField into a numpy array, see
+        AgentBufferField.padded_to_batch.
+        :param pad_value: Value to pad List AgentBufferFields, when there are less than the maximum
+            number of agents present.
+        :param dtype: Dtype of output numpy array.
+        :return: Numpy array or List of numpy arrays representing this ColumnarAgentBufferField,
+            where the first dimension is equal to the length of the ColumnarAgentBufferField.
+        """
+        if len(self) > 0 and not self.contains_lists:
+            return np.asanyarray(self._view(), dtype=dtype)
+        return AgentBufferField(list(self._view())).padded_to_batch(pad_value, dtype)
+
+    def to_ndarray(self):
+        """
+        Returns a copy of the elements of the ColumnarAgentBufferField as an ndarray.
+        """
+        if self.contains_lists:
+            return np.array(list(self._view()))
+        return np.array(self._view())
+
+    def _view(self) -> np.ndarray:
+        if self._data is None:
+            return np.empty(0, dtype=np.float32)
+        return self._data[self._start : self._start + self._length]
+
+    def _new_column(self, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        Allocates an array to hold the column.
+        :param shape: The shape of the array, the capacity followed by the element shape.
+        :param dtype: The dtype of the elements.
+        """
+        return np.empty(shape, dtype=dtype)
+
+    def _allocate(self, element: BufferEntry, num_elements: int) -> None:
+        capacity = max(self._capacity, num_elements, self.INITIAL_CAPACITY)
+        if isinstance(element, list):
+            self._data = self._new_column((capacity,), np.dtype(object))
+        else:
+            element = np.asarray(element)
+            self._data = self._new_column((capacity,) + element.shape, element.dtype)
+        self._start = 0
+        self._length = 0
+        self._is_view = False
+
+    def _check_compatible(self, shape: Tuple[int, ...], dtype: np.dtype) -> None:
+        if shape != self._data.shape[1:]:
+            raise BufferException(
+                f"Unable to add an element of shape {shape} to a ColumnarAgentBufferField"
+                f" of shape {self._data.shape[1:]}."
+            )
+        if not np.can_cast(dtype, self._data.dtype, casting="same_kind"):
+            # e.g. a float padding value added to a column of bools
+            new_data = self._new_column(
+                self._data.shape, np.result_type(dtype, self._data.dtype)
+            )
+            new_data[self._start : self._start + self._length] = self._view()
+            self._data = new_data
+            self._is_view = False
+
+    def _reserve(self, num_elements: int) -> None:
+        """
+        Makes sure there is room for num_elements more elements at the end of the column,
+        either by moving the live elements to the front of the column or by growing it.
+        """
+        capacity = len(self._data)
+        required = self._length + num_elements
+        if not self._is_view and self._start + required <= capacity:
+            return
+        if not self._is_view and required <= capacity and self._start * 8 >= capacity:
+            # Numpy handles the overlap between source and destination.
+            self._data[: self._length] = self._view()
+        else:
+            new_capacity = max(
+                required, capacity + capacity // 2, self.INITIAL_CAPACITY
+            )
+            new_data = self._new_column(
+                (new_capacity,) + self._data.shape[1:], self._data.dtype
+            )
+            new_data[: self._length] = self._view()
+            self._data = new_data
+            self._is_view = False
+        self._start = 0
+
+
 class AgentBuffer(MutableMapping):
     """
     AgentBuffer contains a dictionary of AgentBufferFields. Each agent has his own AgentBuffer.
@@ -426,13 +763,24 @@ class AgentBuffer(MutableMapping):
             Number of sequences to sample will be batch_size/sequence_length.
         """
         num_seq_to_sample = batch_size // sequence_length
-        mini_batch = AgentBuffer()
         buff_len = self.num_experiences
         num_sequences_in_buffer = buff_len // sequence_length
         start_idxes = (
             np.random.randint(num_sequences_in_buffer, size=num_seq_to_sample)
             * sequence_length
         )  # Sample random sequence starts
+        return self.make_sequence_mini_batch(start_idxes, sequence_length)
+
+    def make_sequence_mini_batch(
+        self, start_idxes: np.ndarray, sequence_length: int = 1
+    ) -> "AgentBuffer":
+        """
+        Creates a mini-batch from the sequences starting at the given indices.
+        :param start_idxes: Starting indices of the sequences in the buffer.
+        :param sequence_length: Length of the sequences.
+        :return: Dict of mini batch.
+        """
+        mini_batch = AgentBuffer()
         for key in self:
             buffer_field = self[key]
             mb_list = (buffer_field[i : i + sequence_length] for i in start_idxes)
@@ -446,9 +794,13 @@ class AgentBuffer(MutableMapping):
         Saves the AgentBuffer to a file-like object.
         """
         with h5py.File(file_object, "w") as write_file:
-            for key, data in self.items():
+            for key, field in self.items():
+                data = np.asarray(field)
                 write_file.create_dataset(
-                    self._encode_key(key), data=data, dtype="f", compression="gzip"
+                    self._encode_key(key),
+                    data=data,
+                    dtype=_h5_dtype(data),
+                    compression="gzip",
                 )
 
     def load_from_file(self, file_object: BinaryIO) -> None:
@@ -519,3 +871,224 @@ class AgentBuffer(MutableMapping):
             return len(next(iter(self.values())))
         else:
             return 0
+
+
+class ColumnarAgentBuffer(AgentBuffer):
+    """
+    AgentBuffer whose fields are ColumnarAgentBufferFields. make_mini_batch returns views
+    into the columns, sample_mini_batch and shuffle gather all of the sampled sequences
+    in one operation per field, and truncate drops the oldest experiences without moving
+    the remaining ones.
+    """
+
+    def __init__(self, capacity: int = 0):
+        """
+        :param capacity: Number of experiences to preallocate in each field.
+        """
+        super().__init__()
+        self.capacity = capacity
+        self._fields: DefaultDict[
+            AgentBufferKey, ColumnarAgentBufferField
+        ] = defaultdict(  # type: ignore
+            functools.partial(ColumnarAgentBufferField, capacity)
+        )
+
+    def set_field(self, key: AgentBufferKey, field: ColumnarAgentBufferField) -> None:
+        """
+        Sets a field, e.g. one wrapping an existing array with
+        ColumnarAgentBufferField.from_array.
+        """
+        if self.CHECK_KEY_TYPES_AT_RUNTIME:
+            self._check_key(key)
+        self._fields[key] = field
+
+    @staticmethod
+    def _sequence_indices(
+        sequence_starts: np.ndarray, sequence_length: int
+    ) -> np.ndarray:
+        return (sequence_starts[:, None] + np.arange(sequence_length)).ravel()
+
+    def shuffle(
+        self, sequence_length: int, key_list: List[AgentBufferKey] = None
+    ) -> None:
+        """
+        Shuffles the fields in key_list in a consistent way: The reordering will
+        be the same across fields.
+        :param key_list: The fields that must be shuffled.
+        """
+        if key_list is None:
+            key_list = list(self._fields.keys())
+        if not self.check_length(key_list):
+            raise BufferException(
+                "Unable to shuffle if the fields are not of same length"
+            )
+        s = np.arange(len(self[key_list[0]]) // sequence_length)
+        np.random.shuffle(s)
+        indices = self._sequence_indices(s * sequence_length, sequence_length)
+        for key in key_list:
+            self[key].set(self[key][indices])
+
+    def make_mini_batch(self, start: int, end: int) -> "ColumnarAgentBuffer":
+        """
+        Creates a mini-batch from buffer. The fields of the mini-batch are views into
+        this buffer.
+        :param start: Starting index of buffer.
+        :param end: Ending index of buffer.
+        :return: Dict of mini batch.
+        """
+        mini_batch = ColumnarAgentBuffer()
+        for key, field in self._fields.items():
+            mini_batch[key] = field[start:end]
+        return mini_batch
+
+    def sample_mini_batch(
+        self, batch_size: int, sequence_length: int = 1
+    ) -> "ColumnarAgentBuffer":
+        """
+        Creates a mini-batch from a random start and end.
+        :param batch_size: number of elements to withdraw.
+        :param sequence_length: Length of sequences to sample.
+            Number of sequences to sample will be batch_size/sequence_length.
+        """
+        num_seq_to_sample = batch_size // sequence_length
+        num_sequences_in_buffer = self.num_experiences // sequence_length
+        start_idxes = (
+            np.random.randint(num_sequences_in_buffer, size=num_seq_to_sample)
+            * sequence_length
+        )  # Sample random sequence starts
+        return self.make_sequence_mini_batch(start_idxes, sequence_length)
+
+    def make_sequence_mini_batch(
+        self, start_idxes: np.ndarray, sequence_length: int = 1
+    ) -> "ColumnarAgentBuffer":
+        """
+        Creates a mini-batch from the sequences starting at the given indices.
+        :param start_idxes: Starting indices of the sequences in the buffer.
+        :param sequence_length: Length of the sequences.
+        :return: Dict of mini batch.
+        """
+        indices = self._sequence_indices(start_idxes, sequence_length)
+        mini_batch = ColumnarAgentBuffer()
+        for key, field in self._fields.items():
+            mini_batch[key] = field[indices]
+        return mini_batch
+
+    def save_to_file(self, file_object: BinaryIO) -> None:
+        """
+        Saves the ColumnarAgentBuffer to a file-like object.
+        """
+        with h5py.File(file_object, "w") as write_file:
+            for key, field in self._fields.items():
+                data = field.to_ndarray() if field.contains_lists else np.asarray(field)
+                write_file.create_dataset(
+                    self._encode_key(key),
+                    data=data,
+                    dtype=_h5_dtype(data),
+                    compression="gzip",
+                )
+
+    def load_from_file(self, file_object: BinaryIO) -> None:
+        """
+        Loads the ColumnarAgentBuffer from a file-like object.
+        """
+        with h5py.File(file_object, "r") as read_file:
+            for key in list(read_file.keys()):
+                decoded_key = self._decode_key(key)
+                self[decoded_key] = self._fields.default_factory()  # type: ignore
+                self[decoded_key].extend(read_file[key][()])
+
+    def truncate(self, max_length: int, sequence_length: int = 1) -> None:
+        """
+        Truncates the buffer to a certain length by dropping the oldest experiences.
+        Note that we must truncate an integer number of sequence_lengths
+        param: max_length: The length at which to truncate the buffer.
+        """
+        current_length = self.num_experiences
+        # make max_length an integer number of sequence_lengths
+        max_length -= max_length % sequence_length
+        if current_length > max_length:
+            for field in self._fields.values():
+                field.drop_oldest(current_length - max_length)
+
+
+class MemoryMappedAgentBufferField(ColumnarAgentBufferField):
+    """
+    ColumnarAgentBufferField whose column is a memory-mapped file, so that the field can
+    be larger than the available memory. The pages that were used recently stay cached
+    in memory by the operating system. Fields with small elements, like rewards and
+    actions, are kept in memory since they don't take much of it, as are group entries.
+    """
+
+    def __init__(self, directory: str, capacity: int = 0, min_element_bytes: int = 64):
+        """
+        :param directory: The directory the column files are created in. The files are
+            deleted once they are mapped, so they don't outlive the process.
+        :param capacity: Number of elements to preallocate when the first element is added.
+        :param min_element_bytes: Columns whose elements are smaller than this are kept
+            in memory.
+        """
+        super().__init__(capacity)
+        self.directory = directory
+        self.min_element_bytes = min_element_bytes
+
+    def _new_column(self, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        element_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+        # Empty files can't be mapped.
+        if (
+            dtype == object
+            or element_bytes < self.min_element_bytes
+            or element_bytes * shape[0] == 0
+        ):
+            return super()._new_column(shape, dtype)
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".column", dir=self.directory)
+        os.close(fd)
+        column = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+        try:
+            os.remove(path)
+        except OSError:
+            # Mapped files can't be removed on Windows.
+            pass
+        return column
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        return isinstance(self._data, np.memmap)
+
+    def __getitem__(self, index):
+        if (
+            isinstance(index, np.ndarray)
+            and index.dtype.kind in "iu"
+            and self.is_memory_mapped
+        ):
+            # Read the sampled elements in the order they are in the file.
+            order = np.argsort(index, kind="stable")
+            view = self._view()
+            gathered = np.empty((len(index),) + view.shape[1:], dtype=view.dtype)
+            gathered[order] = view[index[order]]
+            return ColumnarAgentBufferField.from_array(gathered, self.padding_value)
+        return super().__getitem__(index)
+
+
+class MemoryMappedAgentBuffer(ColumnarAgentBuffer):
+    """
+    ColumnarAgentBuffer whose large fields, like the observations, are stored in
+    memory-mapped files, for replay buffers that don't fit in memory. Mini-batches are
+    gathered into memory, reading the sampled experiences in the order they are stored.
+    """
+
+    def __init__(self, directory: str, capacity: int = 0, min_element_bytes: int = 64):
+        """
+        :param directory: The directory the column files are created in.
+        :param capacity: Number of experiences to preallocate in each field.
+        :param min_element_bytes: Fields whose elements are smaller than this are kept in
+            memory.
+        """
+        super().__init__(capacity)
+        self.directory = directory
+        self._fields = defaultdict(
+            functools.partial(
+                MemoryMappedAgentBufferField, directory, capacity, min_element_bytes
+            )
+        )
@@ -178,6 +178,74 @@ def _create_parser() -> argparse.ArgumentParser:
         action=DetectDefault,
     )
 
+    argparser.add_argument(
+        "--shared-memory-obs",
+        default=False,
+        action=DetectDefaultStoreTrue,
+        help="Whether the environment workers should send their observations to the trainer through shared "
+        "memory rather than pickling them. Recommended for visual observations and many environments.",
+    )
+
+    argparser.add_argument(
+        "--batched-inference",
+        default=False,
+        action=DetectDefaultStoreTrue,
+        help="Whether to compute the actions of all the environments that are ready with a single forward "
+        "pass per behavior rather than one per environment. Recommended when training with many "
+        "environments on a CPU.",
+    )
+
+    argparser.add_argument(
+        "--batched-agent-processing",
+        default=False,
+        action=DetectDefaultStoreTrue,
+        help="Whether to process the steps of all the agents of a behavior together when adding them to "
+        "their trajectories, rather than agent by agent. Recommended for behaviors with many agents.",
+    )
+
+    argparser.add_argument(
+        "--step-batch-min-envs",
+        default=1,
+        type=int,
+        help="The number of environments to wait for before processing their steps, unless "
+        "step-batch-timeout-ms has passed. Larger values give larger inference batches at the cost of latency.",
+        action=DetectDefault,
+    )
+    argparser.add_argument(
+        "--step-batch-timeout-ms",
+        default=0,
+        type=int,
+        help="The maximum time to wait for step-batch-min-envs environments before processing the steps "
+        "that are ready.",
+        action=DetectDefault,
+    )
+
+    argparser.add_argument(
+        "--pipelined-stepping",
+        default=False,
+        action=DetectDefaultStoreTrue,
+        help="Whether to send the environments their next actions as soon as their steps are received, "
+        "and to process the steps on a separate thread while the environments simulate.",
+    )
+    argparser.add_argument(
+        "--pipelined-max-lag",
+        default=2,
+        type=int,
+        help="With pipelined stepping, the number of batches of environment steps that can wait to be "
+        "processed before stepping the environments blocks. Bounds how far the policy lags behind the "
+        "collected experience.",
+        action=DetectDefault,
+    )
+
+    argparser.add_argument(
+        "--uint8-visual-obs",
+        default=False,
+        action=DetectDefaultStoreTrue,
+        help="Whether to keep compressed visual observations as uint8 from the environment to the training "
+        "buffers, and only convert them to floats in the visual encoders. Uses 4 times less memory for "
+        "visual observations.",
+    )
+
     argparser.add_argument(
         "--debug",
         default=False,
@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mlagents_envs.base_env import (
+    ActionSpec,
+    BehaviorSpec,
+    DimensionProperty,
+    ObservationSpec,
+    ObservationType,
+)
+from mlagents_envs.logging_util import get_logger
+from mlagents.trainers.buffer import (
+    AgentBuffer,
+    ColumnarAgentBuffer,
+    ColumnarAgentBufferField,
+)
+
+logger = get_logger(__name__)
+
+# Bump when the layout of the cached buffers changes, to invalidate the existing entries.
+DEMO_CACHE_VERSION = 1
+DEMO_CACHE_INDEX_FILE = "index.json"
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _behavior_spec_to_dict(behavior_spec: BehaviorSpec) -> Dict[str, Any]:
+    return {
+        "observation_specs": [
+            {
+                "shape": list(obs_spec.shape),
+                "dimension_property": [int(p) for p in obs_spec.dimension_property],
+                "observation_type": obs_spec.observation_type.value,
+                "name": obs_spec.name,
+            }
+            for obs_spec in behavior_spec.observation_specs
+        ],
+        "continuous_size": behavior_spec.action_spec.continuous_size,
+        "discrete_branches": list(behavior_spec.action_spec.discrete_branches),
+    }
+
+
+def _behavior_spec_from_dict(d: Dict[str, Any]) -> BehaviorSpec:
+    return BehaviorSpec(
+        [
+            ObservationSpec(
+                tuple(obs_spec["shape"]),
+                tuple(DimensionProperty(p) for p in obs_spec["dimension_property"]),
+                ObservationType(obs_spec["observation_type"]),
+                obs_spec["name"],
+            )
+            for obs_spec in d["observation_specs"]
+        ],
+        ActionSpec(d["continuous_size"], tuple(d["discrete_branches"])),
+    )
+
+
+class DemoCache:
+    """
+    Caches the AgentBuffers built from demonstrations, so that the demonstrations are only
+    parsed once. Each entry is a directory with one .npy file per field of the buffer,
+    which are memory-mapped when the entry is loaded, and an index with the behavior
+    spec of the demonstrations and the size, modification time and hash of the files the
+    entry was built from. An entry is only used if the files didn't change: files whose
+    size and modification time match are trusted, the others are hashed.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: The directory the entries are stored in.
+        """
+        self.directory = directory
+
+    def _entry_path(self, file_paths: List[str], sequence_length: int) -> str:
+        key = json.dumps(
+            [
+                DEMO_CACHE_VERSION,
+                [os.path.abspath(path) for path in file_paths],
+                sequence_length,
+            ]
+        )
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _is_valid(file_paths: List[str], index: Dict[str, Any]) -> Tuple[bool, bool]:
+        """
+        Checks that the files of the index didn't change. The modification times of the
+        files that were touched but whose hash still matches are updated in the index.
+        :return: Whether the entry is valid, and whether the index was updated.
+        """
+        if index.get("version") != DEMO_CACHE_VERSION or len(index["files"]) != len(
+            file_paths
+        ):
+            return False, False
+        updated = False
+        for path, cached_file in zip(file_paths, index["files"]):
+            stat = os.stat(path)
+            if (
+                os.path.abspath(path) != cached_file["path"]
+                or stat.st_size != cached_file["size"]
+            ):
+                return False, False
+            if stat.st_mtime_ns != cached_file["mtime_ns"]:
+                if _file_digest(path) != cached_file["sha256"]:
+                    return False, False
+                cached_file["mtime_ns"] = stat.st_mtime_ns
+                updated = True
+        return True, updated
+
+    @staticmethod
+    def _write_index(entry_path: str, index: Dict[str, Any]) -> None:
+        """
+        Replaces the index of an entry at once, so that concurrent runs never see a
+        partial index. Failing to write it isn't an error, the files will be hashed again.
+        """
+        index_path = os.path.join(entry_path, DEMO_CACHE_INDEX_FILE)
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(temp_path, index_path)
+        except OSError as e:
+            logger.debug(f"Could not update the index of {entry_path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def load(
+        self, file_paths: List[str], sequence_length: int
+    ) -> Optional[Tuple[BehaviorSpec, AgentBuffer]]:
+        """
+        Loads the buffer built from the demonstration files with the sequence length.
+        :return: The behavior spec of the demonstrations and the buffer, or None if the
+        cache has no valid entry for them.
+        """
+        entry_path = self._entry_path(file_paths, sequence_length)
+        try:
+            with open(os.path.join(entry_path, DEMO_CACHE_INDEX_FILE)) as f:
+                index = json.load(f)
+            is_valid, updated = self._is_valid(file_paths, index)
+            if not is_valid:
+                logger.debug(f"The cached demonstrations at {entry_path} are stale.")
+                return None
+            if updated:
+                # Don't hash the touched files again next time.
+                self._write_index(entry_path, index)
+            behavior_spec = _behavior_spec_from_dict(index["behavior_spec"])
+            demo_buffer = ColumnarAgentBuffer()
+            for i, key in enumerate(index["fields"]):
+                demo_buffer.set_field(
+                    AgentBuffer._decode_key(key),
+                    ColumnarAgentBufferField.from_array(
+                        np.load(os.path.join(entry_path, f"{i}.npy"), mmap_mode="r")
+                    ),
+                )
+        except (OSError, ValueError, KeyError):
+            return None
+        logger.debug(f"Loaded the cached demonstrations from {entry_path}.")
+        return behavior_spec, demo_buffer
+
+    def save(
+        self,
+        file_paths: List[str],
+        sequence_length: int,
+        behavior_spec: BehaviorSpec,
+        demo_buffer: AgentBuffer,
+    ) -> None:
+        """
+        Stores the buffer built from the demonstration files with the sequence length.
+        Failing to write the entry isn't an error, the demonstrations will be parsed
+        again next time.
+        """
+        entry_path = self._entry_path(file_paths, sequence_length)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            index = {
+                "version": DEMO_CACHE_VERSION,
+                "files": [
+                    {
+                        "path": os.path.abspath(path),
+                        "size": os.stat(path).st_size,
+                        "mtime_ns": os.stat(path).st_mtime_ns,
+                        "sha256": _file_digest(path),
+                    }
+                    for path in file_paths
+                ],
+                "behavior_spec": _behavior_spec_to_dict(behavior_spec),
+                "fields": [AgentBuffer._encode_key(key) for key in demo_buffer.keys()],
+            }
+            # Write the entry next to its final location and move it there at once, so
+            # that concurrent runs never see a partial entry.
+            temp_path = tempfile.mkdtemp(dir=self.directory)
+            try:
+                for i, field in enumerate(demo_buffer.values()):
+                    np.save(os.path.join(temp_path, f"{i}.npy"), np.asarray(field))
+                with open(os.path.join(temp_path, DEMO_CACHE_INDEX_FILE), "w") as f:
+                    json.dump(index, f)
+                shutil.rmtree(entry_path, ignore_errors=True)
+                os.rename(temp_path, entry_path)
+            finally:
+                shutil.rmtree(temp_path, ignore_errors=True)
+        except OSError as e:
+            logger.warning(
+                f"Could not cache the demonstrations in {self.directory}: {e}"
+            )
+            return
+        logger.debug(f"Cached the demonstrations in {entry_path}.")
@@ -1,24 +1,359 @@
+import itertools
+import mmap
 import os
-from typing import List, Tuple
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 import numpy as np
-from mlagents.trainers.buffer import AgentBuffer, BufferKey
+import numpy.typing as npt
+from mlagents.trainers.buffer import (
+    AgentBuffer,
+    AgentBufferKey,
+    BufferKey,
+    ColumnarAgentBuffer,
+    ColumnarAgentBufferField,
+)
 from mlagents_envs.communicator_objects.agent_info_action_pair_pb2 import (
     AgentInfoActionPairProto,
 )
+from mlagents.trainers.demo_cache import DemoCache
 from mlagents.trainers.trajectory import ObsUtil
-from mlagents_envs.rpc_utils import behavior_spec_from_proto, steps_from_proto
+from mlagents_envs.rpc_utils import behavior_spec_from_proto, observations_from_proto
 from mlagents_envs.base_env import BehaviorSpec
 from mlagents_envs.communicator_objects.brain_parameters_pb2 import BrainParametersProto
 from mlagents_envs.communicator_objects.demonstration_meta_pb2 import (
     DemonstrationMetaProto,
 )
-from mlagents_envs.timers import timed, hierarchical_timer
+from mlagents_envs.timers import timed
 from google.protobuf.internal.decoder import _DecodeVarint32  # type: ignore
 from google.protobuf.internal.encoder import _EncodeVarint  # type: ignore
+from google.protobuf.message import Message
 
 
 INITIAL_POS = 33
 SUPPORTED_DEMONSTRATION_VERSIONS = frozenset([0, 1])
+# The number of steps decoded at once when streaming demonstrations.
+DEFAULT_DEMO_CHUNK_SIZE = 4096
+
+DemoColumns = Dict[AgentBufferKey, np.ndarray]
+
+
+def _read_delimited(data: Union[bytes, mmap.mmap], pos: int, message: Message) -> int:
+    """
+    Parses the size-prefixed message at pos into message.
+    :return: The position right after the message.
+    """
+    size, pos = _DecodeVarint32(data, pos)
+    message.ParseFromString(data[pos : pos + size])
+    return pos + size
+
+
+def _read_meta_data(fp: BinaryIO) -> Optional[DemonstrationMetaProto]:
+    """
+    Reads the meta-data at the start of a demonstration file, or returns None if the
+    file is empty.
+    """
+    # First 32 bytes of file dedicated to meta-data.
+    header = fp.read(INITIAL_POS)
+    if not header:
+        return None
+    meta_data_proto = DemonstrationMetaProto()
+    _read_delimited(header, 0, meta_data_proto)
+    if meta_data_proto.api_version not in SUPPORTED_DEMONSTRATION_VERSIONS:
+        raise RuntimeError(
+            f"Can't load Demonstration data from an unsupported version ({meta_data_proto.api_version})"
+        )
+    return meta_data_proto
+
+
+def _flat_column(
+    values: Iterator[float], num_rows: int, row_size: int, dtype: npt.DTypeLike
+) -> np.ndarray:
+    return np.fromiter(values, dtype=dtype, count=num_rows * row_size).reshape(
+        num_rows, row_size
+    )
+
+
+def _action_column(
+    pairs: Sequence[AgentInfoActionPairProto],
+    is_deprecated: np.ndarray,
+    field_name: str,
+    size: int,
+    dtype: npt.DTypeLike,
+) -> np.ndarray:
+    # Demonstrations recorded before the hybrid actions only have the deprecated actions.
+    values = itertools.chain.from_iterable(
+        pair.action_info.vector_actions_deprecated
+        if deprecated
+        else getattr(pair.action_info, field_name)
+        for pair, deprecated in zip(pairs, is_deprecated)
+    )
+    return _flat_column(values, len(pairs), size, dtype)
+
+
+def _deprecated_actions(pairs: Sequence[AgentInfoActionPairProto]) -> np.ndarray:
+    sizes = np.fromiter(
+        (len(pair.action_info.vector_actions_deprecated) for pair in pairs),
+        dtype=np.int64,
+        count=len(pairs),
+    )
+    if np.any(sizes != sizes[0]):
+        raise RuntimeError(
+            "The steps of the demonstration do not all have the same number of actions."
+        )
+    values = itertools.chain.from_iterable(
+        pair.action_info.vector_actions_deprecated for pair in pairs
+    )
+    return _flat_column(values, len(pairs), int(sizes[0]), np.float32)
+
+
+class _DemoStepAssembler:
+    """
+    Turns the stream of recorded AgentInfoActionPairProtos into the columns of the steps
+    of the demonstration. A step is made of the observations and actions of a record and
+    of the reward and done flag of the next one, so the last record of a chunk is kept
+    until the next chunk comes.
+    """
+
+    def __init__(self, behavior_spec: BehaviorSpec):
+        self.behavior_spec = behavior_spec
+        self._last_pair: List[AgentInfoActionPairProto] = []
+        self._last_prev_action: Optional[np.ndarray] = None
+
+    def add(self, pairs: List[AgentInfoActionPairProto]) -> DemoColumns:
+        """
+        Decodes a chunk of records.
+        :return: The columns of the steps that could be completed.
+        """
+        pairs = self._last_pair + pairs
+        if not pairs:
+            return {}
+        deprecated_actions = _deprecated_actions(pairs)
+        first_prev_action = (
+            self._last_prev_action
+            if self._last_prev_action is not None
+            else np.zeros_like(deprecated_actions[:1])
+        )
+        prev_actions = np.concatenate([first_prev_action, deprecated_actions[:-1]])
+        self._last_pair = pairs[-1:]
+        self._last_prev_action = prev_actions[-1:]
+        if len(pairs) < 2:
+            return {}
+        current_pairs = pairs[:-1]
+        next_infos = [pair.agent_info for pair in pairs[1:]]
+        num_steps = len(current_pairs)
+
+        columns: DemoColumns = {}
+        columns[BufferKey.DONE] = np.fromiter(
+            (agent_info.done for agent_info in next_infos), dtype=bool, count=num_steps
+        )
+        columns[BufferKey.ENVIRONMENT_REWARDS] = np.fromiter(
+            (agent_info.reward for agent_info in next_infos),
+            dtype=np.float32,
+            count=num_steps,
+        )
+        observations = observations_from_proto(
+            [pair.agent_info for pair in current_pairs], self.behavior_spec
+        )
+        for i, obs in enumerate(observations):
+            columns[ObsUtil.get_name_at(i)] = obs
+        action_spec = self.behavior_spec.action_spec
+        is_deprecated = np.fromiter(
+            (
+                len(pair.action_info.continuous_actions) == 0
+                and len(pair.action_info.discrete_actions) == 0
+                for pair in current_pairs
+            ),
+            dtype=bool,
+            count=num_steps,
+        )
+        if action_spec.continuous_size > 0:
+            columns[BufferKey.CONTINUOUS_ACTION] = _action_column(
+                current_pairs,
+                is_deprecated,
+                "continuous_actions",
+                action_spec.continuous_size,
+                np.float32,
+            )
+        if action_spec.discrete_size > 0:
+            columns[BufferKey.DISCRETE_ACTION] = _action_column(
+                current_pairs,
+                is_deprecated,
+                "discrete_actions",
+                action_spec.discrete_size,
+                np.int32,
+            )
+        columns[BufferKey.PREV_ACTION] = prev_actions[:-1]
+        return columns
+
+
+class _EpisodeSequencer:
+    """
+    Splits the steps of a demonstration into episodes and pads each episode to a
+    multiple of the sequence length, like AgentBuffer.resequence_and_append does. The
+    steps of the episode that isn't done yet are kept until it is.
+    """
+
+    def __init__(self, sequence_length: int):
+        self.sequence_length = sequence_length
+        self._pending: List[DemoColumns] = []
+
+    def add(self, columns: DemoColumns) -> DemoColumns:
+        """
+        Adds the columns of consecutive steps.
+        :return: The padded columns of the episodes that are done.
+        """
+        if not columns:
+            return {}
+        episode_ends = np.flatnonzero(columns[BufferKey.DONE]) + 1
+        if len(episode_ends) == 0:
+            self._pending.append(columns)
+            return {}
+        num_pending = sum(len(pending[BufferKey.DONE]) for pending in self._pending)
+        columns = self._concatenate(self._pending + [columns])
+        episode_ends += num_pending
+        last_end = episode_ends[-1]
+        self._pending = [{key: value[last_end:] for key, value in columns.items()}]
+        return self._pad(
+            {key: value[:last_end] for key, value in columns.items()},
+            np.diff(episode_ends, prepend=0),
+        )
+
+    def flush(self) -> DemoColumns:
+        """
+        Ends the last episode.
+        :return: The padded columns of the steps of the last episode.
+        """
+        columns = self._concatenate(self._pending)
+        self._pending = []
+        if not columns or len(columns[BufferKey.DONE]) == 0:
+            return {}
+        return self._pad(columns, np.array([len(columns[BufferKey.DONE])]))
+
+    @staticmethod
+    def _concatenate(columns_list: List[DemoColumns]) -> DemoColumns:
+        if len(columns_list) <= 1:
+            return columns_list[0] if columns_list else {}
+        return {
+            key: np.concatenate([columns[key] for columns in columns_list])
+            for key in columns_list[0]
+        }
+
+    def _pad(self, columns: DemoColumns, episode_lengths: np.ndarray) -> DemoColumns:
+        if self.sequence_length == 1:
+            return columns
+        padded_lengths = -(-episode_lengths // self.sequence_length) * (
+            self.sequence_length
+        )
+        # Move the steps of each episode to the start of its padded episode.
+        shifts = (np.cumsum(padded_lengths) - padded_lengths) - (
+            np.cumsum(episode_lengths) - episode_lengths
+        )
+        destinations = np.arange(np.sum(episode_lengths)) + np.repeat(
+            shifts, episode_lengths
+        )
+        padded_columns: DemoColumns = {}
+        for key, value in columns.items():
+            padded = np.zeros((np.sum(padded_lengths),) + value.shape[1:], value.dtype)
+            padded[destinations] = value
+            padded_columns[key] = padded
+        return padded_columns
+
+
+def _columns_to_buffer(columns: DemoColumns) -> ColumnarAgentBuffer:
+    buffer = ColumnarAgentBuffer()
+    for key, value in columns.items():
+        buffer.set_field(key, ColumnarAgentBufferField.from_array(value))
+    return buffer
+
+
+class DemonstrationReader:
+    """
+    Streams the records of demonstration files. The files are memory-mapped and the
+    records are decoded in chunks of chunk_size, so that the size of the demonstrations
+    doesn't bound the memory needed to read them.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = DEFAULT_DEMO_CHUNK_SIZE):
+        """
+        Reads the headers of the demonstration files.
+        :param file_path: Location of demonstration file (.demo) or directory.
+        :param chunk_size: The number of records decoded at once.
+        """
+        self.file_paths = get_demo_files(file_path)
+        self.chunk_size = chunk_size
+        self.total_expected = 0
+        behavior_spec: Optional[BehaviorSpec] = None
+        for meta_data_proto, brain_param_proto, data, pos in self._open_files():
+            self.total_expected += meta_data_proto.number_steps
+            if behavior_spec is None and pos < len(data):
+                agent_info_action = AgentInfoActionPairProto()
+                _read_delimited(data, pos, agent_info_action)
+                behavior_spec = behavior_spec_from_proto(
+                    brain_param_proto, agent_info_action.agent_info
+                )
+        if not behavior_spec:
+            raise RuntimeError(
+                f"No BrainParameters found in demonstration file at {file_path}."
+            )
+        self.behavior_spec: BehaviorSpec = behavior_spec
+
+    def _open_files(
+        self,
+    ) -> Iterator[Tuple[DemonstrationMetaProto, BrainParametersProto, mmap.mmap, int]]:
+        """
+        Maps each non-empty demonstration file.
+        :return: The meta-data and brain parameters of each file, the mapped file and the
+        position of its first record.
+        """
+        for _file_path in self.file_paths:
+            with open(_file_path, "rb") as fp:
+                meta_data_proto = _read_meta_data(fp)
+                if meta_data_proto is None:
+                    continue
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if len(data) <= INITIAL_POS:
+                        continue
+                    brain_param_proto = BrainParametersProto()
+                    pos = _read_delimited(data, INITIAL_POS, brain_param_proto)
+                    yield meta_data_proto, brain_param_proto, data, pos
+
+    def iter_records(self) -> Iterator[List[AgentInfoActionPairProto]]:
+        """
+        Yields the records of the demonstration files in chunks of at most chunk_size.
+        """
+        num_records = 0
+        total_expected = 0
+        for meta_data_proto, _, data, pos in self._open_files():
+            total_expected += meta_data_proto.number_steps
+            chunk: List[AgentInfoActionPairProto] = []
+            while pos < len(data):
+                agent_info_action = AgentInfoActionPairProto()
+                pos = _read_delimited(data, pos, agent_info_action)
+                chunk.append(agent_info_action)
+                num_records += 1
+                if len(chunk) == self.chunk_size:
+                    yield chunk
+                    chunk = []
+                if num_records == total_expected:
+                    break
+            if chunk:
+                yield chunk
+
+    def iter_buffers(self, sequence_length: int) -> Iterator[AgentBuffer]:
+        """
+        Yields the steps of the demonstrations, a chunk at a time, as AgentBuffers whose
+        episodes are padded to a multiple of sequence_length. Episodes are never split
+        across chunks.
+        :param sequence_length: Length of trajectories to fill buffer.
+        """
+        assembler = _DemoStepAssembler(self.behavior_spec)
+        sequencer = _EpisodeSequencer(sequence_length)
+        for chunk in self.iter_records():
+            columns = sequencer.add(assembler.add(chunk))
+            if columns:
+                yield _columns_to_buffer(columns)
+        columns = sequencer.flush()
+        if columns:
+            yield _columns_to_buffer(columns)
 
 
 @timed
@@ -27,120 +362,93 @@ def make_demo_buffer(
     behavior_spec: BehaviorSpec,
     sequence_length: int,
 ) -> AgentBuffer:
-    # Create and populate buffer using experiences
-    demo_raw_buffer = AgentBuffer()
-    demo_processed_buffer = AgentBuffer()
-    for idx, current_pair_info in enumerate(pair_infos):
-        if idx > len(pair_infos) - 2:
-            break
-        next_pair_info = pair_infos[idx + 1]
-        current_decision_step, current_terminal_step = steps_from_proto(
-            [current_pair_info.agent_info], behavior_spec
-        )
-        next_decision_step, next_terminal_step = steps_from_proto(
-            [next_pair_info.agent_info], behavior_spec
-        )
-        previous_action = (
-            np.array(
-                pair_infos[idx].action_info.vector_actions_deprecated, dtype=np.float32
+    sequencer = _EpisodeSequencer(sequence_length)
+    demo_buffer = ColumnarAgentBuffer()
+    for columns in (
+        sequencer.add(_DemoStepAssembler(behavior_spec).add(pair_infos)),
+        sequencer.flush(),
+    ):
+        for key, value in columns.items():
+            demo_buffer[key].extend(value)
+    return demo_buffer
+
+
+def check_demo_behavior_spec(
+    behavior_spec: BehaviorSpec, expected_behavior_spec: BehaviorSpec
+) -> None:
+    """
+    Checks that the demonstrations match the behavior of the policy.
+    :param behavior_spec: The behavior spec of the demonstrations.
+    :param expected_behavior_spec: The behavior spec of the policy.
+    """
+    # check action dimensions in demonstration match
+    if behavior_spec.action_spec != expected_behavior_spec.action_spec:
+        raise RuntimeError(
+            "The actions {} in demonstration do not match the policy's {}.".format(
+                behavior_spec.action_spec, expected_behavior_spec.action_spec
             )
-            * 0
         )
-        if idx > 0:
-            previous_action = np.array(
-                pair_infos[idx - 1].action_info.vector_actions_deprecated,
-                dtype=np.float32,
+    # check observations match
+    if len(behavior_spec.observation_specs) != len(
+        expected_behavior_spec.observation_specs
+    ):
+        raise RuntimeError(
+            "The demonstrations do not have the same number of observations as the policy."
+        )
+    else:
+        for i, (demo_obs, policy_obs) in enumerate(
+            zip(
+                behavior_spec.observation_specs,
+                expected_behavior_spec.observation_specs,
             )
-
-        next_done = len(next_terminal_step) == 1
-        next_reward = 0
-        if len(next_terminal_step) == 1:
-            next_reward = next_terminal_step.reward[0]
-        else:
-            next_reward = next_decision_step.reward[0]
-        current_obs = None
-        if len(current_terminal_step) == 1:
-            current_obs = list(current_terminal_step.values())[0].obs
-        else:
-            current_obs = list(current_decision_step.values())[0].obs
-
-        demo_raw_buffer[BufferKey.DONE].append(next_done)
-        demo_raw_buffer[BufferKey.ENVIRONMENT_REWARDS].append(next_reward)
-        for i, obs in enumerate(current_obs):
-            demo_raw_buffer[ObsUtil.get_name_at(i)].append(obs)
-        if (
-            len(current_pair_info.action_info.continuous_actions) == 0
-            and len(current_pair_info.action_info.discrete_actions) == 0
         ):
-            if behavior_spec.action_spec.continuous_size > 0:
-                demo_raw_buffer[BufferKey.CONTINUOUS_ACTION].append(
-                    current_pair_info.action_info.vector_actions_deprecated
-                )
-            else:
-                demo_raw_buffer[BufferKey.DISCRETE_ACTION].append(
-                    current_pair_info.action_info.vector_actions_deprecated
-                )
-        else:
-            if behavior_spec.action_spec.continuous_size > 0:
-                demo_raw_buffer[BufferKey.CONTINUOUS_ACTION].append(
-                    current_pair_info.action_info.continuous_actions
-                )
-            if behavior_spec.action_spec.discrete_size > 0:
-                demo_raw_buffer[BufferKey.DISCRETE_ACTION].append(
-                    current_pair_info.action_info.discrete_actions
+            if demo_obs.shape != policy_obs.shape:
+                raise RuntimeError(
+                    f"The shape {demo_obs} for observation {i} in demonstration \
+                    do not match the policy's {policy_obs}."
                 )
-        demo_raw_buffer[BufferKey.PREV_ACTION].append(previous_action)
-        if next_done:
-            demo_raw_buffer.resequence_and_append(
-                demo_processed_buffer, batch_size=None, training_length=sequence_length
-            )
-            demo_raw_buffer.reset_agent()
-    demo_raw_buffer.resequence_and_append(
-        demo_processed_buffer, batch_size=None, training_length=sequence_length
-    )
-    return demo_processed_buffer
 
 
 @timed
 def demo_to_buffer(
-    file_path: str, sequence_length: int, expected_behavior_spec: BehaviorSpec = None
+    file_path: str,
+    sequence_length: int,
+    expected_behavior_spec: BehaviorSpec = None,
+    chunk_size: int = DEFAULT_DEMO_CHUNK_SIZE,
+    cache_dir: Optional[str] = None,
 ) -> Tuple[BehaviorSpec, AgentBuffer]:
     """
-    Loads demonstration file and uses it to fill training buffer.
+    Loads demonstration file and uses it to fill training buffer. The demonstrations
+    are streamed, so only a chunk of the records is decoded at any time.
     :param file_path: Location of demonstration file (.demo).
     :param sequence_length: Length of trajectories to fill buffer.
+    :param expected_behavior_spec: If set, the demonstrations must match it.
+    :param chunk_size: The number of records decoded at once.
+    :param cache_dir: If set, the buffer is cached in this directory and reused as long
+    as the demonstration files don't change.
     :return:
     """
-    behavior_spec, info_action_pair, _ = load_demonstration(file_path)
-    demo_buffer = make_demo_buffer(info_action_pair, behavior_spec, sequence_length)
+    demo_cache = DemoCache(cache_dir) if cache_dir is not None else None
+    if demo_cache is not None:
+        cached = demo_cache.load(get_demo_files(file_path), sequence_length)
+        if cached is not None:
+            behavior_spec, demo_buffer = cached
+            if expected_behavior_spec:
+                check_demo_behavior_spec(behavior_spec, expected_behavior_spec)
+            return behavior_spec, demo_buffer
+    reader = DemonstrationReader(file_path, chunk_size)
     if expected_behavior_spec:
-        # check action dimensions in demonstration match
-        if behavior_spec.action_spec != expected_behavior_spec.action_spec:
-            raise RuntimeError(
-                "The actions {} in demonstration do not match the policy's {}.".format(
-                    behavior_spec.action_spec, expected_behavior_spec.action_spec
-                )
-            )
-        # check observations match
-        if len(behavior_spec.observation_specs) != len(
-            expected_behavior_spec.observation_specs
-        ):
-            raise RuntimeError(
-                "The demonstrations do not have the same number of observations as the policy."
-            )
-        else:
-            for i, (demo_obs, policy_obs) in enumerate(
-                zip(
-                    behavior_spec.observation_specs,
-                    expected_behavior_spec.observation_specs,
-                )
-            ):
-                if demo_obs.shape != policy_obs.shape:
-                    raise RuntimeError(
-                        f"The shape {demo_obs} for observation {i} in demonstration \
-                        do not match the policy's {policy_obs}."
-                    )
-    return behavior_spec, demo_buffer
+        # Check before reading the steps, which can take a while.
+        check_demo_behavior_spec(reader.behavior_spec, expected_behavior_spec)
+    demo_buffer = ColumnarAgentBuffer(reader.total_expected)
+    for chunk_buffer in reader.iter_buffers(sequence_length):
+        for key, field in chunk_buffer.items():
+            demo_buffer[key].extend(field)
+    if demo_cache is not None:
+        demo_cache.save(
+            reader.file_paths, sequence_length, reader.behavior_spec, demo_buffer
+        )
+    return reader.behavior_spec, demo_buffer
 
 
 def get_demo_files(path: str) -> List[str]:
@@ -175,57 +483,14 @@ def load_demonstration(
     file_path: str,
 ) -> Tuple[BehaviorSpec, List[AgentInfoActionPairProto], int]:
     """
-    Loads and parses a demonstration file.
+    Loads and parses a demonstration file. Use a DemonstrationReader to stream large
+    demonstrations instead.
     :param file_path: Location of demonstration file (.demo).
     :return: BrainParameter and list of AgentInfoActionPairProto containing demonstration data.
     """
-
-    # First 32 bytes of file dedicated to meta-data.
-    file_paths = get_demo_files(file_path)
-    behavior_spec = None
-    brain_param_proto = None
-    info_action_pairs = []
-    total_expected = 0
-    for _file_path in file_paths:
-        with open(_file_path, "rb") as fp:
-            with hierarchical_timer("read_file"):
-                data = fp.read()
-            next_pos, pos, obs_decoded = 0, 0, 0
-            while pos < len(data):
-                next_pos, pos = _DecodeVarint32(data, pos)
-                if obs_decoded == 0:
-                    meta_data_proto = DemonstrationMetaProto()
-                    meta_data_proto.ParseFromString(data[pos : pos + next_pos])
-                    if (
-                        meta_data_proto.api_version
-                        not in SUPPORTED_DEMONSTRATION_VERSIONS
-                    ):
-                        raise RuntimeError(
-                            f"Can't load Demonstration data from an unsupported version ({meta_data_proto.api_version})"
-                        )
-                    total_expected += meta_data_proto.number_steps
-                    pos = INITIAL_POS
-                if obs_decoded == 1:
-                    brain_param_proto = BrainParametersProto()
-                    brain_param_proto.ParseFromString(data[pos : pos + next_pos])
-                    pos += next_pos
-                if obs_decoded > 1:
-                    agent_info_action = AgentInfoActionPairProto()
-                    agent_info_action.ParseFromString(data[pos : pos + next_pos])
-                    if behavior_spec is None:
-                        behavior_spec = behavior_spec_from_proto(
-                            brain_param_proto, agent_info_action.agent_info
-                        )
-                    info_action_pairs.append(agent_info_action)
-                    if len(info_action_pairs) == total_expected:
-                        break
-                    pos += next_pos
-                obs_decoded += 1
-    if not behavior_spec:
-        raise RuntimeError(
-            f"No BrainParameters found in demonstration file at {file_path}."
-        )
-    return behavior_spec, info_action_pairs, total_expected
+    reader = DemonstrationReader(file_path)
+    info_action_pairs = list(itertools.chain.from_iterable(reader.iter_records()))
+    return reader.behavior_spec, info_action_pairs, reader.total_expected
 
 
 def write_delimited(f, message):
@@ -0,0 +1,395 @@
+import argparse
+import json
+import os
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from mlagents_envs.base_env import BehaviorSpec, DecisionSteps, TerminalSteps
+from mlagents_envs.logging_util import get_logger
+from mlagents.trainers.action_info import ActionInfo
+from mlagents.trainers.behavior_id_utils import (
+    BehaviorIdentifiers,
+    create_name_behavior_id,
+)
+from mlagents.trainers.env_manager import EnvManager, EnvironmentStep
+from mlagents.trainers.exception import UnityTrainerException
+from mlagents.trainers.ghost.snapshot_pool import SnapshotPool
+from mlagents.trainers.policy import Policy
+
+logger = get_logger(__name__)
+
+# A pair of snapshots, the first one plays team 0 and the second one team 1.
+Match = Tuple[int, int]
+
+
+class LeagueResult(NamedTuple):
+    """
+    The results of the matches of a league. Entry [i, j] of the matrices is about the
+    games snapshot i played against snapshot j.
+    """
+
+    names: List[str]
+    # Sum of the scores of the games, 1 for a win and 0.5 for a draw.
+    scores: np.ndarray
+    games: np.ndarray
+
+    @property
+    def win_rates(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.scores / self.games
+
+    def elo_ratings(
+        self, initial_elo: float = 1200.0, prior_games: float = 1.0
+    ) -> np.ndarray:
+        return compute_elo_ratings(self.scores, self.games, initial_elo, prior_games)
+
+    def to_dict(self, initial_elo: float = 1200.0) -> Dict:
+        return {
+            "names": self.names,
+            "elo": self.elo_ratings(initial_elo).tolist(),
+            "games": self.games.tolist(),
+            "scores": self.scores.tolist(),
+            "win_rates": np.nan_to_num(self.win_rates, nan=-1.0).tolist(),
+        }
+
+
+def compute_elo_ratings(
+    scores: np.ndarray,
+    games: np.ndarray,
+    initial_elo: float = 1200.0,
+    prior_games: float = 1.0,
+    num_iterations: int = 1000,
+) -> np.ndarray:
+    """
+    Fits ELO ratings to the results of all the games at once (Bradley-Terry model), which
+    doesn't depend on the order of the games like incremental ELO updates do.
+    :param scores: scores[i, j] is the total score of i against j.
+    :param games: games[i, j] is the number of games between i and j.
+    :param initial_elo: The mean of the ratings.
+    :param prior_games: Number of draws added to every pair that played, so that
+    the ratings stay finite when a snapshot won or lost all its games.
+    :param num_iterations: Maximum number of iterations of the fit.
+    :return: The rating of each snapshot.
+    """
+    played = games > 0
+    scores = scores + 0.5 * prior_games * played
+    games = games + prior_games * played
+    total_scores = scores.sum(axis=1)
+    strengths = np.ones(len(scores))
+    for _ in range(num_iterations):
+        denominators = (games / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+        new_strengths = np.where(
+            denominators > 0, total_scores / np.maximum(denominators, 1e-12), 1.0
+        )
+        new_strengths /= np.exp(np.mean(np.log(new_strengths)))
+        converged = np.allclose(new_strengths, strengths, rtol=1e-9)
+        strengths = new_strengths
+        if converged:
+            break
+    return initial_elo + 400.0 * np.log10(strengths)
+
+
+class _MatchPolicy:
+    """
+    Acts for one team of the league. Each environment worker plays a match, so the
+    DecisionSteps of a worker are handed to the policy of the snapshot that plays this
+    team in its match. The DecisionSteps of the workers playing the same snapshot are
+    evaluated together.
+    """
+
+    def __init__(
+        self, policies: List[Policy], team_index: int, matches: Dict[int, Match]
+    ):
+        self._policies = policies
+        self._team_index = team_index
+        self._matches = matches
+
+    @property
+    def use_recurrent(self) -> bool:
+        return any(policy.use_recurrent for policy in self._policies)
+
+    def get_action(self, decision_requests: DecisionSteps, worker_id: int = 0):
+        return self.get_actions([(decision_requests, worker_id)])[0]
+
+    def get_actions(
+        self, decision_requests: List[Tuple[DecisionSteps, int]]
+    ) -> List[ActionInfo]:
+        request_indices: DefaultDict[int, List[int]] = defaultdict(list)
+        for i, (_, worker_id) in enumerate(decision_requests):
+            snapshot = self._matches[worker_id][self._team_index]
+            request_indices[snapshot].append(i)
+        action_infos: List[ActionInfo] = [ActionInfo.empty()] * len(decision_requests)
+        for snapshot, indices in request_indices.items():
+            snapshot_action_infos = self._policies[snapshot].get_actions(
+                [decision_requests[i] for i in indices]
+            )
+            for i, action_info in zip(indices, snapshot_action_infos):
+                action_infos[i] = action_info
+        return action_infos
+
+
+class LeagueEvaluator:
+    """
+    Evaluates snapshots of a self-play policy against each other, outside of training.
+    Every environment worker of the EnvManager plays one match at a time, and the matches
+    are played in rounds: the environments are reset, each worker is assigned a match,
+    and the round goes on until every match of the round has been played enough times.
+    Only symmetric games with two teams of the same behavior are supported.
+    """
+
+    def __init__(
+        self,
+        env_manager: EnvManager,
+        num_workers: int,
+        brain_name: str,
+        policies: List[Policy],
+        names: Optional[List[str]] = None,
+        max_steps_per_round: int = 100000,
+    ):
+        """
+        :param env_manager: The EnvManager to play the matches with.
+        :param num_workers: The number of environment workers of the EnvManager.
+        :param brain_name: The name of the behavior of both teams.
+        :param policies: An inference policy per snapshot.
+        :param names: The name of each snapshot, for the results.
+        :param max_steps_per_round: The number of steps after which a round is
+        stopped, even if not all of its games were played.
+        """
+        self.env_manager = env_manager
+        self.num_workers = num_workers
+        self.brain_name = brain_name
+        self.policies = policies
+        self.names = names or [f"snapshot-{i}" for i in range(len(policies))]
+        self.max_steps_per_round = max_steps_per_round
+        self._matches: Dict[int, Match] = {}
+        self._behavior_ids = [
+            create_name_behavior_id(brain_name, team_id) for team_id in (0, 1)
+        ]
+
+    def evaluate(self, games_per_match: int = 10) -> LeagueResult:
+        """
+        Plays every snapshot against every other snapshot, on both sides.
+        :param games_per_match: The number of games of each match.
+        :return: The results of the games.
+        """
+        num_policies = len(self.policies)
+        scores = np.zeros((num_policies, num_policies))
+        games = np.zeros((num_policies, num_policies))
+        schedule = [
+            (i, j) for i in range(num_policies) for j in range(num_policies) if i != j
+        ]
+        for team_index, behavior_id in enumerate(self._behavior_ids):
+            self.env_manager.set_policy(
+                behavior_id,
+                _MatchPolicy(self.policies, team_index, self._matches),  # type: ignore
+            )
+        for start in range(0, len(schedule), self.num_workers):
+            round_matches = schedule[start : start + self.num_workers]
+            for worker_id in range(self.num_workers):
+                # Spare workers play the matches of the round again.
+                self._matches[worker_id] = round_matches[worker_id % len(round_matches)]
+            self._play_round(round_matches, games_per_match, scores, games)
+        return LeagueResult(self.names, scores, games)
+
+    def _play_round(
+        self,
+        round_matches: List[Match],
+        games_per_match: int,
+        scores: np.ndarray,
+        games: np.ndarray,
+    ) -> None:
+        match_games: Dict[Match, int] = {match: 0 for match in round_matches}
+        self.env_manager.reset(config={})
+        # The first steps are only used for the first actions.
+        self.env_manager.first_step_infos = []
+        for _ in range(self.max_steps_per_round):
+            for step_info in self.env_manager.get_steps():
+                match = self._matches[step_info.worker_id]
+                for result in self._get_results(step_info):
+                    scores[match] += result
+                    scores[match[::-1]] += 1.0 - result
+                    games[match] += 1
+                    games[match[::-1]] += 1
+                    match_games[match] += 1
+            if all(n >= games_per_match for n in match_games.values()):
+                return
+        logger.warning(
+            f"Stopped a round of the league after {self.max_steps_per_round} steps, "
+            f"with {min(match_games.values())} games played in some matches."
+        )
+
+    def _get_results(self, step_info: EnvironmentStep) -> List[float]:
+        """
+        Returns the result of each game that ended in the step, from the point of view of
+        team 0. Like in the GhostTrainer, the last reward of an agent determines the
+        winner, and interrupted games are ignored.
+        """
+        if self._behavior_ids[0] not in step_info.current_all_step_result:
+            return []
+        terminal_steps: TerminalSteps = step_info.current_all_step_result[
+            self._behavior_ids[0]
+        ][1]
+        results = []
+        ended_groups = set()
+        for i in range(len(terminal_steps)):
+            group_id = int(terminal_steps.group_id[i])
+            if terminal_steps.interrupted[i] or group_id in ended_groups:
+                continue
+            if group_id != 0:
+                # All the members of a group end the game together.
+                ended_groups.add(group_id)
+            final_reward = terminal_steps.reward[i] + terminal_steps.group_reward[i]
+            results.append(
+                1.0 if final_reward > 0 else 0.0 if final_reward < 0 else 0.5
+            )
+        return results
+
+
+def load_league_policies(
+    snapshot_pool: SnapshotPool,
+    brain_name: str,
+    create_policy: Callable[[BehaviorIdentifiers], Policy],
+) -> Tuple[List[Policy], List[str]]:
+    """
+    Creates an inference policy for each snapshot of the pool.
+    :param snapshot_pool: The pool, already loaded.
+    :param brain_name: The behavior the snapshots are for.
+    :param create_policy: Creates a policy for the behavior.
+    :return: The policies and the names of their snapshots, oldest first.
+    """
+    parsed_behavior_id = BehaviorIdentifiers.from_name_behavior_id(
+        create_name_behavior_id(brain_name, 0)
+    )
+    policies: List[Policy] = []
+    names: List[str] = []
+    for serial, index in sorted(
+        (serial, index) for index, serial in enumerate(snapshot_pool.serials)
+    ):
+        if brain_name not in snapshot_pool[index]:
+            continue
+        policy = create_policy(parsed_behavior_id)
+        snapshot_pool[index][brain_name].load_into(policy)
+        policies.append(policy)
+        names.append(f"snapshot-{serial}")
+    return policies, names
+
+
+def parse_command_line(
+    argv: Optional[List[str]] = None,
+) -> Tuple[argparse.Namespace, List[str]]:
+    parser = argparse.ArgumentParser(
+        description="Evaluates the self-play snapshots of a run against each other. "
+        "All the other options are the options of mlagents-learn, used to launch the "
+        "environments.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--behavior", required=True, help="The self-play behavior to evaluate."
+    )
+    parser.add_argument(
+        "--games-per-match",
+        default=10,
+        type=int,
+        help="The number of games each snapshot plays against each other snapshot, "
+        "on each side.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="The file to write the results to. Defaults to league.json in the "
+        "results of the behavior.",
+    )
+    return parser.parse_known_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Provides 'mlagents-evaluate-league', which plays the self-play snapshots saved by a
+    run against each other and writes their win rates and ELO ratings.
+    """
+    # Imported here since they import the trainers.
+    from mlagents.plugins import all_trainer_types
+    from mlagents.torch_utils import set_torch_config
+    from mlagents.trainers.learn import (
+        create_environment_factory,
+        parse_command_line as parse_learn_command_line,
+    )
+    from mlagents.trainers.subprocess_env_manager import SubprocessEnvManager
+
+    args, learn_argv = parse_command_line(argv)
+    options = parse_learn_command_line(learn_argv)
+    set_torch_config(options.torch_settings)
+    checkpoint_settings = options.checkpoint_settings
+    env_settings = options.env_settings
+    trainer_settings = options.behaviors[args.behavior]
+    if trainer_settings.self_play is None:
+        raise UnityTrainerException(f"{args.behavior} isn't trained with self-play.")
+    run_seed = env_settings.seed
+    if run_seed == -1:
+        run_seed = np.random.randint(0, 10000)
+    artifact_path = os.path.join(checkpoint_settings.write_path, args.behavior)
+    snapshot_pool = SnapshotPool(
+        trainer_settings.self_play.window, os.path.join(artifact_path, "snapshots")
+    )
+    if snapshot_pool.load() is None:
+        raise UnityTrainerException(
+            f"No self-play snapshots were saved in {snapshot_pool.directory}."
+        )
+
+    env_factory = create_environment_factory(
+        env_settings.env_path,
+        options.engine_settings.no_graphics,
+        options.engine_settings.no_graphics_monitor,
+        run_seed,
+        env_settings.num_areas,
+        env_settings.timeout_wait,
+        env_settings.base_port if env_settings.env_path is not None else None,
+        env_settings.env_args,
+        os.path.abspath(checkpoint_settings.run_logs_dir),
+        env_settings.uint8_visual_obs,
+    )
+    os.makedirs(checkpoint_settings.run_logs_dir, exist_ok=True)
+    env_manager = SubprocessEnvManager(env_factory, options, env_settings.num_envs)
+    try:
+        env_manager.reset(config={})
+        behavior_spec: BehaviorSpec = env_manager.training_behaviors[
+            create_name_behavior_id(args.behavior, 0)
+        ]
+        trainer = all_trainer_types[trainer_settings.trainer_type](
+            args.behavior,
+            0,
+            trainer_settings,
+            False,
+            False,
+            run_seed,
+            artifact_path,
+        )
+        policies, names = load_league_policies(
+            snapshot_pool,
+            args.behavior,
+            lambda parsed_behavior_id: trainer.create_policy(
+                parsed_behavior_id, behavior_spec
+            ),
+        )
+        evaluator = LeagueEvaluator(
+            env_manager, env_settings.num_envs, args.behavior, policies, names
+        )
+        result = evaluator.evaluate(args.games_per_match)
+    finally:
+        env_manager.close()
+
+    initial_elo = trainer_settings.self_play.initial_elo
+    output_path = args.output or os.path.join(artifact_path, "league.json")
+    with open(output_path, "w") as f:
+        json.dump(result.to_dict(initial_elo), f, indent=4)
+    for name, elo in sorted(
+        zip(result.names, result.elo_ratings(initial_elo)), key=lambda item: -item[1]
+    ):
+        logger.info(f"{name}: ELO {elo:.1f}")
+    logger.info(f"Wrote the results of the league to {output_path}.")
+
+
+if __name__ == "__main__":
+    main()
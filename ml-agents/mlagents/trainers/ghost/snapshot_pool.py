@@ -0,0 +1,368 @@
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from mlagents_envs.logging_util import get_logger
+from mlagents.torch_utils import torch
+from mlagents.trainers.policy import Policy
+from mlagents.trainers.policy.weight_store import WeightSnapshot, next_weight_version
+from mlagents.trainers.settings import OpponentSamplingType
+
+logger = get_logger(__name__)
+
+# Tensors are written at offsets aligned to this many bytes so that they can be read
+# back as properly aligned views.
+ARRAY_ALIGNMENT = 8
+SNAPSHOT_INDEX_FILE = "snapshots.json"
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+class TensorDescriptor(NamedTuple):
+    name: str
+    offset: int
+    shape: Tuple[int, ...]
+    # The dtype the tensor is stored with, and the dtype it is loaded with.
+    storage_dtype: str
+    dtype: str
+
+
+class CompactSnapshot:
+    """
+    The weights of a policy packed into a single contiguous byte array, optionally with
+    the floating point tensors stored in half precision. The array is either in memory or
+    in a file, which is memory-mapped when the weights are loaded.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        tensors: List[TensorDescriptor],
+        data: Optional[np.ndarray] = None,
+        path: Optional[str] = None,
+    ):
+        self.version = version
+        self.tensors = tensors
+        self._data = data
+        self.path = path
+
+    @staticmethod
+    def from_weights(
+        version: int, weights: Dict[str, torch.Tensor], half_precision: bool = False
+    ) -> "CompactSnapshot":
+        """
+        Packs the weights.
+        :param version: The version of the weights.
+        :param weights: The state_dict of the network.
+        :param half_precision: Whether to store the floating point tensors in half
+        precision. Tensors with values out of the half precision range, like the
+        statistics of the normalizers, are kept in their own precision.
+        """
+        arrays: List[np.ndarray] = []
+        tensors: List[TensorDescriptor] = []
+        offset = 0
+        for name, tensor in weights.items():
+            array = tensor.detach().cpu().numpy()
+            if (
+                half_precision
+                and array.dtype == np.float32
+                and np.all(np.abs(array) <= np.finfo(np.float16).max)
+            ):
+                array = array.astype(np.float16)
+            array = np.ascontiguousarray(array)
+            tensors.append(
+                TensorDescriptor(
+                    name,
+                    offset,
+                    tuple(array.shape),
+                    array.dtype.str,
+                    str(tensor.dtype).replace("torch.", ""),
+                )
+            )
+            arrays.append(array)
+            offset = _aligned(offset + array.nbytes)
+        data = np.zeros(offset, dtype=np.uint8)
+        for array, descriptor in zip(arrays, tensors):
+            data[descriptor.offset : descriptor.offset + array.nbytes] = array.reshape(
+                -1
+            ).view(np.uint8)
+        return CompactSnapshot(version, tensors, data=data)
+
+    @property
+    def in_memory(self) -> bool:
+        return self._data is not None
+
+    def to_weights(self) -> Dict[str, torch.Tensor]:
+        """
+        Unpacks the weights. Spilled snapshots are read from their file.
+        """
+        data = self._data
+        if data is None:
+            data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        weights: Dict[str, torch.Tensor] = {}
+        for descriptor in self.tensors:
+            dtype = np.dtype(descriptor.storage_dtype)
+            array = np.frombuffer(
+                data,
+                dtype=dtype,
+                count=int(np.prod(descriptor.shape)),
+                offset=descriptor.offset,
+            ).reshape(descriptor.shape)
+            weights[descriptor.name] = torch.from_numpy(array.copy()).to(
+                getattr(torch, descriptor.dtype)
+            )
+        return weights
+
+    def load_into(self, policy: Policy) -> bool:
+        """
+        Loads the weights into the policy, unless it already has this version. The
+        weights are only unpacked when they are loaded.
+        :return: Whether the weights were loaded.
+        """
+        if policy.weights_version == self.version:
+            return False
+        return policy.load_versioned_weights(self.version, self.to_weights())
+
+    def write(self, path: str) -> None:
+        """
+        Writes the packed weights to a file, so that they survive restarts.
+        """
+        if self._data is not None:
+            self._data.tofile(path)
+        self.path = path
+
+    def spill(self, path: str) -> None:
+        """
+        Writes the packed weights to a file if needed and frees their memory.
+        """
+        if self.path is None:
+            self.write(path)
+        self._data = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "file": os.path.basename(self.path),  # type: ignore
+            "tensors": [list(descriptor) for descriptor in self.tensors],
+        }
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any], directory: str) -> "CompactSnapshot":
+        tensors = [
+            TensorDescriptor(name, offset, tuple(shape), storage_dtype, dtype)
+            for name, offset, shape, storage_dtype, dtype in d["tensors"]
+        ]
+        # The version is only meaningful within a run.
+        return CompactSnapshot(
+            next_weight_version(), tensors, path=os.path.join(directory, d["file"])
+        )
+
+
+class SnapshotPool:
+    """
+    The window of past policy snapshots a GhostTrainer samples its opponents from. Each
+    slot holds a CompactSnapshot per brain. Only the most recent snapshots are kept in
+    memory, the others are spilled to files in the snapshot directory and are read back
+    when they are swapped in. The pool is written to the snapshot directory when the
+    model is saved so that it can be restored when resuming.
+    """
+
+    def __init__(
+        self,
+        window: int,
+        directory: str,
+        half_precision: bool = False,
+        max_in_memory: Optional[int] = None,
+    ):
+        """
+        :param window: The number of slots of the pool.
+        :param directory: The directory the snapshots are spilled and saved to.
+        :param half_precision: Whether to store the weights in half precision.
+        :param max_in_memory: The number of snapshots to keep in memory, all of them if
+        None.
+        """
+        self.window = window
+        self.directory = directory
+        self.half_precision = half_precision
+        self.max_in_memory = max_in_memory
+        self._slots: List[Dict[str, CompactSnapshot]] = []
+        # Identifies the files of the snapshots, and the order the snapshots were added in.
+        self._serials: List[int] = []
+        self._next_serial = 0
+        # The files of replaced snapshots, removed once the index no longer lists them.
+        self._replaced_paths: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __getitem__(self, index: int) -> Dict[str, CompactSnapshot]:
+        return self._slots[index]
+
+    @property
+    def serials(self) -> List[int]:
+        """
+        The serial number of the snapshot of each slot. Newer snapshots have larger ones.
+        """
+        return list(self._serials)
+
+    def put(self, index: int, weights: Dict[str, WeightSnapshot]) -> None:
+        """
+        Stores the weights of each brain in a slot, replacing the snapshot that was there.
+        :param index: The slot, at most the number of slots in use.
+        :param weights: The weights of each brain of the policy.
+        """
+        snapshot = {
+            brain_name: CompactSnapshot.from_weights(
+                # Weights stored in half precision differ from the weights of their
+                # version.
+                next_weight_version()
+                if self.half_precision
+                else weight_snapshot.version,
+                weight_snapshot.weights,
+                self.half_precision,
+            )
+            for brain_name, weight_snapshot in weights.items()
+        }
+        if index == len(self._slots):
+            self._slots.append(snapshot)
+            self._serials.append(self._next_serial)
+        else:
+            self._replaced_paths.extend(
+                brain_snapshot.path
+                for brain_snapshot in self._slots[index].values()
+                if brain_snapshot.path is not None
+            )
+            self._slots[index] = snapshot
+            self._serials[index] = self._next_serial
+        self._next_serial += 1
+        self._spill_oldest()
+
+    def sample(
+        self,
+        sampling: OpponentSamplingType,
+        elos: List[float],
+        current_elo: float,
+    ) -> int:
+        """
+        Picks the slot of the next opponent.
+        :param sampling: How to pick the slot. With ELO sampling, slots are picked in
+        proportion to the expected score of their snapshot against the current policy,
+        so that stronger opponents are picked more often.
+        :param elos: The ELO of the snapshot of each slot.
+        :param current_elo: The ELO of the current policy.
+        :return: The slot.
+        """
+        if sampling == OpponentSamplingType.ELO:
+            slot_elos = np.asarray(elos[: len(self._slots)], dtype=np.float64)
+            scores = 1.0 / (1.0 + np.power(10.0, (current_elo - slot_elos) / 400.0))
+            return int(np.random.choice(len(self._slots), p=scores / scores.sum()))
+        return np.random.randint(len(self._slots))
+
+    def save(self, snapshot_counter: int, elos: List[float]) -> None:
+        """
+        Writes the snapshots that are only in memory and the index of the pool, then
+        removes the files of the snapshots replaced since the last save.
+        :param snapshot_counter: The slot the next snapshot will be stored in.
+        :param elos: The ELO of the snapshot of each slot.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        slots = []
+        for serial, snapshot, elo in zip(self._serials, self._slots, elos):
+            for brain_name, brain_snapshot in snapshot.items():
+                if brain_snapshot.path is None:
+                    brain_snapshot.write(self._snapshot_path(brain_name, serial))
+            slots.append(
+                {
+                    "serial": serial,
+                    "elo": elo,
+                    "brains": {
+                        brain_name: brain_snapshot.to_dict()
+                        for brain_name, brain_snapshot in snapshot.items()
+                    },
+                }
+            )
+        index_path = os.path.join(self.directory, SNAPSHOT_INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "snapshot_counter": snapshot_counter,
+                    "next_serial": self._next_serial,
+                    "slots": slots,
+                },
+                f,
+            )
+        os.replace(index_path + ".tmp", index_path)
+        for path in self._replaced_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self._replaced_paths = []
+
+    def load(self) -> Optional[Tuple[int, List[float]]]:
+        """
+        Restores the pool saved in the snapshot directory, if any. The snapshots are
+        read when they are swapped in.
+        :return: The slot the next snapshot must be stored in and the ELO of the snapshot
+        of each slot, or None if there was nothing to restore.
+        """
+        index_path = os.path.join(self.directory, SNAPSHOT_INDEX_FILE)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path) as f:
+            index = json.load(f)
+        saved_slots = index["slots"][: self.window]
+        slots = [
+            slot
+            for slot in saved_slots
+            if all(
+                os.path.exists(os.path.join(self.directory, d["file"]))
+                for d in slot["brains"].values()
+            )
+        ]
+        if not slots:
+            return None
+        snapshot_counter = index["snapshot_counter"] % self.window
+        if len(slots) < len(saved_slots):
+            # Files removed outside of training leave holes in the pool. Order the
+            # other snapshots from the oldest to the newest, so that the next snapshots
+            # still replace the oldest ones.
+            logger.warning(
+                f"{len(saved_slots) - len(slots)} self-play snapshots are missing "
+                f"from {self.directory}."
+            )
+            slots.sort(key=lambda slot: slot["serial"])
+            snapshot_counter = len(slots) % self.window
+        self._slots = [
+            {
+                brain_name: CompactSnapshot.from_dict(d, self.directory)
+                for brain_name, d in slot["brains"].items()
+            }
+            for slot in slots
+        ]
+        self._serials = [slot["serial"] for slot in slots]
+        self._next_serial = index["next_serial"]
+        logger.info(
+            f"Restored {len(self._slots)} self-play snapshots from {self.directory}."
+        )
+        return snapshot_counter, [slot["elo"] for slot in slots]
+
+    def _snapshot_path(self, brain_name: str, serial: int) -> str:
+        return os.path.join(self.directory, f"{brain_name}-{serial}.bin")
+
+    def _spill_oldest(self) -> None:
+        if self.max_in_memory is None:
+            return
+        in_memory = [
+            (serial, snapshot)
+            for serial, snapshot in zip(self._serials, self._slots)
+            if any(s.in_memory for s in snapshot.values())
+        ]
+        in_memory.sort(key=lambda item: item[0])
+        if len(in_memory) <= self.max_in_memory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for serial, snapshot in in_memory[: len(in_memory) - self.max_in_memory]:
+            for brain_name, brain_snapshot in snapshot.items():
+                brain_snapshot.spill(self._snapshot_path(brain_name, serial))
@@ -1,16 +1,19 @@
 # # Unity ML-Agents Toolkit
 # ## ML-Agent Learning (Ghost Trainer)
 
+import os
 from collections import defaultdict
-from typing import Deque, Dict, DefaultDict, List
+from typing import Deque, Dict, DefaultDict, List, Mapping, Union
 
 import numpy as np
 
 from mlagents_envs.logging_util import get_logger
 from mlagents_envs.base_env import BehaviorSpec
 from mlagents.trainers.policy import Policy
+from mlagents.trainers.policy.weight_store import VersionedWeightStore
 
 from mlagents.trainers.trainer import Trainer
+from mlagents.trainers.ghost.snapshot_pool import CompactSnapshot, SnapshotPool
 from mlagents.trainers.optimizer.torch_optimizer import TorchOptimizer
 from mlagents.trainers.trajectory import Trajectory
 from mlagents.trainers.agent_processor import AgentManagerQueue
@@ -61,7 +64,12 @@ class GhostTrainer(Trainer):
         """
 
         super().__init__(
-            brain_name, trainer_settings, training, artifact_path, reward_buff_cap
+            brain_name,
+            trainer_settings,
+            training,
+            trainer.load,
+            artifact_path,
+            reward_buff_cap,
         )
 
         self.trainer = trainer
@@ -112,11 +120,19 @@ class GhostTrainer(Trainer):
         # steps.
         self.ghost_step: int = 0
 
-        # A list of dicts from brain name to a single snapshot for this trainer's policies
-        self.policy_snapshots: List[Dict[str, List[float]]] = []
+        # The slots of the window, each with a dict from brain name to a single snapshot
+        # for this trainer's policies
+        self.policy_snapshots = SnapshotPool(
+            self.window,
+            os.path.join(artifact_path, "snapshots"),
+            half_precision=self_play_parameters.snapshot_half_precision,
+            max_in_memory=self_play_parameters.snapshots_in_memory,
+        )
+        self.opponent_sampling = self_play_parameters.opponent_sampling
 
-        # A dict from brain name to the current snapshot of this trainer's policies
-        self.current_policy_snapshot: Dict[str, List[float]] = {}
+        # A dict from brain name to the current weights of this trainer's policies.
+        # Ghost policies only copy them when a new version was published.
+        self.current_policy_snapshot: Dict[str, VersionedWeightStore] = {}
 
         self.snapshot_counter: int = 0
 
@@ -140,6 +156,12 @@ class GhostTrainer(Trainer):
         )  # for learning policy
         self.current_opponent: int = 0
 
+        if self.load:
+            restored = self.policy_snapshots.load()
+            if restored is not None:
+                self.snapshot_counter, snapshot_elos = restored
+                self.policy_elos[: len(snapshot_elos)] = snapshot_elos
+
     @property
     def get_step(self) -> int:
         """
@@ -229,26 +251,19 @@ class GhostTrainer(Trainer):
                 internal_trajectory_queue = self._internal_trajectory_queues[
                     parsed_behavior_id.brain_name
                 ]
-                try:
-                    # We grab at most the maximum length of the queue.
-                    # This ensures that even if the queue is being filled faster than it is
-                    # being emptied, the trajectories in the queue are on-policy.
-                    for _ in range(trajectory_queue.qsize()):
-                        t = trajectory_queue.get_nowait()
-                        # adds to wrapped trainers queue
-                        internal_trajectory_queue.put(t)
-                        self._process_trajectory(t)
-                except AgentManagerQueue.Empty:
-                    pass
+                # We grab at most the maximum length of the queue.
+                # This ensures that even if the queue is being filled faster than it is
+                # being emptied, the trajectories in the queue are on-policy.
+                trajectories = trajectory_queue.get_many()
+                # adds to wrapped trainers queue
+                internal_trajectory_queue.put_many(trajectories)
+                for t in trajectories:
+                    self._process_trajectory(t)
             else:
                 # Dump trajectories from non-learning policy
-                try:
-                    for _ in range(trajectory_queue.qsize()):
-                        t = trajectory_queue.get_nowait()
-                        # count ghost steps
-                        self.ghost_step += len(t.steps)
-                except AgentManagerQueue.Empty:
-                    pass
+                for t in trajectory_queue.get_many():
+                    # count ghost steps
+                    self.ghost_step += len(t.steps)
 
         self._next_summary_step = self.trainer._next_summary_step
         self.trainer.advance()
@@ -264,7 +279,9 @@ class GhostTrainer(Trainer):
             internal_policy_queue = self._internal_policy_queues[brain_name]
             try:
                 policy = internal_policy_queue.get_nowait()
-                self.current_policy_snapshot[brain_name] = policy.get_weights()
+                self.current_policy_snapshot[brain_name].publish(
+                    policy.get_weights_view()
+                )
             except AgentManagerQueue.Empty:
                 continue
             if (
@@ -279,7 +296,7 @@ class GhostTrainer(Trainer):
                         brain_name, next_learning_team
                     )
                     policy = self.get_policy(behavior_id)
-                    policy.load_weights(self.current_policy_snapshot[brain_name])
+                    self.current_policy_snapshot[brain_name].load_into(policy)
                     name_to_policy_queue[brain_name].put(policy)
 
         # CASE 2: Current learning team is managed by this GhostTrainer.
@@ -301,7 +318,7 @@ class GhostTrainer(Trainer):
             for brain_name in name_to_policy_queue:
                 behavior_id = create_name_behavior_id(brain_name, next_learning_team)
                 policy = self.get_policy(behavior_id)
-                policy.load_weights(self.current_policy_snapshot[brain_name])
+                self.current_policy_snapshot[brain_name].load_into(policy)
                 name_to_policy_queue[brain_name].put(policy)
 
         # Note save and swap should be on different step counters.
@@ -331,8 +348,21 @@ class GhostTrainer(Trainer):
         GlobalTrainingStatus.set_parameter_state(
             self.brain_name, StatusType.ELO, self.current_elo
         )
+        self.policy_snapshots.save(self.snapshot_counter, self.policy_elos)
         self.trainer.save_model()
 
+    def flush(self) -> None:
+        """
+        Forwarding call to wrapped trainers flush.
+        """
+        self.trainer.flush()
+
+    def close(self) -> None:
+        """
+        Forwarding call to wrapped trainers close.
+        """
+        self.trainer.close()
+
     def create_policy(
         self,
         parsed_behavior_id: BehaviorIdentifiers,
@@ -355,11 +385,11 @@ class GhostTrainer(Trainer):
                 parsed_behavior_id, behavior_spec
             )
             self.trainer.add_policy(parsed_behavior_id, internal_trainer_policy)
-            self.current_policy_snapshot[
-                parsed_behavior_id.brain_name
-            ] = internal_trainer_policy.get_weights()
+            weight_store = VersionedWeightStore()
+            weight_store.publish(internal_trainer_policy.get_weights_view())
+            self.current_policy_snapshot[parsed_behavior_id.brain_name] = weight_store
 
-            policy.load_weights(internal_trainer_policy.get_weights())
+            weight_store.load_into(policy)
             self._save_snapshot()  # Need to save after trainer initializes policy
             self._learning_team = self.controller.get_learning_team
             self.wrapped_trainer_team = team_id
@@ -390,17 +420,14 @@ class GhostTrainer(Trainer):
         Saves a snapshot of the current weights of the policy and maintains the policy_snapshots
         according to the window size
         """
-        for brain_name in self.current_policy_snapshot:
-            current_snapshot_for_brain_name = self.current_policy_snapshot[brain_name]
-
-            try:
-                self.policy_snapshots[self.snapshot_counter][
-                    brain_name
-                ] = current_snapshot_for_brain_name
-            except IndexError:
-                self.policy_snapshots.append(
-                    {brain_name: current_snapshot_for_brain_name}
-                )
+        # The snapshots must not change when new versions are published.
+        self.policy_snapshots.put(
+            self.snapshot_counter,
+            {
+                brain_name: weight_store.snapshot()
+                for brain_name, weight_store in self.current_policy_snapshot.items()
+            },
+        )
         self.policy_elos[self.snapshot_counter] = self.current_elo
         self.snapshot_counter = (self.snapshot_counter + 1) % self.window
 
@@ -412,8 +439,11 @@ class GhostTrainer(Trainer):
         for team_id in self._team_to_name_to_policy_queue:
             if team_id == self._learning_team:
                 continue
-            elif np.random.uniform() < (1 - self.play_against_latest_model_ratio):
-                x = np.random.randint(len(self.policy_snapshots))
+            snapshot: Mapping[str, Union[CompactSnapshot, VersionedWeightStore]]
+            if np.random.uniform() < (1 - self.play_against_latest_model_ratio):
+                x = self.policy_snapshots.sample(
+                    self.opponent_sampling, self.policy_elos, self.current_elo
+                )
                 snapshot = self.policy_snapshots[x]
             else:
                 snapshot = self.current_policy_snapshot
@@ -424,7 +454,7 @@ class GhostTrainer(Trainer):
             for brain_name in self._team_to_name_to_policy_queue[team_id]:
                 behavior_id = create_name_behavior_id(brain_name, team_id)
                 policy = self.get_policy(behavior_id)
-                policy.load_weights(snapshot[brain_name])
+                snapshot[brain_name].load_into(policy)
                 name_to_policy_queue[brain_name].put(policy)
                 logger.debug(
                     "Step {}: Swapping snapshot {} to id {} with team {} learning".format(
@@ -106,6 +106,7 @@ def run_training(run_seed: int, options: RunOptions, num_areas: int) -> None:
             port,
             env_settings.env_args,
             os.path.abspath(run_logs_dir),  # Unity environment requires absolute path
+            env_settings.uint8_visual_obs,
         )
 
         env_manager = SubprocessEnvManager(env_factory, options, env_settings.num_envs)
@@ -131,6 +132,7 @@ def run_training(run_seed: int, options: RunOptions, num_areas: int) -> None:
             env_parameter_manager,
             not checkpoint_settings.inference,
             run_seed,
+            env_settings.batched_agent_processing,
         )
 
     # Begin training
@@ -182,6 +184,7 @@ def create_environment_factory(
     start_port: Optional[int],
     env_args: Optional[List[str]],
     log_folder: str,
+    uint8_visual_obs: bool = False,
 ) -> Callable[[int, List[SideChannel]], BaseEnv]:
     def create_unity_environment(
         worker_id: int, side_channels: List[SideChannel]
@@ -200,6 +203,7 @@ def create_environment_factory(
             side_channels=side_channels,
             log_folder=log_folder,
             timeout_wait=timeout_wait,
+            uint8_visual_observations=uint8_visual_obs,
         )
 
     return create_unity_environment
@@ -1,6 +1,8 @@
 # # Unity ML-Agents Toolkit
 import abc
-from typing import Any, Tuple, List
+from typing import Any, Dict, Tuple, List
+
+from mlagents.trainers.policy.checkpoint_manager import ModelCheckpointManager
 
 
 class BaseModelSaver(abc.ABC):
@@ -57,6 +59,26 @@ class BaseModelSaver(abc.ABC):
         """
         pass
 
+    def remove_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        """
+        Removes the files of a checkpoint that is no longer kept.
+        :param checkpoint: The checkpoint, as stored by the ModelCheckpointManager.
+        """
+        ModelCheckpointManager.remove_checkpoint(checkpoint)
+
+    def flush(self) -> None:
+        """
+        Waits until the checkpoints being saved in the background are written, and
+        raises the first error that happened while writing them.
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Finishes saving the checkpoints and releases the resources of the ModelSaver.
+        """
+        pass
+
     @abc.abstractmethod
     def initialize_or_load(self, policy):
         """
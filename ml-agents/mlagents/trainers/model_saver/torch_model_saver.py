@@ -1,10 +1,14 @@
+import copy
 import os
 import shutil
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from mlagents.torch_utils import torch
-from typing import Dict, Union, Optional, cast, Tuple, List
+from typing import Any, Callable, Deque, Dict, Union, Optional, cast, Tuple, List
 from mlagents_envs.exception import UnityPolicyException
 from mlagents_envs.logging_util import get_logger
 from mlagents.trainers.model_saver.model_saver import BaseModelSaver
+from mlagents.trainers.policy.checkpoint_manager import ModelCheckpointManager
 from mlagents.trainers.settings import TrainerSettings, SerializationSettings
 from mlagents.trainers.policy.torch_policy import TorchPolicy
 from mlagents.trainers.optimizer.torch_optimizer import TorchOptimizer
@@ -15,14 +19,47 @@ logger = get_logger(__name__)
 DEFAULT_CHECKPOINT_NAME = "checkpoint.pt"
 
 
+def _snapshot(state: Any) -> Any:
+    """
+    Copies the tensors of a state dict, so that it can be saved while training goes on.
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().clone()
+    if isinstance(state, dict):
+        # Shallow copy first to keep the metadata of the state dicts of the modules.
+        snapshot = copy.copy(state)
+        for key, value in state.items():
+            snapshot[key] = _snapshot(value)
+        return snapshot
+    if isinstance(state, (list, tuple)):
+        return type(state)(_snapshot(value) for value in state)
+    return state
+
+
 class TorchModelSaver(BaseModelSaver):
     """
-    ModelSaver class for PyTorch
+    ModelSaver class for PyTorch. If max_pending_checkpoints is positive, checkpoints
+    are snapshotted in memory and written, exported to ONNX and cleaned up by a
+    background thread, so that training isn't blocked while they are written. The first
+    error of the background thread is raised by the next call to save_checkpoint, flush
+    or close.
     """
 
     def __init__(
-        self, trainer_settings: TrainerSettings, model_path: str, load: bool = False
+        self,
+        trainer_settings: TrainerSettings,
+        model_path: str,
+        load: bool = False,
+        max_pending_checkpoints: int = 0,
     ):
+        """
+        :param trainer_settings: The settings of the trainer.
+        :param model_path: The directory the checkpoints are saved in.
+        :param load: Whether to resume from the last checkpoint in model_path.
+        :param max_pending_checkpoints: The number of checkpoints that can be waiting to
+            be written in the background. Saving a checkpoint blocks when the queue is
+            full. If 0, the checkpoints are written right away.
+        """
         super().__init__()
         self.model_path = model_path
         self.initialize_path = trainer_settings.init_path
@@ -33,6 +70,47 @@ class TorchModelSaver(BaseModelSaver):
         self.exporter: Optional[ModelSerializer] = None
         self.modules: Dict[str, torch.nn.Modules] = {}
 
+        self._max_pending = max_pending_checkpoints
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Deque[Future] = deque()
+        self._error: Optional[BaseException] = None
+        if self._max_pending > 0:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="model_saver"
+            )
+
+    def _submit(self, fn: Callable, *args: Any) -> None:
+        """
+        Runs fn in the background thread, after the tasks submitted before, or right
+        away if checkpoints are written synchronously.
+        """
+        if self._executor is None:
+            fn(*args)
+            return
+        while self._pending and self._pending[0].done():
+            self._wait()
+        while len(self._pending) >= self._max_pending:
+            self._wait()
+        self._raise_error()
+        self._pending.append(self._executor.submit(fn, *args))
+
+    def _wait(self) -> None:
+        """
+        Waits for the oldest background task, and keeps its error if it is the first one.
+        """
+        error = self._pending.popleft().exception()
+        if error is None:
+            return
+        if self._error is None:
+            self._error = error
+        else:
+            logger.warning(f"Failed to save the model in the background: {error}")
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
     def register(self, module: Union[TorchPolicy, TorchOptimizer]) -> None:
         if isinstance(module, TorchPolicy) or isinstance(module, TorchOptimizer):
             self.modules.update(module.get_modules())  # type: ignore
@@ -55,15 +133,45 @@ class TorchModelSaver(BaseModelSaver):
         }
         pytorch_ckpt_path = f"{checkpoint_path}.pt"
         export_ckpt_path = f"{checkpoint_path}.onnx"
+        actor = None
+        if self._executor is not None:
+            state_dict = _snapshot(state_dict)
+            if self.policy is not None:
+                actor = copy.deepcopy(self.policy.actor)
+        self._submit(self._write_checkpoint, state_dict, checkpoint_path, actor)
+        return export_ckpt_path, [pytorch_ckpt_path]
+
+    def _write_checkpoint(
+        self,
+        state_dict: Dict[str, Any],
+        checkpoint_path: str,
+        actor: Optional[torch.nn.Module],
+    ) -> None:
         torch.save(state_dict, f"{checkpoint_path}.pt")
         torch.save(state_dict, os.path.join(self.model_path, DEFAULT_CHECKPOINT_NAME))
-        self.export(checkpoint_path, behavior_name)
-        return export_ckpt_path, [pytorch_ckpt_path]
+        if self.exporter is not None:
+            self.exporter.export_policy_model(checkpoint_path, actor)
 
     def export(self, output_filepath: str, behavior_name: str) -> None:
         if self.exporter is not None:
             self.exporter.export_policy_model(output_filepath)
 
+    def remove_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
+        # Removed after the checkpoints being written, which may include this one.
+        self._submit(ModelCheckpointManager.remove_checkpoint, checkpoint)
+
+    def flush(self) -> None:
+        while self._pending:
+            self._wait()
+        self._raise_error()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+
     def initialize_or_load(self, policy: Optional[TorchPolicy] = None) -> None:
         # Initialize/Load registered self.policy by default.
         # If given input argument policy, use the input policy instead.
@@ -141,6 +249,9 @@ class TorchModelSaver(BaseModelSaver):
         Copy the .nn file at the given source to the destination.
         Also copies the corresponding .onnx file if it exists.
         """
+        self._submit(self._copy_final_model, source_nn_path)
+
+    def _copy_final_model(self, source_nn_path: str) -> None:
         final_model_name = os.path.splitext(source_nn_path)[0]
 
         if SerializationSettings.convert_to_onnx:
@@ -4,6 +4,7 @@ import numpy as np
 from collections import defaultdict
 
 from mlagents.trainers.buffer import AgentBuffer, AgentBufferField
+from mlagents.trainers.exception import UnityTrainerException
 from mlagents.trainers.trajectory import ObsUtil
 from mlagents.trainers.torch_entities.components.bc.module import BCModule
 from mlagents.trainers.torch_entities.components.reward_providers import (
@@ -50,6 +51,22 @@ class TorchOptimizer(Optimizer):
     def update(self, batch: AgentBuffer, num_sequences: int) -> Dict[str, float]:
         pass
 
+    def update_prioritized(
+        self, batch: AgentBuffer, num_sequences: int, importance_weights: np.ndarray
+    ) -> Tuple[Dict[str, float], np.ndarray]:
+        """
+        Updates the model like update, for prioritized experience replay.
+        :param batch: Experience mini-batch.
+        :param num_sequences: Number of sequences in the batch.
+        :param importance_weights: The importance sampling weight of each experience of
+            the batch, which scales its loss.
+        :return: The update stats, and the absolute TD error of each experience of the
+            batch, from which the priority of its sequence is computed.
+        """
+        raise UnityTrainerException(
+            f"{self.__class__.__name__} doesn't support prioritized replay."
+        )
+
     def create_reward_signals(
         self, reward_signal_configs: Dict[RewardSignalType, RewardSignalSettings]
     ) -> None:
@@ -169,9 +186,10 @@ class TorchOptimizer(Optimizer):
 
         # Convert to tensors
         current_obs = [
-            ModelUtils.list_to_tensor(obs) for obs in ObsUtil.from_buffer(batch, n_obs)
+            ModelUtils.list_to_obs_tensor(obs)
+            for obs in ObsUtil.from_buffer(batch, n_obs)
         ]
-        next_obs = [ModelUtils.list_to_tensor(obs) for obs in next_obs]
+        next_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in next_obs]
 
         next_obs = [obs.unsqueeze(0) for obs in next_obs]
 
@@ -209,3 +227,197 @@ class TorchOptimizer(Optimizer):
             if agent_id in self.critic_memory_dict:
                 self.critic_memory_dict.pop(agent_id)
         return value_estimates, next_value_estimate, all_next_memories
+
+    def get_batch_value_estimates(
+        self,
+        batches: List[AgentBuffer],
+        next_obs: List[List[np.ndarray]],
+        dones: List[bool],
+        agent_ids: List[str],
+    ) -> List[
+        Tuple[Dict[str, np.ndarray], Dict[str, float], Optional[AgentBufferField]]
+    ]:
+        """
+        Get value estimates and memories for several trajectories, like calling
+        get_trajectory_value_estimates on each of them, but evaluating the critic on all of the
+        trajectories and their next observations in one forward pass. With memories, the
+        trajectories are evaluated one sequence at a time, and the sequences at the same position
+        in every trajectory are evaluated together.
+        :param batches: AgentBuffers that each consist of a trajectory.
+        :param next_obs: The next observation after each trajectory.
+        :param dones: Whether each trajectory is terminal.
+        :param agent_ids: Agent ID of the agent that each trajectory belongs to.
+        :returns: A List with the Tuple returned by get_trajectory_value_estimates for each trajectory.
+        """
+        results: List[
+            Tuple[Dict[str, np.ndarray], Dict[str, float], Optional[AgentBufferField]]
+        ] = []
+        start = 0
+        while start < len(batches):
+            # The final critic memory of a trajectory is the initial memory of the next
+            # trajectory of the same agent, so those must be evaluated after it.
+            end = start
+            group_agent_ids = set()
+            while end < len(batches) and not (
+                self.policy.use_recurrent and agent_ids[end] in group_agent_ids
+            ):
+                group_agent_ids.add(agent_ids[end])
+                end += 1
+            results.extend(
+                self._get_batch_value_estimates(
+                    batches[start:end],
+                    next_obs[start:end],
+                    dones[start:end],
+                    agent_ids[start:end],
+                )
+            )
+            start = end
+        return results
+
+    def _get_batch_value_estimates(
+        self,
+        batches: List[AgentBuffer],
+        next_obs: List[List[np.ndarray]],
+        dones: List[bool],
+        agent_ids: List[str],
+    ) -> List[
+        Tuple[Dict[str, np.ndarray], Dict[str, float], Optional[AgentBufferField]]
+    ]:
+        n_obs = len(self.policy.behavior_spec.observation_specs)
+        lengths = [batch.num_experiences for batch in batches]
+        num_experiences = sum(lengths)
+        trajectory_obs = [ObsUtil.from_buffer(batch, n_obs) for batch in batches]
+        # One tensor per observation, with the observations of all of the trajectories
+        # followed by their next observations.
+        all_obs = [
+            ModelUtils.list_to_obs_tensor(
+                np.concatenate(
+                    [np.asanyarray(obs[i]) for obs in trajectory_obs]
+                    + [np.stack([_next_obs[i] for _next_obs in next_obs])]
+                )
+            )
+            for i in range(n_obs)
+        ]
+        all_next_memories: List[Optional[AgentBufferField]] = [None] * len(batches)
+
+        # To prevent memory leak and improve performance, evaluate with no_grad.
+        with torch.no_grad():
+            if self.policy.use_recurrent:
+                current_obs = [_obs[:num_experiences] for _obs in all_obs]
+                next_obs_tensors = [_obs[num_experiences:] for _obs in all_obs]
+                memories = [
+                    self.critic_memory_dict[agent_id]
+                    if agent_id in self.critic_memory_dict
+                    else torch.zeros((1, 1, self.critic.memory_size))
+                    for agent_id in agent_ids
+                ]
+                (
+                    value_estimates,
+                    all_next_memories,
+                    memories,
+                ) = self._evaluate_batch_by_sequence(current_obs, lengths, memories)
+                next_value_estimates, _ = self.critic.critic_pass(
+                    next_obs_tensors, torch.cat(memories, dim=1), sequence_length=1
+                )
+            else:
+                all_values, _ = self.critic.critic_pass(
+                    all_obs, None, sequence_length=num_experiences + len(batches)
+                )
+                value_estimates = {
+                    name: list(torch.split(values[:num_experiences], lengths))
+                    for name, values in all_values.items()
+                }
+                next_value_estimates = {
+                    name: values[num_experiences:]
+                    for name, values in all_values.items()
+                }
+                memories = [None] * len(batches)
+
+        results: List[
+            Tuple[Dict[str, np.ndarray], Dict[str, float], Optional[AgentBufferField]]
+        ] = []
+        for i, (done, agent_id) in enumerate(zip(dones, agent_ids)):
+            # Store the memory for the next trajectory. This should NOT have a gradient.
+            self.critic_memory_dict[agent_id] = memories[i]
+            value_estimate = {
+                name: ModelUtils.to_numpy(values[i])
+                for name, values in value_estimates.items()
+            }
+            next_value_estimate: Dict[str, float] = {
+                name: float(values[i]) for name, values in next_value_estimates.items()
+            }
+            if done:
+                for k in next_value_estimate:
+                    if not self.reward_signals[k].ignore_done:
+                        next_value_estimate[k] = 0.0
+                self.critic_memory_dict.pop(agent_id)
+            results.append((value_estimate, next_value_estimate, all_next_memories[i]))
+        return results
+
+    def _evaluate_batch_by_sequence(
+        self,
+        tensor_obs: List[torch.Tensor],
+        lengths: List[int],
+        initial_memories: List[torch.Tensor],
+    ) -> Tuple[
+        Dict[str, List[torch.Tensor]], List[AgentBufferField], List[torch.Tensor]
+    ]:
+        """
+        Evaluate several trajectories sequence-by-sequence, like _evaluate_by_sequence. The
+        sequences at the same position in each trajectory are evaluated in one critic pass, the
+        last, shorter sequences of the trajectories are grouped by length.
+        :param tensor_obs: A List of tensors of shape (total_len, <obs_dim>) that are the
+            observations of all of the trajectories, one after the other.
+        :param lengths: The length of each trajectory.
+        :param initial_memories: The memory that preceeds each trajectory, of shape (1,1,<mem_size>).
+        :return: A Tuple of the value estimates of each trajectory as a Dict of [name, List[tensor]],
+            the AgentBufferField of initial memories of each trajectory, and the final memory of
+            each trajectory.
+        """
+        sequence_length = self.policy.sequence_length
+        starts = np.cumsum([0] + lengths[:-1])
+        memories = list(initial_memories)
+        all_next_memories = [AgentBufferField() for _ in lengths]
+        all_values: List[Dict[str, List[torch.Tensor]]] = [
+            defaultdict(list) for _ in lengths
+        ]
+        for seq_start in range(0, max(lengths), sequence_length):
+            # The trajectories that still have a sequence to evaluate, by the length of that
+            # sequence. Only the last sequence of a trajectory can be shorter.
+            by_length: Dict[int, List[int]] = defaultdict(list)
+            for i, length in enumerate(lengths):
+                if seq_start < length:
+                    by_length[min(sequence_length, length - seq_start)].append(i)
+            for seq_len, indices in by_length.items():
+                seq_obs = [
+                    torch.cat(
+                        [
+                            _obs[
+                                starts[i] + seq_start : starts[i] + seq_start + seq_len
+                            ]
+                            for i in indices
+                        ]
+                    )
+                    for _obs in tensor_obs
+                ]
+                for i in indices:
+                    _mem = ModelUtils.to_numpy(memories[i].squeeze())
+                    for _ in range(seq_len):
+                        all_next_memories[i].append(_mem)
+                values, seq_memories = self.critic.critic_pass(
+                    seq_obs,
+                    torch.cat([memories[i] for i in indices], dim=1),
+                    sequence_length=seq_len,
+                )
+                for j, i in enumerate(indices):
+                    memories[i] = seq_memories[:, j : j + 1]
+                    for signal_name, _val in values.items():
+                        all_values[i][signal_name].append(
+                            _val[j * seq_len : (j + 1) * seq_len]
+                        )
+        # Create one tensor per reward signal and trajectory
+        all_value_tensors: Dict[str, List[torch.Tensor]] = defaultdict(list)
+        for values in all_values:
+            for signal_name, value_list in values.items():
+                all_value_tensors[signal_name].append(torch.cat(value_list, dim=0))
+        return all_value_tensors, all_next_memories, memories
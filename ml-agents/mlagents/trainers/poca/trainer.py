@@ -12,7 +12,7 @@ from mlagents_envs.logging_util import get_logger
 from mlagents_envs.base_env import BehaviorSpec
 from mlagents.trainers.buffer import BufferKey, RewardSignalUtil
 from mlagents.trainers.trainer.on_policy_trainer import OnPolicyTrainer
-from mlagents.trainers.trainer.trainer_utils import lambda_return
+from mlagents.trainers.trainer.trainer_utils import lambda_return_batch
 from mlagents.trainers.policy import Policy
 from mlagents.trainers.policy.torch_policy import TorchPolicy
 from mlagents.trainers.poca.optimizer_torch import TorchPOCAOptimizer, POCASettings
@@ -134,44 +134,60 @@ class POCATrainer(OnPolicyTrainer):
             # Report the reward signals
             self.collected_rewards[name][agent_id] += np.sum(evaluate_result)
 
-        # Compute lambda returns and advantage
-        tmp_advantages = []
-        for name in self.optimizer.reward_signals:
-
-            local_rewards = np.array(
-                agent_buffer_trajectory[RewardSignalUtil.rewards_key(name)].get_batch(),
-                dtype=np.float32,
-            )
-
-            baseline_estimate = agent_buffer_trajectory[
-                RewardSignalUtil.baseline_estimates_key(name)
-            ].get_batch()
-            v_estimates = agent_buffer_trajectory[
-                RewardSignalUtil.value_estimates_key(name)
-            ].get_batch()
-
-            lambd_returns = lambda_return(
-                r=local_rewards,
-                value_estimates=v_estimates,
-                gamma=self.optimizer.reward_signals[name].gamma,
-                lambd=self.hyperparameters.lambd,
-                value_next=value_next[name],
-            )
-
-            local_advantage = np.array(lambd_returns) - np.array(baseline_estimate)
-
+        # Compute lambda returns and advantage for all reward signals at once
+        reward_signal_names = list(self.optimizer.reward_signals)
+        local_rewards = np.array(
+            [
+                agent_buffer_trajectory[RewardSignalUtil.rewards_key(name)].get_batch()
+                for name in reward_signal_names
+            ],
+            dtype=np.float32,
+        )
+        baseline_estimates = np.array(
+            [
+                agent_buffer_trajectory[
+                    RewardSignalUtil.baseline_estimates_key(name)
+                ].get_batch()
+                for name in reward_signal_names
+            ],
+            dtype=np.float32,
+        )
+        v_estimates = np.array(
+            [
+                agent_buffer_trajectory[
+                    RewardSignalUtil.value_estimates_key(name)
+                ].get_batch()
+                for name in reward_signal_names
+            ],
+            dtype=np.float32,
+        )
+        lambd_returns = lambda_return_batch(
+            rewards=local_rewards,
+            value_estimates=v_estimates,
+            gamma=np.array(
+                [
+                    self.optimizer.reward_signals[name].gamma
+                    for name in reward_signal_names
+                ]
+            ),
+            lambd=self.hyperparameters.lambd,
+            value_next=np.concatenate(
+                [np.ravel(value_next[name]) for name in reward_signal_names]
+            ),
+        )
+        local_advantages = lambd_returns - baseline_estimates
+        for name, local_return, local_advantage in zip(
+            reward_signal_names, lambd_returns, local_advantages
+        ):
             agent_buffer_trajectory[RewardSignalUtil.returns_key(name)].set(
-                lambd_returns
+                local_return
             )
             agent_buffer_trajectory[RewardSignalUtil.advantage_key(name)].set(
                 local_advantage
             )
-            tmp_advantages.append(local_advantage)
 
         # Get global advantages
-        global_advantages = list(
-            np.mean(np.array(tmp_advantages, dtype=np.float32), axis=0)
-        )
+        global_advantages = list(np.mean(local_advantages, axis=0))
         agent_buffer_trajectory[BufferKey.ADVANTAGES].set(global_advantages)
 
         self._append_to_update_buffer(agent_buffer_trajectory)
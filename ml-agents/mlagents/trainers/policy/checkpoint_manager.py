@@ -1,5 +1,5 @@
 # # Unity ML-Agents Toolkit
-from typing import Dict, Any, Optional, List
+from typing import Callable, Dict, Any, Optional, List
 import os
 import attr
 from mlagents.trainers.training_status import GlobalTrainingStatus, StatusType
@@ -50,7 +50,10 @@ class ModelCheckpointManager:
 
     @classmethod
     def _cleanup_extra_checkpoints(
-        cls, checkpoints: List[Dict], keep_checkpoints: int
+        cls,
+        checkpoints: List[Dict],
+        keep_checkpoints: int,
+        remove_checkpoint: Optional[Callable[[Dict[str, Any]], None]] = None,
     ) -> List[Dict]:
         """
         Ensures that the number of checkpoints stored are within the number
@@ -59,27 +62,37 @@ class ModelCheckpointManager:
 
         :param behavior_name: The behavior name whose checkpoints we will mange.
         :param keep_checkpoints: Number of checkpoints to record (user-defined).
+        :param remove_checkpoint: Removes the files of a checkpoint. Defaults to
+            removing them right away.
         """
+        if remove_checkpoint is None:
+            remove_checkpoint = ModelCheckpointManager.remove_checkpoint
         while len(checkpoints) > keep_checkpoints:
             if keep_checkpoints <= 0 or len(checkpoints) == 0:
                 break
-            ModelCheckpointManager.remove_checkpoint(checkpoints.pop(0))
+            remove_checkpoint(checkpoints.pop(0))
         return checkpoints
 
     @classmethod
     def add_checkpoint(
-        cls, behavior_name: str, new_checkpoint: ModelCheckpoint, keep_checkpoints: int
+        cls,
+        behavior_name: str,
+        new_checkpoint: ModelCheckpoint,
+        keep_checkpoints: int,
+        remove_checkpoint: Optional[Callable[[Dict[str, Any]], None]] = None,
     ) -> None:
         """
         Make room for new checkpoint if needed and insert new checkpoint information.
         :param behavior_name: Behavior name for the checkpoint.
         :param new_checkpoint: The new checkpoint to be recorded.
         :param keep_checkpoints: Number of checkpoints to record (user-defined).
+        :param remove_checkpoint: Removes the files of the checkpoints that are no
+            longer kept. Defaults to removing them right away.
         """
         new_checkpoint_dict = attr.asdict(new_checkpoint)
         checkpoints = cls.get_checkpoints(behavior_name)
         checkpoints.append(new_checkpoint_dict)
-        cls._cleanup_extra_checkpoints(checkpoints, keep_checkpoints)
+        cls._cleanup_extra_checkpoints(checkpoints, keep_checkpoints, remove_checkpoint)
         GlobalTrainingStatus.set_parameter_state(
             behavior_name, StatusType.CHECKPOINTS, checkpoints
         )
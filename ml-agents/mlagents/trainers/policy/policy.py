@@ -1,6 +1,8 @@
 from abc import abstractmethod
-from typing import Dict, List, Optional
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import numpy as np
+import numpy.typing as npt
 
 from mlagents_envs.base_env import ActionTuple, BehaviorSpec, DecisionSteps
 from mlagents_envs.exception import UnityException
@@ -18,6 +20,91 @@ class UnityPolicyException(UnityException):
     pass
 
 
+class AgentArrayStore(Mapping):
+    """
+    Stores one array per agent in the slots of a single preallocated array, so that the
+    arrays of a batch of agents are saved and retrieved with one fancy-indexing operation.
+    The array grows geometrically and the slots of removed agents are reused.
+    It can be read like a Dict[GlobalAgentId, np.ndarray].
+    """
+
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, shape: Tuple[int, ...], dtype: npt.DTypeLike):
+        self._data = np.zeros((self.INITIAL_CAPACITY,) + shape, dtype=dtype)
+        self._slots: Dict[GlobalAgentId, int] = {}
+        # Free slots are popped from the end, so that the lowest ones are used first.
+        self._free_slots: List[int] = list(range(self.INITIAL_CAPACITY - 1, -1, -1))
+
+    def __contains__(self, agent_id: object) -> bool:
+        return agent_id in self._slots
+
+    def __getitem__(self, agent_id: GlobalAgentId) -> np.ndarray:
+        return self._data[self._slots[agent_id]].copy()
+
+    def __iter__(self) -> Iterator[GlobalAgentId]:
+        return iter(self._slots)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get_slots(self, agent_ids: List[GlobalAgentId]) -> np.ndarray:
+        """
+        Returns the slots of the agents, -1 for the agents that aren't in the store.
+        """
+        return np.fromiter(
+            (self._slots.get(agent_id, -1) for agent_id in agent_ids),
+            dtype=np.int64,
+            count=len(agent_ids),
+        )
+
+    def save(self, agent_ids: List[GlobalAgentId], values: np.ndarray) -> None:
+        """
+        Saves the arrays of the agents, values[i] being the array of agent_ids[i].
+        """
+        if len(values) != len(agent_ids):
+            raise UnityPolicyException(
+                f"Got {len(values)} arrays to save for {len(agent_ids)} agents."
+            )
+        slots = self.get_slots(agent_ids)
+        for index in np.flatnonzero(slots < 0):
+            slots[index] = self._allocate_slot(agent_ids[index])
+        self._data[slots] = values
+
+    def retrieve(self, agent_ids: List[GlobalAgentId]) -> np.ndarray:
+        """
+        Returns the arrays of the agents stacked in one array. Agents that aren't in the
+        store get zeros.
+        """
+        slots = self.get_slots(agent_ids)
+        result = self._data[slots]
+        result[slots < 0] = 0
+        return result
+
+    def remove(self, agent_ids: List[GlobalAgentId]) -> None:
+        for agent_id in agent_ids:
+            slot = self._slots.pop(agent_id, None)
+            if slot is not None:
+                self._free_slots.append(slot)
+
+    def _allocate_slot(self, agent_id: GlobalAgentId) -> int:
+        if agent_id in self._slots:
+            # The agent appears several times in the batch being saved.
+            return self._slots[agent_id]
+        if not self._free_slots:
+            capacity = len(self._data)
+            new_capacity = capacity * 2
+            new_data = np.zeros(
+                (new_capacity,) + self._data.shape[1:], self._data.dtype
+            )
+            new_data[:capacity] = self._data
+            self._data = new_data
+            self._free_slots = list(range(new_capacity - 1, capacity - 1, -1))
+        slot = self._free_slots.pop()
+        self._slots[agent_id] = slot
+        return slot
+
+
 class Policy:
     def __init__(
         self,
@@ -28,9 +115,6 @@ class Policy:
         self.behavior_spec = behavior_spec
         self.network_settings: NetworkSettings = network_settings
         self.seed = seed
-        self.previous_action_dict: Dict[str, np.ndarray] = {}
-        self.previous_memory_dict: Dict[str, np.ndarray] = {}
-        self.memory_dict: Dict[str, np.ndarray] = {}
         self.normalize = network_settings.normalize
         self.use_recurrent = self.network_settings.memory is not None
         self.m_size = 0
@@ -38,6 +122,13 @@ class Policy:
         if self.use_recurrent:
             self.m_size = self.network_settings.memory.memory_size
             self.sequence_length = self.network_settings.memory.sequence_length
+        self.previous_action_dict = AgentArrayStore(
+            (self.behavior_spec.action_spec.discrete_size,), np.int32
+        )
+        self.previous_memory_dict = AgentArrayStore((self.m_size,), np.float32)
+        self.memory_dict = AgentArrayStore((self.m_size,), np.float32)
+        # Version of the weights last loaded with load_versioned_weights, if any.
+        self.weights_version: Optional[int] = None
 
     def make_empty_memory(self, num_agents):
         """
@@ -54,33 +145,24 @@ class Policy:
             return
 
         # Pass old memories into previous_memory_dict
-        for agent_id in agent_ids:
-            if agent_id in self.memory_dict:
-                self.previous_memory_dict[agent_id] = self.memory_dict[agent_id]
-
-        for index, agent_id in enumerate(agent_ids):
-            self.memory_dict[agent_id] = memory_matrix[index, :]
+        previous_ids = [
+            agent_id for agent_id in agent_ids if agent_id in self.memory_dict
+        ]
+        if previous_ids:
+            self.previous_memory_dict.save(
+                previous_ids, self.memory_dict.retrieve(previous_ids)
+            )
+        self.memory_dict.save(agent_ids, memory_matrix)
 
     def retrieve_memories(self, agent_ids: List[GlobalAgentId]) -> np.ndarray:
-        memory_matrix = np.zeros((len(agent_ids), self.m_size), dtype=np.float32)
-        for index, agent_id in enumerate(agent_ids):
-            if agent_id in self.memory_dict:
-                memory_matrix[index, :] = self.memory_dict[agent_id]
-        return memory_matrix
+        return self.memory_dict.retrieve(agent_ids)
 
     def retrieve_previous_memories(self, agent_ids: List[GlobalAgentId]) -> np.ndarray:
-        memory_matrix = np.zeros((len(agent_ids), self.m_size), dtype=np.float32)
-        for index, agent_id in enumerate(agent_ids):
-            if agent_id in self.previous_memory_dict:
-                memory_matrix[index, :] = self.previous_memory_dict[agent_id]
-        return memory_matrix
+        return self.previous_memory_dict.retrieve(agent_ids)
 
     def remove_memories(self, agent_ids: List[GlobalAgentId]) -> None:
-        for agent_id in agent_ids:
-            if agent_id in self.memory_dict:
-                self.memory_dict.pop(agent_id)
-            if agent_id in self.previous_memory_dict:
-                self.previous_memory_dict.pop(agent_id)
+        self.memory_dict.remove(agent_ids)
+        self.previous_memory_dict.remove(agent_ids)
 
     def make_empty_previous_action(self, num_agents: int) -> np.ndarray:
         """
@@ -95,26 +177,32 @@ class Policy:
     def save_previous_action(
         self, agent_ids: List[GlobalAgentId], action_tuple: ActionTuple
     ) -> None:
-        for index, agent_id in enumerate(agent_ids):
-            self.previous_action_dict[agent_id] = action_tuple.discrete[index, :]
+        self.previous_action_dict.save(agent_ids, action_tuple.discrete)
 
     def retrieve_previous_action(self, agent_ids: List[GlobalAgentId]) -> np.ndarray:
-        action_matrix = self.make_empty_previous_action(len(agent_ids))
-        for index, agent_id in enumerate(agent_ids):
-            if agent_id in self.previous_action_dict:
-                action_matrix[index, :] = self.previous_action_dict[agent_id]
-        return action_matrix
+        return self.previous_action_dict.retrieve(agent_ids)
 
     def remove_previous_action(self, agent_ids: List[GlobalAgentId]) -> None:
-        for agent_id in agent_ids:
-            if agent_id in self.previous_action_dict:
-                self.previous_action_dict.pop(agent_id)
+        self.previous_action_dict.remove(agent_ids)
 
     def get_action(
         self, decision_requests: DecisionSteps, worker_id: int = 0
     ) -> ActionInfo:
         raise NotImplementedError
 
+    def get_actions(
+        self, decision_requests: List[Tuple[DecisionSteps, int]]
+    ) -> List[ActionInfo]:
+        """
+        Decides actions for the DecisionSteps of several environment workers.
+        :param decision_requests: List of DecisionSteps and the id of the worker they come from.
+        :return: One ActionInfo per entry of decision_requests.
+        """
+        return [
+            self.get_action(decision_steps, worker_id)
+            for decision_steps, worker_id in decision_requests
+        ]
+
     @staticmethod
     def check_nan_action(action: Optional[ActionTuple]) -> None:
         # Fast NaN check on the action
@@ -137,10 +225,30 @@ class Policy:
     def load_weights(self, values: List[np.ndarray]) -> None:
         pass
 
+    def load_versioned_weights(self, version: int, values: Any) -> bool:
+        """
+        Loads the weights unless they are the version that was loaded last.
+        :param version: The version of the weights, see VersionedWeightStore.
+        :param values: The weights, in the format of load_weights.
+        :return: Whether the weights were loaded.
+        """
+        if version == self.weights_version:
+            return False
+        self.load_weights(values)
+        self.weights_version = version
+        return True
+
     @abstractmethod
     def get_weights(self) -> List[np.ndarray]:
         return []
 
+    def get_weights_view(self) -> Any:
+        """
+        Returns the weights without copying them when possible. Unlike with get_weights,
+        they change when the policy is updated.
+        """
+        return self.get_weights()
+
     @abstractmethod
     def init_load_weights(self) -> None:
         pass
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 import numpy as np
 from mlagents.torch_utils import torch, default_device
 import copy
@@ -6,7 +6,7 @@ import copy
 from mlagents.trainers.action_info import ActionInfo
 from mlagents.trainers.behavior_id_utils import get_global_agent_id
 from mlagents.trainers.policy import Policy
-from mlagents_envs.base_env import DecisionSteps, BehaviorSpec
+from mlagents_envs.base_env import DecisionSteps, BehaviorSpec, _ActionTupleBase
 from mlagents_envs.timers import timed
 
 from mlagents.trainers.settings import NetworkSettings
@@ -137,6 +137,99 @@ class TorchPolicy(Policy):
             agent_ids=list(decision_requests.agent_id),
         )
 
+    def get_actions(
+        self, decision_requests: List[Tuple[DecisionSteps, int]]
+    ) -> List[ActionInfo]:
+        """
+        Decides actions for the DecisionSteps of several environment workers with a single
+        forward pass, and splits the results back per worker.
+        :param decision_requests: List of DecisionSteps and the id of the worker they come from.
+        :return: One ActionInfo per entry of decision_requests.
+        """
+        if sum(len(decision_steps) > 0 for decision_steps, _ in decision_requests) < 2:
+            return super().get_actions(decision_requests)
+
+        global_agent_ids = [
+            get_global_agent_id(worker_id, int(agent_id))
+            for decision_steps, worker_id in decision_requests
+            for agent_id in decision_steps.agent_id
+        ]
+        run_out = self.evaluate(
+            self._concatenate_decision_steps(
+                [decision_steps for decision_steps, _ in decision_requests]
+            ),
+            global_agent_ids,
+        )
+        self.save_memories(global_agent_ids, run_out.get("memory_out"))
+        self.check_nan_action(run_out.get("action"))
+
+        action_infos = []
+        start = 0
+        for decision_steps, _ in decision_requests:
+            if len(decision_steps) == 0:
+                action_infos.append(ActionInfo.empty())
+                continue
+            end = start + len(decision_steps)
+            outputs = {
+                key: self._slice_output(value, start, end)
+                for key, value in run_out.items()
+            }
+            action_infos.append(
+                ActionInfo(
+                    action=outputs.get("action"),
+                    env_action=outputs.get("env_action"),
+                    outputs=outputs,
+                    agent_ids=list(decision_steps.agent_id),
+                )
+            )
+            start = end
+        return action_infos
+
+    def _concatenate_decision_steps(
+        self, all_decision_steps: List[DecisionSteps]
+    ) -> DecisionSteps:
+        all_decision_steps = [steps for steps in all_decision_steps if len(steps) > 0]
+        action_mask = None
+        if any(steps.action_mask is not None for steps in all_decision_steps):
+            # Workers that didn't send a mask have all their actions available.
+            action_mask = [
+                np.concatenate(
+                    [
+                        steps.action_mask[i]
+                        if steps.action_mask is not None
+                        else np.zeros((len(steps), branch_size), dtype=np.bool_)
+                        for steps in all_decision_steps
+                    ]
+                )
+                for i, branch_size in enumerate(
+                    self.behavior_spec.action_spec.discrete_branches
+                )
+            ]
+        return DecisionSteps(
+            obs=[
+                np.concatenate(obs)
+                for obs in zip(*(steps.obs for steps in all_decision_steps))
+            ],
+            reward=np.concatenate([steps.reward for steps in all_decision_steps]),
+            agent_id=np.concatenate([steps.agent_id for steps in all_decision_steps]),
+            action_mask=action_mask,
+            group_id=np.concatenate([steps.group_id for steps in all_decision_steps]),
+            group_reward=np.concatenate(
+                [steps.group_reward for steps in all_decision_steps]
+            ),
+        )
+
+    @staticmethod
+    def _slice_output(value: Any, start: int, end: int) -> Any:
+        if isinstance(value, _ActionTupleBase):
+            return type(value)(
+                continuous=value.continuous[start:end],
+                discrete=value.discrete[start:end],
+            )
+        if isinstance(value, np.ndarray):
+            return value[start:end]
+        return value
+
     def get_current_step(self):
         """
         Gets current model step.
@@ -162,6 +255,7 @@ class TorchPolicy(Policy):
 
     def load_weights(self, values: List[np.ndarray]) -> None:
         self.actor.load_state_dict(values)
+        self.weights_version = None
 
     def init_load_weights(self) -> None:
         pass
@@ -169,5 +263,8 @@ class TorchPolicy(Policy):
     def get_weights(self) -> List[np.ndarray]:
         return copy.deepcopy(self.actor.state_dict())
 
+    def get_weights_view(self) -> Dict[str, torch.Tensor]:
+        return self.actor.state_dict()
+
     def get_modules(self):
         return {"Policy": self.actor, "global_step": self.global_step}
@@ -0,0 +1,115 @@
+import itertools
+import threading
+from typing import Dict, List, NamedTuple, Optional
+
+from mlagents.torch_utils import torch
+from mlagents.trainers.policy import Policy
+
+# Versions are unique across all the stores, so that a policy never mistakes the weights
+# of one store for the weights of another.
+_weight_versions = itertools.count(1)
+
+
+def next_weight_version() -> int:
+    """
+    Returns a new version number, for weights that don't come from a store.
+    """
+    return next(_weight_versions)
+
+
+class WeightSnapshot(NamedTuple):
+    """
+    A frozen version of the weights of a VersionedWeightStore.
+    """
+
+    version: int
+    weights: Dict[str, torch.Tensor]
+
+    def load_into(self, policy: Policy) -> bool:
+        """
+        Loads the weights into the policy, unless it already has this version.
+        :return: Whether the weights were loaded.
+        """
+        return policy.load_versioned_weights(self.version, self.weights)
+
+
+class VersionedWeightStore:
+    """
+    Shares the weights of a trained policy with the policies used for inference. The
+    trainer publishes a new version by copying the weights into the back buffer of the
+    store and swapping it with the front buffer, so publishing doesn't allocate once both
+    buffers exist. Readers load the front buffer only when its version differs from the
+    version they already have, so the weights are only copied when they changed.
+    """
+
+    def __init__(self):
+        self._buffers: List[Optional[Dict[str, torch.Tensor]]] = [None, None]
+        self._front = 0
+        self._version = 0
+        # Held while swapping the buffers and while reading the front buffer. The back
+        # buffer is only written by the publisher, so it isn't held while copying.
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        """
+        The version of the latest published weights, 0 if nothing was published.
+        """
+        return self._version
+
+    def publish(self, weights: Dict[str, torch.Tensor]) -> int:
+        """
+        Publishes a new version of the weights. The weights are copied, so the caller can
+        keep updating them.
+        :param weights: The state_dict of the network.
+        :return: The version of the weights.
+        """
+        back = 1 - self._front
+        buffer = self._buffers[back]
+        with torch.no_grad():
+            if buffer is None or not self._matches(buffer, weights):
+                buffer = {
+                    name: value.detach().clone() for name, value in weights.items()
+                }
+                self._buffers[back] = buffer
+            else:
+                for name, value in weights.items():
+                    buffer[name].copy_(value)
+        with self._lock:
+            self._front = back
+            self._version = next_weight_version()
+        return self._version
+
+    def load_into(self, policy: Policy) -> bool:
+        """
+        Loads the latest weights into the policy, unless it already has them.
+        :return: Whether the weights were loaded.
+        """
+        with self._lock:
+            if self._buffers[self._front] is None:
+                return False
+            return policy.load_versioned_weights(
+                self._version, self._buffers[self._front]
+            )
+
+    def snapshot(self) -> WeightSnapshot:
+        """
+        Returns a copy of the latest weights that isn't affected by the next versions.
+        """
+        with self._lock:
+            buffer = self._buffers[self._front]
+            if buffer is None:
+                return WeightSnapshot(self._version, {})
+            return WeightSnapshot(
+                self._version,
+                {name: value.clone() for name, value in buffer.items()},
+            )
+
+    @staticmethod
+    def _matches(
+        buffer: Dict[str, torch.Tensor], weights: Dict[str, torch.Tensor]
+    ) -> bool:
+        return buffer.keys() == weights.keys() and all(
+            buffer[name].shape == value.shape and buffer[name].dtype == value.dtype
+            for name, value in weights.items()
+        )
@@ -2,16 +2,21 @@
 # ## ML-Agent Learning (PPO)
 # Contains an implementation of PPO as described in: https://arxiv.org/abs/1707.06347
 
-from typing import cast, Type, Union, Dict, Any
+from typing import cast, Type, Union, Dict, Any, List, Optional
 
 import numpy as np
 
 from mlagents_envs.base_env import BehaviorSpec
 from mlagents_envs.logging_util import get_logger
-from mlagents.trainers.buffer import BufferKey, RewardSignalUtil
+from mlagents.trainers.buffer import (
+    AgentBuffer,
+    AgentBufferField,
+    BufferKey,
+    RewardSignalUtil,
+)
 from mlagents.trainers.trainer.on_policy_trainer import OnPolicyTrainer
 from mlagents.trainers.policy.policy import Policy
-from mlagents.trainers.trainer.trainer_utils import get_gae
+from mlagents.trainers.trainer.trainer_utils import get_gae_batch
 from mlagents.trainers.optimizer.torch_optimizer import TorchOptimizer
 from mlagents.trainers.policy.torch_policy import TorchPolicy
 from mlagents.trainers.ppo.optimizer_torch import TorchPPOOptimizer, PPOSettings
@@ -71,28 +76,102 @@ class PPOTrainer(OnPolicyTrainer):
         Processing involves calculating value and advantage targets for model updating step.
         :param trajectory: The Trajectory tuple containing the steps to be processed.
         """
-        super()._process_trajectory(trajectory)
-        agent_id = trajectory.agent_id  # All the agents should have the same ID
+        self._process_trajectories([trajectory])
 
-        agent_buffer_trajectory = trajectory.to_agentbuffer()
-        # Check if we used group rewards, warn if so.
-        self._warn_if_group_reward(agent_buffer_trajectory)
+    def _process_trajectories(self, trajectories: List[Trajectory]) -> None:
+        """
+        Processes the trajectories taken from a trajectory queue, putting them into the update
+        buffer. The value estimates and the advantages of all of the trajectories are computed
+        in one batch.
+        :param trajectories: The Trajectories taken from the queue.
+        """
+        agent_buffer_trajectories = [t.to_agentbuffer() for t in trajectories]
+        for agent_buffer_trajectory in agent_buffer_trajectories:
+            # Check if we used group rewards, warn if so.
+            self._warn_if_group_reward(agent_buffer_trajectory)
 
-        # Update the normalization
-        if self.is_training:
-            self.policy.actor.update_normalization(agent_buffer_trajectory)
-            self.optimizer.critic.update_normalization(agent_buffer_trajectory)
+            # Update the normalization
+            if self.is_training:
+                self.policy.actor.update_normalization(agent_buffer_trajectory)
+                self.optimizer.critic.update_normalization(agent_buffer_trajectory)
 
         # Get all value estimates
-        (
-            value_estimates,
-            value_next,
-            value_memories,
-        ) = self.optimizer.get_trajectory_value_estimates(
-            agent_buffer_trajectory,
-            trajectory.next_obs,
-            trajectory.done_reached and not trajectory.interrupted,
+        all_value_estimates = self.optimizer.get_batch_value_estimates(
+            agent_buffer_trajectories,
+            [t.next_obs for t in trajectories],
+            [t.done_reached and not t.interrupted for t in trajectories],
+            [t.agent_id for t in trajectories],
+        )
+        reward_signal_names = list(self.optimizer.reward_signals)
+        value_next = np.zeros(
+            (len(trajectories), len(reward_signal_names)), dtype=np.float32
         )
+        for i, (agent_buffer_trajectory, value_estimates) in enumerate(
+            zip(agent_buffer_trajectories, all_value_estimates)
+        ):
+            trajectory_value_next = self._evaluate_trajectory(
+                agent_buffer_trajectory, *value_estimates
+            )
+            value_next[i] = np.concatenate(
+                [np.ravel(trajectory_value_next[name]) for name in reward_signal_names]
+            )
+
+        # Compute GAE and returns for all trajectories and reward signals at once. Each
+        # row is one reward signal of one trajectory, padded to the longest trajectory.
+        lengths = np.array([b.num_experiences for b in agent_buffer_trajectories])
+        shape = (len(trajectories), len(reward_signal_names), lengths.max())
+        local_rewards = np.zeros(shape, dtype=np.float32)
+        local_value_estimates = np.zeros(shape, dtype=np.float32)
+        for i, agent_buffer_trajectory in enumerate(agent_buffer_trajectories):
+            for j, name in enumerate(reward_signal_names):
+                local_rewards[i, j, : lengths[i]] = agent_buffer_trajectory[
+                    RewardSignalUtil.rewards_key(name)
+                ].get_batch()
+                local_value_estimates[i, j, : lengths[i]] = agent_buffer_trajectory[
+                    RewardSignalUtil.value_estimates_key(name)
+                ].get_batch()
+        local_advantages = get_gae_batch(
+            rewards=local_rewards.reshape(-1, shape[-1]),
+            value_estimates=local_value_estimates.reshape(-1, shape[-1]),
+            lengths=np.repeat(lengths, len(reward_signal_names)),
+            value_next=value_next.ravel(),
+            gamma=np.tile(
+                [
+                    self.optimizer.reward_signals[name].gamma
+                    for name in reward_signal_names
+                ],
+                len(trajectories),
+            ),
+            lambd=self.hyperparameters.lambd,
+        ).reshape(shape)
+        local_returns = local_advantages + local_value_estimates
+
+        for i, (trajectory, agent_buffer_trajectory) in enumerate(
+            zip(trajectories, agent_buffer_trajectories)
+        ):
+            super()._process_trajectory(trajectory)
+            self._append_trajectory(
+                trajectory,
+                agent_buffer_trajectory,
+                local_advantages[i, :, : lengths[i]],
+                local_returns[i, :, : lengths[i]],
+            )
+
+    def _evaluate_trajectory(
+        self,
+        agent_buffer_trajectory: AgentBuffer,
+        value_estimates: Dict[str, np.ndarray],
+        value_next: Dict[str, float],
+        value_memories: Optional[AgentBufferField],
+    ) -> Dict[str, float]:
+        """
+        Adds the value estimates and the rewards of all reward signals to a trajectory.
+        :param agent_buffer_trajectory: The trajectory as an AgentBuffer.
+        :param value_estimates: The value estimates of the trajectory.
+        :param value_next: The value estimates of the next observation after the trajectory.
+        :param value_memories: The initial critic memories, if using memories.
+        :return: The value estimates of the next observation, for bootstrapping.
+        """
         if value_memories is not None:
             agent_buffer_trajectory[BufferKey.CRITIC_MEMORY].set(value_memories)
 
@@ -106,9 +185,6 @@ class PPOTrainer(OnPolicyTrainer):
             )
 
         # Evaluate all reward functions
-        self.collected_rewards["environment"][agent_id] += np.sum(
-            agent_buffer_trajectory[BufferKey.ENVIRONMENT_REWARDS]
-        )
         for name, reward_signal in self.optimizer.reward_signals.items():
             evaluate_result = (
                 reward_signal.evaluate(agent_buffer_trajectory) * reward_signal.strength
@@ -116,30 +192,37 @@ class PPOTrainer(OnPolicyTrainer):
             agent_buffer_trajectory[RewardSignalUtil.rewards_key(name)].extend(
                 evaluate_result
             )
-            # Report the reward signals
-            self.collected_rewards[name][agent_id] += np.sum(evaluate_result)
-
-        # Compute GAE and returns
-        tmp_advantages = []
-        tmp_returns = []
-        for name in self.optimizer.reward_signals:
-            bootstrap_value = value_next[name]
-
-            local_rewards = agent_buffer_trajectory[
-                RewardSignalUtil.rewards_key(name)
-            ].get_batch()
-            local_value_estimates = agent_buffer_trajectory[
-                RewardSignalUtil.value_estimates_key(name)
-            ].get_batch()
-
-            local_advantage = get_gae(
-                rewards=local_rewards,
-                value_estimates=local_value_estimates,
-                value_next=bootstrap_value,
-                gamma=self.optimizer.reward_signals[name].gamma,
-                lambd=self.hyperparameters.lambd,
+        return value_next
+
+    def _append_trajectory(
+        self,
+        trajectory: Trajectory,
+        agent_buffer_trajectory: AgentBuffer,
+        local_advantages: np.ndarray,
+        local_returns: np.ndarray,
+    ) -> None:
+        """
+        Adds the advantages and returns to a trajectory, puts it into the update buffer and
+        reports its rewards.
+        :param trajectory: The Trajectory tuple containing the steps to be processed.
+        :param agent_buffer_trajectory: The trajectory as an AgentBuffer.
+        :param local_advantages: The advantages of each reward signal, of shape
+            (num_reward_signals, trajectory_len).
+        :param local_returns: The returns of each reward signal, of shape
+            (num_reward_signals, trajectory_len).
+        """
+        agent_id = trajectory.agent_id  # All the agents should have the same ID
+        # The rewards are reported in order, since the drained trajectories may hold the
+        # end of an episode and the start of the next one.
+        self.collected_rewards["environment"][agent_id] += np.sum(
+            agent_buffer_trajectory[BufferKey.ENVIRONMENT_REWARDS]
+        )
+        for name, local_advantage, local_return in zip(
+            self.optimizer.reward_signals, local_advantages, local_returns
+        ):
+            self.collected_rewards[name][agent_id] += np.sum(
+                agent_buffer_trajectory[RewardSignalUtil.rewards_key(name)]
             )
-            local_return = local_advantage + local_value_estimates
             # This is later use as target for the different value estimates
             agent_buffer_trajectory[RewardSignalUtil.returns_key(name)].set(
                 local_return
@@ -147,14 +230,10 @@ class PPOTrainer(OnPolicyTrainer):
             agent_buffer_trajectory[RewardSignalUtil.advantage_key(name)].set(
                 local_advantage
             )
-            tmp_advantages.append(local_advantage)
-            tmp_returns.append(local_return)
 
         # Get global advantages
-        global_advantages = list(
-            np.mean(np.array(tmp_advantages, dtype=np.float32), axis=0)
-        )
-        global_returns = list(np.mean(np.array(tmp_returns, dtype=np.float32), axis=0))
+        global_advantages = list(np.mean(local_advantages, axis=0))
+        global_returns = list(np.mean(local_returns, axis=0))
         agent_buffer_trajectory[BufferKey.ADVANTAGES].set(global_advantages)
         agent_buffer_trajectory[BufferKey.DISCOUNTED_RETURNS].set(global_returns)
 
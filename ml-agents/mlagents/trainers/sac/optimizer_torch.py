@@ -248,6 +248,7 @@ class TorchSACOptimizer(TorchOptimizer):
         dones: torch.Tensor,
         rewards: Dict[str, torch.Tensor],
         loss_masks: torch.Tensor,
+        importance_weights: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         q1_losses = []
         q2_losses = []
@@ -261,12 +262,21 @@ class TorchSACOptimizer(TorchOptimizer):
                     * self.gammas[i]
                     * target_values[name]
                 )
-            _q1_loss = 0.5 * ModelUtils.masked_mean(
-                torch.nn.functional.mse_loss(q_backup, q1_stream), loss_masks
-            )
-            _q2_loss = 0.5 * ModelUtils.masked_mean(
-                torch.nn.functional.mse_loss(q_backup, q2_stream), loss_masks
-            )
+            if importance_weights is None:
+                _q1_loss = 0.5 * ModelUtils.masked_mean(
+                    torch.nn.functional.mse_loss(q_backup, q1_stream), loss_masks
+                )
+                _q2_loss = 0.5 * ModelUtils.masked_mean(
+                    torch.nn.functional.mse_loss(q_backup, q2_stream), loss_masks
+                )
+            else:
+                # Correct for the bias of prioritized replay.
+                _q1_loss = 0.5 * ModelUtils.masked_mean(
+                    importance_weights * (q_backup - q1_stream) ** 2, loss_masks
+                )
+                _q2_loss = 0.5 * ModelUtils.masked_mean(
+                    importance_weights * (q_backup - q2_stream) ** 2, loss_masks
+                )
 
             q1_losses.append(_q1_loss)
             q2_losses.append(_q2_loss)
@@ -274,6 +284,31 @@ class TorchSACOptimizer(TorchOptimizer):
         q2_loss = torch.mean(torch.stack(q2_losses))
         return q1_loss, q2_loss
 
+    def sac_td_errors(
+        self,
+        q1_out: Dict[str, torch.Tensor],
+        q2_out: Dict[str, torch.Tensor],
+        target_values: Dict[str, torch.Tensor],
+        dones: torch.Tensor,
+        rewards: Dict[str, torch.Tensor],
+        loss_masks: torch.Tensor,
+    ) -> torch.Tensor:
+        """
+        Returns the absolute TD error of each experience, averaged over the two Q
+        networks and the reward streams. The error of masked experiences is 0.
+        """
+        td_errors = []
+        with torch.no_grad():
+            for i, name in enumerate(q1_out.keys()):
+                q_backup = rewards[name] + (
+                    (1.0 - self.use_dones_in_backup[name] * dones)
+                    * self.gammas[i]
+                    * target_values[name]
+                )
+                for q_out in (q1_out, q2_out):
+                    td_errors.append(torch.abs(q_backup - q_out[name].squeeze()))
+            return torch.mean(torch.stack(td_errors), dim=0) * loss_masks
+
     def sac_value_loss(
         self,
         log_probs: ActionLogProbs,
@@ -488,6 +523,26 @@ class TorchSACOptimizer(TorchOptimizer):
             indexed by name. If none, don't update the reward signals.
         :return: Output from update process.
         """
+        update_stats, _ = self._update(batch, num_sequences)
+        return update_stats
+
+    @timed
+    def update_prioritized(
+        self, batch: AgentBuffer, num_sequences: int, importance_weights: np.ndarray
+    ) -> Tuple[Dict[str, float], np.ndarray]:
+        update_stats, td_errors = self._update(
+            batch,
+            num_sequences,
+            torch.as_tensor(importance_weights, dtype=torch.float32),
+        )
+        return update_stats, ModelUtils.to_numpy(td_errors)
+
+    def _update(
+        self,
+        batch: AgentBuffer,
+        num_sequences: int,
+        importance_weights: Optional[torch.Tensor] = None,
+    ) -> Tuple[Dict[str, float], torch.Tensor]:
         rewards = {}
         for name in self.reward_signals:
             rewards[name] = ModelUtils.list_to_tensor(
@@ -497,11 +552,11 @@ class TorchSACOptimizer(TorchOptimizer):
         n_obs = len(self.policy.behavior_spec.observation_specs)
         current_obs = ObsUtil.from_buffer(batch, n_obs)
         # Convert to tensors
-        current_obs = [ModelUtils.list_to_tensor(obs) for obs in current_obs]
+        current_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in current_obs]
 
         next_obs = ObsUtil.from_buffer_next(batch, n_obs)
         # Convert to tensors
-        next_obs = [ModelUtils.list_to_tensor(obs) for obs in next_obs]
+        next_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in next_obs]
 
         act_masks = ModelUtils.list_to_tensor(batch[BufferKey.ACTION_MASK])
         actions = AgentAction.from_buffer(batch)
@@ -597,6 +652,15 @@ class TorchSACOptimizer(TorchOptimizer):
         dones = ModelUtils.list_to_tensor(batch[BufferKey.DONE])
 
         q1_loss, q2_loss = self.sac_q_loss(
+            q1_stream,
+            q2_stream,
+            target_values,
+            dones,
+            rewards,
+            masks,
+            importance_weights,
+        )
+        td_errors = self.sac_td_errors(
             q1_stream, q2_stream, target_values, dones, rewards, masks
         )
         value_loss = self.sac_value_loss(
@@ -639,7 +703,7 @@ class TorchSACOptimizer(TorchOptimizer):
             "Policy/Learning Rate": decay_lr,
         }
 
-        return update_stats
+        return update_stats, td_errors
 
     def get_modules(self):
         modules = {
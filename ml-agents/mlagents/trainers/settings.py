@@ -114,6 +114,22 @@ class ConditioningType(Enum):
     NONE = "none"
 
 
+class QueueOverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    SPILL = "spill"
+
+
+class OpponentSamplingType(Enum):
+    UNIFORM = "uniform"
+    ELO = "elo"
+
+
+class ReplayBufferFormat(Enum):
+    HDF5 = "hdf5"
+    SEGMENTS = "segments"
+
+
 @attr.s(auto_attribs=True)
 class NetworkSettings:
     @attr.s
@@ -151,6 +167,7 @@ class BehavioralCloningSettings:
     # to decide these parameters, based on Trainer hyperparams
     num_epoch: Optional[int] = None
     batch_size: Optional[int] = None
+    demo_cache_dir: Optional[str] = None
 
 
 @attr.s(auto_attribs=True)
@@ -159,6 +176,7 @@ class HyperparamSettings:
     buffer_size: int = 10240
     learning_rate: float = 3.0e-4
     learning_rate_schedule: ScheduleType = ScheduleType.CONSTANT
+    columnar_buffer: bool = False
 
 
 @attr.s(auto_attribs=True)
@@ -166,6 +184,14 @@ class OnPolicyHyperparamSettings(HyperparamSettings):
     num_epoch: int = 3
 
 
+@attr.s(auto_attribs=True)
+class PrioritizedReplaySettings:
+    alpha: float = 0.6
+    beta: float = 0.4
+    beta_schedule: ScheduleType = ScheduleType.LINEAR
+    epsilon: float = 1e-6
+
+
 @attr.s(auto_attribs=True)
 class OffPolicyHyperparamSettings(HyperparamSettings):
     batch_size: int = 128
@@ -173,6 +199,9 @@ class OffPolicyHyperparamSettings(HyperparamSettings):
     buffer_init_steps: int = 0
     steps_per_update: float = 1
     save_replay_buffer: bool = False
+    replay_buffer_format: ReplayBufferFormat = ReplayBufferFormat.HDF5
+    memory_mapped_buffer_dir: Optional[str] = None
+    prioritized_replay: Optional[PrioritizedReplaySettings] = None
     reward_signal_steps_per_update: float = 4
 
 
@@ -236,6 +265,7 @@ class GAILSettings(RewardSignalSettings):
     use_actions: bool = False
     use_vail: bool = False
     demo_path: str = attr.ib(kw_only=True)
+    demo_cache_dir: Optional[str] = None
 
 
 @attr.s(auto_attribs=True)
@@ -609,6 +639,9 @@ class SelfPlaySettings:
     window: int = 10
     play_against_latest_model_ratio: float = 0.5
     initial_elo: float = 1200.0
+    opponent_sampling: OpponentSamplingType = OpponentSamplingType.UNIFORM
+    snapshot_half_precision: bool = False
+    snapshots_in_memory: Optional[int] = None
 
 
 @attr.s(auto_attribs=True)
@@ -633,10 +666,14 @@ class TrainerSettings(ExportableSettings):
     init_path: Optional[str] = None
     keep_checkpoints: int = 5
     even_checkpoints: bool = False
+    checkpoint_queue_size: int = attr.ib(default=2)
     max_steps: int = 500000
     time_horizon: int = 64
     summary_freq: int = 50000
     threaded: bool = False
+    trainer_process: bool = attr.ib(default=False)
+    trajectory_queue_size: int = attr.ib(default=20)
+    trajectory_queue_overflow: QueueOverflowPolicy = QueueOverflowPolicy.BLOCK
     self_play: Optional[SelfPlaySettings] = None
     behavioral_cloning: Optional[BehavioralCloningSettings] = None
 
@@ -656,6 +693,28 @@ class TrainerSettings(ExportableSettings):
                     "When using memory, sequence length must be less than or equal to batch size. "
                 )
 
+    @trainer_process.validator
+    def _check_trainer_process(self, attribute, value):
+        if value and self.self_play is not None:
+            raise TrainerConfigError(
+                "trainer_process can't be used with self_play, since the ghost trainers "
+                "of a team share their controller."
+            )
+
+    @checkpoint_queue_size.validator
+    def _check_checkpoint_queue_size(self, attribute, value):
+        if value < 0:
+            raise TrainerConfigError(
+                "checkpoint_queue_size must be set to a non-negative number."
+            )
+
+    @trajectory_queue_size.validator
+    def _check_trajectory_queue_size(self, attribute, value):
+        if value <= 0:
+            raise TrainerConfigError(
+                "trajectory_queue_size must be set to a positive number >= 1."
+            )
+
     @checkpoint_interval.validator
     def _set_checkpoint_interval(self, attribute, value):
         if self.even_checkpoints:
@@ -824,6 +883,16 @@ class EnvironmentSettings:
     restarts_rate_limit_period_s: int = parser.get_default(
         "restarts_rate_limit_period_s"
     )
+    shared_memory_obs: bool = parser.get_default("shared_memory_obs")
+    batched_inference: bool = parser.get_default("batched_inference")
+    batched_agent_processing: bool = parser.get_default("batched_agent_processing")
+    step_batch_min_envs: int = attr.ib(
+        default=parser.get_default("step_batch_min_envs")
+    )
+    step_batch_timeout_ms: int = parser.get_default("step_batch_timeout_ms")
+    pipelined_stepping: bool = parser.get_default("pipelined_stepping")
+    pipelined_max_lag: int = parser.get_default("pipelined_max_lag")
+    uint8_visual_obs: bool = parser.get_default("uint8_visual_obs")
 
     @num_envs.validator
     def validate_num_envs(self, attribute, value):
@@ -835,6 +904,13 @@ class EnvironmentSettings:
         if value <= 0:
             raise ValueError("num_areas must be set to a positive number >= 1.")
 
+    @step_batch_min_envs.validator
+    def validate_step_batch_min_envs(self, attribute, value):
+        if value <= 0:
+            raise ValueError(
+                "step_batch_min_envs must be set to a positive number >= 1."
+            )
+
 
 @attr.s(auto_attribs=True)
 class EngineSettings:
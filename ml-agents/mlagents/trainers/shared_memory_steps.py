@@ -0,0 +1,233 @@
+import os
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from mlagents_envs.base_env import (
+    BehaviorName,
+    BehaviorSpec,
+    DecisionSteps,
+    TerminalSteps,
+)
+from mlagents_envs.logging_util import get_logger
+from mlagents.trainers.env_manager import AllStepResult
+
+logger = get_logger(__name__)
+
+# Arrays are written at offsets aligned to this many bytes so that they can be read
+# back as properly aligned views.
+ARRAY_ALIGNMENT = 8
+# Number of agents per behavior the arena is initially sized for.
+INITIAL_AGENTS_PER_BEHAVIOR = 16
+# Growth factor of the arena when a step result doesn't fit anymore.
+ARENA_GROWTH_FACTOR = 1.5
+
+
+class ArrayDescriptor(NamedTuple):
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class StepsDescriptor(NamedTuple):
+    """
+    Describes where the arrays of a DecisionSteps or TerminalSteps are in the arena.
+    action_mask is only used by DecisionSteps, interrupted only by TerminalSteps.
+    """
+
+    obs: List[ArrayDescriptor]
+    reward: ArrayDescriptor
+    agent_id: ArrayDescriptor
+    group_id: ArrayDescriptor
+    group_reward: ArrayDescriptor
+    action_mask: Optional[List[ArrayDescriptor]] = None
+    interrupted: Optional[ArrayDescriptor] = None
+
+
+class SharedStepResult(NamedTuple):
+    """
+    The small message sent through the step queue in place of an AllStepResult when
+    the step result itself was written to shared memory.
+    """
+
+    shm_name: str
+    owner_pid: int
+    nbytes: int
+    steps: Dict[BehaviorName, Tuple[StepsDescriptor, StepsDescriptor]]
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+class SharedStepWriter:
+    """
+    Used by an environment worker to write its step results to a shared memory arena it
+    owns. The arena is initially sized from the BehaviorSpecs and is replaced by a larger
+    one whenever a step result doesn't fit.
+    The reader must be done with a step result before the next one is written; the
+    SubprocessEnvManager guarantees this since a worker only steps again after its
+    previous result has been read.
+    """
+
+    def __init__(self, behavior_specs: Optional[Dict[BehaviorName, BehaviorSpec]]):
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._initial_size = sum(
+            INITIAL_AGENTS_PER_BEHAVIOR * self.bytes_per_agent(spec)
+            for spec in (behavior_specs or {}).values()
+        )
+
+    @staticmethod
+    def bytes_per_agent(behavior_spec: BehaviorSpec) -> int:
+        """
+        Returns the approximate number of bytes needed to store one agent of the
+        behavior in a DecisionSteps and in a TerminalSteps.
+        """
+        obs_bytes = sum(
+            int(np.prod(obs_spec.shape)) * np.dtype(np.float32).itemsize
+            for obs_spec in behavior_spec.observation_specs
+        )
+        mask_bytes = sum(behavior_spec.action_spec.discrete_branches)
+        # reward, agent_id, group_id, group_reward and interrupted
+        scalar_bytes = 4 * 4 + 1
+        return 2 * (obs_bytes + scalar_bytes) + mask_bytes
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._shm.name if self._shm is not None else None
+
+    def write(self, all_step_result: AllStepResult) -> SharedStepResult:
+        """
+        Copies all the arrays of the step result into the arena.
+        :param all_step_result: The step result of every behavior of the environment.
+        :return: The SharedStepResult to send to the reader.
+        """
+        arrays: List[np.ndarray] = []
+        offset = 0
+
+        def _add(array: np.ndarray) -> ArrayDescriptor:
+            nonlocal offset
+            array = np.ascontiguousarray(array)
+            descriptor = ArrayDescriptor(offset, array.shape, array.dtype.str)
+            arrays.append(array)
+            offset = _aligned(offset + array.nbytes)
+            return descriptor
+
+        steps: Dict[BehaviorName, Tuple[StepsDescriptor, StepsDescriptor]] = {}
+        for behavior_name, (decision_steps, terminal_steps) in all_step_result.items():
+            action_mask = None
+            if decision_steps.action_mask is not None:
+                action_mask = [_add(mask) for mask in decision_steps.action_mask]
+            steps[behavior_name] = (
+                StepsDescriptor(
+                    obs=[_add(obs) for obs in decision_steps.obs],
+                    reward=_add(decision_steps.reward),
+                    agent_id=_add(decision_steps.agent_id),
+                    group_id=_add(decision_steps.group_id),
+                    group_reward=_add(decision_steps.group_reward),
+                    action_mask=action_mask,
+                ),
+                StepsDescriptor(
+                    obs=[_add(obs) for obs in terminal_steps.obs],
+                    reward=_add(terminal_steps.reward),
+                    agent_id=_add(terminal_steps.agent_id),
+                    group_id=_add(terminal_steps.group_id),
+                    group_reward=_add(terminal_steps.group_reward),
+                    interrupted=_add(terminal_steps.interrupted),
+                ),
+            )
+
+        self._reserve(offset)
+        buf = np.frombuffer(self._shm.buf, dtype=np.uint8)  # type: ignore
+        position = 0
+        for array in arrays:
+            buf[position : position + array.nbytes] = array.reshape(-1).view(np.uint8)
+            position = _aligned(position + array.nbytes)
+        del buf
+        return SharedStepResult(self._shm.name, os.getpid(), offset, steps)  # type: ignore
+
+    def _reserve(self, nbytes: int) -> None:
+        if self._shm is not None and self._shm.size >= nbytes:
+            return
+        size = max(nbytes, self._initial_size, ARRAY_ALIGNMENT)
+        if self._shm is not None:
+            size = max(size, int(self._shm.size * ARENA_GROWTH_FACTOR))
+            logger.debug(f"Growing shared memory step arena to {size} bytes.")
+        self.close()
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+
+    def close(self) -> None:
+        """
+        Releases the arena. Readers that are still attached keep their mapping until they
+        detach.
+        """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+class SharedStepReader:
+    """
+    Used by the SubprocessEnvManager to rebuild the step results a SharedStepWriter
+    wrote. Each step result is copied out of the arena with a single copy, and its
+    DecisionSteps and TerminalSteps hold views into that copy. The copy is needed since
+    the AgentProcessor keeps observations around after the worker has stepped again.
+    """
+
+    def __init__(self):
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+    def read(self, shared_step_result: SharedStepResult) -> AllStepResult:
+        self._attach(shared_step_result)
+        data = np.frombuffer(
+            self._shm.buf, dtype=np.uint8, count=shared_step_result.nbytes  # type: ignore
+        ).copy()
+
+        def _get(descriptor: ArrayDescriptor) -> np.ndarray:
+            dtype = np.dtype(descriptor.dtype)
+            count = int(np.prod(descriptor.shape))
+            return np.frombuffer(
+                data, dtype=dtype, count=count, offset=descriptor.offset
+            ).reshape(descriptor.shape)
+
+        all_step_result: AllStepResult = {}
+        for behavior_name, (decision, terminal) in shared_step_result.steps.items():
+            action_mask = None
+            if decision.action_mask is not None:
+                action_mask = [_get(mask) for mask in decision.action_mask]
+            all_step_result[behavior_name] = (
+                DecisionSteps(
+                    [_get(obs) for obs in decision.obs],
+                    _get(decision.reward),
+                    _get(decision.agent_id),
+                    action_mask,
+                    _get(decision.group_id),
+                    _get(decision.group_reward),
+                ),
+                TerminalSteps(
+                    [_get(obs) for obs in terminal.obs],
+                    _get(terminal.reward),
+                    _get(terminal.interrupted),  # type: ignore
+                    _get(terminal.agent_id),
+                    _get(terminal.group_id),
+                    _get(terminal.group_reward),
+                ),
+            )
+        return all_step_result
+
+    def _attach(self, shared_step_result: SharedStepResult) -> None:
+        if self._shm is not None and self._shm.name == shared_step_result.shm_name:
+            return
+        self.close()
+        self._shm = shared_memory.SharedMemory(name=shared_step_result.shm_name)
+        if os.name == "posix" and shared_step_result.owner_pid != os.getpid():
+            # The writer owns the arena and unlinks it. Don't let the resource tracker
+            # of this process unlink it as well when it exits.
+            resource_tracker.unregister(self._shm._name, "shared_memory")  # type: ignore
+
+    def close(self) -> None:
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
@@ -1,7 +1,9 @@
 import datetime
-from typing import Dict, NamedTuple, List, Any, Optional, Callable, Set
+from typing import Dict, NamedTuple, List, Any, Optional, Callable, Set, Union
 import cloudpickle
 import enum
+import queue
+import threading
 import time
 
 from mlagents_envs.environment import UnityEnvironment
@@ -18,6 +20,11 @@ from mlagents_envs.base_env import BaseEnv, BehaviorName, BehaviorSpec
 from mlagents_envs import logging_util
 from mlagents.trainers.env_manager import EnvManager, EnvironmentStep, AllStepResult
 from mlagents.trainers.settings import TrainerSettings
+from mlagents.trainers.shared_memory_steps import (
+    SharedStepReader,
+    SharedStepResult,
+    SharedStepWriter,
+)
 from mlagents_envs.timers import (
     TimerNode,
     timed,
@@ -46,6 +53,9 @@ from mlagents_envs.side_channel.side_channel import SideChannel
 
 logger = logging_util.get_logger(__name__)
 WORKER_SHUTDOWN_TIMEOUT_S = 10
+# How long to block on the step queue at a time. Waits longer than this are split up so
+# that the main process stays responsive.
+STEP_QUEUE_POLL_TIMEOUT_S = 1.0
 
 
 class EnvironmentCommand(enum.Enum):
@@ -71,7 +81,8 @@ class EnvironmentResponse(NamedTuple):
 
 
 class StepResponse(NamedTuple):
-    all_step_result: AllStepResult
+    # A SharedStepResult if the worker writes its observations to shared memory.
+    all_step_result: Union[AllStepResult, SharedStepResult]
     timer_root: Optional[TimerNode]
     environment_stats: EnvironmentStats
 
@@ -85,6 +96,7 @@ class UnityEnvWorker:
         self.previous_all_action_info: Dict[str, ActionInfo] = {}
         self.waiting = False
         self.closed = False
+        self.step_reader = SharedStepReader()
 
     def send(self, cmd: EnvironmentCommand, payload: Any = None) -> None:
         try:
@@ -142,6 +154,7 @@ def worker(
     if worker_id == 0:
         training_analytics_channel = TrainingAnalyticsSideChannel()
     env: UnityEnvironment = None
+    step_writer: Optional[SharedStepWriter] = None
     # Set log level. On some platforms, the logger isn't common with the
     # main process, so we need to set it again.
     logging_util.set_log_level(log_level)
@@ -170,6 +183,8 @@ def worker(
             training_analytics_channel = None
         if training_analytics_channel:
             training_analytics_channel.environment_initialized(run_options)
+        if run_options.env_settings.shared_memory_obs:
+            step_writer = SharedStepWriter(env.behavior_specs)
 
         while True:
             req: EnvironmentRequest = parent_conn.recv()
@@ -187,7 +202,11 @@ def worker(
                 # TODO get gauges from the workers and merge them in the main process too.
                 env_stats = stats_channel.get_and_reset_stats()
                 step_response = StepResponse(
-                    all_step_result, get_timer_root(), env_stats
+                    step_writer.write(all_step_result)
+                    if step_writer is not None
+                    else all_step_result,
+                    get_timer_root(),
+                    env_stats,
                 )
                 step_queue.put(
                     EnvironmentResponse(
@@ -237,6 +256,8 @@ def worker(
         logger.debug(f"UnityEnvironment worker {worker_id} closing.")
         if env is not None:
             env.close()
+        if step_writer is not None:
+            step_writer.close()
         logger.debug(f"UnityEnvironment worker {worker_id} done.")
         parent_conn.close()
         step_queue.put(EnvironmentResponse(EnvironmentCommand.CLOSED, worker_id, None))
@@ -262,6 +283,13 @@ class SubprocessEnvManager(EnvManager):
             [] for _ in range(n_env)
         ]
         self.restart_counts: List[int] = [0] * n_env
+        # Used in pipelined mode to hand steps over to the thread that processes them.
+        # A None marks the end of processing.
+        self._step_infos_queue: "queue.Queue[Optional[List[EnvironmentStep]]]" = (
+            queue.Queue(maxsize=max(run_options.env_settings.pipelined_max_lag, 1))
+        )
+        self._processing_thread: Optional[threading.Thread] = None
+        self._processing_exception: Optional[BaseException] = None
         for worker_idx in range(n_env):
             self.env_workers.append(
                 self.create_worker(
@@ -297,6 +325,11 @@ class SubprocessEnvManager(EnvManager):
         return UnityEnvWorker(child_process, worker_id, parent_conn)
 
     def _queue_steps(self) -> None:
+        if not self._can_prefetch_actions():
+            self._wait_for_processing()
+        if self.run_options.env_settings.batched_inference:
+            self._queue_steps_batched()
+            return
         for env_worker in self.env_workers:
             if not env_worker.waiting:
                 env_action_info = self._take_step(env_worker.previous_step)
@@ -304,6 +337,16 @@ class SubprocessEnvManager(EnvManager):
                 env_worker.send(EnvironmentCommand.STEP, env_action_info)
                 env_worker.waiting = True
 
+    def _queue_steps_batched(self) -> None:
+        ready_workers = [ew for ew in self.env_workers if not ew.waiting]
+        if not ready_workers:
+            return
+        all_action_info = self._take_steps([ew.previous_step for ew in ready_workers])
+        for env_worker, env_action_info in zip(ready_workers, all_action_info):
+            env_worker.previous_all_action_info = env_action_info
+            env_worker.send(EnvironmentCommand.STEP, env_action_info)
+            env_worker.waiting = True
+
     def _restart_failed_workers(self, first_failure: EnvironmentResponse) -> None:
         if first_failure.cmd != EnvironmentCommand.ENV_EXITED:
             return
@@ -320,6 +363,7 @@ class SubprocessEnvManager(EnvManager):
             logger.warning(f"Restarting worker[{worker_id}] after '{ex}'")
             self.recent_restart_timestamps[worker_id].append(datetime.datetime.now())
             self.restart_counts[worker_id] += 1
+            self.env_workers[worker_id].step_reader.close()
             self.env_workers[worker_id] = self.create_worker(
                 worker_id, self.step_queue, self.env_factory, self.run_options
             )
@@ -337,14 +381,17 @@ class SubprocessEnvManager(EnvManager):
         deadline = datetime.datetime.now() + datetime.timedelta(minutes=1)
         while workers_still_pending and deadline > datetime.datetime.now():
             try:
+                step: EnvironmentResponse = self.step_queue.get(
+                    timeout=STEP_QUEUE_POLL_TIMEOUT_S
+                )
                 while True:
-                    step: EnvironmentResponse = self.step_queue.get_nowait()
                     if step.cmd == EnvironmentCommand.ENV_EXITED:
                         workers_still_pending.add(step.worker_id)
                         all_failures[step.worker_id] = step.payload
                     else:
                         workers_still_pending.remove(step.worker_id)
                         self.env_workers[step.worker_id].waiting = False
+                    step = self.step_queue.get_nowait()
             except EmptyQueueException:
                 pass
         if deadline < datetime.datetime.now():
@@ -409,12 +456,21 @@ class SubprocessEnvManager(EnvManager):
 
         worker_steps: List[EnvironmentResponse] = []
         step_workers: Set[int] = set()
-        # Poll the step queue for completed steps from environment workers until we retrieve
-        # 1 or more, which we will then return as StepInfos
-        while len(worker_steps) < 1:
+        env_settings = self.run_options.env_settings
+        min_steps = min(env_settings.step_batch_min_envs, len(self.env_workers))
+        deadline = time.time() + env_settings.step_batch_timeout_ms / 1000.0
+        # Wait on the step queue for completed steps from environment workers until we retrieve
+        # 1 or more, and either step_batch_min_envs of them or the batching timeout is reached.
+        # We will then return them as StepInfos.
+        while len(worker_steps) < 1 or (
+            len(worker_steps) < min_steps and time.time() < deadline
+        ):
+            timeout = STEP_QUEUE_POLL_TIMEOUT_S
+            if worker_steps:
+                timeout = min(timeout, max(deadline - time.time(), 0.0))
             try:
+                step: EnvironmentResponse = self.step_queue.get(timeout=timeout)
                 while True:
-                    step: EnvironmentResponse = self.step_queue.get_nowait()
                     if step.cmd == EnvironmentCommand.ENV_EXITED:
                         # If even one env exits try to restart all envs that failed.
                         self._restart_failed_workers(step)
@@ -426,16 +482,75 @@ class SubprocessEnvManager(EnvManager):
                         self.env_workers[step.worker_id].waiting = False
                         worker_steps.append(step)
                         step_workers.add(step.worker_id)
+                    step = self.step_queue.get_nowait()
             except EmptyQueueException:
                 pass
         step_infos = self._postprocess_steps(worker_steps)
+        if self._can_prefetch_actions():
+            # Send the workers their next actions right away, so that they simulate
+            # while their steps are being processed.
+            self._queue_steps()
         return step_infos
 
+    def _can_prefetch_actions(self) -> bool:
+        # Recurrent policies read and update the memories of the agents when they compute
+        # actions, so the previous steps must have been processed before.
+        return self.run_options.env_settings.pipelined_stepping and not any(
+            policy.use_recurrent for policy in self.policies.values()
+        )
+
+    def process_steps(self, new_step_infos: List[EnvironmentStep]) -> int:
+        if not self.run_options.env_settings.pipelined_stepping:
+            return super().process_steps(new_step_infos)
+        self._raise_processing_exception()
+        if self._processing_thread is None:
+            self._processing_thread = threading.Thread(
+                target=self._process_step_infos_loop, daemon=True
+            )
+            self._processing_thread.start()
+        # This blocks when the processing thread is pipelined_max_lag steps behind.
+        self._step_infos_queue.put(new_step_infos)
+        return len(new_step_infos)
+
+    def _process_step_infos_loop(self) -> None:
+        while True:
+            step_infos = self._step_infos_queue.get()
+            try:
+                if step_infos is None:
+                    return
+                # Once processing failed, drop the remaining steps until the error is raised.
+                if self._processing_exception is None:
+                    self._process_step_infos(step_infos)
+            except Exception as ex:
+                self._processing_exception = ex
+            finally:
+                self._step_infos_queue.task_done()
+
+    def _wait_for_processing(self) -> None:
+        """
+        Blocks until all the steps handed to the processing thread have been processed.
+        """
+        if self._processing_thread is not None:
+            self._step_infos_queue.join()
+        self._raise_processing_exception()
+
+    def _raise_processing_exception(self) -> None:
+        if self._processing_exception is not None:
+            ex = self._processing_exception
+            self._processing_exception = None
+            raise ex
+
+    def reset(self, config: Dict = None) -> int:
+        self._wait_for_processing()
+        return super().reset(config)
+
     def _reset_env(self, config: Optional[Dict] = None) -> List[EnvironmentStep]:
         while any(ew.waiting for ew in self.env_workers):
-            if not self.step_queue.empty():
-                step = self.step_queue.get_nowait()
+            try:
+                step = self.step_queue.get(timeout=STEP_QUEUE_POLL_TIMEOUT_S)
                 self.env_workers[step.worker_id].waiting = False
+            except EmptyQueueException:
+                pass
         # Send config to environment
         self.set_env_parameters(config)
         # First enqueue reset commands for all workers so that they reset in parallel
@@ -480,13 +595,19 @@ class SubprocessEnvManager(EnvManager):
 
     def close(self) -> None:
         logger.debug("SubprocessEnvManager closing.")
+        if self._processing_thread is not None:
+            self._step_infos_queue.put(None)
+            self._processing_thread.join()
+            self._processing_thread = None
         for env_worker in self.env_workers:
             env_worker.request_close()
         # Pull messages out of the queue until every worker has CLOSED or we time out.
         deadline = time.time() + WORKER_SHUTDOWN_TIMEOUT_S
         while self.workers_alive > 0 and time.time() < deadline:
             try:
-                step: EnvironmentResponse = self.step_queue.get_nowait()
+                step: EnvironmentResponse = self.step_queue.get(
+                    timeout=max(deadline - time.time(), 0.0)
+                )
                 env_worker = self.env_workers[step.worker_id]
                 if step.cmd == EnvironmentCommand.CLOSED and not env_worker.closed:
                     env_worker.closed = True
@@ -504,6 +625,8 @@ class SubprocessEnvManager(EnvManager):
                     logger.error(
                         "A SubprocessEnvManager worker did not shut down correctly so it was forcefully terminated."
                     )
+        for env_worker in self.env_workers:
+            env_worker.step_reader.close()
         self.step_queue.join_thread()
 
     def _postprocess_steps(
@@ -514,8 +637,11 @@ class SubprocessEnvManager(EnvManager):
         for step in env_steps:
             payload: StepResponse = step.payload
             env_worker = self.env_workers[step.worker_id]
+            all_step_result = payload.all_step_result
+            if isinstance(all_step_result, SharedStepResult):
+                all_step_result = env_worker.step_reader.read(all_step_result)
             new_step = EnvironmentStep(
-                payload.all_step_result,
+                all_step_result,
                 step.worker_id,
                 env_worker.previous_all_action_info,
                 payload.environment_stats,
@@ -544,3 +670,33 @@ class SubprocessEnvManager(EnvManager):
                     step_tuple[0], last_step.worker_id
                 )
         return all_action_info
+
+    @timed
+    def _take_steps(
+        self, last_steps: List[EnvironmentStep]
+    ) -> List[Dict[BehaviorName, ActionInfo]]:
+        """
+        Computes the actions of several workers, with one call to the policy of each
+        behavior for all of the workers.
+        """
+        all_action_info: List[Dict[BehaviorName, ActionInfo]] = [{} for _ in last_steps]
+        for brain_name, policy in self.policies.items():
+            step_indices = [
+                i
+                for i, last_step in enumerate(last_steps)
+                if brain_name in last_step.current_all_step_result
+            ]
+            if not step_indices:
+                continue
+            action_infos = policy.get_actions(
+                [
+                    (
+                        last_steps[i].current_all_step_result[brain_name][0],
+                        last_steps[i].worker_id,
+                    )
+                    for i in step_indices
+                ]
+            )
+            for i, action_info in zip(step_indices, action_infos):
+                all_action_info[i][brain_name] = action_info
+        return all_action_info
@@ -1,3 +1,5 @@
+import os
+import threading
 from unittest import mock
 import pytest
 from typing import List
@@ -9,6 +11,7 @@ from mlagents.trainers.agent_processor import (
     AgentManagerQueue,
 )
 from mlagents.trainers.action_info import ActionInfo
+from mlagents.trainers.settings import QueueOverflowPolicy
 from mlagents.trainers.torch_entities.action_log_probs import LogProbsTuple
 from mlagents.trainers.trajectory import Trajectory
 from mlagents.trainers.stats import StatsReporter, StatsSummary
@@ -189,6 +192,126 @@ def test_group_statuses():
         assert len(step.group_status) == 1
 
 
+def _run_grouped_episode(processor: AgentProcessor) -> None:
+    observation_specs = create_observation_specs_with_shapes([(8,), (4, 4, 3)])
+    action_spec = ActionSpec.create_continuous(2)
+    action_info = ActionInfo.empty()
+    for step in range(5):
+        decision_steps, terminal_steps = mb.create_mock_steps(
+            num_agents=4,
+            observation_specs=observation_specs,
+            action_spec=action_spec,
+            grouped=True,
+        )
+        # Agent 3 isn't part of the group.
+        decision_steps.group_id[3] = 0
+        for obs in decision_steps.obs:
+            obs *= np.arange(4).reshape((4,) + (1,) * (obs.ndim - 1)) + step
+        decision_steps.reward[:] = np.arange(4) * step
+        processor.add_experiences(decision_steps, terminal_steps, 0, action_info)
+        action_info = _create_action_info(4, decision_steps.agent_id)
+        action_info.outputs["action"].continuous[:, 0] = np.arange(4) + step
+        action_info.outputs["log_probs"].continuous[:, 0] = -np.arange(4) - step
+
+    # Agents 1 and 3 are done while the other agents keep going.
+    next_decision_steps, _ = mb.create_mock_steps(
+        num_agents=2,
+        observation_specs=observation_specs,
+        action_spec=action_spec,
+        grouped=True,
+        agent_ids=[0, 2],
+    )
+    _, next_terminal_steps = mb.create_mock_steps(
+        num_agents=2,
+        observation_specs=observation_specs,
+        action_spec=action_spec,
+        done=True,
+        grouped=True,
+        agent_ids=[3, 1],
+    )
+    next_terminal_steps.interrupted[0] = True
+    processor.add_experiences(next_decision_steps, next_terminal_steps, 0, action_info)
+    action_info = _create_action_info(2, next_decision_steps.agent_id)
+    processor.add_experiences(next_decision_steps, next_terminal_steps, 0, action_info)
+
+
+def test_agentprocessor_batched():
+    trajectories = []
+    for batched in [False, True]:
+        policy = create_mock_policy()
+        policy.use_recurrent = True
+        policy.retrieve_previous_memories.side_effect = lambda agent_ids: np.array(
+            [[float(agent_id.split("-")[-1])] for agent_id in agent_ids],
+            dtype=np.float32,
+        )
+        policy.retrieve_previous_action.side_effect = lambda agent_ids: np.zeros(
+            (len(agent_ids), 0), dtype=np.int32
+        )
+        tqueue = mock.Mock()
+        processor = AgentProcessor(
+            policy,
+            "test_brain_name",
+            max_trajectory_length=3,
+            stats_reporter=StatsReporter("testcat"),
+            batched=batched,
+        )
+        processor.publish_trajectory_queue(tqueue)
+        _run_grouped_episode(processor)
+        trajectories.append([call[0][0] for call in tqueue.put.call_args_list])
+
+    # The batched processing must create the same trajectories, in the same order.
+    assert len(trajectories[0]) == len(trajectories[1]) == 8
+    for trajectory, batched_trajectory in zip(*trajectories):
+        assert trajectory.agent_id == batched_trajectory.agent_id
+        assert trajectory.done_reached == batched_trajectory.done_reached
+        assert trajectory.interrupted == batched_trajectory.interrupted
+        buffer = trajectory.to_agentbuffer()
+        batched_buffer = batched_trajectory.to_agentbuffer()
+        assert buffer.keys() == batched_buffer.keys()
+        for key in buffer.keys():
+            for value, batched_value in zip(buffer[key], batched_buffer[key]):
+                np.testing.assert_array_equal(value, batched_value)
+
+
+@pytest.mark.parametrize("batched", [True, False], ids=["batched", "per_agent"])
+def test_agentprocessor_previous_action(batched):
+    policy = create_mock_policy()
+    policy.use_recurrent = False
+    policy.retrieve_previous_action.side_effect = lambda agent_ids: np.zeros(
+        (len(agent_ids), 1), dtype=np.int32
+    )
+    processor = AgentProcessor(
+        policy,
+        "test_brain_name",
+        stats_reporter=StatsReporter("testcat"),
+        batched=batched,
+    )
+    decision_steps, terminal_steps = mb.create_mock_steps(
+        num_agents=3,
+        observation_specs=create_observation_specs_with_shapes([(8,)]),
+        action_spec=ActionSpec.create_discrete((3,)),
+        agent_ids=[4, 5, 6],
+    )
+    processor.add_experiences(decision_steps, terminal_steps, 0, ActionInfo.empty())
+    discrete_actions = np.array([[0], [1], [2], [1]], dtype=np.int32)
+    action_info = ActionInfo(
+        action=ActionTuple(discrete=discrete_actions),
+        env_action=ActionTuple(discrete=discrete_actions),
+        outputs={"action": ActionTuple(discrete=discrete_actions)},
+        # Agent 7 just reset, so its action isn't saved.
+        agent_ids=[4, 7, 5, 6],
+    )
+    processor.add_experiences(decision_steps, terminal_steps, 0, action_info)
+    # Both modes save the own row of actions of each agent.
+    agent_ids = []
+    saved_actions = []
+    for call in policy.save_previous_action.call_args_list:
+        agent_ids += call[0][0]
+        saved_actions.append(call[0][1].discrete)
+    assert agent_ids == ["agent_0-4", "agent_0-5", "agent_0-6"]
+    np.testing.assert_array_equal(np.concatenate(saved_actions), [[0], [2], [1]])
+
+
 def test_agent_deletion():
     policy = create_mock_policy()
     tqueue = mock.Mock()
@@ -238,16 +361,20 @@ def test_agent_deletion():
             processor.add_experiences(
                 mock_decision_step, mock_terminal_step, _ep, fake_action_info
             )
-            add_calls.append(
-                mock.call([get_global_agent_id(_ep, 0)], fake_action_outputs["action"])
-            )
+            add_calls.append([get_global_agent_id(_ep, 0)])
         processor.add_experiences(
             mock_done_decision_step, mock_done_terminal_step, _ep, fake_action_info
         )
         # Make sure we don't add experiences from the prior agents after the done
         remove_calls.append(mock.call([get_global_agent_id(_ep, 0)]))
 
-    policy.save_previous_action.assert_has_calls(add_calls)
+    # Each agent saves its own row of the actions.
+    saved_calls = [call[0] for call in policy.save_previous_action.call_args_list]
+    assert [agent_ids for agent_ids, _ in saved_calls] == add_calls
+    for _, action_tuple in saved_calls:
+        np.testing.assert_array_equal(
+            action_tuple.discrete, fake_action_outputs["action"].discrete[[0]]
+        )
     policy.remove_previous_action.assert_has_calls(remove_calls)
     # Check that there are no experiences left
     assert len(processor._experience_buffers.keys()) == 0
@@ -346,6 +473,69 @@ def test_agent_manager_queue():
     assert queue.empty()
 
 
+def test_agent_manager_queue_many():
+    queue = AgentManagerQueue(behavior_id="testbehavior")
+    queue.put_many([0, 1, 2])
+    queue.put(3)
+    assert queue.qsize() == 4
+    assert queue.get_many(max_items=3) == [0, 1, 2]
+    assert queue.get_many() == [3]
+    assert queue.get_many() == []
+    with pytest.raises(AgentManagerQueue.Empty):
+        queue.get_nowait()
+
+
+def test_agent_manager_queue_block():
+    queue = AgentManagerQueue(
+        behavior_id="testbehavior", maxlen=2, overflow_policy=QueueOverflowPolicy.BLOCK
+    )
+    producer = threading.Thread(target=queue.put_many, args=([0, 1, 2, 3],))
+    producer.start()
+    items: List[int] = []
+    while len(items) < 4:
+        assert queue.qsize() <= 2
+        items += queue.get_many()
+    producer.join()
+    assert items == [0, 1, 2, 3]
+
+
+def test_agent_manager_queue_drop_oldest():
+    queue = AgentManagerQueue(
+        behavior_id="testbehavior",
+        maxlen=2,
+        overflow_policy=QueueOverflowPolicy.DROP_OLDEST,
+    )
+    queue.put_many([0, 1, 2])
+    queue.put(3)
+    assert queue.get_many() == [2, 3]
+
+
+def test_agent_manager_queue_spill():
+    queue = AgentManagerQueue(
+        behavior_id="testbehavior", maxlen=2, overflow_policy=QueueOverflowPolicy.SPILL
+    )
+    queue.put_many([np.full(3, i) for i in range(5)])
+    assert queue.qsize() == 5
+    assert len(os.listdir(queue._spill_dir.name)) == 3
+    np.testing.assert_array_equal(queue.get_nowait(), np.full(3, 0))
+    # Items put while some are spilled are spilled too, to keep them in order.
+    queue.put(np.full(3, 5))
+    items = queue.get_many()
+    np.testing.assert_array_equal(items, [np.full(3, i) for i in range(1, 6)])
+    assert not os.listdir(queue._spill_dir.name)
+
+
+@mock.patch("mlagents.trainers.agent_processor.set_gauge")
+def test_agent_manager_queue_gauges(mock_set_gauge):
+    queue = AgentManagerQueue(behavior_id="testbehavior", name="trajectory_queue")
+    queue.put_many([0, 1])
+    mock_set_gauge.assert_called_with("testbehavior.trajectory_queue.depth", 2)
+    queue.get_many()
+    gauges = {call[0][0]: call[0][1] for call in mock_set_gauge.call_args_list}
+    assert gauges["testbehavior.trajectory_queue.depth"] == 0
+    assert gauges["testbehavior.trajectory_queue.latency_ms"] >= 0
+
+
 def test_agent_manager_stats():
     policy = mock.Mock()
     stats_reporter = StatsReporter("FakeCategory")
@@ -1,8 +1,16 @@
+import io
+import os
+
 import numpy as np
+import pytest
 from mlagents.trainers.buffer import (
     AgentBuffer,
     AgentBufferField,
+    BufferException,
     BufferKey,
+    ColumnarAgentBuffer,
+    ColumnarAgentBufferField,
+    MemoryMappedAgentBuffer,
     ObservationKeyPrefix,
     RewardSignalKeyPrefix,
 )
@@ -280,3 +288,215 @@ def test_buffer_save_load():
     assert len(original) == len(loaded)
     for k in original.keys():
         assert np.allclose(original[k], loaded[k])
+
+
+@pytest.mark.parametrize("buffer_class", [AgentBuffer, ColumnarAgentBuffer])
+def test_buffer_uint8_obs(buffer_class):
+    buffer = buffer_class()
+    obs_key = (ObservationKeyPrefix.OBSERVATION, 0)
+    obs = np.random.randint(0, 256, (5, 3, 4, 4), dtype=np.uint8)
+    buffer[obs_key].extend(obs)
+    buffer[BufferKey.DONE].extend(np.zeros(5, dtype=np.float32))
+
+    # Padding an incomplete sequence keeps the observations uint8.
+    padded = np.asarray(buffer[obs_key].get_batch(training_length=3))
+    assert padded.dtype == np.uint8
+    np.testing.assert_array_equal(padded[:5], obs)
+    assert not padded[5:].any()
+
+    write_buffer = io.BytesIO()
+    buffer.save_to_file(write_buffer)
+    loaded = buffer_class()
+    loaded.load_from_file(write_buffer)
+    loaded_obs = np.asarray(loaded[obs_key])
+    assert loaded_obs.dtype == np.uint8
+    np.testing.assert_array_equal(loaded_obs, obs)
+    assert np.asarray(loaded[BufferKey.DONE]).dtype == np.float32
+
+
+def test_columnar_buffer_matches_agentbuffer():
+    agent_2_buffer = construct_fake_buffer(2)
+    agent_3_buffer = construct_fake_buffer(3)
+    update_buffer = AgentBuffer()
+    columnar_buffer = ColumnarAgentBuffer()
+    for _buffer in (agent_2_buffer, agent_3_buffer):
+        for target in (update_buffer, columnar_buffer):
+            _buffer.resequence_and_append(target, batch_size=None, training_length=4)
+
+    assert columnar_buffer.keys() == update_buffer.keys()
+    assert columnar_buffer.num_experiences == update_buffer.num_experiences == 24
+    for key in update_buffer.keys():
+        assert isinstance(columnar_buffer[key], ColumnarAgentBufferField)
+    assert np.array_equal(
+        np.array(columnar_buffer[ObsUtil.get_name_at(0)]),
+        np.array(update_buffer[ObsUtil.get_name_at(0)]),
+    )
+    # Group entries are kept as lists, including the padding
+    assert columnar_buffer[BufferKey.GROUP_CONTINUOUS_ACTION].contains_lists
+    assert len(columnar_buffer[BufferKey.GROUP_CONTINUOUS_ACTION][0]) == 3
+    assert len(columnar_buffer[BufferKey.GROUP_CONTINUOUS_ACTION][-1]) == 0
+    for expected, padded in zip(
+        update_buffer[BufferKey.GROUP_CONTINUOUS_ACTION].padded_to_batch(),
+        columnar_buffer[BufferKey.GROUP_CONTINUOUS_ACTION].padded_to_batch(),
+    ):
+        assert np.array_equal(expected, padded)
+
+    for key in update_buffer.keys():
+        for sequential in (True, False):
+            expected = update_buffer[key].get_batch(
+                batch_size=2, training_length=3, sequential=sequential
+            )
+            batch = columnar_buffer[key].get_batch(
+                batch_size=2, training_length=3, sequential=sequential
+            )
+            assert len(expected) == len(batch)
+            if not columnar_buffer[key].contains_lists:
+                assert np.array_equal(np.array(expected), batch)
+
+
+def test_columnar_buffer_mini_batch_is_view():
+    columnar_buffer = ColumnarAgentBuffer()
+    construct_fake_buffer(1).resequence_and_append(
+        columnar_buffer, batch_size=None, training_length=1
+    )
+    mb = columnar_buffer.make_mini_batch(start=2, end=5)
+    assert mb.keys() == columnar_buffer.keys()
+    obs = np.asarray(mb[ObsUtil.get_name_at(0)])
+    assert obs.shape == (3, 3)
+    assert np.shares_memory(obs, np.asarray(columnar_buffer[ObsUtil.get_name_at(0)]))
+    assert_array(obs[0], np.array([121, 122, 123], dtype=np.float32))
+
+    # Appending to a mini-batch must not write into the original buffer
+    mb[ObsUtil.get_name_at(0)].append(np.zeros(3, dtype=np.float32))
+    assert len(mb[ObsUtil.get_name_at(0)]) == 4
+    assert_array(
+        columnar_buffer[ObsUtil.get_name_at(0)][5],
+        np.array([151, 152, 153], dtype=np.float32),
+    )
+
+
+def test_columnar_buffer_sample_and_shuffle():
+    columnar_buffer = ColumnarAgentBuffer()
+    for fake_agent_id in (1, 2):
+        construct_fake_buffer(fake_agent_id).resequence_and_append(
+            columnar_buffer, batch_size=None, training_length=2
+        )
+    mb = columnar_buffer.sample_mini_batch(batch_size=4, sequence_length=1)
+    assert mb.keys() == columnar_buffer.keys()
+    assert np.array(mb[BufferKey.CONTINUOUS_ACTION]).shape == (4, 2)
+
+    mb = columnar_buffer.sample_mini_batch(batch_size=20, sequence_length=19)
+    assert np.array(mb[BufferKey.CONTINUOUS_ACTION]).shape == (19, 2)
+    assert len(mb[BufferKey.GROUP_CONTINUOUS_ACTION]) == 19
+
+    columnar_buffer.shuffle(sequence_length=2)
+    assert columnar_buffer.num_experiences == 20
+    obs = np.array(columnar_buffer[ObsUtil.get_name_at(0)])
+    actions = np.array(columnar_buffer[BufferKey.CONTINUOUS_ACTION])
+    # Fields are shuffled consistently, padding stays zero in both
+    not_padding = obs[:, 0] != 0
+    assert np.array_equal(obs[not_padding, 0] + 3, actions[not_padding, 0])
+    assert not np.any(actions[~not_padding])
+
+
+def test_columnar_buffer_truncate():
+    columnar_buffer = ColumnarAgentBuffer(capacity=20)
+    for fake_agent_id in (1, 2):
+        construct_fake_buffer(fake_agent_id).resequence_and_append(
+            columnar_buffer, batch_size=None, training_length=2
+        )
+    columnar_buffer.truncate(4, sequence_length=3)
+    assert columnar_buffer.num_experiences == 3
+    assert_array(
+        columnar_buffer[ObsUtil.get_name_at(0)][0],
+        np.array([271, 272, 273], dtype=np.float32),
+    )
+    # The space freed by truncate is reused rather than growing the column
+    for fake_agent_id in (3, 4):
+        construct_fake_buffer(fake_agent_id).resequence_and_append(
+            columnar_buffer, batch_size=None, training_length=2
+        )
+    assert columnar_buffer.num_experiences == 23
+    assert_array(
+        columnar_buffer[ObsUtil.get_name_at(0)][3],
+        np.array([301, 302, 303], dtype=np.float32),
+    )
+    assert_array(
+        columnar_buffer[ObsUtil.get_name_at(0)][-1],
+        np.array([0, 0, 0], dtype=np.float32),
+    )
+
+
+def test_columnar_field():
+    field = ColumnarAgentBufferField()
+    field.append(True)
+    field.append(False)
+    # Values that can't be cast to the column dtype upcast the column
+    field.extend([0.5, 1.5])
+    assert np.asarray(field).dtype == np.float64
+    assert_array(np.asarray(field), np.array([1.0, 0.0, 0.5, 1.5]))
+
+    field[-1] = 2.0
+    assert field[-1] == 2.0
+    field.set(field[1:3])
+    assert_array(np.asarray(field), np.array([0.0, 0.5]))
+
+    with pytest.raises(BufferException):
+        field.append(np.zeros(2))
+
+    field.reset_field()
+    assert len(field) == 0
+
+
+def test_columnar_buffer_save_load():
+    original = ColumnarAgentBuffer()
+    construct_fake_buffer(3).resequence_and_append(original, training_length=1)
+
+    write_buffer = io.BytesIO()
+    original.save_to_file(write_buffer)
+
+    loaded = ColumnarAgentBuffer()
+    loaded.load_from_file(write_buffer)
+
+    assert len(original) == len(loaded)
+    for k in original.keys():
+        assert np.allclose(original[k].to_ndarray(), loaded[k].to_ndarray())
+
+
+def test_memory_mapped_buffer(tmp_path):
+    directory = os.path.join(tmp_path, "replay")
+    columnar_buffer = ColumnarAgentBuffer(capacity=10)
+    mapped_buffer = MemoryMappedAgentBuffer(
+        directory, capacity=10, min_element_bytes=12
+    )
+    for fake_agent_id in range(1, 5):
+        for buffer in (columnar_buffer, mapped_buffer):
+            construct_fake_buffer(fake_agent_id).resequence_and_append(
+                buffer, batch_size=None, training_length=1
+            )
+        columnar_buffer.truncate(20)
+        mapped_buffer.truncate(20)
+    # Only the observations are large enough to be mapped.
+    assert mapped_buffer[ObsUtil.get_name_at(0)].is_memory_mapped
+    assert not mapped_buffer[BufferKey.CONTINUOUS_ACTION].is_memory_mapped
+    assert not mapped_buffer[BufferKey.GROUP_CONTINUOUS_ACTION].is_memory_mapped
+    if os.name != "nt":
+        assert not os.listdir(directory)
+
+    assert mapped_buffer.num_experiences == columnar_buffer.num_experiences == 20
+    for key in columnar_buffer.keys():
+        assert np.array_equal(
+            mapped_buffer[key].to_ndarray(), columnar_buffer[key].to_ndarray()
+        )
+    np.random.seed(0)
+    columnar_batch = columnar_buffer.sample_mini_batch(batch_size=12)
+    np.random.seed(0)
+    mapped_batch = mapped_buffer.sample_mini_batch(batch_size=12)
+    for key in columnar_buffer.keys():
+        assert np.array_equal(
+            mapped_batch[key].to_ndarray(), columnar_batch[key].to_ndarray()
+        )
+
+    # Empty elements can't be mapped.
+    mapped_buffer[BufferKey.MEMORY].extend(np.zeros((20, 0), dtype=np.float32))
+    assert not mapped_buffer[BufferKey.MEMORY].is_memory_mapped
@@ -1,5 +1,6 @@
 import io
 import os
+import shutil
 from unittest import mock
 import numpy as np
 import pytest
@@ -13,6 +14,7 @@ from mlagents.trainers.tests.mock_brain import (
     setup_test_behavior_specs,
 )
 from mlagents.trainers.demo_loader import (
+    DemonstrationReader,
     load_demonstration,
     demo_to_buffer,
     get_demo_files,
@@ -54,6 +56,90 @@ def test_load_demo_dir():
     )
 
 
+@pytest.mark.parametrize("sequence_length", [1, 3])
+def test_demo_reader_chunks(sequence_length):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.demo")
+    reader = DemonstrationReader(path, chunk_size=64)
+    chunks = list(reader.iter_records())
+    assert all(len(chunk) <= 64 for chunk in chunks)
+    assert sum(len(chunk) for chunk in chunks) == reader.total_expected
+
+    # Streaming the demonstrations in small chunks gives the same buffer.
+    _, demo_buffer = demo_to_buffer(path, sequence_length)
+    _, chunked_buffer = demo_to_buffer(path, sequence_length, chunk_size=64)
+    assert demo_buffer.num_experiences % sequence_length == 0
+    assert set(demo_buffer.keys()) == set(chunked_buffer.keys())
+    for key in demo_buffer.keys():
+        np.testing.assert_array_equal(
+            np.asarray(demo_buffer[key]), np.asarray(chunked_buffer[key])
+        )
+    # Episodes are never split across the streamed buffers.
+    for chunk_buffer in reader.iter_buffers(sequence_length):
+        assert chunk_buffer.num_experiences % sequence_length == 0
+
+
+def test_demo_cache(tmp_path):
+    demo_path = os.path.join(tmp_path, "test.demo")
+    shutil.copy(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "test.demo"),
+        demo_path,
+    )
+    cache_dir = os.path.join(tmp_path, "cache")
+    behavior_spec, demo_buffer = demo_to_buffer(
+        demo_path, 3, BEHAVIOR_SPEC, cache_dir=cache_dir
+    )
+    assert len(os.listdir(cache_dir)) == 1
+
+    def check_cached():
+        with mock.patch(
+            "mlagents.trainers.demo_loader.DemonstrationReader",
+            side_effect=AssertionError("The demonstrations were parsed again."),
+        ):
+            cached_spec, cached_buffer = demo_to_buffer(
+                demo_path, 3, BEHAVIOR_SPEC, cache_dir=cache_dir
+            )
+        assert cached_spec == behavior_spec
+        assert set(cached_buffer.keys()) == set(demo_buffer.keys())
+        for key in demo_buffer.keys():
+            np.testing.assert_array_equal(
+                np.asarray(cached_buffer[key]), np.asarray(demo_buffer[key])
+            )
+
+    check_cached()
+    # Files that were touched but not modified are recognized by their hash.
+    os.utime(demo_path, ns=(0, 0))
+    check_cached()
+    # The new modification time is stored, so the file isn't hashed again.
+    with mock.patch(
+        "mlagents.trainers.demo_cache._file_digest",
+        side_effect=AssertionError("The demonstrations were hashed again."),
+    ):
+        check_cached()
+    # The mismatch checks also apply to the cached demonstrations.
+    with pytest.raises(RuntimeError):
+        demo_to_buffer(
+            demo_path,
+            3,
+            setup_test_behavior_specs(
+                False, False, vector_action_space=2, vector_obs_space=9
+            ),
+            cache_dir=cache_dir,
+        )
+    # Other sequence lengths have their own entry.
+    _, other_buffer = demo_to_buffer(demo_path, 1, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    assert other_buffer.num_experiences < demo_buffer.num_experiences
+
+    # Modified files are parsed again.
+    with open(demo_path, "ab") as f:
+        f.write(b"\0")
+    with mock.patch(
+        "mlagents.trainers.demo_loader.DemonstrationReader", wraps=DemonstrationReader
+    ) as reader:
+        demo_to_buffer(demo_path, 3, cache_dir=cache_dir)
+    reader.assert_called_once()
+
+
 def test_demo_mismatch():
     path_prefix = os.path.dirname(os.path.abspath(__file__))
     # observation size mismatch
@@ -0,0 +1,194 @@
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+from mlagents_envs.base_env import (
+    ActionSpec,
+    ActionTuple,
+    BaseEnv,
+    BehaviorSpec,
+    DecisionSteps,
+    TerminalSteps,
+)
+from mlagents.trainers.action_info import ActionInfo
+from mlagents.trainers.ghost.league import (
+    LeagueEvaluator,
+    _MatchPolicy,
+    compute_elo_ratings,
+    load_league_policies,
+)
+from mlagents.trainers.ghost.snapshot_pool import SnapshotPool
+from mlagents.trainers.policy.weight_store import VersionedWeightStore
+from mlagents.trainers.ppo.trainer import PPOTrainer
+from mlagents.trainers.settings import SelfPlaySettings, TrainerSettings
+from mlagents.trainers.simple_env_manager import SimpleEnvManager
+from mlagents.trainers.tests import mock_brain as mb
+from mlagents.trainers.tests.dummy_config import create_observation_specs_with_shapes
+
+BRAIN_NAME = "test_brain"
+OBS_SPECS = create_observation_specs_with_shapes([(1,)])
+ACTION_SPEC = ActionSpec.create_discrete((3,))
+
+
+class HighestActionWinsEnvironment(BaseEnv):
+    """
+    Two teams of one agent each. Every game lasts a single step, and the agent with the
+    highest action wins.
+    """
+
+    def __init__(self):
+        self.names = [f"{BRAIN_NAME}?team={team_id}" for team_id in (0, 1)]
+        self.actions: Dict[str, np.ndarray] = {}
+        self.ended = False
+
+    @property
+    def behavior_specs(self) -> Dict[str, BehaviorSpec]:
+        return {name: BehaviorSpec(OBS_SPECS, ACTION_SPEC) for name in self.names}
+
+    def set_actions(self, behavior_name: str, action: ActionTuple) -> None:
+        self.actions[behavior_name] = action.discrete
+
+    def set_action_for_agent(self, behavior_name, agent_id, action) -> None:
+        raise NotImplementedError
+
+    def get_steps(self, behavior_name: str):
+        obs = [np.zeros((1, 1), dtype=np.float32)]
+        decision_steps = DecisionSteps(
+            obs,
+            np.zeros(1, dtype=np.float32),
+            np.zeros(1, dtype=np.int32),
+            None,
+            np.zeros(1, dtype=np.int32),
+            np.zeros(1, dtype=np.float32),
+        )
+        if not self.ended:
+            return decision_steps, TerminalSteps.empty(
+                self.behavior_specs[self.names[0]]
+            )
+        team_actions = [int(self.actions[name][0, 0]) for name in self.names]
+        own_action = team_actions[self.names.index(behavior_name)]
+        reward = float(np.sign(2 * own_action - sum(team_actions)))
+        terminal_steps = TerminalSteps(
+            obs,
+            np.array([reward], dtype=np.float32),
+            np.zeros(1, dtype=bool),
+            np.zeros(1, dtype=np.int32),
+            np.zeros(1, dtype=np.int32),
+            np.zeros(1, dtype=np.float32),
+        )
+        return decision_steps, terminal_steps
+
+    def step(self) -> None:
+        self.ended = True
+
+    def reset(self) -> None:
+        self.ended = False
+
+    def close(self) -> None:
+        pass
+
+
+class ConstantActionPolicy:
+    def __init__(self, action: int):
+        self.action = action
+        self.use_recurrent = False
+        self.num_requests: List[int] = []
+
+    def get_action(self, decision_requests, worker_id=0) -> ActionInfo:
+        return self.get_actions([(decision_requests, worker_id)])[0]
+
+    def get_actions(self, decision_requests) -> List[ActionInfo]:
+        self.num_requests.append(len(decision_requests))
+        return [
+            ActionInfo(
+                None,
+                ActionTuple(
+                    discrete=np.full((len(decision_steps), 1), self.action, np.int32)
+                ),
+                {},
+                list(decision_steps.agent_id),
+            )
+            for decision_steps, _ in decision_requests
+        ]
+
+
+def test_league_evaluator():
+    env_manager = SimpleEnvManager(HighestActionWinsEnvironment(), None)
+    policies = [ConstantActionPolicy(action) for action in (1, 0, 2, 2)]
+    evaluator = LeagueEvaluator(env_manager, 1, BRAIN_NAME, policies)
+    result = evaluator.evaluate(games_per_match=3)
+
+    # Every snapshot played 3 games against every other snapshot on each side.
+    expected_games = np.full((4, 4), 6.0)
+    np.fill_diagonal(expected_games, 0.0)
+    np.testing.assert_array_equal(result.games, expected_games)
+    assert result.win_rates[0, 1] == 1.0
+    assert result.win_rates[1, 0] == 0.0
+    assert result.win_rates[2, 3] == 0.5
+    elos = result.elo_ratings()
+    assert elos[2] == pytest.approx(elos[3])
+    assert elos[2] > elos[0] > elos[1]
+    assert np.mean(elos) == pytest.approx(1200.0)
+    assert result.to_dict()["names"] == [f"snapshot-{i}" for i in range(4)]
+
+
+def test_match_policy_batches_snapshots():
+    policies = [ConstantActionPolicy(action) for action in (0, 1, 2)]
+    matches = {0: (0, 1), 1: (2, 1), 2: (0, 2)}
+    match_policy = _MatchPolicy(policies, 1, matches)
+    decision_steps, _ = mb.create_mock_steps(2, OBS_SPECS, ACTION_SPEC)
+    action_infos = match_policy.get_actions(
+        [(decision_steps, worker_id) for worker_id in range(3)]
+    )
+    # The workers playing the same snapshot are evaluated together.
+    assert policies[1].num_requests == [2]
+    assert policies[2].num_requests == [1]
+    assert not policies[0].num_requests
+    assert [int(info.env_action.discrete[0, 0]) for info in action_infos] == [1, 1, 2]
+
+
+def test_compute_elo_ratings():
+    scores = np.array([[0.0, 75.0], [25.0, 0.0]])
+    games = np.array([[0.0, 100.0], [100.0, 0.0]])
+    elos = compute_elo_ratings(scores, games, prior_games=0.0)
+    # A 75% expected score is a difference of about 191 ELO.
+    assert elos[0] - elos[1] == pytest.approx(400 * np.log10(3))
+    # Snapshots that won all their games still get a finite rating.
+    elos = compute_elo_ratings(np.array([[0.0, 10.0], [0.0, 0.0]]), games)
+    assert np.all(np.isfinite(elos)) and elos[0] > elos[1]
+
+
+def test_load_league_policies(tmp_path):
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    trainer = PPOTrainer(
+        BRAIN_NAME,
+        0,
+        TrainerSettings(self_play=SelfPlaySettings()),
+        False,
+        False,
+        0,
+        "0",
+    )
+    policy = trainer.create_policy(BRAIN_NAME, mock_specs)
+    weight_store = VersionedWeightStore()
+    pool = SnapshotPool(2, tmp_path.as_posix())
+    for _ in range(2):
+        weight_store.publish(policy.get_weights_view())
+        pool.put(len(pool), {BRAIN_NAME: weight_store.snapshot()})
+    pool.put(0, {BRAIN_NAME: weight_store.snapshot()})
+
+    policies, names = load_league_policies(
+        pool,
+        BRAIN_NAME,
+        lambda parsed_behavior_id: trainer.create_policy(
+            parsed_behavior_id, mock_specs
+        ),
+    )
+    # The oldest snapshot comes first.
+    assert names == ["snapshot-1", "snapshot-2"]
+    for league_policy in policies:
+        for name, value in league_policy.get_weights().items():
+            np.testing.assert_array_equal(value, policy.get_weights()[name])
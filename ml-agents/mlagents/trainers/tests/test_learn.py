@@ -82,6 +82,7 @@ def test_run_training(
                     "mock_param_manager",
                     True,
                     0,
+                    False,
                 )
                 handle_dir_mock.assert_called_once_with(
                     os.path.join("results", "ppo"),
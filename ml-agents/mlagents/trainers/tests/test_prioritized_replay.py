@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+
+from mlagents.trainers.trainer.prioritized_replay import PrioritizedReplay
+
+
+def test_prioritized_replay_sample():
+    np.random.seed(0)
+    replay = PrioritizedReplay(alpha=1.0, epsilon=0.0, capacity=4)
+    replay.add(4)
+    # New sequences get the highest priority seen so far.
+    np.testing.assert_array_equal(replay.priorities(), [1.0, 1.0, 1.0, 1.0])
+    replay.update(np.array([0, 1, 2, 3]), np.array([1.0, 0.0, 3.0, 0.0]))
+    assert replay.total_priority == 4.0
+
+    indices, weights = replay.sample(4000, beta=1.0)
+    counts = np.bincount(indices, minlength=4)
+    assert counts[1] == counts[3] == 0
+    assert abs(counts[0] / counts[2] - 1 / 3) < 0.05
+    # Rarely sampled sequences have the largest weights.
+    np.testing.assert_allclose(weights[indices == 0], 1.0)
+    np.testing.assert_allclose(weights[indices == 2], 1 / 3)
+
+
+def test_prioritized_replay_ring():
+    replay = PrioritizedReplay(alpha=0.5, epsilon=0.0, capacity=4)
+    replay.add(3)
+    replay.update(np.array([0, 1, 2]), np.array([4.0, 9.0, 16.0]))
+    np.testing.assert_allclose(replay.priorities(), [2.0, 3.0, 4.0])
+    assert replay.priorities().max() == replay._max_priority
+
+    # Dropping the oldest sequences renumbers the others from the oldest one.
+    replay.drop_oldest(2)
+    replay.add(2)
+    np.testing.assert_allclose(replay.priorities(), [4.0, 4.0, 4.0])
+    replay.update(np.array([1]), np.array([1.0]))
+    np.testing.assert_allclose(replay.priorities(), [4.0, 1.0, 4.0])
+    assert replay.total_priority == 9.0
+
+    # The tree grows when the buffer holds more sequences than its capacity.
+    replay.add(3)
+    assert replay.num_sequences == 6
+    np.testing.assert_allclose(replay.priorities(), [4.0, 1.0, 4.0, 4.0, 4.0, 4.0])
+    assert replay.total_priority == 21.0
+    indices, _ = replay.sample(64, beta=0.5)
+    assert indices.min() >= 0 and indices.max() < 6
+
+
+def test_prioritized_replay_save_load():
+    replay = PrioritizedReplay(alpha=1.0, epsilon=0.0, capacity=4)
+    replay.add(4)
+    replay.update(np.array([0, 1, 2, 3]), np.array([2.0, 5.0, 1.0, 3.0]))
+    replay.drop_oldest(2)
+    file_object = io.BytesIO()
+    replay.save_to_file(file_object)
+
+    file_object.seek(0)
+    loaded = PrioritizedReplay(alpha=1.0, epsilon=0.0)
+    loaded.load_from_file(file_object)
+    np.testing.assert_array_equal(loaded.priorities(), [1.0, 3.0])
+    assert loaded.total_priority == 4.0
+    # New sequences still get the highest priority seen before saving.
+    loaded.add(1)
+    np.testing.assert_array_equal(loaded.priorities(), [1.0, 3.0, 5.0])
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from mlagents.trainers.buffer import AgentBuffer, BufferKey, ColumnarAgentBuffer
+from mlagents.trainers.trainer.replay_log import SegmentedReplayLog
+
+
+def add_experiences(buffer: AgentBuffer, start: int, num_experiences: int) -> None:
+    for i in range(start, start + num_experiences):
+        buffer[BufferKey.ENVIRONMENT_REWARDS].append(np.array(i, dtype=np.float32))
+        buffer[BufferKey.DISCRETE_ACTION].append(np.array([i, -i], dtype=np.int32))
+        buffer[BufferKey.DONE].append(np.array(i % 3 == 0))
+
+
+def assert_buffers_equal(buffer: AgentBuffer, other: AgentBuffer) -> None:
+    assert set(buffer.keys()) == set(other.keys())
+    for key in buffer.keys():
+        np.testing.assert_array_equal(buffer[key].to_ndarray(), other[key].to_ndarray())
+
+
+@pytest.mark.parametrize("buffer_class", [AgentBuffer, ColumnarAgentBuffer])
+def test_replay_log_incremental(tmp_path, buffer_class):
+    directory = os.path.join(tmp_path, "replay_buffer")
+    buffer = buffer_class()
+    replay_log = SegmentedReplayLog(directory)
+    add_experiences(buffer, 0, 10)
+    replay_log.save(buffer)
+    add_experiences(buffer, 10, 5)
+    replay_log.save(buffer)
+    replay_log.flush()
+    assert sorted(os.listdir(directory)) == [
+        "manifest.json",
+        "segment-0",
+        "segment-1",
+    ]
+
+    # Drop all of the first segment and part of the second one.
+    buffer.truncate(3)
+    replay_log.drop_oldest(12)
+    add_experiences(buffer, 15, 4)
+    replay_log.save(buffer)
+    replay_log.flush()
+    assert sorted(os.listdir(directory)) == [
+        "manifest.json",
+        "segment-1",
+        "segment-2",
+    ]
+    # Only the new experiences were written.
+    assert len(np.load(os.path.join(directory, "segment-2", "0.npy"))) == 4
+
+    loaded_buffer = buffer_class()
+    loaded_log = SegmentedReplayLog(directory)
+    loaded_log.load(loaded_buffer)
+    assert_buffers_equal(buffer, loaded_buffer)
+    np.testing.assert_array_equal(
+        loaded_buffer[BufferKey.ENVIRONMENT_REWARDS].to_ndarray(), np.arange(12, 19)
+    )
+
+    # The loaded log keeps appending to the same segments.
+    add_experiences(loaded_buffer, 19, 2)
+    loaded_log.save(loaded_buffer)
+    loaded_log.close()
+    assert "segment-3" in os.listdir(directory)
+    reloaded_buffer = buffer_class()
+    SegmentedReplayLog(directory).load(reloaded_buffer)
+    assert_buffers_equal(loaded_buffer, reloaded_buffer)
+    replay_log.close()
+
+
+def test_replay_log_rewrite(tmp_path):
+    directory = os.path.join(tmp_path, "replay_buffer")
+    buffer = ColumnarAgentBuffer()
+    replay_log = SegmentedReplayLog(directory)
+    add_experiences(buffer, 0, 6)
+    replay_log.save(buffer)
+    # Nothing changed, so nothing is written.
+    replay_log.save(buffer)
+    replay_log.flush()
+    assert sorted(os.listdir(directory)) == ["manifest.json", "segment-0"]
+
+    # A new field makes the log start over from the whole buffer.
+    buffer[BufferKey.CONTINUOUS_ACTION].set(np.ones((6, 2), dtype=np.float32))
+    replay_log.save(buffer)
+    replay_log.close()
+    assert sorted(os.listdir(directory)) == ["manifest.json", "segment-1"]
+    loaded_buffer = ColumnarAgentBuffer()
+    SegmentedReplayLog(directory).load(loaded_buffer)
+    assert_buffers_equal(buffer, loaded_buffer)
+
+    with pytest.raises(FileNotFoundError):
+        SegmentedReplayLog(os.path.join(tmp_path, "missing")).load(AgentBuffer())
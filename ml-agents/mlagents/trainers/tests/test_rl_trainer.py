@@ -193,6 +193,7 @@ def test_summary_checkpoint(mock_add_checkpoint, mock_write_summary):
                 ],
             ),
             trainer.trainer_settings.keep_checkpoints,
+            remove_checkpoint=trainer.model_saver.remove_checkpoint,
         )
         for step in checkpoint_range
     ]
@@ -0,0 +1,110 @@
+from multiprocessing import Pipe, Process, resource_tracker
+
+import numpy as np
+
+from mlagents.trainers.shared_memory_steps import SharedStepReader, SharedStepWriter
+from mlagents.trainers.tests import mock_brain as mb
+from mlagents.trainers.tests.dummy_config import create_observation_specs_with_shapes
+from mlagents_envs.base_env import ActionSpec, BehaviorSpec
+
+OBS_SPECS = create_observation_specs_with_shapes([(3,), (8, 8, 3)])
+ACTION_SPEC = ActionSpec.create_discrete((3, 2))
+
+
+def _make_step_result(num_agents):
+    decision_steps, _ = mb.create_mock_steps(num_agents, OBS_SPECS, ACTION_SPEC)
+    _, terminal_steps = mb.create_mock_steps(
+        2, OBS_SPECS, ACTION_SPEC, done=True, agent_ids=[100, 101]
+    )
+    decision_steps.obs[0][:] = np.arange(num_agents * 3).reshape(num_agents, 3)
+    if num_agents > 0:
+        decision_steps.action_mask[1][0, 1] = True
+    return {"test_brain": (decision_steps, terminal_steps)}
+
+
+def _assert_step_results_equal(result, expected):
+    assert result.keys() == expected.keys()
+    for name in expected:
+        for steps, expected_steps in zip(result[name], expected[name]):
+            assert len(steps.obs) == len(expected_steps.obs)
+            for obs, expected_obs in zip(steps.obs, expected_steps.obs):
+                np.testing.assert_array_equal(obs, expected_obs)
+                assert obs.dtype == expected_obs.dtype
+            for field in ("reward", "agent_id", "group_id", "group_reward"):
+                np.testing.assert_array_equal(
+                    getattr(steps, field), getattr(expected_steps, field)
+                )
+                assert (
+                    getattr(steps, field).dtype == getattr(expected_steps, field).dtype
+                )
+        np.testing.assert_array_equal(
+            result[name][1].interrupted, expected[name][1].interrupted
+        )
+        for mask, expected_mask in zip(
+            result[name][0].action_mask, expected[name][0].action_mask
+        ):
+            np.testing.assert_array_equal(mask, expected_mask)
+
+
+def test_shared_step_roundtrip():
+    writer = SharedStepWriter({"test_brain": BehaviorSpec(OBS_SPECS, ACTION_SPEC)})
+    reader = SharedStepReader()
+    try:
+        step_result = _make_step_result(4)
+        shared_step_result = writer.write(step_result)
+        result = reader.read(shared_step_result)
+        _assert_step_results_equal(result, step_result)
+        # The result is a copy, so the arena can be written to again.
+        writer.write(_make_step_result(3))
+        _assert_step_results_equal(result, step_result)
+
+        # Make sure the arena grows when more agents show up.
+        name = writer.name
+        step_result = _make_step_result(100)
+        result = reader.read(writer.write(step_result))
+        assert writer.name != name
+        _assert_step_results_equal(result, step_result)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_shared_step_empty_behavior():
+    writer = SharedStepWriter(None)
+    reader = SharedStepReader()
+    try:
+        step_result = _make_step_result(0)
+        result = reader.read(writer.write(step_result))
+        assert len(result["test_brain"][0]) == 0
+        _assert_step_results_equal(result, step_result)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def _write_in_subprocess(conn):
+    # Environment workers are started before the trainer uses shared memory, so they
+    # have their own resource tracker. Earlier tests started one in this process.
+    tracker = resource_tracker.ResourceTracker()
+    resource_tracker.register = tracker.register
+    resource_tracker.unregister = tracker.unregister
+    writer = SharedStepWriter(None)
+    conn.send(writer.write(_make_step_result(5)))
+    # Keep the arena alive until the parent has read it.
+    conn.recv()
+    writer.close()
+
+
+def test_shared_step_across_processes():
+    parent_conn, child_conn = Pipe()
+    process = Process(target=_write_in_subprocess, args=(child_conn,))
+    process.start()
+    reader = SharedStepReader()
+    try:
+        assert parent_conn.poll(30)
+        result = reader.read(parent_conn.recv())
+        _assert_step_results_equal(result, _make_step_result(5))
+    finally:
+        reader.close()
+        parent_conn.send(None)
+        process.join()
@@ -4,7 +4,7 @@ import unittest
 import pytest
 from queue import Empty as EmptyQueue
 
-from mlagents.trainers.settings import RunOptions
+from mlagents.trainers.settings import EnvironmentSettings, RunOptions
 from mlagents.trainers.subprocess_env_manager import (
     SubprocessEnvManager,
     EnvironmentResponse,
@@ -43,6 +43,17 @@ class MockEnvWorker:
         self.send = Mock()
         self.recv = Mock(return_value=resp)
         self.waiting = False
+        self.step_reader = Mock()
+
+
+def mock_step_queue(responses):
+    """
+    Creates a mock step queue whose blocking and non-blocking gets return the responses in order.
+    """
+    step_queue = Mock()
+    step_queue.get_nowait.side_effect = responses
+    step_queue.get.side_effect = lambda *args, **kwargs: step_queue.get_nowait()
+    return step_queue
 
 
 def create_worker_mock(worker_id, step_queue, env_factor, engine_c):
@@ -129,12 +140,17 @@ class SubprocessEnvManagerTest(unittest.TestCase):
     def test_step_takes_steps_for_all_non_waiting_envs(self, mock_create_worker):
         mock_create_worker.side_effect = create_worker_mock
         manager = SubprocessEnvManager(mock_env_factory, RunOptions(), 3)
-        manager.step_queue = Mock()
-        manager.step_queue.get_nowait.side_effect = [
-            EnvironmentResponse(EnvironmentCommand.STEP, 0, StepResponse(0, None, {})),
-            EnvironmentResponse(EnvironmentCommand.STEP, 1, StepResponse(1, None, {})),
-            EmptyQueue(),
-        ]
+        manager.step_queue = mock_step_queue(
+            [
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 0, StepResponse(0, None, {})
+                ),
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 1, StepResponse(1, None, {})
+                ),
+                EmptyQueue(),
+            ]
+        )
         step_mock = Mock()
         last_steps = [Mock(), Mock(), Mock()]
         manager.env_workers[0].previous_step = last_steps[0]
@@ -156,6 +172,152 @@ class SubprocessEnvManagerTest(unittest.TestCase):
             manager.env_workers[1].previous_step,
         ]
 
+    @mock.patch(
+        "mlagents.trainers.subprocess_env_manager.SubprocessEnvManager.create_worker"
+    )
+    def test_step_waits_for_min_envs(self, mock_create_worker):
+        mock_create_worker.side_effect = create_worker_mock
+        run_options = RunOptions(
+            env_settings=EnvironmentSettings(
+                step_batch_min_envs=2, step_batch_timeout_ms=10000
+            )
+        )
+        manager = SubprocessEnvManager(mock_env_factory, run_options, 3)
+        manager.step_queue = mock_step_queue(
+            [
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 0, StepResponse(0, None, {})
+                ),
+                EmptyQueue(),
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 2, StepResponse(2, None, {})
+                ),
+                EmptyQueue(),
+            ]
+        )
+        for env_worker in manager.env_workers:
+            env_worker.previous_step = Mock()
+        manager._take_step = Mock(return_value={})
+        res = manager._step()
+        assert [step.worker_id for step in res] == [0, 2]
+        # The first wait blocks, the following ones are bounded by the batching timeout.
+        first_call, second_call = manager.step_queue.get.call_args_list
+        assert first_call.kwargs["timeout"] > 0
+        assert 0 <= second_call.kwargs["timeout"] <= 10.0
+        assert manager.env_workers[1].waiting
+
+    @mock.patch(
+        "mlagents.trainers.subprocess_env_manager.SubprocessEnvManager.create_worker"
+    )
+    def test_step_batch_timeout(self, mock_create_worker):
+        mock_create_worker.side_effect = create_worker_mock
+        run_options = RunOptions(
+            env_settings=EnvironmentSettings(
+                step_batch_min_envs=3, step_batch_timeout_ms=0
+            )
+        )
+        manager = SubprocessEnvManager(mock_env_factory, run_options, 3)
+        manager.step_queue = mock_step_queue(
+            [
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 1, StepResponse(1, None, {})
+                ),
+                EmptyQueue(),
+            ]
+        )
+        for env_worker in manager.env_workers:
+            env_worker.previous_step = Mock()
+        manager._take_step = Mock(return_value={})
+        res = manager._step()
+        assert [step.worker_id for step in res] == [1]
+
+    @mock.patch(
+        "mlagents.trainers.subprocess_env_manager.SubprocessEnvManager.create_worker"
+    )
+    def test_step_batched_inference(self, mock_create_worker):
+        mock_create_worker.side_effect = create_worker_mock
+        run_options = RunOptions(
+            env_settings=EnvironmentSettings(batched_inference=True)
+        )
+        manager = SubprocessEnvManager(mock_env_factory, run_options, 3)
+        decision_steps = [Mock(), Mock(), Mock()]
+        manager.env_workers[0].previous_step = EnvironmentStep(
+            {"a": (decision_steps[0], Mock()), "b": (decision_steps[1], Mock())},
+            0,
+            {},
+            {},
+        )
+        manager.env_workers[1].previous_step = EnvironmentStep(
+            {"a": (decision_steps[2], Mock())}, 1, {}, {}
+        )
+        manager.env_workers[2].waiting = True
+        policy_a, policy_b = Mock(), Mock()
+        action_infos_a = [Mock(), Mock()]
+        action_infos_b = [Mock()]
+        policy_a.get_actions.return_value = action_infos_a
+        policy_b.get_actions.return_value = action_infos_b
+        manager.policies = {"a": policy_a, "b": policy_b}
+
+        manager._queue_steps()
+        # One call per behavior for all of the workers that are ready.
+        policy_a.get_actions.assert_called_once_with(
+            [(decision_steps[0], 0), (decision_steps[2], 1)]
+        )
+        policy_b.get_actions.assert_called_once_with([(decision_steps[1], 0)])
+        manager.env_workers[0].send.assert_called_once_with(
+            EnvironmentCommand.STEP, {"a": action_infos_a[0], "b": action_infos_b[0]}
+        )
+        manager.env_workers[1].send.assert_called_once_with(
+            EnvironmentCommand.STEP, {"a": action_infos_a[1]}
+        )
+        manager.env_workers[2].send.assert_not_called()
+        assert all(ew.waiting for ew in manager.env_workers)
+
+    @mock.patch(
+        "mlagents.trainers.subprocess_env_manager.SubprocessEnvManager.create_worker"
+    )
+    def test_pipelined_stepping(self, mock_create_worker):
+        mock_create_worker.side_effect = create_worker_mock
+        run_options = RunOptions(
+            env_settings=EnvironmentSettings(pipelined_stepping=True)
+        )
+        manager = SubprocessEnvManager(mock_env_factory, run_options, 2)
+        manager.step_queue = mock_step_queue(
+            [
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP,
+                    0,
+                    StepResponse({"testbrain": (Mock(), Mock())}, None, {}),
+                ),
+                EmptyQueue(),
+            ]
+        )
+        for env_worker in manager.env_workers:
+            env_worker.previous_step = Mock()
+        policy = Mock(use_recurrent=False)
+        manager.set_policy("testbrain", policy)
+        agent_manager = Mock()
+        manager.set_agent_manager("testbrain", agent_manager)
+        manager._take_step = Mock(return_value={})
+
+        step_infos = manager._step()
+        # Worker 0 got its next actions before its step was processed.
+        assert manager._take_step.call_count == 3
+        assert all(ew.waiting for ew in manager.env_workers)
+        agent_manager.add_experiences.assert_not_called()
+
+        assert manager.process_steps(step_infos) == 1
+        manager._wait_for_processing()
+        agent_manager.add_experiences.assert_called_once()
+
+        # Errors on the processing thread are raised on the main thread.
+        agent_manager.add_experiences.side_effect = RuntimeError("processing failed")
+        manager.process_steps(step_infos)
+        with pytest.raises(RuntimeError):
+            manager._wait_for_processing()
+        manager._step_infos_queue.put(None)
+        manager._processing_thread.join()
+
     @mock.patch(
         "mlagents.trainers.subprocess_env_manager.SubprocessEnvManager.create_worker"
     )
@@ -175,20 +337,27 @@ class SubprocessEnvManagerTest(unittest.TestCase):
             restarting_worker,
         ]
         manager = SubprocessEnvManager(mock_env_factory, RunOptions(), 2)
-        manager.step_queue = Mock()
-        manager.step_queue.get_nowait.side_effect = [
-            EnvironmentResponse(
-                EnvironmentCommand.ENV_EXITED,
-                0,
-                UnityCommunicationException("Test msg"),
-            ),
-            EnvironmentResponse(EnvironmentCommand.CLOSED, 0, None),
-            EnvironmentResponse(EnvironmentCommand.STEP, 1, StepResponse(0, None, {})),
-            EmptyQueue(),
-            EnvironmentResponse(EnvironmentCommand.STEP, 0, StepResponse(1, None, {})),
-            EnvironmentResponse(EnvironmentCommand.STEP, 1, StepResponse(2, None, {})),
-            EmptyQueue(),
-        ]
+        manager.step_queue = mock_step_queue(
+            [
+                EnvironmentResponse(
+                    EnvironmentCommand.ENV_EXITED,
+                    0,
+                    UnityCommunicationException("Test msg"),
+                ),
+                EnvironmentResponse(EnvironmentCommand.CLOSED, 0, None),
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 1, StepResponse(0, None, {})
+                ),
+                EmptyQueue(),
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 0, StepResponse(1, None, {})
+                ),
+                EnvironmentResponse(
+                    EnvironmentCommand.STEP, 1, StepResponse(2, None, {})
+                ),
+                EmptyQueue(),
+            ]
+        )
         step_mock = Mock()
         last_steps = [Mock(), Mock(), Mock()]
         assert crashing_worker is manager.env_workers[0]
@@ -261,13 +430,17 @@ class SubprocessEnvManagerTest(unittest.TestCase):
         assert agent_manager_mock.policy == mock_policy
 
 
+@pytest.mark.parametrize("shared_memory_obs", [False, True])
 @pytest.mark.parametrize("num_envs", [1, 4])
-def test_subprocess_env_endtoend(num_envs):
+def test_subprocess_env_endtoend(num_envs, shared_memory_obs):
     def simple_env_factory(worker_id, config):
         env = SimpleEnvironment(["1D"], action_sizes=(0, 1))
         return env
 
-    env_manager = SubprocessEnvManager(simple_env_factory, RunOptions(), num_envs)
+    run_options = RunOptions(
+        env_settings=EnvironmentSettings(shared_memory_obs=shared_memory_obs)
+    )
+    env_manager = SubprocessEnvManager(simple_env_factory, run_options, num_envs)
     # Run PPO using env_manager
     check_environment_trains(
         simple_env_factory(0, []),
@@ -1,11 +1,18 @@
+import os
+import time
 from unittest.mock import patch
 
+import numpy as np
 import pytest
 
 from mlagents.trainers.agent_processor import AgentManagerQueue
 from mlagents.trainers.behavior_id_utils import BehaviorIdentifiers
 from mlagents.trainers.environment_parameter_manager import EnvironmentParameterManager
-from mlagents.trainers.settings import RunOptions
+from mlagents.trainers.settings import (
+    PrioritizedReplaySettings,
+    ReplayBufferFormat,
+    RunOptions,
+)
 from mlagents.trainers.tests import mock_brain as mb
 from mlagents.trainers.tests.dummy_config import (
     create_observation_specs_with_shapes,
@@ -15,6 +22,16 @@ from mlagents.trainers.tests.dummy_config import (
 )
 from mlagents.trainers.tests.mock_brain import make_fake_trajectory
 from mlagents.trainers.trainer import TrainerFactory
+from mlagents.trainers.trainer.trainer_process import TrainerProcess
+from mlagents.trainers.training_status import GlobalTrainingStatus, StatusType
+from mlagents.trainers.trainer.trainer_utils import (
+    discount_rewards,
+    discount_rewards_batch,
+    get_gae,
+    get_gae_batch,
+    lambda_return,
+    lambda_return_batch,
+)
 
 
 @pytest.fixture
@@ -76,6 +93,110 @@ def test_ppo_trainer_update_normalization(ppo_config):
         policy_update_normalization_mock.assert_called_once()
 
 
+def test_ppo_trainer_process_trajectories(ppo_config):
+    brain_name = "test_brain"
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    trainer_factory = TrainerFactory(
+        trainer_config=ppo_config.behaviors,
+        output_path="results_dir",
+        train_model=True,
+        load_model=False,
+        seed=42,
+        param_manager=EnvironmentParameterManager(),
+    )
+    ppo_trainer = trainer_factory.generate(brain_name)
+    parsed_behavior_id = BehaviorIdentifiers.from_name_behavior_id(brain_name)
+    policy = ppo_trainer.create_policy(parsed_behavior_id, mock_specs)
+    ppo_trainer.add_policy(parsed_behavior_id, policy)
+    trajectories = [
+        make_fake_trajectory(
+            length=length,
+            max_step_complete=max_step_complete,
+            observation_specs=create_observation_specs_with_shapes([(1,)]),
+            action_spec=mock_specs.action_spec,
+        )
+        for length, max_step_complete in [(15, True), (7, False), (12, True)]
+    ]
+    for trajectory in trajectories:
+        ppo_trainer._process_trajectory(trajectory)
+    expected_buffer = ppo_trainer.update_buffer
+    ppo_trainer.update_buffer = ppo_trainer.update_buffer.__class__()
+
+    # The advantages of all of the trajectories are computed in one batch.
+    ppo_trainer._process_trajectories(trajectories)
+    assert ppo_trainer.update_buffer.num_experiences == 34
+    for key in expected_buffer.keys():
+        np.testing.assert_allclose(
+            np.asarray(ppo_trainer.update_buffer[key]),
+            np.asarray(expected_buffer[key]),
+            rtol=1e-5,
+            atol=1e-6,
+        )
+
+
+def test_trainer_process(ppo_config, tmpdir):
+    behavior_id = "test_brain?team=0"
+    parsed_behavior_id = BehaviorIdentifiers.from_name_behavior_id(behavior_id)
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    ppo_config.behaviors["test_brain"].trainer_process = True
+    trainer_factory = TrainerFactory(
+        trainer_config=ppo_config.behaviors,
+        output_path=str(tmpdir),
+        train_model=True,
+        load_model=False,
+        seed=42,
+        param_manager=EnvironmentParameterManager(),
+    )
+    trainer = trainer_factory.generate("test_brain")
+    assert isinstance(trainer, TrainerProcess)
+    assert not trainer.threaded
+    try:
+        policy = trainer.create_policy(parsed_behavior_id, mock_specs)
+        trainer.add_policy(parsed_behavior_id, policy)
+        trajectory_queue = AgentManagerQueue(behavior_id)
+        policy_queue = AgentManagerQueue(behavior_id)
+        trainer.subscribe_trajectory_queue(trajectory_queue)
+        trainer.publish_policy_queue(policy_queue)
+        initial_weights = {
+            name: value.clone() for name, value in policy.get_weights().items()
+        }
+
+        # Enough steps to fill the update buffer of 64 steps.
+        for _ in range(5):
+            trajectory_queue.put(
+                make_fake_trajectory(
+                    length=15,
+                    max_step_complete=True,
+                    observation_specs=create_observation_specs_with_shapes([(1,)]),
+                    action_spec=mock_specs.action_spec,
+                )
+            )
+        deadline = time.time() + 60
+        while policy_queue.empty() and time.time() < deadline:
+            trainer.advance()
+            time.sleep(0.01)
+        assert policy_queue.get_nowait() is policy
+        assert trainer.get_step == 75
+        assert any(
+            not (value == initial_weights[name]).all()
+            for name, value in policy.get_weights().items()
+        )
+
+        trainer.save_model()
+        assert os.path.exists(os.path.join(str(tmpdir), "test_brain.onnx"))
+        checkpoints = GlobalTrainingStatus.get_parameter_state(
+            "test_brain", StatusType.CHECKPOINTS
+        )
+        assert checkpoints[-1]["steps"] == 75
+    finally:
+        trainer.close()
+    assert not trainer._process.is_alive()
+
+
 def test_sac_trainer_update_normalization(sac_config):
     behavior_id_team0 = "test_brain?team=0"
     brain_name = BehaviorIdentifiers.from_name_behavior_id(behavior_id_team0).brain_name
@@ -120,6 +241,110 @@ def test_sac_trainer_update_normalization(sac_config):
         policy_update_normalization_mock.assert_called_once()
 
 
+def test_sac_trainer_segmented_replay_buffer(sac_config, tmpdir):
+    behavior_id = BehaviorIdentifiers.from_name_behavior_id("test_brain")
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    hyperparameters = sac_config.behaviors["test_brain"].hyperparameters
+    hyperparameters.save_replay_buffer = True
+    hyperparameters.replay_buffer_format = ReplayBufferFormat.SEGMENTS
+
+    def create_trainer(load_model):
+        trainer_factory = TrainerFactory(
+            trainer_config=sac_config.behaviors,
+            output_path=str(tmpdir),
+            train_model=True,
+            load_model=load_model,
+            seed=42,
+            param_manager=EnvironmentParameterManager(),
+        )
+        trainer = trainer_factory.generate(behavior_id.brain_name)
+        trainer.add_policy(behavior_id, trainer.create_policy(behavior_id, mock_specs))
+        return trainer
+
+    sac_trainer = create_trainer(load_model=False)
+    trajectory_queue = AgentManagerQueue(behavior_id.behavior_id)
+    sac_trainer.subscribe_trajectory_queue(trajectory_queue)
+    trajectory_queue.put(
+        make_fake_trajectory(
+            length=15,
+            max_step_complete=True,
+            observation_specs=create_observation_specs_with_shapes([(1,)]),
+            action_spec=mock_specs.action_spec,
+        )
+    )
+    sac_trainer.advance()
+    sac_trainer.save_model()
+    sac_trainer.close()
+    assert os.path.exists(os.path.join(tmpdir, "test_brain", "replay_buffer"))
+
+    loaded_trainer = create_trainer(load_model=True)
+    assert loaded_trainer.update_buffer.num_experiences == 15
+    for key, field in sac_trainer.update_buffer.items():
+        np.testing.assert_array_equal(
+            np.asarray(loaded_trainer.update_buffer[key]), np.asarray(field)
+        )
+    loaded_trainer.close()
+
+
+@pytest.mark.parametrize(
+    "replay_buffer_format", [ReplayBufferFormat.HDF5, ReplayBufferFormat.SEGMENTS]
+)
+def test_sac_trainer_saves_priorities(sac_config, replay_buffer_format, tmpdir):
+    behavior_id = BehaviorIdentifiers.from_name_behavior_id("test_brain")
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    hyperparameters = sac_config.behaviors["test_brain"].hyperparameters
+    hyperparameters.save_replay_buffer = True
+    hyperparameters.replay_buffer_format = replay_buffer_format
+    hyperparameters.prioritized_replay = PrioritizedReplaySettings()
+
+    def create_trainer(load_model):
+        trainer_factory = TrainerFactory(
+            trainer_config=sac_config.behaviors,
+            output_path=str(tmpdir),
+            train_model=True,
+            load_model=load_model,
+            seed=42,
+            param_manager=EnvironmentParameterManager(),
+        )
+        trainer = trainer_factory.generate(behavior_id.brain_name)
+        trainer.add_policy(behavior_id, trainer.create_policy(behavior_id, mock_specs))
+        return trainer
+
+    sac_trainer = create_trainer(load_model=False)
+    trajectory_queue = AgentManagerQueue(behavior_id.behavior_id)
+    sac_trainer.subscribe_trajectory_queue(trajectory_queue)
+    trajectory_queue.put(
+        make_fake_trajectory(
+            length=15,
+            max_step_complete=True,
+            observation_specs=create_observation_specs_with_shapes([(1,)]),
+            action_spec=mock_specs.action_spec,
+        )
+    )
+    sac_trainer.advance()
+    # Only some of the sequences have been sampled when saving.
+    sac_trainer._prioritized_replay.add(10)
+    sac_trainer._prioritized_replay.update(np.arange(10), np.arange(10) + 5.0)
+    priorities = sac_trainer._prioritized_replay.priorities()
+    sac_trainer.save_model()
+    sac_trainer.close()
+
+    loaded_trainer = create_trainer(load_model=True)
+    loaded_replay = loaded_trainer._prioritized_replay
+    np.testing.assert_array_equal(loaded_replay.priorities(), priorities)
+    assert loaded_replay._max_priority == sac_trainer._prioritized_replay._max_priority
+    # The sequences that weren't sampled yet get the highest priority.
+    loaded_trainer._sample_prioritized(1)
+    np.testing.assert_array_equal(
+        loaded_replay.priorities()[10:], [loaded_replay._max_priority] * 5
+    )
+    loaded_trainer.close()
+
+
 def test_poca_trainer_update_normalization(poca_config):
     behavior_id_team0 = "test_brain?team=0"
     brain_name = BehaviorIdentifiers.from_name_behavior_id(behavior_id_team0).brain_name
@@ -162,3 +387,72 @@ def test_poca_trainer_update_normalization(poca_config):
         poca_trainer.advance()
         optimizer_update_normalization_mock.assert_called_once()
         policy_update_normalization_mock.assert_called_once()
+
+
+def _pad(sequences, length):
+    padded = np.zeros((len(sequences), length), dtype=np.float32)
+    for i, seq in enumerate(sequences):
+        padded[i, : len(seq)] = seq
+    return padded
+
+
+def test_batched_returns_match_per_trajectory():
+    np.random.seed(0)
+    lengths = np.array([7, 1, 12, 12])
+    gammas = np.array([0.99, 0.9, 0.5, 0.99])
+    value_next = np.random.normal(size=len(lengths)).astype(np.float32)
+    rewards = [np.random.normal(size=n).astype(np.float32) for n in lengths]
+    values = [np.random.normal(size=n).astype(np.float32) for n in lengths]
+    max_len = max(lengths)
+
+    discounted = discount_rewards_batch(
+        _pad(rewards, max_len), lengths, gamma=gammas, value_next=value_next
+    )
+    advantages = get_gae_batch(
+        _pad(rewards, max_len),
+        _pad(values, max_len),
+        lengths,
+        value_next=value_next,
+        gamma=gammas,
+        lambd=0.95,
+    )
+    returns = lambda_return_batch(
+        _pad(rewards, max_len),
+        _pad(values, max_len),
+        lengths,
+        gamma=gammas,
+        lambd=0.8,
+        value_next=value_next,
+    )
+    # The results keep the dtype of the rewards.
+    for result in (discounted, advantages, returns):
+        assert result.dtype == np.float32
+    for i, length in enumerate(lengths):
+        np.testing.assert_allclose(
+            discounted[i, :length],
+            discount_rewards(rewards[i], gammas[i], value_next[i]),
+            rtol=1e-5,
+        )
+        np.testing.assert_allclose(
+            advantages[i, :length],
+            get_gae(rewards[i], values[i], value_next[i], gammas[i], 0.95),
+            rtol=1e-5,
+            atol=1e-6,
+        )
+        np.testing.assert_allclose(
+            returns[i, :length],
+            lambda_return(rewards[i], values[i], gammas[i], 0.8, value_next[i]),
+            rtol=1e-5,
+            atol=1e-6,
+        )
+        # Padding never leaks into the results
+        for result in (discounted, advantages, returns):
+            assert np.all(result[i, length:] == 0)
+
+
+def test_batched_returns_full_length():
+    rewards = np.ones((2, 3), dtype=np.float32)
+    np.testing.assert_allclose(
+        discount_rewards_batch(rewards, gamma=0.5),
+        [[1.75, 1.5, 1.0], [1.75, 1.5, 1.0]],
+    )
@@ -3,7 +3,7 @@ import numpy as np
 from mlagents.trainers.tests.mock_brain import make_fake_trajectory
 from mlagents.trainers.tests.dummy_config import create_observation_specs_with_shapes
 from mlagents.trainers.trajectory import GroupObsUtil
-from mlagents_envs.base_env import ActionSpec
+from mlagents_envs.base_env import ActionSpec, ActionTuple
 from mlagents.trainers.buffer import AgentBuffer, BufferKey, ObservationKeyPrefix
 
 VEC_OBS_SIZE = 6
@@ -61,6 +61,25 @@ def test_trajectory_to_agentbuffer():
             assert len(step) == 4
 
 
+def test_trajectory_to_agentbuffer_action_mask():
+    trajectory = make_fake_trajectory(
+        length=3,
+        observation_specs=create_observation_specs_with_shapes([(VEC_OBS_SIZE,)]),
+        action_spec=ActionSpec.create_discrete((3, 2)),
+    )
+    steps = [
+        exp._replace(
+            action_mask=[np.array([False, True, False]), np.array([True, False])]
+        )
+        for exp in trajectory.steps
+    ]
+    agentbuffer = trajectory._replace(steps=steps).to_agentbuffer()
+    # Action masks are flipped so that 1 means active
+    assert np.array_equal(
+        np.array(agentbuffer[BufferKey.ACTION_MASK]), [[1, 0, 1, 0, 1]] * 3
+    )
+
+
 def test_obsutil_group_from_buffer():
     buff = AgentBuffer()
     # Create some obs
@@ -88,3 +107,65 @@ def test_obsutil_group_from_buffer():
                 assert np.isnan(_exp_obs).all()
             else:
                 assert not np.isnan(_exp_obs).any()
+
+
+def test_obsutil_group_from_buffer_uint8():
+    buff = AgentBuffer()
+    obs = np.full((3, 2, 2), 255, dtype=np.uint8)
+    for _ in range(2):
+        buff[GroupObsUtil.get_name_at(0)].append(2 * [obs])
+    buff[GroupObsUtil.get_name_at(0)].append([obs])
+
+    # uint8 observations can't be padded with NaNs, they are normalized instead.
+    gobs = GroupObsUtil.from_buffer(buff, 1)
+    assert np.allclose(gobs[0][0], 1.0)
+    assert np.allclose(gobs[1][0][:2], 1.0)
+    assert np.isnan(gobs[1][0][2]).all()
+
+
+def test_trajectory_to_agentbuffer_next_fields():
+    length = 5
+    trajectory = make_fake_trajectory(
+        length=length,
+        observation_specs=create_observation_specs_with_shapes([(VEC_OBS_SIZE,)]),
+        action_spec=ActionSpec(2, (3, 2)),
+        num_other_agents_in_group=2,
+    )
+    # Make every step distinguishable
+    steps = [
+        exp._replace(
+            obs=[np.full(VEC_OBS_SIZE, i, dtype=np.float32)],
+            action=ActionTuple(
+                continuous=np.full(2, i, dtype=np.float32),
+                discrete=np.full(2, i, dtype=np.int32),
+            ),
+        )
+        for i, exp in enumerate(trajectory.steps)
+    ]
+    trajectory = trajectory._replace(
+        steps=steps,
+        next_obs=[np.full(VEC_OBS_SIZE, length, dtype=np.float32)],
+        next_group_obs=[[np.full(VEC_OBS_SIZE, -1, dtype=np.float32)]],
+    )
+    agentbuffer = trajectory.to_agentbuffer()
+
+    obs = np.array(agentbuffer[(ObservationKeyPrefix.OBSERVATION, 0)])
+    next_obs = np.array(agentbuffer[(ObservationKeyPrefix.NEXT_OBSERVATION, 0)])
+    assert np.array_equal(obs[:, 0], np.arange(length))
+    assert np.array_equal(next_obs[:, 0], np.arange(1, length + 1))
+
+    next_actions = np.array(agentbuffer[BufferKey.NEXT_CONT_ACTION])
+    assert np.array_equal(next_actions[:, 0], [1, 2, 3, 4, 0])
+    next_actions = np.array(agentbuffer[BufferKey.NEXT_DISC_ACTION])
+    assert np.array_equal(next_actions[:, 0], [1, 2, 3, 4, 0])
+
+    # The last next group obs comes from the trajectory's next_group_obs
+    next_group_obs = agentbuffer[(ObservationKeyPrefix.NEXT_GROUP_OBSERVATION, 0)]
+    assert len(next_group_obs[0]) == 2
+    assert len(next_group_obs[-1]) == 1
+    assert np.array_equal(next_group_obs[-1][0], np.full(VEC_OBS_SIZE, -1))
+
+    # Without action masks every discrete action is active, padded with 1
+    action_mask = agentbuffer[BufferKey.ACTION_MASK]
+    assert np.array_equal(np.array(action_mask), np.ones((length, 2)))
+    assert action_mask.padding_value == 1
@@ -72,6 +72,68 @@ def test_load_save_policy(tmp_path):
     assert policy3.get_current_step() == 0
 
 
+def test_save_policy_in_background(tmp_path):
+    path1 = os.path.join(tmp_path, "runid1")
+    trainer_params = TrainerSettings()
+    policy = create_policy_mock(trainer_params.network_settings)
+    model_saver = TorchModelSaver(trainer_params, path1, max_pending_checkpoints=1)
+    model_saver.register(policy)
+    model_saver.initialize_or_load(policy)
+    policy.set_step(2000)
+    expected_state = {
+        name: value.clone() for name, value in policy.actor.state_dict().items()
+    }
+
+    export_path, auxillary_paths = model_saver.save_checkpoint("MockBrain", 2000)
+    # Training goes on while the checkpoint is written.
+    with torch.no_grad():
+        for param in policy.actor.parameters():
+            param.add_(1.0)
+    model_saver.flush()
+    assert os.path.isfile(export_path)
+    assert os.path.isfile(auxillary_paths[0])
+
+    # The checkpoint holds the weights from when it was taken.
+    model_saver2 = TorchModelSaver(trainer_params, path1, load=True)
+    policy2 = create_policy_mock(trainer_params.network_settings)
+    model_saver2.register(policy2)
+    model_saver2.initialize_or_load(policy2)
+    for name, value in policy2.actor.state_dict().items():
+        assert torch.equal(value, expected_state[name])
+    assert policy2.get_current_step() == 2000
+
+    model_saver.remove_checkpoint(
+        {"file_path": export_path, "auxillary_file_paths": auxillary_paths}
+    )
+    model_saver.close()
+    assert not os.path.exists(export_path)
+    assert not os.path.exists(auxillary_paths[0])
+
+
+def test_save_policy_in_background_error(tmp_path):
+    path1 = os.path.join(tmp_path, "runid1")
+    trainer_params = TrainerSettings()
+    policy = create_policy_mock(trainer_params.network_settings)
+    model_saver = TorchModelSaver(trainer_params, path1, max_pending_checkpoints=1)
+    model_saver.register(policy)
+    model_saver.initialize_or_load(policy)
+    with mock.patch.object(
+        model_saver.exporter, "export_policy_model", side_effect=OSError("disk full")
+    ):
+        model_saver.save_checkpoint("MockBrain", 1000)
+        # The error of the previous checkpoint is raised when saving the next one.
+        with pytest.raises(OSError, match="disk full"):
+            model_saver.save_checkpoint("MockBrain", 2000)
+        model_saver.save_checkpoint("MockBrain", 2000)
+        with pytest.raises(OSError, match="disk full"):
+            model_saver.flush()
+        model_saver.flush()
+
+        model_saver.save_checkpoint("MockBrain", 3000)
+        with pytest.raises(OSError, match="disk full"):
+            model_saver.close()
+
+
 @pytest.mark.parametrize("vis_encode_type", ["resnet", "nature_cnn", "match3"])
 def test_load_policy_different_hidden_units(tmp_path, vis_encode_type):
     path1 = os.path.join(tmp_path, "runid1")
@@ -93,6 +93,24 @@ def test_visual_encoder(vis_class, image_size):
     assert encoding.shape == (1, num_outputs)
 
 
+@pytest.mark.parametrize(
+    "vis_class",
+    [
+        SimpleVisualEncoder,
+        ResNetVisualEncoder,
+        NatureVisualEncoder,
+        SmallVisualEncoder,
+        FullyConnectedVisualEncoder,
+    ],
+)
+def test_visual_encoder_uint8(vis_class):
+    image_size = (3, 36, 36)
+    enc = vis_class(image_size[1], image_size[2], image_size[0], 16)
+    uint8_input = torch.randint(0, 256, (2,) + image_size, dtype=torch.uint8)
+    # uint8 inputs are normalized to [0, 1] in the encoder
+    assert torch.allclose(enc(uint8_input), enc(uint8_input.float() / 255.0))
+
+
 @pytest.mark.parametrize(
     "vis_class, size",
     [
@@ -1,17 +1,27 @@
+import os
+
 import pytest
 
 import numpy as np
 
+from mlagents.torch_utils import torch
+
 from mlagents.trainers.ghost.trainer import GhostTrainer
 from mlagents.trainers.ghost.controller import GhostController
+from mlagents.trainers.ghost.snapshot_pool import SnapshotPool
 from mlagents.trainers.behavior_id_utils import BehaviorIdentifiers
+from mlagents.trainers.policy.weight_store import VersionedWeightStore
 from mlagents.trainers.ppo.trainer import PPOTrainer
 from mlagents.trainers.agent_processor import AgentManagerQueue
 from mlagents.trainers.buffer import BufferKey, RewardSignalUtil
 from mlagents.trainers.tests import mock_brain as mb
 from mlagents.trainers.tests.mock_brain import copy_buffer_fields
 from mlagents.trainers.tests.test_trajectory import make_fake_trajectory
-from mlagents.trainers.settings import TrainerSettings, SelfPlaySettings
+from mlagents.trainers.settings import (
+    OpponentSamplingType,
+    SelfPlaySettings,
+    TrainerSettings,
+)
 from mlagents.trainers.tests.dummy_config import create_observation_specs_with_shapes
 
 
@@ -103,6 +113,130 @@ def test_resume(dummy_config, tmp_path):
     for w, lw in zip(weights, weights2):
         np.testing.assert_array_equal(w, lw)
 
+    # The snapshot of the first run was restored, and the resumed policy was added.
+    assert len(trainer2.policy_snapshots) == 2
+    assert trainer2.snapshot_counter == 2
+
+
+def test_snapshot_pool(dummy_config, tmp_path):
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    trainer = PPOTrainer("test", 0, dummy_config, True, False, 0, "0")
+    policy = trainer.create_policy("test", mock_specs)
+    ghost_policy = trainer.create_policy("test", mock_specs)
+    weight_store = VersionedWeightStore()
+    directory = os.path.join(tmp_path.as_posix(), "snapshots")
+    pool = SnapshotPool(3, directory, half_precision=True, max_in_memory=1)
+
+    all_weights = []
+    for index in range(3):
+        with torch.no_grad():
+            for param in policy.actor.parameters():
+                param.add_(1.0)
+        weight_store.publish(policy.get_weights_view())
+        pool.put(index, {"test": weight_store.snapshot()})
+        all_weights.append(policy.get_weights())
+    assert len(pool) == 3
+    # Only the latest snapshot is kept in memory.
+    assert [pool[i]["test"].in_memory for i in range(3)] == [False, False, True]
+    assert len(os.listdir(directory)) == 2
+    assert any(
+        descriptor.storage_dtype == np.dtype(np.float16).str
+        for descriptor in pool[0]["test"].tensors
+    )
+
+    def _assert_loaded(snapshot, weights):
+        assert snapshot.load_into(ghost_policy)
+        for name, value in ghost_policy.get_weights().items():
+            assert value.dtype == weights[name].dtype
+            np.testing.assert_allclose(value, weights[name], rtol=1e-3, atol=1e-3)
+
+    for index in range(3):
+        _assert_loaded(pool[index]["test"], all_weights[index])
+    assert not pool[2]["test"].load_into(ghost_policy)
+
+    # The file of a replaced snapshot is removed once the index no longer lists it.
+    pool.put(0, {"test": weight_store.snapshot()})
+    assert len(os.listdir(directory)) == 3
+
+    pool.save(1, [1000.0, 1100.0, 1200.0, 1300.0])
+    assert sorted(os.listdir(directory)) == [
+        "snapshots.json",
+        "test-1.bin",
+        "test-2.bin",
+        "test-3.bin",
+    ]
+    restored_pool = SnapshotPool(3, directory)
+    assert restored_pool.load() == (1, [1000.0, 1100.0, 1200.0])
+    for index in range(3):
+        assert not restored_pool[index]["test"].in_memory
+    _assert_loaded(restored_pool[0]["test"], all_weights[2])
+    _assert_loaded(restored_pool[1]["test"], all_weights[1])
+    assert SnapshotPool(3, tmp_path.as_posix()).load() is None
+
+
+def test_snapshot_pool_resume_after_replace(dummy_config, tmp_path):
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    trainer = PPOTrainer("test", 0, dummy_config, True, False, 0, "0")
+    policy = trainer.create_policy("test", mock_specs)
+    weight_store = VersionedWeightStore()
+    weight_store.publish(policy.get_weights_view())
+    directory = tmp_path.as_posix()
+    pool = SnapshotPool(3, directory, max_in_memory=1)
+    for index in range(3):
+        pool.put(index, {"test": weight_store.snapshot()})
+    pool.save(0, [1000.0, 1100.0, 1200.0])
+
+    # Training stops after replacing a slot and before saving again.
+    pool.put(0, {"test": weight_store.snapshot()})
+    pool.put(1, {"test": weight_store.snapshot()})
+    restored_pool = SnapshotPool(3, directory)
+    assert restored_pool.load() == (0, [1000.0, 1100.0, 1200.0])
+    assert restored_pool.serials == [0, 1, 2]
+    for index in range(3):
+        assert os.path.exists(restored_pool[index]["test"].path)
+
+    pool.save(2, [1300.0, 1400.0, 1200.0])
+    restored_pool = SnapshotPool(3, directory)
+    assert restored_pool.load() == (2, [1300.0, 1400.0, 1200.0])
+    assert restored_pool.serials == [3, 4, 2]
+    assert not os.path.exists(os.path.join(directory, "test-0.bin"))
+
+    # Without the file of a snapshot, the next snapshot replaces the oldest one.
+    os.remove(os.path.join(directory, "test-3.bin"))
+    restored_pool = SnapshotPool(3, directory)
+    assert restored_pool.load() == (2, [1200.0, 1400.0])
+    assert restored_pool.serials == [2, 4]
+
+
+def test_snapshot_pool_elo_sampling(dummy_config, tmp_path):
+    mock_specs = mb.setup_test_behavior_specs(
+        True, False, vector_action_space=[2], vector_obs_space=1
+    )
+    trainer = PPOTrainer("test", 0, dummy_config, True, False, 0, "0")
+    policy = trainer.create_policy("test", mock_specs)
+    weight_store = VersionedWeightStore()
+    weight_store.publish(policy.get_weights_view())
+    pool = SnapshotPool(3, tmp_path.as_posix())
+    for index in range(3):
+        pool.put(index, {"test": weight_store.snapshot()})
+
+    np.random.seed(0)
+    elos = [1000.0, 1600.0, 1200.0]
+    counts = np.bincount(
+        [pool.sample(OpponentSamplingType.ELO, elos, 1200.0) for _ in range(1000)],
+        minlength=3,
+    )
+    assert counts[1] > counts[2] > counts[0] > 0
+    counts = np.bincount(
+        [pool.sample(OpponentSamplingType.UNIFORM, elos, 1200.0) for _ in range(1000)],
+        minlength=3,
+    )
+    assert all(count > 250 for count in counts)
+
 
 def test_process_trajectory(dummy_config):
     mock_specs = mb.setup_test_behavior_specs(
@@ -236,6 +236,50 @@ def test_multinetworkbody_visual(with_actions):
         assert _enc == pytest.approx(1.0, abs=0.1)
 
 
+def test_multinetworkbody_absent_agents():
+    torch.manual_seed(0)
+    batch_size = 5
+    n_agents = 3
+    obs_shapes = [(4,), (3, 20, 20)]
+    networkbody = MultiAgentNetworkBody(
+        create_observation_specs_with_shapes(obs_shapes),
+        NetworkSettings(),
+        ActionSpec.create_continuous(2),
+    )
+    sample_obs = [
+        [torch.rand((batch_size,) + shape) for shape in obs_shapes]
+        for _ in range(n_agents)
+    ]
+    # The last agent is absent for the first 2 steps
+    for obs in sample_obs[-1]:
+        obs[:2] = float("nan")
+    attn_mask = networkbody._get_masks_from_nans(sample_obs)
+    assert attn_mask[:, -1].tolist() == [1, 1, 0, 0, 0]
+
+    encoded = networkbody._encode_agents(sample_obs, attn_mask)
+    assert encoded.shape == (
+        batch_size,
+        n_agents,
+        networkbody.observation_encoder.total_enc_size,
+    )
+    # Same as encoding the agents one at a time with the NaNs replaced by zeros.
+    for i, agent_obs in enumerate(sample_obs):
+        expected = networkbody.observation_encoder(
+            [torch.nan_to_num(obs, nan=0.0) for obs in agent_obs]
+        )
+        assert torch.allclose(encoded[:, i], expected, atol=1e-6)
+
+    # uint8 visual observations of the first agent are normalized before being
+    # batched with the float ones of the other agents.
+    uint8_visual_obs = (sample_obs[0][1] * 255).round().to(torch.uint8)
+    uint8_sample_obs = [[sample_obs[0][0], uint8_visual_obs]] + sample_obs[1:]
+    encoded = networkbody._encode_agents(uint8_sample_obs, attn_mask)
+    expected = networkbody.observation_encoder(
+        [sample_obs[0][0], uint8_visual_obs.float() / 255.0]
+    )
+    assert torch.allclose(encoded[:, 0], expected, atol=1e-6)
+
+
 def test_valuenetwork():
     torch.manual_seed(0)
     obs_size = 4
@@ -1,6 +1,12 @@
+import numpy as np
 import pytest
 
+from mlagents.torch_utils import torch
+from mlagents_envs.base_env import ActionTuple
+from mlagents.trainers.behavior_id_utils import get_global_agent_id
+from mlagents.trainers.policy.policy import AgentArrayStore, UnityPolicyException
 from mlagents.trainers.policy.torch_policy import TorchPolicy
+from mlagents.trainers.policy.weight_store import VersionedWeightStore
 from mlagents.trainers.tests import mock_brain as mb
 from mlagents.trainers.settings import NetworkSettings
 from mlagents.trainers.torch_entities.networks import SimpleActor
@@ -58,9 +64,168 @@ def test_policy_evaluate(rnn, visual, discrete):
         assert run_out["action"].continuous.shape == (NUM_AGENTS, VECTOR_ACTION_SPACE)
 
 
+@pytest.mark.parametrize("discrete", [True, False], ids=["discrete", "continuous"])
+@pytest.mark.parametrize("rnn", [True, False], ids=["rnn", "no_rnn"])
+def test_policy_get_actions(rnn, discrete):
+    policy = create_policy_mock(
+        NetworkSettings(deterministic=True), use_rnn=rnn, use_discrete=discrete
+    )
+    decision_requests = []
+    for worker_id, num_agents in [(0, 3), (1, 0), (2, 5)]:
+        decision_steps, _ = mb.create_steps_from_behavior_spec(
+            policy.behavior_spec, num_agents=num_agents
+        )
+        for obs in decision_steps.obs:
+            obs[:] = np.random.normal(size=obs.shape)
+        decision_requests.append((decision_steps, worker_id))
+
+    action_infos = policy.get_actions(decision_requests)
+    assert len(action_infos) == len(decision_requests)
+    for action_info, (decision_steps, worker_id) in zip(
+        action_infos, decision_requests
+    ):
+        assert action_info.agent_ids == list(decision_steps.agent_id)
+        if len(decision_steps) == 0:
+            continue
+        global_agent_ids = [
+            get_global_agent_id(worker_id, int(agent_id))
+            for agent_id in decision_steps.agent_id
+        ]
+        if rnn:
+            for agent_id in global_agent_ids:
+                assert agent_id in policy.memory_dict
+        else:
+            # Without memories, the actions match evaluating each worker on its own.
+            run_out = policy.evaluate(decision_steps, global_agent_ids)
+            np.testing.assert_allclose(
+                action_info.env_action.continuous,
+                run_out["env_action"].continuous,
+                atol=1e-5,
+            )
+            np.testing.assert_array_equal(
+                action_info.env_action.discrete, run_out["env_action"].discrete
+            )
+            np.testing.assert_allclose(
+                action_info.outputs["log_probs"].continuous,
+                run_out["log_probs"].continuous,
+                atol=1e-5,
+            )
+
+
 def test_step_overflow():
     policy = create_policy_mock(NetworkSettings())
     policy.set_step(2**31 - 1)
     assert policy.get_current_step() == 2**31 - 1  # step = 2147483647
     policy.increment_step(3)
     assert policy.get_current_step() == 2**31 + 2  # step = 2147483650
+
+
+def test_agent_array_store():
+    store = AgentArrayStore((2,), np.float32)
+    agent_ids = [f"agent-{i}" for i in range(AgentArrayStore.INITIAL_CAPACITY + 4)]
+    values = np.arange(2 * len(agent_ids), dtype=np.float32).reshape(-1, 2)
+    # Saving more agents than the initial capacity grows the store.
+    store.save(agent_ids, values)
+    assert len(store) == len(agent_ids)
+    np.testing.assert_array_equal(store.retrieve(agent_ids[::-1]), values[::-1])
+    np.testing.assert_array_equal(store["agent-3"], values[3])
+
+    # Unknown agents get zeros.
+    retrieved = store.retrieve(["agent-1", "unknown"])
+    np.testing.assert_array_equal(retrieved, [values[1], [0, 0]])
+
+    # The slots of removed agents are reused.
+    store.remove(["agent-1", "unknown"])
+    assert "agent-1" not in store
+    np.testing.assert_array_equal(store.retrieve(["agent-1"]), [[0, 0]])
+    store.save(["new-agent"], np.ones((1, 2)))
+    assert store.get_slots(["new-agent"])[0] == 1
+    np.testing.assert_array_equal(store.retrieve(agent_ids[2:]), values[2:])
+
+
+def test_policy_memories():
+    policy = create_policy_mock(NetworkSettings(), use_rnn=True)
+    agent_ids = ["0-0", "0-1"]
+    memories = np.random.normal(size=(2, policy.m_size)).astype(np.float32)
+    policy.save_memories(agent_ids, memories)
+    np.testing.assert_array_equal(policy.retrieve_memories(agent_ids), memories)
+    assert not policy.retrieve_previous_memories(agent_ids).any()
+
+    policy.save_memories(["0-1", "0-2"], memories + 1)
+    np.testing.assert_array_equal(
+        policy.retrieve_memories(agent_ids + ["0-2"]),
+        [memories[0], memories[0] + 1, memories[1] + 1],
+    )
+    np.testing.assert_array_equal(
+        policy.retrieve_previous_memories(["0-1", "0-2"]),
+        [memories[1], np.zeros(policy.m_size)],
+    )
+
+    policy.remove_memories(["0-1"])
+    assert not policy.retrieve_memories(["0-1"]).any()
+    assert not policy.retrieve_previous_memories(["0-1"]).any()
+    assert "0-0" in policy.memory_dict
+
+
+def test_policy_previous_action():
+    policy = create_policy_mock(NetworkSettings(), use_discrete=True)
+    action_tuple = ActionTuple(
+        discrete=np.array([[1, 0, 2, 1], [2, 1, 0, 0]], dtype=np.int32)
+    )
+    # Each agent needs its own row of actions.
+    with pytest.raises(UnityPolicyException):
+        policy.save_previous_action(["0-0"], action_tuple)
+    assert "0-0" not in policy.previous_action_dict
+    policy.save_previous_action(["0-1", "0-0"], action_tuple)
+    np.testing.assert_array_equal(
+        policy.retrieve_previous_action(["0-0", "0-1"]), [[2, 1, 0, 0], [1, 0, 2, 1]]
+    )
+    policy.remove_previous_action(["0-0"])
+    np.testing.assert_array_equal(
+        policy.retrieve_previous_action(["0-0", "0-1"]), [[0, 0, 0, 0], [1, 0, 2, 1]]
+    )
+
+
+def _assert_weights_equal(policy, weights):
+    for name, value in policy.get_weights().items():
+        assert torch.equal(value, weights[name])
+
+
+def test_versioned_weight_store():
+    trained_policy = create_policy_mock(NetworkSettings(), seed=0)
+    inference_policy = create_policy_mock(NetworkSettings(), seed=1)
+    store = VersionedWeightStore()
+    assert not store.load_into(inference_policy)
+
+    version = store.publish(trained_policy.get_weights_view())
+    assert store.version == version
+    assert store.load_into(inference_policy)
+    assert inference_policy.weights_version == version
+    _assert_weights_equal(inference_policy, trained_policy.get_weights())
+    # The weights didn't change, so they aren't loaded again.
+    assert not store.load_into(inference_policy)
+
+    snapshot = store.snapshot()
+    initial_weights = trained_policy.get_weights()
+    with torch.no_grad():
+        for param in trained_policy.actor.parameters():
+            param.add_(1.0)
+    # The store copied the weights, so the update isn't visible until it is published.
+    _assert_weights_equal(inference_policy, initial_weights)
+    store.publish(trained_policy.get_weights_view())
+    buffers = {id(value) for value in store._buffers[1 - store._front].values()}
+    new_version = store.publish(trained_policy.get_weights_view())
+    assert new_version > version
+    # The buffers are reused once both of them were allocated.
+    assert {id(value) for value in store._buffers[store._front].values()} == buffers
+    assert store.load_into(inference_policy)
+    _assert_weights_equal(inference_policy, trained_policy.get_weights())
+
+    # Snapshots keep the weights of their version.
+    assert snapshot.load_into(inference_policy)
+    _assert_weights_equal(inference_policy, initial_weights)
+    assert not snapshot.load_into(inference_policy)
+    # Loading weights directly invalidates the version.
+    inference_policy.load_weights(snapshot.weights)
+    assert inference_policy.weights_version is None
+    assert snapshot.load_into(inference_policy)
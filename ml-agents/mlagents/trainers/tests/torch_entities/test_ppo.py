@@ -9,6 +9,7 @@ from mlagents.trainers.torch_entities.networks import SimpleActor
 from mlagents.trainers.tests import mock_brain as mb
 from mlagents.trainers.tests.mock_brain import copy_buffer_fields
 from mlagents.trainers.tests.test_trajectory import make_fake_trajectory
+from mlagents.trainers.trajectory import ObsUtil
 from mlagents.trainers.settings import NetworkSettings
 from mlagents.trainers.tests.dummy_config import (  # noqa: F401
     ppo_dummy_config,
@@ -105,6 +106,54 @@ def test_ppo_optimizer_update(dummy_config, rnn, visual, discrete):
         assert stat in return_stats.keys()
 
 
+@pytest.mark.parametrize("rnn", [True, False], ids=["rnn", "no_rnn"])
+def test_ppo_optimizer_update_uint8_visual_obs(dummy_config, rnn):
+    optimizer = create_test_ppo_optimizer(
+        dummy_config, use_rnn=rnn, use_discrete=True, use_visual=True
+    )
+    update_buffer = mb.simulate_rollout(
+        BUFFER_INIT_SAMPLES,
+        optimizer.policy.behavior_spec,
+        memory_size=optimizer.policy.m_size,
+    )
+    copy_buffer_fields(
+        update_buffer,
+        BufferKey.ENVIRONMENT_REWARDS,
+        [
+            BufferKey.ADVANTAGES,
+            RewardSignalUtil.returns_key("extrinsic"),
+            RewardSignalUtil.value_estimates_key("extrinsic"),
+        ],
+    )
+    copy_buffer_fields(update_buffer, BufferKey.MEMORY, [BufferKey.CRITIC_MEMORY])
+    float_values, _, _ = optimizer.get_trajectory_value_estimates(
+        update_buffer,
+        [np.ones((3, 84, 84)), np.ones(VECTOR_OBS_SPACE)],
+        done=False,
+        agent_id="float",
+    )
+    # Store the visual observations as uint8, like with --uint8-visual-obs.
+    visual_obs = np.asarray(update_buffer[ObsUtil.get_name_at(0)])
+    update_buffer[ObsUtil.get_name_at(0)].set(
+        list((visual_obs * 255).round().astype(np.uint8))
+    )
+    uint8_values, _, _ = optimizer.get_trajectory_value_estimates(
+        update_buffer,
+        [np.full((3, 84, 84), 255, dtype=np.uint8), np.ones(VECTOR_OBS_SPACE)],
+        done=False,
+        agent_id="uint8",
+    )
+    np.testing.assert_allclose(
+        uint8_values["extrinsic"], float_values["extrinsic"], atol=1e-5
+    )
+
+    return_stats = optimizer.update(
+        update_buffer,
+        num_sequences=update_buffer.num_experiences // optimizer.policy.sequence_length,
+    )
+    assert "Losses/Policy Loss" in return_stats
+
+
 @pytest.mark.parametrize("discrete", [True, False], ids=["discrete", "continuous"])
 @pytest.mark.parametrize("visual", [True, False], ids=["visual", "vector"])
 @pytest.mark.parametrize("rnn", [True, False], ids=["rnn", "no_rnn"])
@@ -244,5 +293,59 @@ def test_ppo_get_value_estimates(dummy_config, rnn, visual, discrete):
         assert val != 0.0
 
 
+@pytest.mark.parametrize("rnn", [True, False], ids=["rnn", "no_rnn"])
+def test_ppo_get_batch_value_estimates(dummy_config, rnn):
+    optimizer = create_test_ppo_optimizer(
+        dummy_config, use_rnn=rnn, use_discrete=True, use_visual=False
+    )
+    # Trajectories of different lengths, with two trajectories of the same agent.
+    lengths = [30, 17, 30, 5]
+    agent_ids = ["agent_0", "agent_1", "agent_0", "agent_2"]
+    dones = [False, True, False, False]
+    batches = [
+        mb.simulate_rollout(length, optimizer.policy.behavior_spec)
+        for length in lengths
+    ]
+    next_obs = [
+        [
+            np.random.normal(size=obs_spec.shape).astype(np.float32)
+            for obs_spec in optimizer.policy.behavior_spec.observation_specs
+        ]
+        for _ in lengths
+    ]
+    expected = [
+        optimizer.get_trajectory_value_estimates(*args)
+        for args in zip(batches, next_obs, dones, agent_ids)
+    ]
+    expected_memories = dict(optimizer.critic_memory_dict)
+    optimizer.critic_memory_dict.clear()
+
+    results = optimizer.get_batch_value_estimates(batches, next_obs, dones, agent_ids)
+    assert len(results) == len(lengths)
+    for (values, next_values, memories), (
+        expected_values,
+        expected_next_values,
+        expected_all_memories,
+    ) in zip(results, expected):
+        for name, value in expected_values.items():
+            np.testing.assert_allclose(values[name], value, atol=1e-5)
+            np.testing.assert_allclose(
+                next_values[name], expected_next_values[name], atol=1e-5
+            )
+        if rnn:
+            np.testing.assert_allclose(
+                np.array(memories), np.array(expected_all_memories), atol=1e-5
+            )
+        else:
+            assert memories is None
+    assert optimizer.critic_memory_dict.keys() == expected_memories.keys()
+    if rnn:
+        for agent_id, memory in expected_memories.items():
+            assert not optimizer.critic_memory_dict[agent_id].requires_grad
+            np.testing.assert_allclose(
+                optimizer.critic_memory_dict[agent_id], memory, atol=1e-5
+            )
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from mlagents.torch_utils import torch
 
 from mlagents.trainers.buffer import BufferKey, RewardSignalUtil
@@ -88,6 +89,31 @@ def test_sac_optimizer_update(dummy_config, rnn, visual, discrete):
         assert stat in return_stats.keys()
 
 
+@pytest.mark.parametrize("discrete", [True, False], ids=["discrete", "continuous"])
+@pytest.mark.parametrize("rnn", [True, False], ids=["rnn", "no_rnn"])
+def test_sac_optimizer_update_prioritized(dummy_config, rnn, discrete):
+    torch.manual_seed(0)
+    optimizer = create_sac_optimizer_mock(
+        dummy_config, use_rnn=rnn, use_discrete=discrete, use_visual=False
+    )
+    update_buffer = mb.simulate_rollout(
+        BUFFER_INIT_SAMPLES, optimizer.policy.behavior_spec, memory_size=12
+    )
+    update_buffer[RewardSignalUtil.rewards_key("extrinsic")] = update_buffer[
+        BufferKey.ENVIRONMENT_REWARDS
+    ]
+    update_buffer[BufferKey.CRITIC_MEMORY] = update_buffer[BufferKey.MEMORY]
+    importance_weights = np.random.uniform(size=update_buffer.num_experiences)
+    return_stats, td_errors = optimizer.update_prioritized(
+        update_buffer,
+        update_buffer.num_experiences // optimizer.policy.sequence_length,
+        importance_weights,
+    )
+    assert "Losses/Q1 Loss" in return_stats
+    assert td_errors.shape == (update_buffer.num_experiences,)
+    assert np.all(td_errors >= 0)
+
+
 @pytest.mark.parametrize("discrete", [True, False], ids=["discrete", "continuous"])
 def test_sac_update_reward_signals(
     dummy_config, curiosity_dummy_config, discrete  # noqa: F811
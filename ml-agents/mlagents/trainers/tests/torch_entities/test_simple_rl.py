@@ -19,6 +19,7 @@ from mlagents.trainers.settings import (
     RewardSignalType,
     EncoderType,
     ConditioningType,
+    PrioritizedReplaySettings,
 )
 
 from mlagents_envs.communicator_objects.demonstration_meta_pb2 import (
@@ -255,6 +256,27 @@ def test_simple_sac(action_sizes):
     check_environment_trains(env, {BRAIN_NAME: config})
 
 
+@pytest.mark.parametrize("action_sizes", [(0, 1), (1, 0)])
+def test_simple_sac_columnar_buffer(action_sizes):
+    env = SimpleEnvironment([BRAIN_NAME], action_sizes=action_sizes)
+    new_hyperparams = attr.evolve(
+        SAC_TORCH_CONFIG.hyperparameters, columnar_buffer=True
+    )
+    config = attr.evolve(SAC_TORCH_CONFIG, hyperparameters=new_hyperparams)
+    check_environment_trains(env, {BRAIN_NAME: config})
+
+
+@pytest.mark.parametrize("action_sizes", [(0, 1), (1, 0)])
+def test_simple_sac_prioritized_replay(action_sizes):
+    env = SimpleEnvironment([BRAIN_NAME], action_sizes=action_sizes)
+    new_hyperparams = attr.evolve(
+        SAC_TORCH_CONFIG.hyperparameters,
+        prioritized_replay=PrioritizedReplaySettings(),
+    )
+    config = attr.evolve(SAC_TORCH_CONFIG, hyperparameters=new_hyperparams)
+    check_environment_trains(env, {BRAIN_NAME: config})
+
+
 @pytest.mark.parametrize("action_sizes", [(0, 2), (2, 0)])
 def test_2d_sac(action_sizes):
     env = SimpleEnvironment([BRAIN_NAME], action_sizes=action_sizes, step_size=0.8)
@@ -42,7 +42,10 @@ class BCModule:
         params = self.policy.actor.parameters()
         self.optimizer = torch.optim.Adam(params, lr=self.current_lr)
         _, self.demonstration_buffer = demo_to_buffer(
-            settings.demo_path, policy.sequence_length, policy.behavior_spec
+            settings.demo_path,
+            policy.sequence_length,
+            policy.behavior_spec,
+            cache_dir=settings.demo_cache_dir,
         )
         self.batch_size = (
             settings.batch_size if settings.batch_size else default_batch_size
@@ -149,7 +152,7 @@ class BCModule:
             mini_batch_demo, len(self.policy.behavior_spec.observation_specs)
         )
         # Convert to tensors
-        tensor_obs = [ModelUtils.list_to_tensor(obs) for obs in np_obs]
+        tensor_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in np_obs]
         act_masks = None
         expert_actions = AgentAction.from_buffer(mini_batch_demo)
         if self.policy.behavior_spec.action_spec.discrete_size > 0:
@@ -13,6 +13,7 @@ from mlagents.trainers.torch_entities.utils import ModelUtils
 from mlagents.trainers.torch_entities.agent_action import AgentAction
 from mlagents.trainers.torch_entities.action_flattener import ActionFlattener
 from mlagents.trainers.torch_entities.networks import NetworkBody
+from mlagents.trainers.torch_entities.encoders import normalize_visual_obs
 from mlagents.trainers.torch_entities.layers import linear_layer, Initialization
 from mlagents.trainers.demo_loader import demo_to_buffer
 from mlagents.trainers.trajectory import ObsUtil
@@ -27,7 +28,7 @@ class GAILRewardProvider(BaseRewardProvider):
         self._discriminator_network = DiscriminatorNetwork(specs, settings)
         self._discriminator_network.to(default_device())
         _, self._demo_buffer = demo_to_buffer(
-            settings.demo_path, 1, specs
+            settings.demo_path, 1, specs, cache_dir=settings.demo_cache_dir
         )  # This is supposed to be the sequence length but we do not have access here
         params = list(self._discriminator_network.parameters())
         self.optimizer = torch.optim.Adam(params, lr=settings.learning_rate)
@@ -126,7 +127,7 @@ class DiscriminatorNetwork(torch.nn.Module):
         n_obs = len(self.encoder.processors)
         np_obs = ObsUtil.from_buffer(mini_batch, n_obs)
         # Convert to tensors
-        tensor_obs = [ModelUtils.list_to_tensor(obs) for obs in np_obs]
+        tensor_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in np_obs]
         return tensor_obs
 
     def compute_estimate(
@@ -219,6 +220,9 @@ class DiscriminatorNetwork(torch.nn.Module):
         expert_inputs = self.get_state_inputs(expert_batch)
         interp_inputs = []
         for policy_input, expert_input in zip(policy_inputs, expert_inputs):
+            # uint8 visual observations are interpolated as floats in [0, 1].
+            policy_input = normalize_visual_obs(policy_input)
+            expert_input = normalize_visual_obs(expert_input)
             obs_epsilon = torch.rand(policy_input.shape)
             interp_input = obs_epsilon * policy_input + (1 - obs_epsilon) * expert_input
             interp_input.requires_grad = True  # For gradient calculation
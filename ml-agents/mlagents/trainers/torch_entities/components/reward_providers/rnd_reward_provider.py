@@ -73,7 +73,7 @@ class RNDNetwork(torch.nn.Module):
         n_obs = len(self._encoder.processors)
         np_obs = ObsUtil.from_buffer(mini_batch, n_obs)
         # Convert to tensors
-        tensor_obs = [ModelUtils.list_to_tensor(obs) for obs in np_obs]
+        tensor_obs = [ModelUtils.list_to_obs_tensor(obs) for obs in np_obs]
 
         hidden, _ = self._encoder.forward(tensor_obs)
         self._encoder.update_normalization(mini_batch)
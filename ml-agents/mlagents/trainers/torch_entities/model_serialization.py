@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Optional, Tuple
 import threading
 from mlagents.torch_utils import torch
 
@@ -151,18 +151,24 @@ class ModelSerializer:
             return shape[0], shape[1], shape[2]
         return shape
 
-    def export_policy_model(self, output_filepath: str) -> None:
+    def export_policy_model(
+        self, output_filepath: str, actor: Optional[torch.nn.Module] = None
+    ) -> None:
         """
         Exports a Torch model for a Policy to .onnx format for Unity embedding.
 
         :param output_filepath: file path to output the model (without file suffix)
+        :param actor: The actor to export, e.g. a copy of the actor of the policy taken
+            at a checkpoint. Defaults to the actor of the policy.
         """
+        if actor is None:
+            actor = self.policy.actor
         onnx_output_path = f"{output_filepath}.onnx"
         logger.debug(f"Converting to {onnx_output_path}")
 
         with exporting_to_onnx():
             torch.onnx.export(
-                self.policy.actor,
+                actor,
                 self.dummy_input,
                 onnx_output_path,
                 opset_version=SerializationSettings.onnx_opset,
@@ -10,7 +10,10 @@ from mlagents.trainers.settings import NetworkSettings, EncoderType, Conditionin
 from mlagents.trainers.torch_entities.utils import ModelUtils
 from mlagents.trainers.torch_entities.decoders import ValueHeads
 from mlagents.trainers.torch_entities.layers import LSTM, LinearEncoder
-from mlagents.trainers.torch_entities.encoders import VectorInput
+from mlagents.trainers.torch_entities.encoders import (
+    VectorInput,
+    normalize_visual_obs,
+)
 from mlagents.trainers.buffer import AgentBuffer
 from mlagents.trainers.trajectory import ObsUtil
 from mlagents.trainers.torch_entities.conditioning import ConditionalEncoder
@@ -340,21 +343,32 @@ class MultiAgentNetworkBody(torch.nn.Module):
         attn_mask = only_first_obs_flat.isnan().float()
         return attn_mask
 
-    def _copy_and_remove_nans_from_obs(
+    def _encode_agents(
         self, all_obs: List[List[torch.Tensor]], attention_mask: torch.Tensor
-    ) -> List[List[torch.Tensor]]:
+    ) -> torch.Tensor:
         """
-        Helper function to remove NaNs from observations using an attention mask.
+        Encodes the observations of all the agents with a single call to the observation
+        encoder, by flattening the batch and agent dimensions. The observations of absent
+        agents (NaNs) are replaced by zeros.
+        :param all_obs: List (one per agent) of List of observation tensors.
+        :param attention_mask: Attention mask of shape (batch, num_agents), 1 for the
+            absent agents.
+        :return: Tensor of encodings of shape (batch, num_agents, encoding size).
         """
-        obs_with_no_nans = []
-        for i_agent, single_agent_obs in enumerate(all_obs):
-            no_nan_obs = []
-            for obs in single_agent_obs:
-                new_obs = obs.clone()
-                new_obs[attention_mask.bool()[:, i_agent], ::] = 0.0  # Remove NaNs fast
-                no_nan_obs.append(new_obs)
-            obs_with_no_nans.append(no_nan_obs)
-        return obs_with_no_nans
+        batch_size, num_agents = attention_mask.shape
+        absent = attention_mask.bool()
+        flat_obs = []
+        for agents_obs in zip(*all_obs):
+            if len({obs.dtype for obs in agents_obs}) > 1:
+                # The uint8 visual observations of an agent and the normalized ones
+                # of its groupmates.
+                agents_obs = tuple(normalize_visual_obs(obs) for obs in agents_obs)
+            stacked_obs = torch.stack(agents_obs, dim=1)
+            obs_mask = absent.reshape(absent.shape + (1,) * (stacked_obs.dim() - 2))
+            stacked_obs = torch.where(obs_mask, stacked_obs.new_zeros(()), stacked_obs)
+            flat_obs.append(stacked_obs.flatten(end_dim=1))
+        encoded = self.observation_encoder(flat_obs)
+        return encoded.reshape(batch_size, num_agents, -1)
 
     def forward(
         self,
@@ -377,29 +391,23 @@ class MultiAgentNetworkBody(torch.nn.Module):
         """
         self_attn_masks = []
         self_attn_inputs = []
-        concat_f_inp = []
         if obs:
             obs_attn_mask = self._get_masks_from_nans(obs)
-            obs = self._copy_and_remove_nans_from_obs(obs, obs_attn_mask)
-            for inputs, action in zip(obs, actions):
-                encoded = self.observation_encoder(inputs)
-                cat_encodes = [
-                    encoded,
-                    action.to_flat(self.action_spec.discrete_branches),
-                ]
-                concat_f_inp.append(torch.cat(cat_encodes, dim=1))
-            f_inp = torch.stack(concat_f_inp, dim=1)
+            encoded = self._encode_agents(obs, obs_attn_mask)
+            flat_actions = torch.stack(
+                [
+                    action.to_flat(self.action_spec.discrete_branches)
+                    for action in actions
+                ],
+                dim=1,
+            )
+            f_inp = torch.cat([encoded, flat_actions], dim=2)
             self_attn_masks.append(obs_attn_mask)
             self_attn_inputs.append(self.obs_action_encoder(None, f_inp))
 
-        concat_encoded_obs = []
         if obs_only:
             obs_only_attn_mask = self._get_masks_from_nans(obs_only)
-            obs_only = self._copy_and_remove_nans_from_obs(obs_only, obs_only_attn_mask)
-            for inputs in obs_only:
-                encoded = self.observation_encoder(inputs)
-                concat_encoded_obs.append(encoded)
-            g_inp = torch.stack(concat_encoded_obs, dim=1)
+            g_inp = self._encode_agents(obs_only, obs_only_attn_mask)
             self_attn_masks.append(obs_only_attn_mask)
             self_attn_inputs.append(self.obs_encoder(None, g_inp))
 
@@ -1,4 +1,4 @@
-from typing import List, Optional, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Union
 from mlagents.torch_utils import torch, nn
 from mlagents.trainers.torch_entities.layers import LinearEncoder, Initialization
 import numpy as np
@@ -235,6 +235,19 @@ class ModelUtils:
         """
         return torch.as_tensor(np.asanyarray(ndarray_list), dtype=dtype)
 
+    @staticmethod
+    def list_to_obs_tensor(
+        ndarray_list: Union[np.ndarray, List[np.ndarray]]
+    ) -> torch.Tensor:
+        """
+        Converts a list of observations into a tensor, like list_to_tensor. Visual
+        observations stored as uint8 stay uint8, they are only converted to floats
+        in the visual encoders.
+        """
+        array = np.asanyarray(ndarray_list)
+        dtype = torch.uint8 if array.dtype == np.uint8 else torch.float32
+        return torch.as_tensor(array, dtype=dtype)
+
     @staticmethod
     def list_to_tensor_list(
         ndarray_list: List[np.ndarray], dtype: Optional[torch.dtype] = torch.float32
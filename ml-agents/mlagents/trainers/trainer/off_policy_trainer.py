@@ -3,7 +3,7 @@
 # and implemented in https://github.com/hill-a/stable-baselines
 
 from collections import defaultdict
-from typing import Dict, cast
+from typing import Dict, Optional, Tuple, cast
 import os
 
 import numpy as np
@@ -11,16 +11,24 @@ from mlagents.trainers.policy.checkpoint_manager import ModelCheckpoint
 
 from mlagents_envs.logging_util import get_logger
 from mlagents_envs.timers import timed
-from mlagents.trainers.buffer import RewardSignalUtil
+from mlagents.trainers.buffer import MemoryMappedAgentBuffer, RewardSignalUtil
 from mlagents.trainers.policy import Policy
 from mlagents.trainers.optimizer.torch_optimizer import TorchOptimizer
 from mlagents.trainers.trainer.rl_trainer import RLTrainer
 from mlagents.trainers.behavior_id_utils import BehaviorIdentifiers
-from mlagents.trainers.settings import TrainerSettings, OffPolicyHyperparamSettings
+from mlagents.trainers.settings import (
+    TrainerSettings,
+    OffPolicyHyperparamSettings,
+    ReplayBufferFormat,
+)
+from mlagents.trainers.trainer.prioritized_replay import PrioritizedReplay
+from mlagents.trainers.trainer.replay_log import SegmentedReplayLog
+from mlagents.trainers.torch_entities.utils import ModelUtils
 
 logger = get_logger(__name__)
 
 BUFFER_TRUNCATE_PERCENT = 0.8
+PRIORITIES_FILENAME = "prioritized_replay.npz"
 
 
 class OffPolicyTrainer(RLTrainer):
@@ -65,6 +73,14 @@ class OffPolicyTrainer(RLTrainer):
             OffPolicyHyperparamSettings, trainer_settings.hyperparameters
         )
 
+        if self.hyperparameters.memory_mapped_buffer_dir is not None:
+            # Leave room for the experiences added between two truncations, so that the
+            # experiences are rarely moved within the files.
+            self.update_buffer = MemoryMappedAgentBuffer(
+                self.hyperparameters.memory_mapped_buffer_dir,
+                2 * self.hyperparameters.buffer_size,
+            )
+
         self._step = 0
 
         # Don't divide by zero
@@ -77,6 +93,27 @@ class OffPolicyTrainer(RLTrainer):
         )
 
         self.checkpoint_replay_buffer = self.hyperparameters.save_replay_buffer
+        self._replay_log: Optional[SegmentedReplayLog] = None
+        if (
+            self.checkpoint_replay_buffer
+            and self.hyperparameters.replay_buffer_format == ReplayBufferFormat.SEGMENTS
+        ):
+            self._replay_log = SegmentedReplayLog(
+                os.path.join(self.artifact_path, "replay_buffer")
+            )
+
+        self._prioritized_replay: Optional[PrioritizedReplay] = None
+        prioritized_replay_settings = self.hyperparameters.prioritized_replay
+        if prioritized_replay_settings is not None:
+            self._prioritized_replay = PrioritizedReplay(
+                prioritized_replay_settings.alpha, prioritized_replay_settings.epsilon
+            )
+            self._importance_sampling_beta = ModelUtils.DecayedValue(
+                prioritized_replay_settings.beta_schedule,
+                prioritized_replay_settings.beta,
+                1.0,
+                self.trainer_settings.max_steps,
+            )
 
     def _checkpoint(self) -> ModelCheckpoint:
         """
@@ -96,27 +133,93 @@ class OffPolicyTrainer(RLTrainer):
         super().save_model()
         if self.checkpoint_replay_buffer:
             self.save_replay_buffer()
+            if self._replay_log is not None:
+                self._replay_log.flush()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            if self._replay_log is not None:
+                self._replay_log.close()
 
     def save_replay_buffer(self) -> None:
         """
-        Save the training buffer's update buffer to a pickle file.
+        Save the training buffer's update buffer to a pickle file. With the segments
+        format, only the experiences added since the last save are written, in the
+        background.
         """
-        filename = os.path.join(self.artifact_path, "last_replay_buffer.hdf5")
-        logger.info(f"Saving Experience Replay Buffer to {filename}...")
-        with open(filename, "wb") as file_object:
-            self.update_buffer.save_to_file(file_object)
-            logger.info(
-                f"Saved Experience Replay Buffer ({os.path.getsize(filename)} bytes)."
+        if self._replay_log is not None:
+            self._replay_log.save(self.update_buffer)
+        else:
+            filename = os.path.join(self.artifact_path, "last_replay_buffer.hdf5")
+            logger.info(f"Saving Experience Replay Buffer to {filename}...")
+            with open(filename, "wb") as file_object:
+                self.update_buffer.save_to_file(file_object)
+                logger.info(
+                    f"Saved Experience Replay Buffer ({os.path.getsize(filename)} bytes)."
+                )
+        if self._prioritized_replay is not None:
+            self._save_priorities()
+
+    def _save_priorities(self) -> None:
+        """
+        Saves the priorities of prioritized replay next to the replay buffer. The file
+        is replaced at once, so that a crash doesn't leave a partial file behind.
+        """
+        assert self._prioritized_replay is not None
+        filename = os.path.join(self.artifact_path, PRIORITIES_FILENAME)
+        tmp_filename = f"{filename}.tmp"
+        with open(tmp_filename, "wb") as file_object:
+            self._prioritized_replay.save_to_file(file_object)
+        os.replace(tmp_filename, filename)
+
+    def _load_priorities(self) -> None:
+        """
+        Loads the priorities saved with the replay buffer. Without them, the restored
+        sequences get the highest priority, like new ones.
+        """
+        assert self._prioritized_replay is not None
+        filename = os.path.join(self.artifact_path, PRIORITIES_FILENAME)
+        if not os.path.exists(filename):
+            logger.warning(
+                f"No priorities found at {filename}, the sequences of the replay "
+                "buffer will get the highest priority."
             )
+            return
+        prioritized_replay = PrioritizedReplay(
+            self._prioritized_replay.alpha, self._prioritized_replay.epsilon
+        )
+        with open(filename, "rb") as file_object:
+            prioritized_replay.load_from_file(file_object)
+        # The replay buffer is loaded when creating the policy, before self.policy is set.
+        memory = self.trainer_settings.network_settings.memory
+        sequence_length = memory.sequence_length if memory is not None else 1
+        num_sequences_in_buffer = self.update_buffer.num_experiences // sequence_length
+        if prioritized_replay.num_sequences > num_sequences_in_buffer:
+            logger.warning(
+                f"The priorities at {filename} don't match the replay buffer, the "
+                "sequences of the replay buffer will get the highest priority."
+            )
+            return
+        self._prioritized_replay = prioritized_replay
 
     def load_replay_buffer(self) -> None:
         """
         Loads the last saved replay buffer from a file.
         """
-        filename = os.path.join(self.artifact_path, "last_replay_buffer.hdf5")
-        logger.info(f"Loading Experience Replay Buffer from {filename}...")
-        with open(filename, "rb+") as file_object:
-            self.update_buffer.load_from_file(file_object)
+        if self._replay_log is not None:
+            logger.info(
+                f"Loading Experience Replay Buffer from {self._replay_log.directory}..."
+            )
+            self._replay_log.load(self.update_buffer)
+        else:
+            filename = os.path.join(self.artifact_path, "last_replay_buffer.hdf5")
+            logger.info(f"Loading Experience Replay Buffer from {filename}...")
+            with open(filename, "rb+") as file_object:
+                self.update_buffer.load_from_file(file_object)
+        if self._prioritized_replay is not None:
+            self._load_priorities()
         logger.debug(
             "Experience replay buffer has {} experiences.".format(
                 self.update_buffer.num_experiences
@@ -198,17 +301,38 @@ class OffPolicyTrainer(RLTrainer):
             logger.debug(f"Updating SAC policy at step {self._step}")
             buffer = self.update_buffer
             if self.update_buffer.num_experiences >= self.hyperparameters.batch_size:
-                sampled_minibatch = buffer.sample_mini_batch(
-                    self.hyperparameters.batch_size,
-                    sequence_length=self.policy.sequence_length,
-                )
+                if self._prioritized_replay is None:
+                    sampled_minibatch = buffer.sample_mini_batch(
+                        self.hyperparameters.batch_size,
+                        sequence_length=self.policy.sequence_length,
+                    )
+                else:
+                    sequence_idxes, importance_weights = self._sample_prioritized(
+                        n_sequences
+                    )
+                    sampled_minibatch = buffer.make_sequence_mini_batch(
+                        sequence_idxes * self.policy.sequence_length,
+                        self.policy.sequence_length,
+                    )
                 # Get rewards for each reward
                 for name, signal in self.optimizer.reward_signals.items():
                     sampled_minibatch[RewardSignalUtil.rewards_key(name)] = (
                         signal.evaluate(sampled_minibatch) * signal.strength
                     )
 
-                update_stats = self.optimizer.update(sampled_minibatch, n_sequences)
+                if self._prioritized_replay is None:
+                    update_stats = self.optimizer.update(sampled_minibatch, n_sequences)
+                else:
+                    update_stats, td_errors = self.optimizer.update_prioritized(
+                        sampled_minibatch,
+                        n_sequences,
+                        np.repeat(importance_weights, self.policy.sequence_length),
+                    )
+                    # The priority of a sequence is its largest TD error.
+                    self._prioritized_replay.update(
+                        sequence_idxes,
+                        td_errors.reshape(-1, self.policy.sequence_length).max(axis=1),
+                    )
                 for stat_name, value in update_stats.items():
                     batch_update_stats[stat_name].append(value)
 
@@ -226,13 +350,43 @@ class OffPolicyTrainer(RLTrainer):
         # Truncate update buffer if neccessary. Truncate more than we need to to avoid truncating
         # a large buffer at each update.
         if self.update_buffer.num_experiences > self.hyperparameters.buffer_size:
+            num_experiences = self.update_buffer.num_experiences
+            # Keep whole sequences, so that they still start at multiples of the
+            # sequence length.
             self.update_buffer.truncate(
-                int(self.hyperparameters.buffer_size * BUFFER_TRUNCATE_PERCENT)
+                int(self.hyperparameters.buffer_size * BUFFER_TRUNCATE_PERCENT),
+                sequence_length=self.policy.sequence_length,
             )
+            num_dropped = num_experiences - self.update_buffer.num_experiences
+            if self._replay_log is not None:
+                self._replay_log.drop_oldest(num_dropped)
+            if self._prioritized_replay is not None:
+                self._prioritized_replay.drop_oldest(
+                    num_dropped // self.policy.sequence_length
+                )
         # TODO: revisit this update
         self._update_reward_signals()
         return has_updated
 
+    def _sample_prioritized(self, num_sequences: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Samples sequences of the update buffer in proportion to their priority. The
+        sequences added to the buffer since the last call get the highest priority.
+        :param num_sequences: The number of sequences to sample.
+        :return: The indices of the sampled sequences and their importance sampling
+            weights.
+        """
+        prioritized_replay = self._prioritized_replay
+        assert prioritized_replay is not None
+        num_sequences_in_buffer = (
+            self.update_buffer.num_experiences // self.policy.sequence_length
+        )
+        prioritized_replay.add(
+            num_sequences_in_buffer - prioritized_replay.num_sequences
+        )
+        beta = self._importance_sampling_beta.get_value(self._step)
+        return prioritized_replay.sample(num_sequences, beta)
+
     def _update_reward_signals(self) -> None:
         """
         Iterate through the reward signals and update them. Unlike in PPO,
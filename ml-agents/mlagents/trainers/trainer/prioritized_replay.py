@@ -0,0 +1,174 @@
+from typing import BinaryIO, Tuple
+
+import numpy as np
+
+
+class PrioritizedReplay:
+    """
+    Samples the sequences of a replay buffer in proportion to their priority, for
+    prioritized experience replay (https://arxiv.org/abs/1511.05952). The priorities are
+    stored in a sum-tree, a binary tree whose leaves are the priorities of the sequences
+    and whose nodes are the sums of their children, so that sampling a sequence and
+    updating its priority take O(log n).
+
+    The sequences are numbered from the oldest one in the buffer. The leaves are used as
+    a ring, so that dropping the oldest sequences when the buffer is truncated doesn't
+    move the others.
+    """
+
+    def __init__(self, alpha: float, epsilon: float = 1e-6, capacity: int = 1024):
+        """
+        :param alpha: How much the priorities affect sampling, 0 samples uniformly.
+        :param epsilon: Added to the TD errors, so that every sequence can be sampled.
+        :param capacity: Number of sequences to allocate leaves for. The tree grows when
+            more sequences are added.
+        """
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self._capacity = 1
+        while self._capacity < capacity:
+            self._capacity *= 2
+        self._tree = np.zeros(2 * self._capacity, dtype=np.float64)
+        # The leaf of the oldest sequence.
+        self._start = 0
+        self._num_sequences = 0
+        # New sequences get the highest priority seen so far.
+        self._max_priority = 1.0
+
+    @property
+    def num_sequences(self) -> int:
+        return self._num_sequences
+
+    @property
+    def total_priority(self) -> float:
+        return float(self._tree[1])
+
+    def priorities(self) -> np.ndarray:
+        """
+        Returns the priorities of the sequences, from the oldest to the newest.
+        """
+        return self._tree[self._capacity + self._leaves(np.arange(self._num_sequences))]
+
+    def add(self, num_sequences: int) -> None:
+        """
+        Adds sequences after the newest one, with the highest priority seen so far.
+        :param num_sequences: The number of sequences added to the buffer.
+        """
+        if num_sequences <= 0:
+            return
+        if self._num_sequences + num_sequences > self._capacity:
+            self._grow(self._num_sequences + num_sequences)
+        leaves = self._leaves(self._num_sequences + np.arange(num_sequences))
+        self._num_sequences += num_sequences
+        self._set(leaves, np.full(num_sequences, self._max_priority))
+
+    def drop_oldest(self, num_sequences: int) -> None:
+        """
+        Removes the oldest sequences, when they are dropped from the buffer.
+        :param num_sequences: The number of sequences dropped from the buffer.
+        """
+        num_sequences = min(num_sequences, self._num_sequences)
+        if num_sequences <= 0:
+            return
+        self._set(self._leaves(np.arange(num_sequences)), np.zeros(num_sequences))
+        self._start = (self._start + num_sequences) % self._capacity
+        self._num_sequences -= num_sequences
+
+    def sample(self, num_samples: int, beta: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Samples sequences in proportion to their priority. The range of the total
+        priority is split in num_samples equal parts, and one sequence is sampled in
+        each, which reduces the variance of the mini-batches.
+        :param num_samples: The number of sequences to sample.
+        :param beta: Strength of the importance sampling correction, 1 fully corrects
+            for the bias of prioritized sampling.
+        :return: The indices of the sampled sequences from the oldest one, and their
+            importance sampling weights, normalized so that the largest one is 1.
+        """
+        total = self._tree[1]
+        targets = (np.arange(num_samples) + np.random.random(num_samples)) * (
+            total / num_samples
+        )
+        # Walk down the tree, going right when the target is past the left child.
+        # Rounding errors can't lead to an empty subtree, since its sum would be 0.
+        nodes = np.ones(num_samples, dtype=np.int64)
+        while nodes[0] < self._capacity:
+            left = 2 * nodes
+            left_sums = self._tree[left]
+            go_right = (targets >= left_sums) & (self._tree[left + 1] > 0)
+            targets = np.where(go_right, targets - left_sums, targets)
+            nodes = left + go_right
+        indices = (nodes - self._capacity - self._start) % self._capacity
+        probabilities = self._tree[nodes] / total
+        weights = (self._num_sequences * probabilities) ** -beta
+        return indices, weights / weights.max()
+
+    def update(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """
+        Sets the priorities of sampled sequences from their TD errors.
+        :param indices: The indices of the sequences from the oldest one.
+        :param td_errors: The absolute TD errors of the sequences.
+        """
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self._max_priority = max(self._max_priority, float(priorities.max()))
+        self._set(self._leaves(indices), priorities)
+
+    def save_to_file(self, file_object: BinaryIO) -> None:
+        """
+        Writes the priorities of the sequences, from the oldest to the newest.
+        """
+        np.savez(
+            file_object,
+            priorities=self.priorities(),
+            max_priority=np.float64(self._max_priority),
+        )
+
+    def load_from_file(self, file_object: BinaryIO) -> None:
+        """
+        Replaces the priorities with the ones written by save_to_file.
+        """
+        with np.load(file_object) as data:
+            priorities = data["priorities"]
+            max_priority = float(data["max_priority"])
+        self._tree[:] = 0
+        self._start = 0
+        self._num_sequences = 0
+        if len(priorities) > 0:
+            self.add(len(priorities))
+            self._set(self._leaves(np.arange(len(priorities))), priorities)
+        self._max_priority = max_priority
+
+    def _leaves(self, indices: np.ndarray) -> np.ndarray:
+        return (self._start + indices) % self._capacity
+
+    def _set(self, leaves: np.ndarray, priorities: np.ndarray) -> None:
+        nodes = leaves + self._capacity
+        self._tree[nodes] = priorities
+        if len(nodes) * int(np.log2(self._capacity)) > self._capacity:
+            # Cheaper to recompute all of the sums when many leaves change at once.
+            self._rebuild()
+            return
+        # Update the sums of the ancestors one level at a time. All the leaves are at
+        # the same depth, and writing the sum of a node more than once is harmless.
+        nodes = nodes // 2
+        while nodes[0] > 0:
+            self._tree[nodes] = self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+            nodes //= 2
+
+    def _rebuild(self) -> None:
+        level = self._capacity // 2
+        while level > 0:
+            self._tree[level : 2 * level] = (
+                self._tree[2 * level : 4 * level : 2]
+                + self._tree[2 * level + 1 : 4 * level : 2]
+            )
+            level //= 2
+
+    def _grow(self, min_capacity: int) -> None:
+        priorities = self.priorities()
+        while self._capacity < min_capacity:
+            self._capacity *= 2
+        self._tree = np.zeros(2 * self._capacity, dtype=np.float64)
+        self._start = 0
+        self._tree[self._capacity : self._capacity + len(priorities)] = priorities
+        self._rebuild()
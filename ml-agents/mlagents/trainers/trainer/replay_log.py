@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from mlagents_envs.logging_util import get_logger
+from mlagents.trainers.buffer import AgentBuffer, ColumnarAgentBuffer
+
+logger = get_logger(__name__)
+
+REPLAY_LOG_VERSION = 1
+REPLAY_LOG_MANIFEST_FILE = "manifest.json"
+
+
+def _load_array(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Arrays of Python objects, like ragged group entries, can't be memory-mapped.
+        return np.load(path, allow_pickle=True)
+
+
+class SegmentedReplayLog:
+    """
+    Persists a replay buffer as an append-only log of segments. Each checkpoint only
+    writes the experiences added to the buffer since the previous checkpoint, as a
+    segment with one uncompressed .npy file per field, and a manifest listing the
+    segments that hold the experiences still in the buffer. The experiences to write are
+    copied when the checkpoint is taken, the files are written by a background thread.
+
+    The experiences are numbered in the order they were added to the buffer, so the log
+    must be told when the oldest experiences are dropped from the buffer.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: The directory the segments and the manifest are written to.
+        """
+        self.directory = directory
+        # The number of experiences dropped from the buffer so far, i.e. the number of
+        # the oldest experience in the buffer.
+        self.num_dropped = 0
+        # The range of experiences of the last manifest.
+        self._saved_start = 0
+        self._saved_end = 0
+        self._fields: Optional[List[str]] = None
+        self._segments: List[Dict[str, Any]] = []
+        self._next_segment = 0
+        self._needs_rewrite = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="replay_log"
+        )
+        self._pending: Optional[Future] = None
+
+    def drop_oldest(self, num_experiences: int) -> None:
+        """
+        Records that the oldest experiences were dropped from the buffer.
+        :param num_experiences: The number of experiences dropped.
+        """
+        self.num_dropped += num_experiences
+
+    def save(self, buffer: AgentBuffer) -> None:
+        """
+        Starts writing the experiences added to the buffer since the last call. Returns
+        once they are copied, before they are written.
+        :param buffer: The replay buffer.
+        """
+        start = self.num_dropped
+        end = start + buffer.num_experiences
+        fields = [AgentBuffer._encode_key(key) for key in buffer.keys()]
+        if self._needs_rewrite or fields != self._fields or end < self._saved_end:
+            # The log doesn't match the buffer anymore, start over from the whole buffer.
+            obsolete = self._segments
+            self._segments = []
+            self._saved_end = start
+            self._needs_rewrite = False
+        else:
+            obsolete = [
+                segment
+                for segment in self._segments
+                if segment["start"] + segment["length"] <= start
+            ]
+            self._segments = [
+                segment for segment in self._segments if segment not in obsolete
+            ]
+        self._fields = fields
+        segment_start = max(self._saved_end, start)
+        num_new = end - segment_start
+        arrays: List[np.ndarray] = []
+        if num_new > 0:
+            segment = {
+                "name": f"segment-{self._next_segment}",
+                "start": segment_start,
+                "length": num_new,
+            }
+            self._next_segment += 1
+            self._segments.append(segment)
+            arrays = [
+                field[len(field) - num_new :].to_ndarray() for field in buffer.values()
+            ]
+        elif not obsolete and start == self._saved_start:
+            return
+        self._saved_start = start
+        self._saved_end = end
+        manifest = {
+            "version": REPLAY_LOG_VERSION,
+            "fields": fields,
+            "start": start,
+            "end": end,
+            "segments": list(self._segments),
+        }
+        self._pending = self._executor.submit(
+            self._write,
+            self._segments[-1]["name"] if num_new > 0 else None,
+            arrays,
+            manifest,
+            [segment["name"] for segment in obsolete],
+        )
+        self._pending.add_done_callback(self._on_written)
+
+    def _write(
+        self,
+        segment_name: Optional[str],
+        arrays: List[np.ndarray],
+        manifest: Dict[str, Any],
+        obsolete: List[str],
+    ) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if segment_name is not None:
+            segment_path = os.path.join(self.directory, segment_name)
+            os.makedirs(segment_path, exist_ok=True)
+            for i, array in enumerate(arrays):
+                np.save(
+                    os.path.join(segment_path, f"{i}.npy"),
+                    array,
+                    allow_pickle=array.dtype == object,
+                )
+        manifest_path = os.path.join(self.directory, REPLAY_LOG_MANIFEST_FILE)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        for name in obsolete:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _on_written(self, future: Future) -> None:
+        error = future.exception()
+        if error is not None:
+            logger.warning(f"Failed to save the replay buffer: {error}")
+            # The manifests written after this one would reference a missing segment.
+            self._needs_rewrite = True
+
+    def flush(self) -> None:
+        """
+        Waits until the experiences of the last call to save are written.
+        """
+        if self._pending is not None:
+            self._pending.exception()
+
+    def close(self) -> None:
+        """
+        Finishes writing and stops the background thread.
+        """
+        self._executor.shutdown(wait=True)
+
+    def load(self, buffer: AgentBuffer) -> None:
+        """
+        Restores the experiences of the log into an empty buffer. The segments are
+        memory-mapped and copied into the buffer.
+        :param buffer: The replay buffer.
+        """
+        with open(os.path.join(self.directory, REPLAY_LOG_MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        if manifest["version"] != REPLAY_LOG_VERSION:
+            raise ValueError(
+                f"Unsupported replay buffer version {manifest['version']}."
+            )
+        keys = [AgentBuffer._decode_key(field) for field in manifest["fields"]]
+        start = manifest["start"]
+        # Map all of the segments before filling the buffer, so that a missing segment
+        # leaves the buffer empty.
+        segment_arrays = []
+        for segment in manifest["segments"]:
+            # Skip the experiences that were dropped after the segment was written.
+            skip = max(start - segment["start"], 0)
+            segment_path = os.path.join(self.directory, segment["name"])
+            segment_arrays.append(
+                [
+                    _load_array(os.path.join(segment_path, f"{i}.npy"))[skip:]
+                    for i in range(len(keys))
+                ]
+            )
+        for arrays in segment_arrays:
+            for key, array in zip(keys, arrays):
+                if not isinstance(buffer, ColumnarAgentBuffer):
+                    array = np.array(array)
+                buffer[key].extend(array)
+        self.num_dropped = start
+        self._saved_start = start
+        self._saved_end = manifest["end"]
+        self._fields = manifest["fields"]
+        self._segments = manifest["segments"]
+        self._next_segment = (
+            max(int(s["name"].rsplit("-", 1)[1]) for s in self._segments) + 1
+            if self._segments
+            else 0
+        )
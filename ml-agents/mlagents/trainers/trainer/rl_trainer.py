@@ -15,14 +15,13 @@ from mlagents_envs.logging_util import get_logger
 from mlagents_envs.timers import timed
 from mlagents.trainers.optimizer import Optimizer
 from mlagents.trainers.optimizer.torch_optimizer import TorchOptimizer
-from mlagents.trainers.buffer import AgentBuffer, BufferKey
+from mlagents.trainers.buffer import AgentBuffer, BufferKey, ColumnarAgentBuffer
 from mlagents.trainers.trainer import Trainer
 from mlagents.trainers.torch_entities.components.reward_providers.base_reward_provider import (
     BaseRewardProvider,
 )
 from mlagents_envs.timers import hierarchical_timer
 from mlagents.trainers.model_saver.torch_model_saver import TorchModelSaver
-from mlagents.trainers.agent_processor import AgentManagerQueue
 from mlagents.trainers.trajectory import Trajectory
 from mlagents.trainers.settings import TrainerSettings
 from mlagents.trainers.stats import StatsPropertyType
@@ -46,7 +45,11 @@ class RLTrainer(Trainer):
         self.collected_rewards: Dict[str, Dict[str, int]] = {
             "environment": defaultdict(lambda: 0)
         }
-        self.update_buffer: AgentBuffer = AgentBuffer()
+        self.update_buffer: AgentBuffer = (
+            ColumnarAgentBuffer(self.trainer_settings.hyperparameters.buffer_size)
+            if self.trainer_settings.hyperparameters.columnar_buffer
+            else AgentBuffer()
+        )
         self._stats_reporter.add_property(
             StatsPropertyType.HYPERPARAMETERS, self.trainer_settings.as_dict()
         )
@@ -119,7 +122,10 @@ class RLTrainer(Trainer):
         trainer_settings: TrainerSettings, model_path: str, load: bool
     ) -> BaseModelSaver:
         model_saver = TorchModelSaver(  # type: ignore
-            trainer_settings, model_path, load
+            trainer_settings,
+            model_path,
+            load,
+            max_pending_checkpoints=trainer_settings.checkpoint_queue_size,
         )
         return model_saver
 
@@ -152,7 +158,10 @@ class RLTrainer(Trainer):
             auxillary_file_paths=auxillary_paths,
         )
         ModelCheckpointManager.add_checkpoint(
-            self.brain_name, new_checkpoint, self.trainer_settings.keep_checkpoints
+            self.brain_name,
+            new_checkpoint,
+            self.trainer_settings.keep_checkpoints,
+            remove_checkpoint=self.model_saver.remove_checkpoint,
         )
         return new_checkpoint
 
@@ -177,6 +186,15 @@ class RLTrainer(Trainer):
         )
         ModelCheckpointManager.track_final_checkpoint(self.brain_name, final_checkpoint)
 
+    def flush(self) -> None:
+        """
+        Waits until the checkpoints being saved in the background are written.
+        """
+        self.model_saver.flush()
+
+    def close(self) -> None:
+        self.model_saver.close()
+
     @abc.abstractmethod
     def _update_policy(self) -> bool:
         """
@@ -224,6 +242,15 @@ class RLTrainer(Trainer):
         self._maybe_save_model(self.get_step + len(trajectory.steps))
         self._increment_step(len(trajectory.steps), trajectory.behavior_id)
 
+    def _process_trajectories(self, trajectories: List[Trajectory]) -> None:
+        """
+        Processes the trajectories taken from a trajectory queue, in order. Trainers can
+        override this to batch work across the trajectories.
+        :param trajectories: The Trajectories taken from the queue.
+        """
+        for t in trajectories:
+            self._process_trajectory(t)
+
     def _maybe_write_summary(self, step_after_process: int) -> None:
         """
         If processing the trajectory will make the step exceed the next summary write,
@@ -285,15 +312,10 @@ class RLTrainer(Trainer):
                 # We grab at most the maximum length of the queue.
                 # This ensures that even if the queue is being filled faster than it is
                 # being emptied, the trajectories in the queue are on-policy.
-                _queried = False
-                for _ in range(traj_queue.qsize()):
-                    _queried = True
-                    try:
-                        t = traj_queue.get_nowait()
-                        self._process_trajectory(t)
-                    except AgentManagerQueue.Empty:
-                        break
-                if self.threaded and not _queried:
+                trajectories = traj_queue.get_many()
+                if trajectories:
+                    self._process_trajectories(trajectories)
+                if self.threaded and not trajectories:
                     # Yield thread to avoid busy-waiting
                     time.sleep(0.0001)
         if self.should_still_train:
@@ -161,6 +161,18 @@ class Trainer(abc.ABC):
         """
         pass
 
+    def flush(self) -> None:
+        """
+        Waits until the models being saved in the background are written.
+        """
+        pass
+
+    def close(self) -> None:
+        """
+        Releases the resources of the trainer once training is over.
+        """
+        pass
+
     def publish_policy_queue(self, policy_queue: AgentManagerQueue[Policy]) -> None:
         """
         Adds a policy queue to the list of queues to publish to when this Trainer
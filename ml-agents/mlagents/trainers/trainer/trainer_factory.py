@@ -1,10 +1,12 @@
 import os
+from functools import partial
 from typing import Dict
 
 from mlagents_envs.logging_util import get_logger
 from mlagents.trainers.environment_parameter_manager import EnvironmentParameterManager
 from mlagents.trainers.exception import TrainerConfigError
 from mlagents.trainers.trainer import Trainer
+from mlagents.trainers.trainer.trainer_process import TrainerProcess
 from mlagents.trainers.ghost.trainer import GhostTrainer
 from mlagents.trainers.ghost.controller import GhostController
 from mlagents.trainers.settings import TrainerSettings
@@ -55,7 +57,8 @@ class TrainerFactory:
 
     def generate(self, behavior_name: str) -> Trainer:
         trainer_settings = self.trainer_config[behavior_name]
-        return TrainerFactory._initialize_trainer(
+        create_trainer = partial(
+            TrainerFactory._initialize_trainer,
             trainer_settings,
             behavior_name,
             self.output_path,
@@ -66,6 +69,9 @@ class TrainerFactory:
             self.param_manager,
             self.multi_gpu,
         )
+        if trainer_settings.trainer_process:
+            return TrainerProcess(create_trainer)
+        return create_trainer()
 
     @staticmethod
     def _initialize_trainer(
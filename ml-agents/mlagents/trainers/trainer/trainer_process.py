@@ -0,0 +1,408 @@
+import enum
+import queue
+import signal
+import traceback
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import cloudpickle
+import numpy as np
+
+from mlagents_envs import logging_util
+from mlagents_envs.base_env import BehaviorSpec
+from mlagents_envs.side_channel.stats_side_channel import StatsAggregationMethod
+from mlagents_envs.timers import get_timer_root, hierarchical_timer, reset_timers
+from mlagents.torch_utils import torch, default_device, set_torch_config
+from mlagents.trainers.agent_processor import AgentManagerQueue
+from mlagents.trainers.behavior_id_utils import BehaviorIdentifiers
+from mlagents.trainers.exception import UnityTrainerException
+from mlagents.trainers.policy import Policy
+from mlagents.trainers.settings import TorchSettings
+from mlagents.trainers.stats import (
+    StatsPropertyType,
+    StatsReporter,
+    StatsSummary,
+    StatsWriter,
+)
+from mlagents.trainers.trainer.trainer import Trainer
+from mlagents.trainers.training_status import GlobalTrainingStatus
+from mlagents.trainers.trajectory import Trajectory
+
+logger = logging_util.get_logger(__name__)
+# How long to wait at a time for a response of the trainer process, before checking
+# that it is still alive.
+RESPONSE_POLL_TIMEOUT_S = 1.0
+# How long the trainer process waits for new commands when it has nothing to do.
+IDLE_POLL_TIMEOUT_S = 0.1
+PROCESS_SHUTDOWN_TIMEOUT_S = 10
+
+
+class TrainerCommand(enum.Enum):
+    ADD_POLICY = 1
+    TRAJECTORIES = 2
+    END_EPISODE = 3
+    SAVE_MODEL = 4
+    CLOSE = 5
+    POLICY_ADDED = 6
+    POLICY_UPDATED = 7
+    STATUS = 8
+    MODEL_SAVED = 9
+    CLOSED = 10
+    ERROR = 11
+
+
+class TrainerMessage(NamedTuple):
+    cmd: TrainerCommand
+    payload: Any = None
+
+
+class TrainerStatus(NamedTuple):
+    """
+    What the trainer process reports to the main process after advancing its trainer.
+    """
+
+    step: int
+    # Cumulative rewards of the episodes that ended since the last status, newest first.
+    rewards: List[float]
+    # The stats the trainer added or wrote since the last status, in order.
+    stats_events: List[Tuple[Any, ...]]
+    training_status: Dict[str, Any]
+
+
+def _weights_to_numpy(policy: Policy) -> Dict[str, np.ndarray]:
+    return {
+        name: value.detach().cpu().numpy()
+        for name, value in policy.get_weights().items()
+    }
+
+
+def _load_numpy_weights(policy: Policy, weights: Dict[str, np.ndarray]) -> None:
+    policy.load_weights(
+        {name: torch.as_tensor(value) for name, value in weights.items()}
+    )
+
+
+class _StatsForwarder(StatsWriter):
+    """
+    Records the stats of the trainer process, so that the main process can add them to
+    its own StatsReporter. The stats are written with the stats of the AgentManager,
+    which live in the main process.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple[Any, ...]] = []
+
+    def on_add_stat(
+        self,
+        category: str,
+        key: str,
+        value: float,
+        aggregation: StatsAggregationMethod = StatsAggregationMethod.AVERAGE,
+    ) -> None:
+        self.events.append((key, value, aggregation))
+
+    def write_stats(
+        self, category: str, values: Dict[str, StatsSummary], step: int
+    ) -> None:
+        self.events.append((step,))
+
+    def add_property(
+        self, category: str, property_type: StatsPropertyType, value: Any
+    ) -> None:
+        # The properties are added by the trainer of the main process.
+        pass
+
+
+class TrainerProcess(Trainer):
+    """
+    Runs a trainer in its own process, so that the trajectory processing and the model
+    updates don't contend with the environment stepping and inference for the GIL.
+    The TrainerProcess is advanced by the main process like a non-threaded trainer: it
+    forwards the trajectories of its queues to the trainer process, and loads the
+    policy weights the trainer process publishes into the policies the environments
+    act with.
+    """
+
+    def __init__(self, create_trainer: Callable[[], Trainer]):
+        """
+        :param create_trainer: Creates the trainer. It is called once in the main process
+        to create the policies used for inference, and once in the trainer process.
+        """
+        self._local_trainer = create_trainer()
+        super().__init__(
+            self._local_trainer.brain_name,
+            self._local_trainer.trainer_settings,
+            self._local_trainer.is_training,
+            self._local_trainer.load,
+            self._local_trainer.artifact_path,
+            self._local_trainer.reward_buffer.maxlen or 1,
+        )
+        self._behavior_specs: Dict[str, BehaviorSpec] = {}
+        self._closed = False
+
+        context = get_context("spawn")
+        self._command_queue = context.Queue()
+        self._response_queue = context.Queue()
+        self._process = context.Process(
+            target=trainer_process_worker,
+            args=(
+                self._command_queue,
+                self._response_queue,
+                cloudpickle.dumps(create_trainer),
+                dict(GlobalTrainingStatus.saved_state[self.brain_name]),
+                str(default_device()),
+                logger.level,
+            ),
+            daemon=True,
+        )
+        self._process.start()
+
+    @property
+    def threaded(self) -> bool:
+        """
+        The TrainerProcess must be advanced by the main process to exchange trajectories
+        and policies with the trainer process.
+        """
+        return False
+
+    def create_policy(
+        self, parsed_behavior_id: BehaviorIdentifiers, behavior_spec: BehaviorSpec
+    ) -> Policy:
+        self._behavior_specs[parsed_behavior_id.behavior_id] = behavior_spec
+        return self._local_trainer.create_policy(parsed_behavior_id, behavior_spec)
+
+    def add_policy(
+        self, parsed_behavior_id: BehaviorIdentifiers, policy: Policy
+    ) -> None:
+        """
+        Adds the policy to the trainer of the trainer process, and loads the weights it
+        was initialized with into the policy.
+        """
+        behavior_id = parsed_behavior_id.behavior_id
+        self.policies[behavior_id] = policy
+        self._send(
+            TrainerCommand.ADD_POLICY,
+            (parsed_behavior_id, self._behavior_specs[behavior_id]),
+        )
+        weights, step = self._wait_for(TrainerCommand.POLICY_ADDED)
+        _load_numpy_weights(policy, weights)
+        self._step = step
+
+    def advance(self) -> None:
+        """
+        Sends the trajectories of the queues to the trainer process, and processes what
+        the trainer process sent back since the last call.
+        """
+        with hierarchical_timer("send_trajectories"):
+            for traj_queue in self.trajectory_queues:
+                trajectories = traj_queue.get_many()
+                if trajectories:
+                    self._send(
+                        TrainerCommand.TRAJECTORIES,
+                        (traj_queue.behavior_id, trajectories),
+                    )
+        while True:
+            try:
+                message: TrainerMessage = self._response_queue.get_nowait()
+            except queue.Empty:
+                break
+            self._handle(message)
+
+    def end_episode(self) -> None:
+        self._send(TrainerCommand.END_EPISODE)
+
+    def save_model(self) -> None:
+        """
+        Saves the model in the trainer process, and waits for it to be saved.
+        """
+        self._send(TrainerCommand.SAVE_MODEL)
+        self._wait_for(TrainerCommand.MODEL_SAVED)
+
+    def close(self) -> None:
+        """
+        Stops the trainer process, and merges its timers with the timers of the main
+        process.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._send(TrainerCommand.CLOSE)
+            timer_root = self._wait_for(TrainerCommand.CLOSED)
+            with hierarchical_timer("trainer_processes") as main_timer_node:
+                main_timer_node.merge(
+                    timer_root, root_name="trainer_process_root", is_parallel=True
+                )
+        except UnityTrainerException:
+            logger.debug(f"The trainer process of {self.brain_name} already exited.")
+        self._process.join(PROCESS_SHUTDOWN_TIMEOUT_S)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def _send(self, cmd: TrainerCommand, payload: Any = None) -> None:
+        self._command_queue.put(TrainerMessage(cmd, payload))
+
+    def _wait_for(self, cmd: TrainerCommand) -> Any:
+        """
+        Processes the messages of the trainer process until it responds with cmd, and
+        returns the payload of the response.
+        """
+        while True:
+            try:
+                message: TrainerMessage = self._response_queue.get(
+                    timeout=RESPONSE_POLL_TIMEOUT_S
+                )
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise UnityTrainerException(
+                        f"The trainer process of {self.brain_name} exited unexpectedly."
+                    )
+                continue
+            if message.cmd == cmd:
+                return message.payload
+            self._handle(message)
+
+    def _handle(self, message: TrainerMessage) -> None:
+        if message.cmd == TrainerCommand.POLICY_UPDATED:
+            behavior_id, weights = message.payload
+            policy = self.policies[behavior_id]
+            _load_numpy_weights(policy, weights)
+            for q in self.policy_queues:
+                if q.behavior_id == behavior_id:
+                    q.put(policy)
+        elif message.cmd == TrainerCommand.STATUS:
+            status: TrainerStatus = message.payload
+            self._step = status.step
+            for reward in reversed(status.rewards):
+                self.reward_buffer.appendleft(reward)
+            for event in status.stats_events:
+                if len(event) == 1:
+                    self.stats_reporter.write_stats(event[0])
+                    continue
+                key, value, aggregation = event
+                if aggregation == StatsAggregationMethod.MOST_RECENT:
+                    self.stats_reporter.set_stat(key, value)
+                else:
+                    self.stats_reporter.add_stat(key, value, aggregation)
+            GlobalTrainingStatus.saved_state[self.brain_name] = status.training_status
+        elif message.cmd == TrainerCommand.ERROR:
+            raise UnityTrainerException(
+                f"The trainer process of {self.brain_name} failed:\n{message.payload}"
+            )
+
+
+def trainer_process_worker(
+    command_queue: Any,
+    response_queue: Any,
+    pickled_create_trainer: bytes,
+    training_status: Dict[str, Any],
+    device: str,
+    log_level: int,
+) -> None:
+    # The main process handles interruptions, and then asks this process to save the
+    # model and exit.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging_util.set_log_level(log_level)
+    set_torch_config(TorchSettings(device=device))
+    # Trainer plugins are registered when mlagents-learn starts, which a spawned
+    # process doesn't do.
+    from mlagents.plugins.trainer_type import register_trainer_plugins
+
+    register_trainer_plugins()
+    reset_timers()
+    stats_forwarder = _StatsForwarder()
+    StatsReporter.writers = [stats_forwarder]
+
+    def _send(cmd: TrainerCommand, payload: Any = None) -> None:
+        response_queue.put(TrainerMessage(cmd, payload))
+
+    trainer: Trainer = None  # type: ignore  # set once the process is set up
+    policy_queues: List[AgentManagerQueue[Policy]] = []
+    last_step = 0
+
+    def _send_updates(force_status: bool = False) -> None:
+        """
+        Sends the latest version of the updated policies, and the status of the trainer
+        if it changed.
+        :param force_status: Whether to send the status even if the step didn't change,
+        e.g. when the trainer only added checkpoints to its training status.
+        """
+        nonlocal last_step
+        for policy_queue in policy_queues:
+            policies = policy_queue.get_many()
+            if policies:
+                _send(
+                    TrainerCommand.POLICY_UPDATED,
+                    (policy_queue.behavior_id, _weights_to_numpy(policies[-1])),
+                )
+        if (
+            force_status
+            or trainer.get_step != last_step
+            or trainer.reward_buffer
+            or stats_forwarder.events
+        ):
+            last_step = trainer.get_step
+            _send(
+                TrainerCommand.STATUS,
+                TrainerStatus(
+                    step=trainer.get_step,
+                    rewards=list(trainer.reward_buffer),
+                    stats_events=stats_forwarder.events,
+                    training_status=dict(
+                        GlobalTrainingStatus.saved_state[trainer.brain_name]
+                    ),
+                ),
+            )
+            trainer.reward_buffer.clear()
+            stats_forwarder.events = []
+
+    try:
+        trainer = cloudpickle.loads(pickled_create_trainer)()
+        GlobalTrainingStatus.saved_state[trainer.brain_name] = training_status
+        trajectory_queues: Dict[str, AgentManagerQueue[Trajectory]] = {}
+        last_step = trainer.get_step
+        while True:
+            # Wait a little for new commands if there are no trajectories to process.
+            idle = all(q.empty() for q in trajectory_queues.values())
+            try:
+                message: TrainerMessage = command_queue.get(
+                    block=idle, timeout=IDLE_POLL_TIMEOUT_S
+                )
+            except queue.Empty:
+                with hierarchical_timer("trainer_advance"):
+                    trainer.advance()
+                _send_updates()
+                continue
+
+            if message.cmd == TrainerCommand.ADD_POLICY:
+                parsed_behavior_id, behavior_spec = message.payload
+                behavior_id = parsed_behavior_id.behavior_id
+                policy = trainer.create_policy(parsed_behavior_id, behavior_spec)
+                trainer.add_policy(parsed_behavior_id, policy)
+                trajectory_queues[behavior_id] = AgentManagerQueue(behavior_id)
+                trainer.subscribe_trajectory_queue(trajectory_queues[behavior_id])
+                policy_queue: AgentManagerQueue[Policy] = AgentManagerQueue(behavior_id)
+                policy_queues.append(policy_queue)
+                trainer.publish_policy_queue(policy_queue)
+                _send(
+                    TrainerCommand.POLICY_ADDED,
+                    (_weights_to_numpy(policy), trainer.get_step),
+                )
+            elif message.cmd == TrainerCommand.TRAJECTORIES:
+                behavior_id, trajectories = message.payload
+                trajectory_queues[behavior_id].put_many(trajectories)
+            elif message.cmd == TrainerCommand.END_EPISODE:
+                trainer.end_episode()
+            elif message.cmd == TrainerCommand.SAVE_MODEL:
+                trainer.save_model()
+                trainer.flush()
+                # Send the status first, so that the main process knows about the new
+                # checkpoints once the model is saved.
+                _send_updates(force_status=True)
+                _send(TrainerCommand.MODEL_SAVED)
+            elif message.cmd == TrainerCommand.CLOSE:
+                break
+        trainer.close()
+        _send(TrainerCommand.CLOSED, get_timer_root())
+    except Exception:
+        _send(TrainerCommand.ERROR, traceback.format_exc())
@@ -1,3 +1,5 @@
+from typing import Optional, Union
+
 import numpy as np
 
 
@@ -43,3 +45,109 @@ def lambda_return(r, value_estimates, gamma=0.99, lambd=0.8, value_next=0.0):
             + (1 - lambd) * gamma * value_estimates[t + 1]
         )
     return returns
+
+
+def _lengths_or_full(array: np.ndarray, lengths: Optional[np.ndarray]) -> np.ndarray:
+    if lengths is None:
+        return np.full(array.shape[0], array.shape[1])
+    return np.asarray(lengths)
+
+
+def discount_rewards_batch(
+    rewards: np.ndarray,
+    lengths: Optional[np.ndarray] = None,
+    gamma: Union[float, np.ndarray] = 0.99,
+    value_next: Union[float, np.ndarray] = 0.0,
+) -> np.ndarray:
+    """
+    Computes discounted sums of future rewards for many sequences at once. Each row
+    is a sequence (e.g. one reward signal of one trajectory), padded to the length
+    of the longest one. The recursion runs once over time for all of the rows.
+    :param rewards: Rewards, of shape (num_sequences, max_length).
+    :param lengths: Length of each sequence. If None, every sequence is max_length long.
+    :param gamma: Discount factor, either one for all sequences or one per sequence.
+    :param value_next: Value estimate following the last step of each sequence, either one
+        for all sequences or one per sequence.
+    :return: Discounted sums of future rewards of shape (num_sequences, max_length).
+        Padded steps are 0.
+    """
+    rewards = np.asarray(rewards)
+    lengths = _lengths_or_full(rewards, lengths)
+    discounted_r = np.zeros_like(rewards)
+    running_add = np.broadcast_to(
+        np.asarray(value_next, dtype=rewards.dtype), lengths.shape
+    ).copy()
+    gamma = np.asarray(gamma, dtype=rewards.dtype)
+    for t in reversed(range(rewards.shape[1])):
+        active = t < lengths
+        running_add = np.where(active, running_add * gamma + rewards[:, t], running_add)
+        discounted_r[:, t] = np.where(active, running_add, 0)
+    return discounted_r
+
+
+def get_gae_batch(
+    rewards: np.ndarray,
+    value_estimates: np.ndarray,
+    lengths: Optional[np.ndarray] = None,
+    value_next: Union[float, np.ndarray] = 0.0,
+    gamma: Union[float, np.ndarray] = 0.99,
+    lambd: float = 0.95,
+) -> np.ndarray:
+    """
+    Computes generalized advantage estimates for many sequences at once. See
+    discount_rewards_batch for the layout of the inputs.
+    :param rewards: Rewards, of shape (num_sequences, max_length).
+    :param value_estimates: Value estimates, of shape (num_sequences, max_length).
+    :param lengths: Length of each sequence. If None, every sequence is max_length long.
+    :param value_next: Value estimate for the step following each sequence.
+    :param gamma: Discount factor, either one for all sequences or one per sequence.
+    :param lambd: GAE weighing factor.
+    :return: Advantage estimates of shape (num_sequences, max_length).
+    """
+    rewards = np.asarray(rewards)
+    value_estimates = np.asarray(value_estimates)
+    lengths = _lengths_or_full(rewards, lengths)
+    # Keep the dtype of the rewards, like the per-trajectory helpers.
+    gamma = np.asarray(gamma, dtype=rewards.dtype)
+    rows = np.arange(len(lengths))
+    next_value_estimates = np.zeros_like(value_estimates)
+    next_value_estimates[:, :-1] = value_estimates[:, 1:]
+    next_value_estimates[rows, lengths - 1] = value_next
+    delta_t = (
+        rewards + np.reshape(gamma, (-1, 1)) * next_value_estimates - value_estimates
+    )
+    return discount_rewards_batch(delta_t, lengths, gamma=gamma * lambd)
+
+
+def lambda_return_batch(
+    rewards: np.ndarray,
+    value_estimates: np.ndarray,
+    lengths: Optional[np.ndarray] = None,
+    gamma: Union[float, np.ndarray] = 0.99,
+    lambd: float = 0.8,
+    value_next: Union[float, np.ndarray] = 0.0,
+) -> np.ndarray:
+    """
+    Computes lambda returns for many sequences at once. See discount_rewards_batch
+    for the layout of the inputs.
+    :param rewards: Rewards, of shape (num_sequences, max_length).
+    :param value_estimates: Value estimates, of shape (num_sequences, max_length).
+    :param lengths: Length of each sequence. If None, every sequence is max_length long.
+    :param gamma: Discount factor, either one for all sequences or one per sequence.
+    :param lambd: Lambda weighing factor.
+    :param value_next: Value estimate for the step following each sequence.
+    :return: Lambda returns of shape (num_sequences, max_length).
+    """
+    rewards = np.asarray(rewards)
+    value_estimates = np.asarray(value_estimates)
+    lengths = _lengths_or_full(rewards, lengths)
+    # Keep the dtype of the rewards, like the per-trajectory helpers.
+    gamma = np.asarray(gamma, dtype=rewards.dtype)
+    rows = np.arange(len(lengths))
+    # Every step bootstraps (1 - lambd) of the next value estimate, except the
+    # last one which bootstraps all of value_next.
+    bootstrap = np.zeros_like(value_estimates)
+    bootstrap[:, :-1] = (1 - lambd) * value_estimates[:, 1:]
+    bootstrap[rows, lengths - 1] = value_next
+    returns = rewards + np.reshape(gamma, (-1, 1)) * bootstrap
+    return discount_rewards_batch(returns, lengths, gamma=gamma * lambd)
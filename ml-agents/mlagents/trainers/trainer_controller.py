@@ -40,6 +40,7 @@ class TrainerController:
         param_manager: EnvironmentParameterManager,
         train: bool,
         training_seed: int,
+        batched_agent_processing: bool = False,
     ):
         """
         :param output_path: Path to save the model.
@@ -50,6 +51,8 @@ class TrainerController:
         :param train: Whether to train model, or only run inference.
         :param training_seed: Seed to use for Numpy and Torch random number generation.
         :param threaded: Whether or not to run trainers in a separate thread. Disable for testing/debugging.
+        :param batched_agent_processing: Whether the AgentManagers process the steps of all the agents of a
+        behavior together.
         """
         self.trainers: Dict[str, Trainer] = {}
         self.brain_name_to_identifier: Dict[str, Set] = defaultdict(set)
@@ -61,6 +64,7 @@ class TrainerController:
         self.param_manager = param_manager
         self.ghost_controller = self.trainer_factory.ghost_controller
         self.registered_behavior_ids: Set[str] = set()
+        self.batched_agent_processing = batched_agent_processing
 
         self.trainer_threads: List[threading.Thread] = []
         self.kill_trainers = False
@@ -78,6 +82,9 @@ class TrainerController:
 
         for brain_name in self.trainers.keys():
             self.trainers[brain_name].save_model()
+        # The models are written in the background, wait for all of them at once.
+        for trainer in self.trainers.values():
+            trainer.flush()
         self.logger.debug("Saved Model")
 
     @staticmethod
@@ -146,6 +153,9 @@ class TrainerController:
             trainer.stats_reporter,
             trainer.parameters.time_horizon,
             threaded=trainer.threaded,
+            batched=self.batched_agent_processing,
+            trajectory_queue_len=trainer.parameters.trajectory_queue_size,
+            trajectory_queue_overflow=trainer.parameters.trajectory_queue_overflow,
         )
         env_manager.set_agent_manager(name_behavior_id, agent_manager)
         env_manager.set_policy(name_behavior_id, policy)
@@ -198,6 +208,8 @@ class TrainerController:
         finally:
             if self.train_model:
                 self._save_models()
+            for trainer in self.trainers.values():
+                trainer.close()
 
     def end_trainer_episodes(self) -> None:
         # Reward buffers reset takes place only for curriculum learning
@@ -1,8 +1,9 @@
-from typing import List, NamedTuple
+from typing import List, NamedTuple, cast
 import numpy as np
 
 from mlagents.trainers.buffer import (
     AgentBuffer,
+    AgentBufferField,
     ObservationKeyPrefix,
     AgentBufferKey,
     BufferKey,
@@ -100,6 +101,20 @@ class GroupObsUtil:
     ) -> List[List[np.ndarray]]:
         return list(map(list, zip(*list_list)))
 
+    @staticmethod
+    def _padded_to_batch(group_obs: AgentBufferField) -> List[np.ndarray]:
+        """
+        Pads the group observations with NaNs for the missing agents. uint8 visual
+        observations can't hold NaNs, so they are normalized to floats in [0, 1] like the
+        visual encoders would.
+        """
+        # The group observations are lists, which are padded to a list of arrays.
+        padded = cast(List[np.ndarray], group_obs.padded_to_batch(pad_value=np.nan))
+        first_obs = next((entry[0] for entry in group_obs if entry), None)
+        if first_obs is not None and first_obs.dtype == np.uint8:
+            return [obs / 255.0 for obs in padded]
+        return padded
+
     @staticmethod
     def from_buffer(batch: AgentBuffer, num_obs: int) -> List[np.array]:
         """
@@ -108,7 +123,7 @@ class GroupObsUtil:
         separated_obs: List[np.array] = []
         for i in range(num_obs):
             separated_obs.append(
-                batch[GroupObsUtil.get_name_at(i)].padded_to_batch(pad_value=np.nan)
+                GroupObsUtil._padded_to_batch(batch[GroupObsUtil.get_name_at(i)])
             )
         # separated_obs contains a List(num_obs) of Lists(num_agents), we want to flip
         # that and get a List(num_agents) of Lists(num_obs)
@@ -123,9 +138,7 @@ class GroupObsUtil:
         separated_obs: List[np.array] = []
         for i in range(num_obs):
             separated_obs.append(
-                batch[GroupObsUtil.get_name_at_next(i)].padded_to_batch(
-                    pad_value=np.nan
-                )
+                GroupObsUtil._padded_to_batch(batch[GroupObsUtil.get_name_at_next(i)])
             )
         # separated_obs contains a List(num_obs) of Lists(num_agents), we want to flip
         # that and get a List(num_agents) of Lists(num_obs)
@@ -144,152 +157,139 @@ class Trajectory(NamedTuple):
 
     def to_agentbuffer(self) -> AgentBuffer:
         """
-        Converts a Trajectory to an AgentBuffer
+        Converts a Trajectory to an AgentBuffer. Each field is stacked for the whole
+        trajectory and added to the AgentBuffer in one operation.
         :param trajectory: A Trajectory
         :returns: AgentBuffer. Note that the length of the AgentBuffer will be one
         less than the trajectory, as the next observation need to be populated from the last
         step of the trajectory.
         """
         agent_buffer_trajectory = AgentBuffer()
-        obs = self.steps[0].obs
-        for step, exp in enumerate(self.steps):
-            is_last_step = step == len(self.steps) - 1
-            if not is_last_step:
-                next_obs = self.steps[step + 1].obs
-            else:
-                next_obs = self.next_obs
-
-            num_obs = len(obs)
-            for i in range(num_obs):
-                agent_buffer_trajectory[ObsUtil.get_name_at(i)].append(obs[i])
-                agent_buffer_trajectory[ObsUtil.get_name_at_next(i)].append(next_obs[i])
-
-            # Take care of teammate obs and actions
-            teammate_continuous_actions, teammate_discrete_actions, teammate_rewards = (
-                [],
-                [],
-                [],
-            )
-            for group_status in exp.group_status:
-                teammate_rewards.append(group_status.reward)
-                teammate_continuous_actions.append(group_status.action.continuous)
-                teammate_discrete_actions.append(group_status.action.discrete)
-
-            # Team actions
-            agent_buffer_trajectory[BufferKey.GROUP_CONTINUOUS_ACTION].append(
-                teammate_continuous_actions
-            )
-            agent_buffer_trajectory[BufferKey.GROUP_DISCRETE_ACTION].append(
-                teammate_discrete_actions
-            )
-            agent_buffer_trajectory[BufferKey.GROUPMATE_REWARDS].append(
-                teammate_rewards
-            )
-            agent_buffer_trajectory[BufferKey.GROUP_REWARD].append(exp.group_reward)
-
-            # Next actions
-            teammate_cont_next_actions = []
-            teammate_disc_next_actions = []
-            if not is_last_step:
-                next_exp = self.steps[step + 1]
-                for group_status in next_exp.group_status:
-                    teammate_cont_next_actions.append(group_status.action.continuous)
-                    teammate_disc_next_actions.append(group_status.action.discrete)
-            else:
-                for group_status in exp.group_status:
-                    teammate_cont_next_actions.append(group_status.action.continuous)
-                    teammate_disc_next_actions.append(group_status.action.discrete)
-
-            agent_buffer_trajectory[BufferKey.GROUP_NEXT_CONT_ACTION].append(
-                teammate_cont_next_actions
-            )
-            agent_buffer_trajectory[BufferKey.GROUP_NEXT_DISC_ACTION].append(
-                teammate_disc_next_actions
-            )
-
-            for i in range(num_obs):
-                ith_group_obs = []
-                for _group_status in exp.group_status:
-                    # Assume teammates have same obs space
-                    ith_group_obs.append(_group_status.obs[i])
-                agent_buffer_trajectory[GroupObsUtil.get_name_at(i)].append(
-                    ith_group_obs
-                )
-
-                ith_group_obs_next = []
-                if is_last_step:
-                    for _obs in self.next_group_obs:
-                        ith_group_obs_next.append(_obs[i])
-                else:
-                    next_group_status = self.steps[step + 1].group_status
-                    for _group_status in next_group_status:
-                        # Assume teammates have same obs space
-                        ith_group_obs_next.append(_group_status.obs[i])
-                agent_buffer_trajectory[GroupObsUtil.get_name_at_next(i)].append(
-                    ith_group_obs_next
-                )
-
-            if exp.memory is not None:
-                agent_buffer_trajectory[BufferKey.MEMORY].append(exp.memory)
-
-            agent_buffer_trajectory[BufferKey.MASKS].append(1.0)
-            agent_buffer_trajectory[BufferKey.DONE].append(exp.done)
-            agent_buffer_trajectory[BufferKey.GROUP_DONES].append(
-                [_status.done for _status in exp.group_status]
-            )
+        steps = self.steps
+        num_obs = len(steps[0].obs)
+        # The group status following each step. The last step has no next step, in which
+        # case we use its own group status for the next group actions.
+        next_group_statuses = [exp.group_status for exp in steps[1:]] + [
+            steps[-1].group_status
+        ]
 
-            # Adds the log prob and action of continuous/discrete separately
-            agent_buffer_trajectory[BufferKey.CONTINUOUS_ACTION].append(
-                exp.action.continuous
-            )
-            agent_buffer_trajectory[BufferKey.DISCRETE_ACTION].append(
-                exp.action.discrete
-            )
-
-            if not is_last_step:
-                next_action = self.steps[step + 1].action
-                cont_next_actions = next_action.continuous
-                disc_next_actions = next_action.discrete
-            else:
-                cont_next_actions = np.zeros_like(exp.action.continuous)
-                disc_next_actions = np.zeros_like(exp.action.discrete)
-
-            agent_buffer_trajectory[BufferKey.NEXT_CONT_ACTION].append(
-                cont_next_actions
-            )
-            agent_buffer_trajectory[BufferKey.NEXT_DISC_ACTION].append(
-                disc_next_actions
+        for i in range(num_obs):
+            # Stack the observations once, including the bootstrapping observation. The
+            # next observations are then a shifted view of the same array.
+            all_obs = np.stack([exp.obs[i] for exp in steps] + [self.next_obs[i]])
+            agent_buffer_trajectory[ObsUtil.get_name_at(i)].extend(all_obs[:-1])
+            agent_buffer_trajectory[ObsUtil.get_name_at_next(i)].extend(all_obs[1:])
+
+            # Assume teammates have same obs space
+            group_obs = [
+                [_status.obs[i] for _status in exp.group_status] for exp in steps
+            ]
+            next_group_obs = group_obs[1:] + [[_obs[i] for _obs in self.next_group_obs]]
+            agent_buffer_trajectory[GroupObsUtil.get_name_at(i)].extend(group_obs)
+            agent_buffer_trajectory[GroupObsUtil.get_name_at_next(i)].extend(
+                next_group_obs
             )
 
-            agent_buffer_trajectory[BufferKey.CONTINUOUS_LOG_PROBS].append(
-                exp.action_probs.continuous
+        # Take care of teammate obs and actions
+        agent_buffer_trajectory[BufferKey.GROUP_CONTINUOUS_ACTION].extend(
+            [
+                [_status.action.continuous for _status in exp.group_status]
+                for exp in steps
+            ]
+        )
+        agent_buffer_trajectory[BufferKey.GROUP_DISCRETE_ACTION].extend(
+            [[_status.action.discrete for _status in exp.group_status] for exp in steps]
+        )
+        agent_buffer_trajectory[BufferKey.GROUPMATE_REWARDS].extend(
+            [[_status.reward for _status in exp.group_status] for exp in steps]
+        )
+        agent_buffer_trajectory[BufferKey.GROUP_REWARD].extend(
+            np.array([exp.group_reward for exp in steps], dtype=np.float32)
+        )
+        agent_buffer_trajectory[BufferKey.GROUP_NEXT_CONT_ACTION].extend(
+            [
+                [_status.action.continuous for _status in group_status]
+                for group_status in next_group_statuses
+            ]
+        )
+        agent_buffer_trajectory[BufferKey.GROUP_NEXT_DISC_ACTION].extend(
+            [
+                [_status.action.discrete for _status in group_status]
+                for group_status in next_group_statuses
+            ]
+        )
+        agent_buffer_trajectory[BufferKey.GROUP_DONES].extend(
+            [[_status.done for _status in exp.group_status] for exp in steps]
+        )
+
+        memories = [exp.memory for exp in steps if exp.memory is not None]
+        if memories:
+            agent_buffer_trajectory[BufferKey.MEMORY].extend(np.stack(memories))
+
+        agent_buffer_trajectory[BufferKey.MASKS].extend(
+            np.ones(len(steps), dtype=np.float32)
+        )
+        agent_buffer_trajectory[BufferKey.DONE].extend(
+            np.array([exp.done for exp in steps], dtype=np.bool_)
+        )
+
+        # Adds the log prob and action of continuous/discrete separately. The next actions
+        # are the actions shifted by one step, with zeros after the last step.
+        continuous_actions = np.stack([exp.action.continuous for exp in steps])
+        discrete_actions = np.stack([exp.action.discrete for exp in steps])
+        agent_buffer_trajectory[BufferKey.CONTINUOUS_ACTION].extend(continuous_actions)
+        agent_buffer_trajectory[BufferKey.DISCRETE_ACTION].extend(discrete_actions)
+        agent_buffer_trajectory[BufferKey.NEXT_CONT_ACTION].extend(
+            np.concatenate(
+                [continuous_actions[1:], np.zeros_like(continuous_actions[:1])]
             )
-            agent_buffer_trajectory[BufferKey.DISCRETE_LOG_PROBS].append(
-                exp.action_probs.discrete
-            )
-
-            # Store action masks if necessary. Note that 1 means active, while
-            # in AgentExperience False means active.
-            if exp.action_mask is not None:
-                mask = 1 - np.concatenate(exp.action_mask)
-                agent_buffer_trajectory[BufferKey.ACTION_MASK].append(
-                    mask, padding_value=1
-                )
-            else:
-                # This should never be needed unless the environment somehow doesn't supply the
-                # action mask in a discrete space.
-
-                action_shape = exp.action.discrete.shape
-                agent_buffer_trajectory[BufferKey.ACTION_MASK].append(
-                    np.ones(action_shape, dtype=np.float32), padding_value=1
-                )
-            agent_buffer_trajectory[BufferKey.PREV_ACTION].append(exp.prev_action)
-            agent_buffer_trajectory[BufferKey.ENVIRONMENT_REWARDS].append(exp.reward)
-
-            # Store the next visual obs as the current
-            obs = next_obs
+        )
+        agent_buffer_trajectory[BufferKey.NEXT_DISC_ACTION].extend(
+            np.concatenate([discrete_actions[1:], np.zeros_like(discrete_actions[:1])])
+        )
+        agent_buffer_trajectory[BufferKey.CONTINUOUS_LOG_PROBS].extend(
+            np.stack([exp.action_probs.continuous for exp in steps])
+        )
+        agent_buffer_trajectory[BufferKey.DISCRETE_LOG_PROBS].extend(
+            np.stack([exp.action_probs.discrete for exp in steps])
+        )
+
+        # Store action masks if necessary. Note that 1 means active, while
+        # in AgentExperience False means active.
+        agent_buffer_trajectory[BufferKey.ACTION_MASK].extend(
+            self._stack_action_masks()
+        )
+        agent_buffer_trajectory[BufferKey.ACTION_MASK].padding_value = 1
+
+        agent_buffer_trajectory[BufferKey.PREV_ACTION].extend(
+            np.stack([exp.prev_action for exp in steps])
+        )
+        agent_buffer_trajectory[BufferKey.ENVIRONMENT_REWARDS].extend(
+            np.array([exp.reward for exp in steps], dtype=np.float32)
+        )
         return agent_buffer_trajectory
 
+    def _stack_action_masks(self) -> np.ndarray:
+        """
+        Returns the action masks of the trajectory as a (len(steps), sum of branch sizes)
+        array, where 1 means the action is active.
+        """
+        if all(exp.action_mask is not None for exp in self.steps):
+            # Stack each branch across the trajectory, then join the branches.
+            branches = zip(*(exp.action_mask for exp in self.steps))
+            masks = np.concatenate([np.stack(branch) for branch in branches], axis=1)
+            return (1 - masks).astype(np.float32)
+        # This should never be needed unless the environment somehow doesn't supply the
+        # action mask in a discrete space.
+        return np.stack(
+            [
+                (1 - np.concatenate(exp.action_mask)).astype(np.float32)
+                if exp.action_mask is not None
+                else np.ones(exp.action.discrete.shape, dtype=np.float32)
+                for exp in self.steps
+            ]
+        )
+
     @property
     def done_reached(self) -> bool:
         """
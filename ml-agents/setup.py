@@ -79,6 +79,7 @@ setup(
         "console_scripts": [
             "mlagents-learn=mlagents.trainers.learn:main",
             "mlagents-run-experiment=mlagents.trainers.run_experiment:main",
+            "mlagents-evaluate-league=mlagents.trainers.ghost.league:main",
             "mlagents-push-to-hf=mlagents.utils.push_to_hf:main",
             "mlagents-load-from-hf=mlagents.utils.load_from_hf:main",
         ],